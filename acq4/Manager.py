@@ -29,6 +29,8 @@ import getopt, glob
 from collections import OrderedDict
 import acq4.pyqtgraph as pg
 from .util.HelpfulException import HelpfulException
+from .util.StorageQueue import StorageQueue
+from .util import gcpolicy
 from . import __version__
 from . import devices, modules
 
@@ -80,6 +82,8 @@ class Manager(Qt.QObject):
         self.disableAllDevs = False
         self.alreadyQuit = False
         self.taskLock = Mutex(Qt.QMutex.Recursive)
+        self.storageQueue = StorageQueue()  ## task results are written to disk by these threads
+        gcpolicy.collector()  ## create the shared collector in the GUI thread
         
         try:
             if Manager.CREATED:
@@ -353,6 +357,10 @@ class Manager(Qt.QObject):
                         print("Warning: ignored config option 'defaultMouseMode'; value must be either 'oneButton' or 'threeButton'.")
                 elif key == 'useOpenGL':
                     pg.setConfigOption('useOpenGL', cfg[key])
+                
+                ## number of background threads used to store task results (0 stores synchronously)
+                elif key == 'storageWorkers':
+                    self.storageQueue.setWorkers(int(cfg[key]))
                     
                 ## Copy in any other configurations.
                 ## dicts are extended, all others are overwritten.
@@ -627,7 +635,9 @@ class Manager(Qt.QObject):
         """
         t = Task(self, cmd)
         t.execute()
-        return t.getResult()
+        result = t.getResult()
+        t.waitForStorage()
+        return result
 
     def createTask(self, cmd):
         """
@@ -811,6 +821,8 @@ class Manager(Qt.QObject):
             ld = len(self.devices)
             with pg.ProgressDialog("Shutting down..", 0, lm+ld, cancelText=None, wait=0) as dlg:
                 self.documentation.quit()
+                print("Waiting for data storage to finish..")
+                self.storageQueue.flush()
                 print("Requesting all modules shut down..")
                 logMsg("Shutting Down.", importance=9)
                 while len(self.modules) > 0:  ## Modules may disappear from self.modules as we ask them to quit
@@ -851,6 +863,9 @@ class Manager(Qt.QObject):
 
 class Task:
     id = 0
+
+    ## see setPhaseTimeCallback()
+    phaseTimeCallback = None
     
     
     def __init__(self, dm, command):
@@ -864,6 +879,7 @@ class Task:
         self.startedDevs = []
         self.startTime = None
         self.stopTime = None
+        self.storageJob = None
 
         #self.reserved = False
         try:
@@ -959,14 +975,15 @@ class Task:
             self.stopped = False  # whether sub-tasks have been stopped yet
             self.abortRequested = False
             self._done = False  # cached output of isDone()
+            self.startTime = None  # tasks may be executed more than once
+            self.stopTime = None
 
             #print "======  Executing task %d:" % self.id
             #print self.cfg
             #print "======================="
             
             ## We need to make sure devices are stopped and unlocked properly if anything goes wrong..
-            from acq4.util.debug import Profiler
-            prof = Profiler('Manager.Task.execute', disabled=True)
+            prof = self._profiler('Manager.Task.execute')
             try:
             
                 #print self.id, "Task.execute:", self.tasks
@@ -1050,8 +1067,10 @@ class Task:
                     #print "sleep for", sleep
                     time.sleep(sleep)
                 #print "all tasks finshed."
+                prof.mark('wait')
                 
                 self.stop()
+                prof.mark('stop')
                 #print "  %d execute complete" % self.id
             except: 
                 #printExc("==========  Error in task execution:  ==============")
@@ -1062,6 +1081,20 @@ class Task:
                 prof.finish()
         
         
+    @classmethod
+    def setPhaseTimeCallback(cls, callback):
+        """Set a function to be called as callback(name, [(mark, seconds), ...])
+        at the end of every Task.execute() and Task.stop(), giving the time spent
+        between each of the Profiler marks in those methods. This is used by
+        acq4.benchmarks to measure per-phase task latency. Use None to disable.
+        """
+        cls.phaseTimeCallback = None if callback is None else staticmethod(callback)
+
+    def _profiler(self, name):
+        if Task.phaseTimeCallback is None:
+            return Profiler(name, disabled=True)
+        return MarkRecorder(name, Task.phaseTimeCallback)
+
     def isDone(self):
         """Return True if all tasks are completed and ready to return results.
 
@@ -1136,8 +1169,9 @@ class Task:
         """
         with self.taskLock:
 
-            prof = Profiler("Manager.Task.stop", disabled=True)
+            prof = self._profiler("Manager.Task.stop")
             self.abortRequested = abort
+            storeData = False
             try:
                 if not self.stopped:
                     ## Stop all device tasks
@@ -1168,12 +1202,7 @@ class Task:
                     self.result = result
                     #print "RESULT 1:", self.result
                     
-                    ## Store data if requested
-                    if 'storeData' in self.cfg and self.cfg['storeData'] is True:
-                        self.cfg['storageDir'].setInfo(result['protocol'])
-                        for t in self.tasks:
-                            self.tasks[t].storeResult(self.cfg['storageDir'])
-                    prof.mark("store data")
+                    storeData = self.cfg.get('storeData', False) is True
             finally:   
                 ## Regardless of any other problems, at least make sure we 
                 ## release hardware for future use
@@ -1182,10 +1211,17 @@ class Task:
                 
                 self._releaseAll()
                 prof.mark("release all")
+                
+                ## Store data if requested. All results are in memory by now, so the 
+                ## files are written in the background while the hardware is free.
+                if storeData:
+                    self.storageJob = self.dm.storageQueue.submit(self._storeResults, self.cfg['storageDir'], self.result)
+                    prof.mark("queue storage")
                 prof.finish()
                 
             if abort:
-                gc.collect()  ## it is often the case that now is a good time to garbage-collect.
+                ## it is often the case that now is a good time to garbage-collect.
+                gcpolicy.collector().requestIdleCollect()
             #print "tasks:", self.tasks
             #print "RESULT:", self.result        
         
@@ -1194,6 +1230,27 @@ class Task:
             self.stop()
             return self.result
 
+    def _storeResults(self, dh, result):
+        ## called from a storage thread while the next task may be running; only the
+        ## results already collected by stop() are written, so device tasks are not
+        ## asked to generate them again
+        dh.setInfo(result['protocol'])
+        for t in self.tasks:
+            self.tasks[t].storeResult(dh, result[t])
+
+    def isStored(self):
+        """Return True if this task has no storage pending (results have either been 
+        written or were never requested to be stored)."""
+        return self.storageJob is None or self.storageJob.isDone()
+
+    def waitForStorage(self, timeout=None):
+        """Block until the results of this task have been written to disk.
+        Raises any exception that occurred while storing. Returns False if
+        *timeout* expired first."""
+        if self.storageJob is None:
+            return True
+        return self.storageJob.wait(timeout)
+
     def _releaseAll(self):
         with self.taskLock:
             #print self.id,"Task.releaseAll:"
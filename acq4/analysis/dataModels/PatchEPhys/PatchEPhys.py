@@ -2,8 +2,10 @@
 from __future__ import print_function
 import acq4.util.DataManager as DataManager
 import acq4.util.SequenceRunner as SequenceRunner
-from collections import OrderedDict
-import functools
+from collections import OrderedDict, deque
+import functools, sys, threading
+import six
+from six.moves import queue
 from acq4.util.metaarray import *
 import numpy as np
 
@@ -117,6 +119,11 @@ def buildSequenceArray(*args, **kargs):
         truncate: If join=True and some elements differ in shape, truncate to the smallest shape
         fill:    If join=True, pre-fill the empty array with this value. Any points in the
                  parameter space with no data will be left with this value.
+        workers: Number of threads used to open sequence directories and call func
+                 (see loadSequenceIter). By default (1), everything is loaded in the
+                 calling thread; use more only if func is thread-safe.
+        window:  Maximum number of points that may be loaded ahead of the point being
+                 stored (limits the memory used by concurrent loading).
         
     Example: Return an array of all primary-channel clamp recordings across a sequence 
         buildSequenceArray(seqDir, lambda protoDir: getClampFile(protoDir).read()['primary'])"""
@@ -125,7 +132,7 @@ def buildSequenceArray(*args, **kargs):
         if m is None:
             return i
         
-def buildSequenceArrayIter(dh, func=None, join=True, truncate=False, fill=None):
+def buildSequenceArrayIter(dh, func=None, join=True, truncate=False, fill=None, workers=1, window=16):
     """Iterator for buildSequenceArray that yields progress updates."""
         
     if func is None:
@@ -133,15 +140,10 @@ def buildSequenceArrayIter(dh, func=None, join=True, truncate=False, fill=None):
         join = False
         
     params = listSequenceParams(dh)
-    #inds = OrderedDict([(k, range(len(v))) for k,v in params.iteritems()])
-    #def runFunc(dh, func, params):
-        #name = '_'.join(['%03d'%n for n in params.values()])
-        #fh = dh[name]
-        #return func(fh)
-    #data = SequenceRunner.runSequence(functools.partial(runFunc, dh, func), inds, inds.keys())
     subDirs = dh.subDirs()
     if len(subDirs) == 0:
         yield None, None
+        return
     
     ## set up meta-info for sequence axes
     seqShape = tuple([len(p) for p in params.values()])
@@ -151,59 +153,120 @@ def buildSequenceArrayIter(dh, func=None, join=True, truncate=False, fill=None):
         info[i] = {'name': k, 'values': np.array(v)}
         i += 1
     
-    ## get a data sample
-    first = func(dh[subDirs[0]])
-    
-    ## build empty MetaArray
-    if join:
-        shape = seqShape + first.shape
-        if isinstance(first, MetaArray):
-            info = info + first._info
-        else:
-            info = info + [{} for i in range(first.ndim+1)]
-        data = MetaArray(np.empty(shape, first.dtype), info=info)
-        if fill is not None:
-            data[:] = fill
-        
-    else:
-        shape = seqShape
-        info = info + []
-        data = MetaArray(np.empty(shape, object), info=info)
-
-    ## fill data
+    data = None
+    minShape = None
     i = 0
-    if join and truncate:
-        minShape = first.shape
-        for name in subDirs:
-            subd = dh[name]
-            d = func(subd)
+    for subd, dhInfo, d in loadSequenceIter(dh, subDirs, func, workers=workers, window=window):
+        if data is None:
+            ## build empty MetaArray using the first point as a sample
+            first = d
+            if join:
+                shape = seqShape + first.shape
+                if isinstance(first, MetaArray):
+                    info = info + first._info
+                else:
+                    info = info + [{} for i in range(first.ndim+1)]
+                data = MetaArray(np.empty(shape, first.dtype), info=info)
+                if fill is not None:
+                    data[:] = fill
+            else:
+                shape = seqShape
+                info = info + []
+                data = MetaArray(np.empty(shape, object), info=info)
+            minShape = first.shape if join and truncate else None
+        
+        ind = []
+        for k in params:
+            ind.append(dhInfo[k])
+        if minShape is not None:
             minShape = [min(d.shape[j], minShape[j]) for j in range(d.ndim)]
-            dhInfo = subd.info()
-            ind = []
-            for k in params:
-                ind.append(dhInfo[k])
-            sl = [slice(0,m) for m in minShape]
-            ind += sl
-            data[tuple(ind)] = d[sl]
-            i += 1
-            yield i, len(subDirs)
+            sl = tuple([slice(0,m) for m in minShape])
+            data[tuple(ind) + sl] = d[sl]
+        else:
+            data[tuple(ind)] = d
+        i += 1
+        yield i, len(subDirs)
+        
+    if minShape is not None:
         sl = [slice(None)] * len(seqShape)
         sl += [slice(0,m) for m in minShape]
-        data = data[sl]
-    else:
-        for name in subDirs:
-            subd = dh[name]
-            d = func(subd)
-            dhInfo = subd.info()
-            ind = []
-            for k in params:
-                ind.append(dhInfo[k])
-            data[tuple(ind)] = d
-            i += 1
-            yield i, len(subDirs)
+        data = data[tuple(sl)]
 
     yield data, None
 
+def loadSequenceIter(dh, names, func, workers=1, window=16):
+    """Yield (subDirHandle, subDirInfo, func(subDirHandle)) for each subdirectory
+    of *dh* listed in *names*, in the same order as *names*.
+    
+    With workers > 1, directories are opened and *func* is called by a pool of
+    *workers* threads, so that the latency of (network) storage is overlapped
+    across points; *func* must then be thread-safe. At most *window* points are
+    loaded ahead of the point last yielded. With workers <= 1 (the default),
+    each point is loaded in the calling thread when it is needed.
+    
+    Exceptions raised while loading a point are re-raised when that point is reached.
+    """
+    def load(name):
+        subd = dh[name]
+        dhInfo = subd.info()
+        return subd, dhInfo, func(subd)
+    
+    if workers <= 1:
+        for name in names:
+            yield load(name)
+        return
+    
+    jobs = queue.Queue()
+    pending = deque()
+    stop = [False]
+    
+    def run():
+        while True:
+            job = jobs.get()
+            if job is None or stop[0]:
+                return
+            try:
+                job['result'] = load(job['name'])
+            except BaseException:
+                job['exc'] = sys.exc_info()
+            finally:
+                ## the caller waits for every job it has queued
+                job['done'].set()
+    
+    threads = []
+    for j in range(min(workers, len(names))):
+        t = threading.Thread(target=run, name='loadSequenceIter-%d' % j)
+        t.daemon = True
+        t.start()
+        threads.append(t)
+    
+    names = iter(names)
+    try:
+        while True:
+            ## keep up to *window* points in flight
+            while len(pending) < max(window, 1):
+                try:
+                    name = next(names)
+                except StopIteration:
+                    break
+                job = {'name': name, 'done': threading.Event(), 'result': None, 'exc': None}
+                pending.append(job)
+                jobs.put(job)
+            if len(pending) == 0:
+                break
+            job = pending.popleft()
+            job['done'].wait()
+            if job['exc'] is not None:
+                six.reraise(*job['exc'])
+            result = job['result']
+            job['result'] = None
+            yield result
+    finally:
+        ## also reached if the caller stops iterating early
+        stop[0] = True
+        for t in threads:
+            jobs.put(None)
+
 def getParent(child, parentType):
     """Return the (grand)parent of child that matches parentType"""
     if dirType(child) == parentType:
@@ -588,12 +651,14 @@ class GetClamps():
     def __init__(self):
         pass
 
-    def getClampData(self, dh, pars=None):
+    def getClampData(self, dh, pars=None, reader=None):
         """
         Read the clamp data - whether it is voltage or current clamp, and put the results
         into our class variables. 
         dh is the file handle (directory)
         pars is a structure that provides some control parameters usually set by the GUI
+        reader is an optional function(fileHandle) used to read each clamp file 
+        (for example, PrefetchStore.read); the default is fileHandle.read()
         Returns a short dictionary of some values; others are accessed through the class.
         Returns None if no data is found.
         """   
@@ -669,7 +734,10 @@ class GetClamps():
             except:
                 raise Exception("Error loading data for protocol %s:"
                                 % directory_name)
-            data_file = data_file_handle.read()
+            if reader is None:
+                data_file = data_file_handle.read()
+            else:
+                data_file = reader(data_file_handle)
 
             self.data_mode  = getClampMode(data_file, dir_handle=dh)
             if self.data_mode is None:
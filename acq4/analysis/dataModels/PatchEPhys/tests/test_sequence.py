@@ -0,0 +1,100 @@
+from __future__ import print_function
+import time, tempfile, shutil, threading
+from collections import OrderedDict
+import numpy as np
+import pytest
+import acq4.util.DataManager as DataManager
+from acq4.analysis.dataModels import PatchEPhys
+
+
+@pytest.fixture
+def seqDir():
+    root = tempfile.mkdtemp()
+    params = OrderedDict([('amp', [0, 1, 2]), ('rep', [0, 1])])
+    seq = DataManager.getDirHandle(root).mkdir('seq', info={'dirType': 'ProtocolSequence', 'sequenceParams': params})
+    for amp in params['amp']:
+        for rep in params['rep']:
+            seq.mkdir('%03d_%03d' % (amp, rep), info={'amp': amp, 'rep': rep})
+    yield seq
+    shutil.rmtree(root)
+
+
+def slowValue(dh):
+    ## later points finish first, so that results are completed out of order
+    info = dh.info()
+    time.sleep(0.01 * (5 - info['amp'] * 2 - info['rep']))
+    return info['amp'] * 10 + info['rep']
+
+
+def loaderThreads():
+    return [t for t in threading.enumerate() if t.name.startswith('loadSequenceIter')]
+
+
+def test_loadSequenceIter_order(seqDir):
+    names = seqDir.subDirs()
+    
+    ## by default, everything is loaded in the calling thread
+    threads = set()
+    def func(dh):
+        threads.add(threading.current_thread())
+        return dh
+    list(PatchEPhys.loadSequenceIter(seqDir, names, func))
+    PatchEPhys.buildSequenceArray(seqDir, func, join=False)
+    assert threads == set([threading.current_thread()])
+    
+    for workers in (1, 4):
+        results = list(PatchEPhys.loadSequenceIter(seqDir, names, slowValue, workers=workers, window=3))
+        assert [r[0].shortName() for r in results] == names
+        assert [r[2] for r in results] == [r[1]['amp'] * 10 + r[1]['rep'] for r in results]
+
+
+def test_buildSequenceArray(seqDir):
+    def trace(dh):
+        return np.arange(4) + slowValue(dh) * 100
+    def unequalTrace(dh):
+        info = dh.info()
+        return np.arange(4 + info['amp'] + info['rep']) + slowValue(dh) * 100
+    
+    for func, truncate in [(trace, False), (unequalTrace, True)]:
+        results = [PatchEPhys.buildSequenceArray(seqDir, func, truncate=truncate, workers=workers)
+                   for workers in (1, 4)]
+        for data in results:
+            assert data.shape == (3, 2, 4)
+            for amp in range(3):
+                for rep in range(2):
+                    assert np.all(np.asarray(data[amp, rep]) == np.arange(4) + (amp * 10 + rep) * 100)
+        assert np.all(results[0].asarray() == results[1].asarray())
+
+
+class Abort(BaseException):
+    pass
+
+
+def test_loadSequenceIter_errors(seqDir):
+    names = seqDir.subDirs()
+    for exc in (ValueError, Abort):
+        def func(dh):
+            value = slowValue(dh)
+            if value == 11:
+                raise exc("cannot load %s" % dh.shortName())
+            return value
+        for workers in (1, 4):
+            loaded = []
+            with pytest.raises(exc):
+                for subd, info, value in PatchEPhys.loadSequenceIter(seqDir, names, func, workers=workers):
+                    loaded.append(value)
+            ## points before the failed one are still delivered
+            assert loaded == [0, 1, 10]
+
+
+def test_loadSequenceIter_abandon(seqDir):
+    names = seqDir.subDirs()
+    before = len(loaderThreads())
+    results = PatchEPhys.loadSequenceIter(seqDir, names, slowValue, workers=4, window=2)
+    next(results)
+    assert len(loaderThreads()) > before
+    results.close()
+    start = time.time()
+    while len(loaderThreads()) > before and time.time() < start + 5:
+        time.sleep(0.01)
+    assert len(loaderThreads()) == before
@@ -27,6 +27,7 @@ from acq4.util import Qt
 
 # from acq4.util import DataManager
 from acq4.analysis.AnalysisModule import AnalysisModule
+from acq4.util.FileLoader import PrefetchStore
 
 import acq4.pyqtgraph as pg
 # from acq4.pyqtgraph import configfile
@@ -133,6 +134,9 @@ class IVCurve(AnalysisModule):
         ])
         self.initializeElements()
         self.file_loader_instance = self.getElement('File Loader', create=True)
+        # read clamp data of the selected protocol in the background
+        self.file_loader_instance.setPrefetchFunction(self.dataModel.getClampFile)
+        self.prefetched = PrefetchStore(self.file_loader_instance.prefetcher)
         # grab input form the "Ctrl" window
         self.ctrl.IVCurve_Update.clicked.connect(self.updateAnalysis)
         self.ctrl.IVCurve_PrintResults.clicked.connect(
@@ -486,7 +490,7 @@ class IVCurve(AnalysisModule):
         pars['sequence2'] = {'index': [self.ctrl.IVCurve_Sequence2.currentIndex() - 1]}
         pars['sequence2']['count'] = self.ctrl.IVCurve_Sequence2.count() - 1
 
-        ci = self.Clamps.getClampData(dh, pars)
+        ci = self.Clamps.getClampData(dh, pars, reader=self.prefetched.read)
         if ci is None:
             return False
         self.ctrl.IVCurve_dataMode.setText(self.Clamps.data_mode)
@@ -31,6 +31,11 @@ class MapConvolver(Qt.QWidget):
         self.output = None
         self._availableFields = None ## a list of fieldnames that are available for coloring/contouring
         
+        ## processed images are cached so that changing one item (or just the color map)
+        ## does not recompute the others
+        self._binCache = None   ## (spacing, params, grid, counts)
+        self._imageCache = {}   ## (param, opts, spacing): image
+        
         self.ui.processBtn.hide()
         self.addBtn.clicked.connect(self.addItem)
         self.ui.processBtn.clicked.connect(self.processClicked)
@@ -38,6 +43,7 @@ class MapConvolver(Qt.QWidget):
         
     def setData(self, data):
         self.data = data
+        self.clearCache()
         fields = []
         #self.blockSignals = True
         try:
@@ -94,11 +100,15 @@ class MapConvolver(Qt.QWidget):
     def itemChanged(self):
         self.process()
         
-    def processClicked():
+    def processClicked(self):
         self.process()
         
+    def clearCache(self):
+        self._binCache = None
+        self._imageCache = {}
+        
     def process(self):
-        if self.data == None:
+        if self.data is None:
             return
         if len(self.items) == 0:
             return
@@ -106,6 +116,8 @@ class MapConvolver(Qt.QWidget):
         params = {}
         spacing = self.ui.spacingSpin.value()
         for i in self.items:
+            if i.getParamName() == '':
+                continue
             if str(i.convolutionCombo.currentText()) == "Gaussian convolution":
                 params[str(i.paramCombo.currentText())] = {'sigma':i.sigmaSpin.value()}
                 
@@ -113,22 +125,42 @@ class MapConvolver(Qt.QWidget):
                 params[str(i.paramCombo.currentText())]= {'mode':i.modeCombo.currentText()}
             else:
                 pass
-                
         
+        ## only compute images whose parameters changed since the last call
+        keys = dict([(p, (p, tuple(sorted(params[p].items())), spacing)) for p in params])
+        todo = dict([(p, params[p]) for p in params if keys[p] not in self._imageCache])
+        conv = [p for p in todo if 'mode' not in todo[p]]
+        interp = dict([(p, todo[p]) for p in todo if 'mode' in todo[p]])
         
-        arr = MapConvolver.convolveMaptoImage(self.data, params, spacing=spacing)
-        arrs = MapConvolver.interpolateMapToImage(self.data, params, spacing)
-    
+        if len(params) == 0:
+            return
+        names = sorted(params.keys())
+        if self._binCache is None or self._binCache[0] != spacing or self._binCache[1] != names:
+            grid, counts = afn.binPtsToGrid(self.data, names, spacing)
+            self._binCache = (spacing, names, grid, counts)
+        spacing, names, grid, counts = self._binCache
         
-        dtype = arr.dtype.descr
-        for p in arrs.keys():
-            if p not in arr.dtype.names:
-                dtype.append((p, float))
-            
-        self.output = np.zeros(arr.shape, dtype=dtype)
-        self.output[:] = arr
-        for p in arrs:
-            self.output[p] = arrs[p]
+        if len(conv) > 0:
+            inds = [names.index(p) for p in conv]
+            images = MapConvolver.blurGrids(grid[inds], [todo[p] for p in conv], spacing)
+            for p, img in zip(conv, images):
+                self._imageCache[keys[p]] = img
+        
+        if len(interp) > 0:
+            arrs = MapConvolver.interpolateMapToImage(self.data, interp, spacing)
+            for p in arrs:
+                self._imageCache[keys[p]] = arrs[p]
+        
+        self.output = np.zeros(grid.shape[1:], dtype=[(p, float) for p in names] + [('stimNumber', int)])
+        for p in names:
+            self.output[p] = self._imageCache[keys[p]]
+        self.output['stimNumber'] = counts
+        
+        ## drop images for settings that are no longer in use
+        used = set(keys.values())
+        for k in list(self._imageCache.keys()):
+            if k not in used:
+                del self._imageCache[k]
         
         self.sigOutputChanged.emit(self.output, spacing)
         
@@ -171,25 +203,35 @@ class MapConvolver(Qt.QWidget):
                         as the stdev of a gaussian kernel, otherwise a custom kernel can be specified.
                            ex: {'postCharge': {'sigma':80e-6}, 'dirCharge':{'kernel': ndarray to use as the convolution kernel}}
                spacing - the size of each pixel in the returned grid (default is 5um)
+               
+            Points are binned into the grid (averaging points that fall in the same grid
+            location) and then blurred; all params are processed together. The returned
+            record array has a field for each param and 'stimNumber', the number of
+            points in each grid location.
             """
-        #arr = data
-        arr = afn.convertPtsToSparseImage(data, list(params.keys()), spacing)
+        names = list(params.keys())
+        grid, counts = afn.binPtsToGrid(data, names, spacing)
+        conv = [i for i,p in enumerate(names) if 'mode' not in params[p]]
+        if len(conv) > 0:
+            grid[conv] = MapConvolver.blurGrids(grid[conv], [params[names[i]] for i in conv], spacing)
         
-                                       
-        ## convolve image using either given kernel or gaussian kernel with sigma=sigma
+        arr = np.zeros(grid.shape[1:], dtype=[(p, float) for p in names] + [('stimNumber', int)])
+        for i, p in enumerate(names):
+            arr[p] = grid[i]
+        arr['stimNumber'] = counts
+        return arr
+    
+    @staticmethod
+    def blurGrids(grid, params, spacing):
+        """Blur each image grid[i] according to the convolution options params[i] (see convolveMaptoImage)."""
+        sigmas = []
         for p in params:
-            if 'mode' in params[p].keys():
-                continue
-            elif params[p].get('kernel', None) is None:
-                if params[p].get('sigma', None) is None:
-                    raise Exception("Please specify either a kernel to use for convolution, or sigma for a gaussian kernel for %s param." %p)                    
-                arr[p] = scipy.ndimage.filters.gaussian_filter(arr[p], int(params[p]['sigma']/spacing))
-            else:
+            if p.get('kernel', None) is not None:
                 raise Exception("Convolving by a non-gaussian kernel is not yet supported.")
-                #arr[p] = scipy.ndimage.filters.convolve(arr[p], params[p]['kernel'])
-                
-                
-        return arr
+            if p.get('sigma', None) is None:
+                raise Exception("Please specify either a kernel to use for convolution, or sigma for a gaussian kernel.")
+            sigmas.append(p['sigma'] / spacing)
+        return afn.gaussianBlurGrids(grid, sigmas)
         
 class ConvolverItem(Qt.QTreeWidgetItem):
     def __init__(self, mc):
@@ -23,6 +23,7 @@ import numpy.ma as ma
 import scipy
 
 from acq4.analysis.AnalysisModule import AnalysisModule
+from acq4.util.FileLoader import PrefetchStore
 import acq4.pyqtgraph as pg
 from acq4.pyqtgraph import configfile
 from acq4.util.metaarray import MetaArray
@@ -216,6 +217,9 @@ class PSPReversal(AnalysisModule):
         ])
         self.initializeElements()  # exists as part of analysishost.
         self.file_loader_instance = self.getElement('File Loader', create=True)
+        # read clamp data of the selected protocol in the background
+        self.file_loader_instance.setPrefetchFunction(self.dataModel.getClampFile)
+        self.prefetched = PrefetchStore(self.file_loader_instance.prefetcher)
         # grab input form the "Ctrl" window
         self.ctrl.PSPReversal_Update.clicked.connect(self.interactive_analysis)
         self.ctrl.PSPReversal_PrintResults.clicked.connect(self.print_analysis)
@@ -624,7 +628,7 @@ class PSPReversal(AnalysisModule):
                 print("Error loading data for protocol %s:"
                       % directory_name)
                 continue  # If something goes wrong here, we just carry on
-            data_file = data_file_handle.read()
+            data_file = self.prefetched.read(data_file_handle)
             self.devicesUsed = self.dataModel.getDevices(data_dir_handle)
             self.holding = self.dataModel.getClampHoldingLevel(data_file_handle)
             self.amp_settings = self.dataModel.getWCCompSettings(data_file)
@@ -1,6 +1,7 @@
 from __future__ import print_function
 import numpy as np
 import math
+import scipy.ndimage
 from acq4.pyqtgraph.debug import Profiler
 import acq4.util.functions as utilFn
 
@@ -51,6 +52,57 @@ def convertPtsToSparseImage(data, params, spacing=5e-6):
     return arr
 
 
+
+def binPtsToGrid(data, params, spacing=5e-6):
+    """Vectorized version of convertPtsToSparseImage that returns plain arrays.
+           data - a numpy record array which includes fields for 'xPos', 'yPos' and the parameters specified in params.
+           params - a list of fields to project
+           spacing - the size of each pixel in the returned grid (default is 5um)
+
+        Return (grid, counts). grid has shape (len(params), xdim, ydim) and holds the
+        average value of each param at each grid location (0 where there are no
+        points); counts holds the number of points at each grid location.
+        All points are binned in one pass using np.bincount.
+        """
+    if 'xPos' not in data.dtype.names or 'yPos' not in data.dtype.names:
+        raise Exception("Data needs to have fields for 'xPos' and 'yPos'. Current fields are: %s" %str(data.dtype.names))
+    xmin = data['xPos'].min()
+    ymin = data['yPos'].min()
+    xdim = int((data['xPos'].max()-xmin)/spacing)+5
+    ydim = int((data['yPos'].max()-ymin)/spacing)+5
+
+    ## same pixel assignment as convertPtsToSparseImage
+    xi = ((data['xPos']-xmin)/spacing).astype(int)
+    yi = ((data['yPos']-ymin)/spacing).astype(int)
+    inds = xi * ydim + yi
+    n = xdim * ydim
+
+    counts = np.bincount(inds, minlength=n)
+    norm = np.maximum(counts, 1).astype(float)
+    grid = np.empty((len(params), xdim, ydim), dtype=float)
+    for i, p in enumerate(params):
+        grid[i] = (np.bincount(inds, weights=data[p], minlength=n) / norm).reshape(xdim, ydim)
+    return grid, counts.reshape(xdim, ydim)
+
+
+def gaussianBlurGrids(grid, sigmas):
+    """Blur each image grid[i] (see binPtsToGrid) with a gaussian kernel of
+    standard deviation sigmas[i] (in pixels).
+
+    The kernel is applied separably (one 1D pass per axis), and all images that
+    share the same sigma are filtered together.
+    """
+    out = np.empty(grid.shape, dtype=float)
+    sigmas = np.asarray(sigmas, dtype=float)
+    for sigma in np.unique(sigmas):
+        mask = sigmas == sigma
+        arr = grid[mask]
+        if sigma > 0:
+            arr = scipy.ndimage.gaussian_filter1d(arr, sigma, axis=1)
+            arr = scipy.ndimage.gaussian_filter1d(arr, sigma, axis=2)
+        out[mask] = arr
+    return out
+
 def bendelsSpatialCorrelationAlgorithm(data, radius, spontRate, timeWindow, printProcess=False, eventsKey='numOfPostEvents'):
     ## check that data has 'xPos', 'yPos' and 'numOfPostEvents'
     #SpatialCorrelator.checkArrayInput(data) 
@@ -0,0 +1,35 @@
+from __future__ import print_function
+import numpy as np
+import scipy.ndimage
+from acq4.analysis.tools import functions as afn
+
+
+def makeMap(n=500, seed=0):
+    rng = np.random.RandomState(seed)
+    data = np.zeros(n, dtype=[('xPos', float), ('yPos', float), ('charge', float), ('events', float)])
+    ## sites on a 20um grid, with repeated stimulations of some sites
+    data['xPos'] = rng.randint(0, 30, size=n) * 20e-6 - 1e-3
+    data['yPos'] = rng.randint(0, 25, size=n) * 20e-6 + 2e-3
+    data['charge'] = rng.normal(size=n)
+    data['events'] = rng.poisson(2, size=n)
+    return data
+
+
+def test_bin_pts_to_grid():
+    data = makeMap()
+    params = ['charge', 'events']
+    grid, counts = afn.binPtsToGrid(data, params, spacing=5e-6)
+    ref = afn.convertPtsToSparseImage(data, params, spacing=5e-6)
+    assert grid.shape == (2,) + ref.shape
+    assert counts.sum() == len(data)
+    for i, p in enumerate(params):
+        assert np.allclose(grid[i], ref[p])
+
+
+def test_gaussian_blur_grids():
+    data = makeMap()
+    grid, counts = afn.binPtsToGrid(data, ['charge', 'events', 'charge'], spacing=5e-6)
+    sigmas = [9, 9, 2.5]
+    blurred = afn.gaussianBlurGrids(grid, sigmas)
+    for i, sigma in enumerate(sigmas):
+        assert np.allclose(blurred[i], scipy.ndimage.gaussian_filter(grid[i], sigma))
@@ -0,0 +1,12 @@
+"""
+Performance benchmarks for ACQ4.
+
+Each module in this package can be run as a script, for example:
+
+    python -m acq4.benchmarks.mptransfer
+
+The taskrunner and camera benchmarks run on a Manager with simulated devices
+(see mockrig.py). suite.py runs these together with the DataManager and
+MetaArray benchmarks and writes the results as JSON, which can be compared
+with the results from another commit.
+"""
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division
+"""
+camera.py - Camera frame pipeline rates on a simulated rig
+
+Streams frames from a MockCamera through the same RecordThread used by the
+Camera module and reports the rate at which frames arrive in the GUI thread
+and the rate at which they are written to disk while recording.
+
+    python -m acq4.benchmarks.camera [--duration SEC] [--exposure SEC]
+"""
+
+import time, argparse
+
+
+def run(rig, duration=5.0, exposure=0.001, camera='Camera'):
+    """Record from *camera* for *duration* seconds and return a list of result
+    dicts. *rig* is a MockRig."""
+    from acq4.util.imaging.record_thread import RecordThread
+
+    man = rig.manager
+    cam = man.getDevice(camera)
+    oldExposure = cam.getParam('exposure')
+    oldDir = man.getCurrentDir()
+    man.setCurrentDir(rig.newDir())
+
+    frameTimes = []
+    frameBytes = [0]
+    queued = [0]
+    finished = []
+    recorder = RecordThread(None)
+
+    def newFrame(frame):
+        frameTimes.append(time.time())
+        frameBytes[0] = frame.getImage().nbytes
+        queued[0] = max(queued[0], recorder.newFrame(frame))
+
+    recorder.sigRecordingFinished.connect(lambda fh, n: finished.append((time.time(), fh, n)))
+    recorder.start()
+    cam.sigNewFrame.connect(newFrame)
+    try:
+        cam.setParam('exposure', exposure, autoRestart=False)
+        cam.start()
+        rig.waitFor(lambda: len(frameTimes) > 0)
+        rig.processEvents(0.5)  ## let the frame rate settle before recording
+
+        del frameTimes[:]
+        start = time.time()
+        recorder.startRecording()
+        rig.processEvents(duration)
+        recorder.stopRecording()
+        stop = time.time()
+        cam.stop()
+        nFrames = len(frameTimes)
+
+        rig.waitFor(lambda: len(finished) > 0, timeout=duration + 60.0)
+        writeTime, fh, nWritten = finished[0]
+    finally:
+        cam.sigNewFrame.disconnect(newFrame)
+        recorder.quit()
+        recorder.wait()
+        cam.stop()
+        cam.setParam('exposure', oldExposure, autoRestart=False)
+        man.setCurrentDir(oldDir)
+
+    frameMB = frameBytes[0] / 1e6
+    return [
+        {
+            'name': 'acquire',
+            'exposure_s': exposure,
+            'frames': nFrames,
+            'fps': nFrames / (stop - start),
+        },
+        {
+            'name': 'record',
+            'frames': nWritten,
+            'frame_MB': frameMB,
+            'fps': nWritten / (writeTime - start),
+            'throughput_MBps': nWritten * frameMB / (writeTime - start),
+            'write_lag_s': writeTime - stop,
+            'max_queued_frames': queued[0],
+        },
+    ]
+
+
+def main(argv=None):
+    from .mockrig import MockRig
+
+    parser = argparse.ArgumentParser(description="Measure camera acquisition and recording rates on a simulated rig.")
+    parser.add_argument('--duration', type=float, default=5.0, help="recording duration in seconds")
+    parser.add_argument('--exposure', type=float, default=0.001, help="camera exposure in seconds")
+    args = parser.parse_args(argv)
+
+    rig = MockRig()
+    try:
+        results = run(rig, duration=args.duration, exposure=args.exposure)
+    finally:
+        rig.close()
+
+    acq, rec = results
+    print("acquired %d frames at %0.1f fps" % (acq['frames'], acq['fps']))
+    print("recorded %d frames at %0.1f fps (%0.1f MB/s); finished writing %0.2f s after recording stopped" % (
+        rec['frames'], rec['fps'], rec['throughput_MBps'], rec['write_lag_s']))
+    return results
+
+
+if __name__ == '__main__':
+    main()
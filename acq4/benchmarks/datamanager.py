@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division
+"""
+datamanager.py - DataManager write and index rates
+
+Measures how quickly a DirHandle can create directories, write small
+MetaArray files, update their meta-info in the directory index, and list and
+read back the index. These are the operations performed for every trial when
+a task sequence is stored.
+
+    python -m acq4.benchmarks.datamanager [--files N] [--size SAMPLES]
+"""
+
+import time, shutil, tempfile, argparse
+import numpy as np
+
+
+def rate(name, count, dt, **kwds):
+    result = {'name': name, 'count': count, 'time_s': dt, 'per_s': count / dt}
+    result.update(kwds)
+    return result
+
+
+def run(dh, files=200, size=10000):
+    """Run the benchmark inside DirHandle *dh* and return a list of result dicts.
+
+    *files* is the number of files and directories created, and *size* is the
+    number of float64 samples in each file."""
+    from acq4.util.metaarray import MetaArray
+
+    results = []
+
+    start = time.time()
+    dirs = [dh.mkdir('dir', autoIncrement=True, info={'dirType': 'Protocol', 'index': i}) for i in range(files)]
+    results.append(rate('mkdir', files, time.time() - start))
+
+    data = MetaArray(np.random.normal(size=(2, size)), info=[
+        {'name': 'Channel', 'cols': [{'name': 'primary'}, {'name': 'command'}]},
+        {'name': 'Time', 'units': 's', 'values': np.arange(size) * 5e-5},
+    ])
+    mb = data.asarray().nbytes / 1e6
+    start = time.time()
+    fileHandles = [d.writeFile(data, 'Clamp1.ma', info={'index': i}) for i, d in enumerate(dirs)]
+    dt = time.time() - start
+    results.append(rate('writeFile (separate dirs)', files, dt, file_MB=mb, throughput_MBps=files * mb / dt))
+
+    ## many files in one directory also grows that directory's index
+    flat = dh.mkdir('flat')
+    start = time.time()
+    flatHandles = [flat.writeFile(data, 'Clamp1.ma', autoIncrement=True, info={'index': i}) for i in range(files)]
+    dt = time.time() - start
+    results.append(rate('writeFile (one dir)', files, dt, file_MB=mb, throughput_MBps=files * mb / dt))
+
+    start = time.time()
+    for i, fh in enumerate(flatHandles):
+        fh.setInfo(note='file %d' % i)
+    results.append(rate('setInfo', files, time.time() - start))
+
+    start = time.time()
+    for fh in flatHandles:
+        flat.forget(fh.shortName())
+    for i, fh in enumerate(flatHandles):
+        flat.indexFile(fh.shortName(), info={'index': i})
+    results.append(rate('indexFile', files, time.time() - start))
+
+    start = time.time()
+    names = flat.ls()
+    infos = [flat[n].info() for n in names]
+    results.append(rate('ls + info', len(infos), time.time() - start))
+
+    start = time.time()
+    for fh in fileHandles:
+        fh.read()
+    dt = time.time() - start
+    results.append(rate('read', files, dt, file_MB=mb, throughput_MBps=files * mb / dt))
+
+    return results
+
+
+def main(argv=None):
+    from acq4.util.DataManager import getDirHandle
+
+    parser = argparse.ArgumentParser(description="Measure DataManager write and index rates.")
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--size', type=int, default=10000, help="samples per file")
+    args = parser.parse_args(argv)
+
+    tempDir = tempfile.mkdtemp(prefix='acq4-benchmark-')
+    try:
+        results = run(getDirHandle(tempDir), files=args.files, size=args.size)
+    finally:
+        shutil.rmtree(tempDir, ignore_errors=True)
+
+    print("%30s  %8s  %10s" % ('operation', 'count', 'per second'))
+    for r in results:
+        print("%30s  %8d  %10.1f" % (r['name'], r['count'], r['per_s']))
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division
+"""
+metaarrayio.py - MetaArray read and write bandwidth
+
+Writes and reads back an image stack in each of the MetaArray file formats
+(HDF5, when h5py is available, and the older .ma format). For HDF5, partial
+reads and appending in small blocks (as done while recording from a camera)
+are also measured. Files are written to a temporary directory, so the results
+usually reflect the operating system's file cache rather than the disk itself.
+
+    python -m acq4.benchmarks.metaarrayio [--repeat N] [size_MB]
+"""
+
+import os, time, shutil, tempfile, argparse
+import numpy as np
+import acq4.pyqtgraph.metaarray as metaarray
+from acq4.pyqtgraph.metaarray import MetaArray
+
+
+def imageStack(size, frameShape=(256, 256)):
+    """Return a MetaArray image stack of about *size* MB."""
+    nFrames = max(1, int(size * 1e6 / (2 * frameShape[0] * frameShape[1])))
+    data = np.random.randint(0, 4096, size=(nFrames,) + frameShape).astype(np.uint16)
+    return MetaArray(data, info=[
+        {'name': 'Time', 'units': 's', 'values': np.arange(nFrames) * 0.01},
+        {'name': 'X'},
+        {'name': 'Y'},
+        {'exposure': 0.01},
+    ])
+
+
+def timeit(fn, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        fn()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def measure(name, fn, size, repeat):
+    try:
+        dt = timeit(fn, repeat)
+    except Exception as exc:
+        return {'name': name, 'size_MB': size, 'error': str(exc)}
+    return {'name': name, 'size_MB': size, 'time_s': dt, 'throughput_MBps': size / dt}
+
+
+def run(dirName, size=64, repeat=3, appendFrames=10):
+    """Run the benchmark on a stack of *size* MB in directory *dirName* and
+    return a list of result dicts."""
+    data = imageStack(size)
+    size = data.asarray().nbytes / 1e6
+    results = []
+
+    formats = [('ma', data.writeMa)]
+    if metaarray.HAVE_HDF5:
+        formats = [
+            ('hdf5', data.writeHDF5),
+            ('hdf5 lzf', lambda fn: data.writeHDF5(fn, compression='lzf')),
+        ] + formats
+
+    for fmt, writeFn in formats:
+        fileName = os.path.join(dirName, fmt.replace(' ', '_') + '.ma')
+        results.append(measure('write %s' % fmt, lambda: writeFn(fileName), size, repeat))
+        results.append(measure('read %s' % fmt, lambda: MetaArray(file=fileName).asarray().sum(), size, repeat))
+
+    if metaarray.HAVE_HDF5:
+        fileName = os.path.join(dirName, 'hdf5.ma')
+        n = data.shape[0] // 10
+        results.append(measure('read hdf5 (10% of frames)',
+                               lambda: MetaArray(file=fileName, readAllData=False)[:n].asarray().sum(),
+                               size * n / data.shape[0], repeat))
+
+        ## like RecordThread: first block creates the file, later blocks are appended
+        def append():
+            fileName = os.path.join(dirName, 'append.ma')
+            if os.path.exists(fileName):
+                os.remove(fileName)
+            for i in range(0, data.shape[0], appendFrames):
+                block = data[i:i+appendFrames]
+                block.write(fileName, appendAxis='Time')
+        results.append(measure('append hdf5 (%d frames per write)' % appendFrames, append, size, repeat))
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure MetaArray file read and write bandwidth.")
+    parser.add_argument('size', nargs='?', type=float, default=64, help="size of the image stack in MB")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    tempDir = tempfile.mkdtemp(prefix='acq4-benchmark-')
+    try:
+        results = run(tempDir, args.size, args.repeat)
+    finally:
+        shutil.rmtree(tempDir, ignore_errors=True)
+
+    print("%35s  %10s  %10s" % ('operation', 'time (ms)', 'MB/s'))
+    for r in results:
+        if 'error' in r:
+            print("%35s  failed: %s" % (r['name'], r['error']))
+        else:
+            print("%35s  %10.1f  %10.1f" % (r['name'], r['time_s']*1000, r['throughput_MBps']))
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division
+"""
+mockrig.py - A Manager running simulated hardware, for benchmarks
+
+Writes a configuration with the simulated devices from config/example (mock
+NI DAQ, MockClamp, MockStage, Microscope and MockCamera) into a temporary
+directory and starts a Manager from it. Data written by the benchmarks is
+stored in the same temporary directory, which is removed by MockRig.close().
+"""
+
+import os, time, shutil, tempfile
+from collections import OrderedDict
+from acq4.util import Qt
+import acq4.util.configfile as configfile
+from acq4.util import logstore
+
+
+def mockConfig(storageDir):
+    """Return a configuration dict for a simulated rig that stores data in *storageDir*."""
+    um = 1e-6
+    devices = OrderedDict([
+        ('DAQ', {
+            'driver': 'NiDAQ',
+            'mock': True,
+            'defaultAIMode': 'NRSE',
+            'defaultAIRange': [-10, 10],
+            'defaultAORange': [-10, 10],
+        }),
+        ('Clamp1', {
+            'driver': 'MockClamp',
+            'simulator': 'builtin',
+            'Command': {'device': 'DAQ', 'channel': '/Dev1/ao0', 'type': 'ao'},
+            'ScaledSignal': {'device': 'DAQ', 'channel': '/Dev1/ai5', 'mode': 'NRSE', 'type': 'ai'},
+            'icHolding': 0.0,
+            'vcHolding': -65e-3,
+        }),
+        ('Stage', {
+            'driver': 'MockStage',
+            'transform': {'pos': (0, 0, 0), 'scale': (1, 1, 1), 'angle': 0},
+        }),
+        ('Microscope', {
+            'driver': 'Microscope',
+            'parentDevice': 'Stage',
+            'objectives': {
+                0: {'5x_0.25NA': {'name': '5x 0.25na FLUAR', 'scale': 1.0 / 5.0}},
+            },
+        }),
+        ('Camera', {
+            'driver': 'MockCamera',
+            'parentDevice': 'Microscope',
+            'transform': {'pos': (0, 0), 'scale': (5*2.581*um, -5*2.581*um), 'angle': 0},
+        }),
+    ])
+    return OrderedDict([
+        ('devices', devices),
+        ## the Manager will not start without at least one module loaded
+        ('modules', {'Console': {'module': 'Console', 'config': None}}),
+        ('storageDir', storageDir),
+        ('disableErrorPopups', True),
+    ])
+
+
+class MockRig(object):
+    """Starts a Manager from a mock configuration in a new temporary directory.
+
+    Only one Manager may exist per process, so only one MockRig may be created.
+    """
+    def __init__(self, baseDir=None):
+        self.app = Qt.QApplication.instance()
+        if self.app is None:
+            self.app = Qt.QApplication([])
+
+        self.tempDir = tempfile.mkdtemp(prefix='acq4-benchmark-', dir=baseDir)
+        self.storageDir = os.path.join(self.tempDir, 'data')
+        os.mkdir(self.storageDir)
+        self.configFile = os.path.join(self.tempDir, 'default.cfg')
+        configfile.writeConfigFile(mockConfig(self.storageDir), self.configFile)
+
+        ## the log window writes tempLog.txt to the working directory until a log directory is set
+        self.oldCwd = os.getcwd()
+        os.chdir(self.tempDir)
+
+        from acq4.Manager import Manager
+        try:
+            self.manager = Manager(self.configFile, argv=['-n', '-m', 'Console'])
+            self.manager.setCurrentDir('benchmark')
+        except:
+            os.chdir(self.oldCwd)
+            shutil.rmtree(self.tempDir, ignore_errors=True)
+            raise
+
+    def newDir(self):
+        """Return a new, empty DirHandle for a benchmark to write into."""
+        return self.manager.getCurrentDir().mkdir('run', autoIncrement=True)
+
+    def processEvents(self, duration=0.0):
+        """Process Qt events for at least *duration* seconds."""
+        stop = time.time() + duration
+        while True:
+            self.app.processEvents()
+            if time.time() >= stop:
+                break
+            time.sleep(1e-3)
+
+    def waitFor(self, condition, timeout=30.0):
+        """Process Qt events until *condition()* returns True. Raise an exception
+        if this takes longer than *timeout* seconds."""
+        stop = time.time() + timeout
+        while not condition():
+            if time.time() > stop:
+                raise Exception("Timed out waiting for benchmark to finish.")
+            self.processEvents(5e-3)
+
+    def close(self):
+        """Shut down the Manager and remove all files written by the benchmarks."""
+        try:
+            self.manager.quit()
+            logstore.flushAll()  ## buffered log entries would otherwise be written at exit
+        finally:
+            os.chdir(self.oldCwd)
+            shutil.rmtree(self.tempDir, ignore_errors=True)
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division
+"""
+mptransfer.py - Throughput of arrays returned by a remote process
+
+Compares the shared-memory transport of pyqtgraph.multiprocess with pickling
+arrays through the connection, for arrays of increasing size.
+
+    python -m acq4.benchmarks.mptransfer [--repeat N] [size_MB ...]
+"""
+
+import time, argparse
+import numpy as np
+import acq4.pyqtgraph.multiprocess as mp
+
+
+def measure(proc, remoteArray, shm, repeat):
+    """Return the minimum time needed to fetch *remoteArray* (a proxy) by value.
+    The data is summed after each transfer so that lazily mapped pages are counted."""
+    proc.shm.threshold = 1000000 if shm else None
+    remoteArray._getValue()  ## the new setting reaches the remote process with this request
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        arr = remoteArray._getValue()
+        arr.sum()
+        times.append(time.time() - start)
+        del arr
+    return min(times)
+
+
+def run(sizes=(1, 10, 100, 400), repeat=5):
+    """Run the benchmark for arrays of *sizes* MB and return a list of result dicts."""
+    proc = mp.Process()
+    results = []
+    try:
+        rnp = proc._import('numpy')
+        for size in sizes:
+            arr = rnp.ones(int(size * 1e6 // 8))
+            for shm in (False, True):
+                dt = measure(proc, arr, shm, repeat)
+                results.append({
+                    'size_MB': size,
+                    'transport': 'shm' if shm else 'pickle',
+                    'time_s': dt,
+                    'throughput_MBps': size / dt,
+                })
+            del arr
+    finally:
+        proc.join()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare shared-memory and pickle transport of arrays from a remote process.")
+    parser.add_argument('sizes', nargs='*', type=float, default=[1, 10, 100, 400], help="array sizes in MB")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.repeat)
+    print("%10s  %10s  %10s  %12s" % ('size (MB)', 'transport', 'time (ms)', 'MB/s'))
+    for r in results:
+        print("%10g  %10s  %10.1f  %12.1f" % (r['size_MB'], r['transport'], r['time_s']*1000, r['throughput_MBps']))
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division
+"""
+suite.py - Run all mock-rig benchmarks and report the results as JSON
+
+Starts a Manager with simulated devices (see mockrig.py), runs the task
+sequence, camera, DataManager and MetaArray benchmarks, and writes a single
+JSON document describing the results, the system, and the git commit that was
+tested. Two such documents can be compared to find performance changes
+between commits:
+
+    python -m acq4.benchmarks.suite --output before.json
+    (check out another commit)
+    python -m acq4.benchmarks.suite --output after.json --compare before.json
+
+or, without running the benchmarks again:
+
+    python -m acq4.benchmarks.suite --compare before.json after.json
+"""
+
+import os, sys, json, time, platform, subprocess, argparse
+from collections import OrderedDict
+import numpy as np
+
+
+FORMAT_VERSION = 1
+
+## result fields that are compared between runs, and whether larger values are better
+METRICS = OrderedDict([
+    ('trials_per_s', True),
+    ('overhead_ms', False),
+    ('mean_ms', False),
+    ('fps', True),
+    ('per_s', True),
+    ('throughput_MBps', True),
+    ('write_lag_s', False),
+])
+
+
+def gitInfo():
+    """Return (commit, dirty) for the source tree containing acq4, or (None, None)."""
+    path = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=path, stderr=subprocess.STDOUT)
+        status = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=path, stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit.decode().strip(), len(status.strip()) > 0
+
+
+def systemInfo():
+    from acq4.util import Qt
+    import acq4.pyqtgraph as pg
+    import acq4.pyqtgraph.metaarray as metaarray
+    info = OrderedDict([
+        ('platform', platform.platform()),
+        ('machine', platform.machine()),
+        ('processor', platform.processor()),
+        ('python', platform.python_version()),
+        ('numpy', np.__version__),
+        ('qt', '%s %s' % (pg.Qt.QT_LIB, Qt.qVersion())),
+        ('hdf5', metaarray.HAVE_HDF5),
+    ])
+    try:
+        import multiprocessing
+        info['cpu_count'] = multiprocessing.cpu_count()
+    except NotImplementedError:
+        info['cpu_count'] = None
+    return info
+
+
+def run(quick=False):
+    """Run all benchmarks and return a dict ready to be written as JSON."""
+    from acq4.util.debug import printExc
+    from .mockrig import MockRig
+    from . import taskrunner, camera, datamanager, metaarrayio
+
+    if quick:
+        opts = {'trials': 10, 'duration': 1.0, 'files': 50, 'size': 16}
+    else:
+        opts = {'trials': 50, 'duration': 5.0, 'files': 200, 'size': 64}
+
+    benchmarks = OrderedDict([
+        ('taskrunner', lambda rig: taskrunner.run(rig, trials=opts['trials'])),
+        ('camera', lambda rig: camera.run(rig, duration=opts['duration'])),
+        ('datamanager', lambda rig: datamanager.run(rig.newDir(), files=opts['files'])),
+        ('metaarray', lambda rig: metaarrayio.run(rig.newDir().name(), size=opts['size'])),
+    ])
+
+    commit, dirty = gitInfo()
+    output = OrderedDict([
+        ('format', FORMAT_VERSION),
+        ('commit', commit),
+        ('dirty', dirty),
+        ('time', time.strftime('%Y-%m-%dT%H:%M:%S')),
+        ('system', systemInfo()),
+        ('options', opts),
+        ('benchmarks', OrderedDict()),
+    ])
+
+    rig = MockRig()
+    try:
+        for name, fn in benchmarks.items():
+            print("Running %s benchmark.." % name)
+            try:
+                output['benchmarks'][name] = fn(rig)
+            except Exception as exc:
+                printExc("Error in %s benchmark:" % name)
+                output['benchmarks'][name] = {'error': str(exc)}
+    finally:
+        rig.close()
+    return output
+
+
+def toJson(results):
+    def default(obj):
+        ## numpy scalars (other than float64) are not serializable
+        if isinstance(obj, np.generic):
+            return obj.item()
+        raise TypeError("Object of type %s is not JSON serializable" % type(obj))
+    return json.dumps(results, indent=2, default=default)
+
+
+def compare(old, new):
+    """Compare two results dicts (as returned by run()) and return a list of
+    (benchmark, name, metric, oldValue, newValue, ratio) for each metric found
+    in both. A ratio greater than 1 means the new result is better."""
+    rows = []
+    for bench, newResults in new['benchmarks'].items():
+        oldResults = old['benchmarks'].get(bench)
+        if not isinstance(newResults, list) or not isinstance(oldResults, list):
+            continue
+        oldByName = dict([(r['name'], r) for r in oldResults])
+        for r in newResults:
+            o = oldByName.get(r['name'])
+            if o is None:
+                continue
+            for metric, higherIsBetter in METRICS.items():
+                if metric not in r or metric not in o:
+                    continue
+                a, b = o[metric], r[metric]
+                if a == 0 or b == 0:
+                    ratio = None
+                elif higherIsBetter:
+                    ratio = b / a
+                else:
+                    ratio = a / b
+                rows.append((bench, r['name'], metric, a, b, ratio))
+    return rows
+
+
+def printComparison(old, new, stream=None):
+    stream = sys.stdout if stream is None else stream
+    print("Comparing %s (old) with %s (new); ratio > 1 is an improvement." % (old.get('commit'), new.get('commit')), file=stream)
+    print("%-12s  %-45s  %-16s  %12s  %12s  %7s" % ('benchmark', 'name', 'metric', 'old', 'new', 'ratio'), file=stream)
+    for bench, name, metric, a, b, ratio in compare(old, new):
+        ratioStr = '-' if ratio is None else '%0.2f' % ratio
+        print("%-12s  %-45s  %-16s  %12.4g  %12.4g  %7s" % (bench, name, metric, a, b, ratioStr), file=stream)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run all mock-rig benchmarks and report results as JSON.")
+    parser.add_argument('--output', '-o', help="file to write JSON results to (default is stdout)")
+    parser.add_argument('--quick', action='store_true', help="run shorter versions of each benchmark")
+    parser.add_argument('--compare', nargs='+', metavar='JSON',
+                        help="compare results with a previous run; if two files are given, compare them without running the benchmarks")
+    args = parser.parse_args(argv)
+
+    if args.compare is not None and len(args.compare) > 2:
+        parser.error("--compare accepts at most two files")
+    loaded = [json.load(open(f)) for f in (args.compare or [])]
+    if len(loaded) == 2:
+        printComparison(*loaded)
+        return loaded[1]
+
+    if args.output is None:
+        ## keep stdout clean for the JSON document
+        stdout = sys.stdout
+        sys.stdout = sys.stderr
+        try:
+            results = run(quick=args.quick)
+        finally:
+            sys.stdout = stdout
+        print(toJson(results))
+    else:
+        results = run(quick=args.quick)
+        with open(args.output, 'w') as fh:
+            fh.write(toJson(results))
+    if len(loaded) == 1:
+        printComparison(loaded[0], results, stream=sys.stderr if args.output is None else sys.stdout)
+    return results
+
+
+if __name__ == '__main__':
+    main()
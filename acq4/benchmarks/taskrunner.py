@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division
+"""
+taskrunner.py - Task sequence throughput on a simulated rig
+
+Runs a sequence of MockClamp trials through the same TaskThread and
+SequenceCompiler used by the TaskRunner module (without its GUI) and reports
+the number of trials per second, along with the mean time spent in each of the
+Profiler-marked phases of Manager.Task.execute() and Manager.Task.stop().
+
+    python -m acq4.benchmarks.taskrunner [--trials N] [--duration SEC] [--no-store]
+"""
+
+import time, argparse, threading
+from collections import OrderedDict
+import numpy as np
+
+
+class PhaseTimes(object):
+    """Collects the times reported to Task.setPhaseTimeCallback()."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.times = OrderedDict()  ## (name, mark): [seconds, ...]
+
+    def __call__(self, name, marks):
+        with self.lock:
+            for mark, dt in marks:
+                self.times.setdefault((name, mark), []).append(dt)
+
+    def results(self):
+        results = []
+        with self.lock:
+            for (name, mark), times in self.times.items():
+                times = np.array(times)
+                results.append({
+                    'name': 'phase: %s: %s' % (name.split('.')[-1], mark.strip()),
+                    'count': len(times),
+                    'mean_ms': times.mean() * 1000,
+                    'max_ms': times.max() * 1000,
+                })
+        return results
+
+
+class _TaskRunnerStub(object):
+    ## TaskThread only needs the manager from its TaskRunner
+    def __init__(self, manager):
+        self.manager = manager
+
+
+def run(rig, trials=50, duration=0.05, rate=20000., clamp='Clamp1', daq='DAQ', store=True):
+    """Run a sequence of *trials* trials of *duration* seconds each and return
+    a list of result dicts. *rig* is a MockRig."""
+    from acq4.Manager import Task
+    from acq4.modules.TaskRunner.TaskRunner import TaskThread
+    from acq4.modules.TaskRunner.SequenceCompiler import SequenceCompiler
+
+    npts = int(duration * rate)
+    dh = rig.newDir() if store else None
+
+    def protocolFn(params):
+        prot = {'protocol': {'duration': duration, 'leadTime': 0.0, 'cycleTime': 0.0,
+                             'timeout': None, 'storeData': store}}
+        if store:
+            name = '_'.join(['%03d' % i for i in params.values()])
+            prot['protocol']['storageDir'] = dh.mkdir(name, info={'dirType': 'Protocol'})
+        return prot
+
+    def deviceFn(dev, params):
+        if dev == daq:
+            return {'rate': rate, 'numPts': npts}
+        cmd = np.zeros(npts)
+        cmd[npts//4:npts//2] = 10e-12 * params['amplitude']
+        return {'mode': 'ic', 'command': cmd, 'holding': 0.0}
+
+    paramInds = OrderedDict([((clamp, 'amplitude'), list(range(trials)))])
+    frames = []
+    errors = []
+    thread = TaskThread(_TaskRunnerStub(rig.manager))
+    thread.sigNewFrame.connect(lambda frame: frames.append(frame['params']))
+    thread.sigExitFromError.connect(lambda: errors.append(True))
+
+    phases = PhaseTimes()
+    Task.setPhaseTimeCallback(phases)
+    try:
+        start = time.time()
+        seq = SequenceCompiler(protocolFn, deviceFn, [daq, clamp], paramInds, list(paramInds.keys()))
+        seq.start()
+        thread.startTask(seq, paramInds)
+        rig.waitFor(lambda: not thread.isRunning(), timeout=trials * (duration + 5.0))
+        elapsed = time.time() - start
+    finally:
+        Task.setPhaseTimeCallback(None)
+
+    if len(errors) > 0 or len(frames) != trials:
+        raise Exception("Task sequence failed after %d of %d trials." % (len(frames), trials))
+
+    results = [{
+        'name': 'sequence',
+        'trials': trials,
+        'trial_duration_s': duration,
+        'store': store,
+        'time_s': elapsed,
+        'trials_per_s': trials / elapsed,
+        'overhead_ms': (elapsed / trials - duration) * 1000,
+    }]
+    return results + phases.results()
+
+
+def main(argv=None):
+    from .mockrig import MockRig
+
+    parser = argparse.ArgumentParser(description="Measure task sequence throughput on a simulated rig.")
+    parser.add_argument('--trials', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=0.05, help="duration of each trial in seconds")
+    parser.add_argument('--no-store', action='store_true', help="do not write results to disk")
+    args = parser.parse_args(argv)
+
+    rig = MockRig()
+    try:
+        results = run(rig, trials=args.trials, duration=args.duration, store=not args.no_store)
+    finally:
+        rig.close()
+
+    seq = results[0]
+    print("%d trials in %0.2f s: %0.1f trials/s (%0.1f ms overhead per trial)" % (
+        seq['trials'], seq['time_s'], seq['trials_per_s'], seq['overhead_ms']))
+    print("%-50s  %8s  %10s  %10s" % ('', 'count', 'mean (ms)', 'max (ms)'))
+    for r in results[1:]:
+        print("%-50s  %8d  %10.2f  %10.2f" % (r['name'], r['count'], r['mean_ms'], r['max_ms']))
+    return results
+
+
+if __name__ == '__main__':
+    main()
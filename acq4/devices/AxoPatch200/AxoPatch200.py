@@ -11,6 +11,7 @@ import numpy as np
 from acq4.pyqtgraph.WidgetGroup import WidgetGroup
 from collections import OrderedDict
 from acq4.util.debug import printExc
+from acq4.util.metaarray import MetaArray
 from .devGuiTemplate import *
 
 
@@ -161,7 +162,7 @@ class AxoPatch200(DAQGeneric):
         self.devLock = Mutex(Mutex.Recursive)    ## protects self.holding, possibly self.config, ..others, perhaps?
         self.mdCanceled = False
         
-        DAQGeneric.__init__(self, dm, daqConfig, name)
+        DAQGeneric.__init__(self, dm, {'channels': daqConfig, 'regularTimeAxis': config.get('regularTimeAxis', False)}, name)
         
         self.modeDialog = Qt.QMessageBox()
         self.modeDialog.hide()
@@ -459,10 +460,13 @@ class AxoPatch200Task(DAQGenericTask):
         #else:
             #raise Exception("No scale for channel %s" % chan)
             
-    def storeResult(self, dirHandle):
+    def storeResult(self, dirHandle, result=None):
         #DAQGenericTask.storeResult(self, dirHandle)
         #dirHandle.setInfo(self.ampState)
-        result = self.getResult()
+        if result is None:
+            result = self.getResult()
+        ## don't modify the result that was handed to other listeners
+        result = MetaArray(result.asarray(), info=result.infoCopy())
         result._info[-1]['ClampState'] = self.ampState
         dirHandle.writeFile(result, self.dev.name())
         
@@ -599,8 +599,9 @@ class CameraTask(DAQGenericTask):
             self.resultObj = CameraTaskResult(self, self.frames[:], daqResult)
         return self.resultObj
         
-    def storeResult(self, dirHandle):
-        result = self.getResult()
+    def storeResult(self, dirHandle, result=None):
+        if result is None:
+            result = self.getResult()
         result = {'frames': (result.asMetaArray(), result.info()), 'daqResult': (result.daqResult(), {})}
         dh = dirHandle.mkdir(self.dev.name())
         for k in result:
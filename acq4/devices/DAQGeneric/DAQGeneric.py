@@ -74,7 +74,12 @@ class DAQGeneric(Device):
                 channel: '/Dev1/line7'
                 type: 'di'
                 invert: True
+        regularTimeAxis: False
         
+    If regularTimeAxis is True, the Time axis of task results is described by
+    its start and step (see metaarray.axis) rather than an explicit array of
+    values. This saves memory and disk space, but files written this way can
+    not be read by versions of acq4 that predate regular axes.
     """
     sigHoldingChanged = Qt.Signal(object, object)
     
@@ -83,8 +88,13 @@ class DAQGeneric(Device):
         self._DGLock = Mutex(Qt.QMutex.Recursive)  ## protects access to _DGHolding, _DGConfig
         ## Do some sanity checks here on the configuration
         
+        self.regularTimeAxis = config.get('regularTimeAxis', False)
+        
         # 'channels' key is expected; for backward compatibility we just use the top-level config.
-        config = config.get('channels', config)
+        if 'channels' in config:
+            config = config['channels']
+        elif 'regularTimeAxis' in config:
+            config = OrderedDict([(k, v) for k, v in config.items() if k != 'regularTimeAxis'])
         self._DGConfig = config
         self._DGHolding = {}
         for ch in config:
@@ -435,9 +445,6 @@ class DAQGenericTask(DeviceTask):
         if len(result) > 0:
             meta = result[list(result.keys())[0]]['info']
             rate = meta['rate']
-            nPts = meta['numPts']
-            ## Create an array of time values
-            timeVals = np.linspace(0, float(nPts-1) / float(rate), nPts)
             
             ## Concatenate all channels together into a single array, generate MetaArray info
             chanList = [np.atleast_2d(result[x]['data']) for x in result]
@@ -462,7 +469,12 @@ class DAQGenericTask(DeviceTask):
                     
                     daqState[ch]['holding'] = self.holdingVals[ch]
             
-            info = [axis(name='Channel', cols=cols), axis(name='Time', units='s', values=timeVals)] + [{'DAQ': daqState}]
+            if self.dev.regularTimeAxis:
+                timeAxis = axis(name='Time', units='s', start=0.0, step=1.0 / rate)
+            else:
+                nPts = meta['numPts']
+                timeAxis = axis(name='Time', units='s', values=np.linspace(0, float(nPts-1) / float(rate), nPts))
+            info = [axis(name='Channel', cols=cols), timeAxis] + [{'DAQ': daqState}]
             
             
             protInfo = self._DAQCmd.copy()  ## copy everything but the command arrays and low-level configuration info
@@ -477,8 +489,8 @@ class DAQGenericTask(DeviceTask):
         else:
             return None
             
-    def storeResult(self, dirHandle):
-        DeviceTask.storeResult(self, dirHandle)
+    def storeResult(self, dirHandle, result=None):
+        DeviceTask.storeResult(self, dirHandle, result)
         for ch in self._DAQCmd:
             if self._DAQCmd[ch].get('recordInit', False):
             #if 'recordInit' in self._DAQCmd[ch] and self._DAQCmd[ch]['recordInit']:
@@ -220,8 +220,9 @@ class OutputChannelGui(DaqChannelGui):
         ps = self.ui.waveGeneratorWidget.listSequences()
         for k in ps:
             params[k] = range(len(ps[k]))
-        waves = []
-        runSequence(lambda p: waves.append(self.getSingleWave(p)), params, list(params.keys())) ## appends waveforms for the entire parameter space to waves
+        paramList = []
+        runSequence(lambda p: paramList.append(dict(p)), params, list(params.keys()))
+        waves = self.getWaveBatch(paramList)  ## waveforms for the entire parameter space
 
         autoRange = self.plot.getViewBox().autoRangeEnabled()
         self.plot.enableAutoRange(x=False, y=False)
@@ -266,6 +267,13 @@ class OutputChannelGui(DaqChannelGui):
         wave = self.ui.waveGeneratorWidget.getSingle(self.rate, self.numPts, params)
         
         return wave
+
+    def getWaveBatch(self, paramList):
+        """Return the command waveforms for a list of sequence parameter dicts."""
+        h = self.getHoldingValue()
+        if h is not None:
+            self.ui.waveGeneratorWidget.setOffset(h)
+        return self.ui.waveGeneratorWidget.getBatch(self.rate, self.numPts, paramList)
         
     def holdingCheckChanged(self, *v):
         self.ui.holdingSpin.setEnabled(self.ui.holdingCheck.isChecked())
@@ -247,9 +247,14 @@ class DeviceTask(object):
         """
         return None
     
-    def storeResult(self, dirHandle):
+    def storeResult(self, dirHandle, result=None):
         """
         Store the most recent set of results inside the specified dirHandle. 
+        *result* is the value previously returned by getResult(); if it is None,
+        getResult() is called. The Manager calls this method from a background
+        thread, so it should not depend on device state that may change while
+        the next task runs.
+        
         Although each device may determine the best data structure and formats
         to write, a few conventions are recommended: 
         
@@ -263,7 +268,8 @@ class DeviceTask(object):
           should be added to the directory meta-info, and it should begin with
           the name of the device.
         """
-        result = self.getResult()
+        if result is None:
+            result = self.getResult()
         if result is None:
             return
         elif isinstance(result, dict):
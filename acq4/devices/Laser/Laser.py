@@ -764,6 +764,8 @@ class LaserTask(DAQGenericTask):
         ### set up shutter, qSwitch and pCell -- self.cmd['daqProtocol'] points to the command structure that the DAQGeneric will use, don't set self.cmd['daqProtocol'] equal to something else!
         if 'shutter' in self.cmd:
             self.cmd['daqProtocol']['shutter'] = self.cmd['shutter']
+            ## command waveforms may be shared (and read-only); copy before modifying
+            self.cmd['daqProtocol']['shutter']['command'] = self.cmd['shutter']['command'].copy()
             self.cmd['daqProtocol']['shutter']['command'][-1] = 0
         elif 'shutterMode' in self.cmd:
             if self.cmd['shutterMode'] is 'auto':
@@ -786,6 +788,7 @@ class LaserTask(DAQGenericTask):
             
         if 'qSwitch' in self.cmd:
             self.cmd['daqProtocol']['qSwitch'] = self.cmd['qSwitch']
+            self.cmd['daqProtocol']['qSwitch']['command'] = self.cmd['qSwitch']['command'].copy()
             self.cmd['daqProtocol']['qSwitch']['command'][-1] = 0
         elif 'qSwitch' in calcCmds:
             self.cmd['daqProtocol']['qSwitch']['command'] = calcCmds['qSwitch']
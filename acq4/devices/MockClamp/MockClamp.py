@@ -42,7 +42,7 @@ class MockClamp(DAQGeneric):
         
         self.config = config
         
-        DAQGeneric.__init__(self, dm, daqConfig, name)
+        DAQGeneric.__init__(self, dm, {'channels': daqConfig, 'regularTimeAxis': config.get('regularTimeAxis', False)}, name)
         
         try:
             self.setHolding()
@@ -19,7 +19,8 @@ class MockStage(Stage):
         
         self._lastMove = None
         self.stageThread = MockStageThread()
-        self.stageThread.positionChanged.connect(self.posChanged)
+        ## posChanged is thread-safe; calling it directly means the position is current when a move finishes
+        self.stageThread.positionChanged.connect(self.posChanged, Qt.Qt.DirectConnection)
         self.stageThread.start()
         
         dm.declareInterface(name, ['stage'], self)
@@ -118,6 +119,7 @@ class MockStage(Stage):
     def _interruptMove(self):
         if self._lastMove is not None and not self._lastMove.isDone():
             self._lastMove._interrupted = True
+            self._lastMove._moveFinished()
 
     def setUserSpeed(self, v):
         pass
@@ -253,6 +255,7 @@ class MockStageThread(Thread):
                     self._setPosition(target)
                     self.currentMove._finished = True
                     self.stop()
+                    currentMove._moveFinished()
                 else:
                     unit = dif / dist
                     step = unit * stepDist
@@ -150,8 +150,9 @@ class MultiClampTaskGui(TaskGui):
         ps = self.ui.waveGeneratorWidget.listSequences()
         for k in ps:
             params[k] = range(len(ps[k]))
-        waves = []
-        runSequence(lambda p: waves.append(self.getSingleWave(p)), params, list(params.keys()))
+        paramList = []
+        runSequence(lambda p: paramList.append(dict(p)), params, list(params.keys()))
+        waves = self.getWaveBatch(paramList)  ## waveforms for the entire parameter space
 
         # Plot all waves but disable auto-range first to improve performance.
         autoRange = self.ui.bottomPlotWidget.getViewBox().autoRangeEnabled()
@@ -240,6 +241,12 @@ class MultiClampTaskGui(TaskGui):
         if wave is None:
             return None
         return wave
+
+    def getWaveBatch(self, paramList):
+        """Return the command waveforms for a list of sequence parameter dicts."""
+        state = self.stateGroup.state()
+        self.ui.waveGeneratorWidget.setOffset(state['holdingSpin'])
+        return self.ui.waveGeneratorWidget.getBatch(self.rate, self.numPts, paramList)
         
         
     def getMode(self):
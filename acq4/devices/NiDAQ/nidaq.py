@@ -316,7 +316,7 @@ class Task(DeviceTask):
         ## Results should be collected by individual devices using getData
         return None
         
-    def storeResult(self, dirHandle):
+    def storeResult(self, dirHandle, result=None):
         pass
         
     def getData(self, channel):
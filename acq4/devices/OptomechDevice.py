@@ -376,6 +376,7 @@ class OptomechDevice(InterfaceMixin):
         If *subdev* is given, then the transform is computed with that subdevice instead.
         *subdev* may be the name of the device or the device itself.
         """
+        self._flushPendingTransform()
         with self.__lock:
             tr = Qt.QMatrix4x4(self.__transform)
             
@@ -390,6 +391,7 @@ class OptomechDevice(InterfaceMixin):
         """
         See deviceTransform; this method returns the inverse.
         """
+        self._flushPendingTransform()
         invtr = self.__inverseTransform
         if invtr == 0:
             tr = Qt.QMatrix4x4(self.__transform)
@@ -427,6 +429,7 @@ class OptomechDevice(InterfaceMixin):
         If *subdev* is given, it must be a dictionary of {deviceName: subdevice} or
         {deviceName: subdeviceName} pairs specifying the state to compute.
         """
+        self.__flushPendingGlobalTransform()
         gt = self.__globalTransform
         if subdev is None: ## return cached transform
             if gt == 0:
@@ -464,6 +467,7 @@ class OptomechDevice(InterfaceMixin):
         See globalTransform; this method returns the inverse.
         """
         #dev = self.getSubdevice(subdev)
+        self.__flushPendingGlobalTransform()
         if subdev is None: ## return cached transform
             igt = self.__inverseGlobalTransform
             if igt == 0:
@@ -580,6 +584,21 @@ class OptomechDevice(InterfaceMixin):
             parents.append(p)
         return parents
 
+    def _flushPendingTransform(self):
+        """Apply any change to this device's transform that has been deferred.
+
+        This is called before the transform is read. The default implementation
+        does nothing; devices that defer transform updates (see Stage.posChanged)
+        must reimplement it.
+        """
+        pass
+
+    def __flushPendingGlobalTransform(self):
+        ## cached global transforms are only invalidated once a (grand)parent
+        ## applies its deferred change, so every parent must be flushed first
+        for dev in self.parentDevices():
+            dev._flushPendingTransform()
+
     def invalidateCachedTransforms(self, invalidateLocal=True):
         with self.__lock:
             if invalidateLocal:
@@ -428,8 +428,9 @@ class ScannerTask(DeviceTask):
 
         return result
     
-    def storeResult(self, dirHandle):
-        result = self.getResult()
+    def storeResult(self, dirHandle, result=None):
+        if result is None:
+            result = self.getResult()
         dirHandle.setInfo({self.dev.name(): result})
         
         
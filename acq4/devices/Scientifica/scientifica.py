@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
-import time
+import time, threading
 import numpy as np
 from acq4.util import Qt
 from ..Stage import Stage, MoveFuture, StageInterface
@@ -159,6 +159,7 @@ class Scientifica(Stage):
             speed = self._interpretSpeed(speed)
 
             self._lastMove = ScientificaMoveFuture(self, pos, speed, self.userSpeed)
+            self.monitor.wake()
             return self._lastMove
 
     def deviceInterface(self, win):
@@ -196,6 +197,8 @@ class MonitorThread(Thread):
         self.monitorObj = monitorObj
         self.stopped = False
         self.interval = 0.3
+        self.moveInterval = 30e-3  # poll interval while a programmed move is in progress
+        self._wake = threading.Event()
         
         Thread.__init__(self)
 
@@ -206,10 +209,16 @@ class MonitorThread(Thread):
     def stop(self):
         with self.lock:
             self.stopped = True
+        self._wake.set()
 
     def setInterval(self, i):
         with self.lock:
             self.interval = i
+
+    def wake(self):
+        """Poll immediately (and then rapidly) rather than waiting for the current interval to end.
+        """
+        self._wake.set()
     
     def run(self):
         minInterval = 100e-3
@@ -233,7 +242,16 @@ class MonitorThread(Thread):
                 if self.monitorObj is True:
                     self.dev._checkObjective()
 
-                time.sleep(interval)
+                # while a programmed move is running, check for completion at a faster rate
+                # (this notifies anyone waiting on the move as soon as it finishes)
+                move = self.dev._lastMove
+                if move is not None and not move.isDone():
+                    interval = min(interval, self.moveInterval)
+
+                self._wake.wait(interval)
+                if self._wake.is_set():
+                    self._wake.clear()
+                    interval = minInterval
             except:
                 debug.printExc('Error in Scientifica monitor thread:')
                 time.sleep(maxInterval)
@@ -281,12 +299,14 @@ class ScientificaMoveFuture(MoveFuture):
         if dif < 2.5e-6:
             # reached target
             self._finished = True
+            self._moveFinished()
             return 1
         else:
             # missed
             self._finished = True
             self._interrupted = True
             self._errorMsg = "Move did not complete (target=%s, position=%s, dif=%s)." % (self.targetPos, pos, dif)
+            self._moveFinished()
             return -1
 
     def _stopped(self):
@@ -112,6 +112,11 @@ class Sensapex(Stage):
         # called by driver poller when position has changed
         self._getPosition()
 
+        # notify anyone waiting on the current move as soon as it finishes
+        move = self._lastMove
+        if move is not None:
+            move.isDone()
+
     def targetPosition(self):
         with self.lock:
             if self._lastMove is None or self._lastMove.isDone():
@@ -179,9 +184,8 @@ class MonitorThread(Thread):
                     dev = devices.get(devid, None)
                     if dev is not None:
                         # received an update packet for this device; ask it to update its position
+                        # (signals and transform updates are rate-limited by the Stage position coalescer)
                         dev._getPosition()
-                        
-                time.sleep(0.03)  # rate-limit updates to 30 Hz 
             except:
                 debug.printExc('Error in Sensapex monitor thread:')
                 time.sleep(1)
@@ -227,12 +231,14 @@ class SensapexMoveFuture(MoveFuture):
         if dif < 2.5e-6:
             # reached target
             self._finished = True
+            self._moveFinished()
             return 1
         else:
             # missed
             self._finished = True
             self._interrupted = True
             self._errorMsg = "Move did not complete (target=%s, position=%s, dif=%s)." % (self.targetPos, pos, dif)
+            self._moveFinished()
             return -1
 
     def _stopped(self):
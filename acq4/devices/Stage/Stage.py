@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
+import threading
 from acq4.util import Qt
 from acq4.devices.Device import *
 from acq4.devices.OptomechDevice import *
@@ -24,7 +25,14 @@ class Stage(Device, OptomechDevice):
     sigLimitsChanged = Qt.Signal(object)
     sigSwitchChanged = Qt.Signal(object, object)  # self, {switch_name: value, ...}
 
+    ## if True, transform updates and sigPositionChanged are delivered at most once per display frame
+    coalescePositionUpdates = True
+
     def __init__(self, dm, config, name):
+        # these are needed as soon as the device transform is read (see _flushPendingTransform)
+        self._pendingRel = None  # accumulated position change not yet applied to the transform
+        self._flushLock = Mutex(Qt.QMutex.Recursive)  # serializes transform updates
+
         Device.__init__(self, dm, config, name)
         OptomechDevice.__init__(self, dm, config, name)
 
@@ -55,6 +63,9 @@ class Stage(Device, OptomechDevice):
         self._progressTimer = Qt.QTimer()
         self._progressTimer.timeout.connect(self.updateProgressDialog)
 
+        ## created here (in the GUI thread) because drivers report positions from their own threads
+        positionCoalescer()
+
         dm.declareInterface(name, ['stage'], self)
 
     def quit(self):
@@ -100,9 +111,11 @@ class Stage(Device, OptomechDevice):
         return Qt.QMatrix4x4(self._stageTransform)
 
     def mapToStage(self, obj):
+        self._flushPendingTransform()
         return self._mapTransform(obj, self._stageTransform)
 
     def mapFromStage(self, obj):
+        self._flushPendingTransform()
         return self._mapTransform(obj, self._invStageTransform)
 
     def posChanged(self, pos):
@@ -110,20 +123,59 @@ class Stage(Device, OptomechDevice):
         emitting sigPositionChanged.
 
         Subclasses must call this method when the device position has changed.
+        It may be called from any thread. The new position is available from
+        getPosition() immediately, and the transform is brought up to date
+        whenever it is read (eg. by globalPosition() or mapToGlobal()). Otherwise,
+        the transform update and signal are coalesced so that they happen at
+        most once per display frame (see PositionUpdateCoalescer and
+        flushPositionUpdate()).
         """
         with self.lock:
             rel = [0] * len(self.pos)
             rel[:len(pos)] = [pos[i] - self.pos[i] for i in range(len(pos))]
             self.pos[:len(pos)] = pos
-        
+            if self._pendingRel is None:
+                self._pendingRel = rel
+            else:
+                self._pendingRel = [a + b for a, b in zip(self._pendingRel, rel)]
+
+        if self.coalescePositionUpdates:
+            positionCoalescer().positionChanged(self)
+        else:
+            self.flushPositionUpdate()
+
+    def flushPositionUpdate(self):
+        """Immediately apply any position change that is waiting to be
+        delivered: rebuild the device transform, emit sigPositionChanged, and
+        check switch thresholds. May be called from any thread.
+        """
+        with self._flushLock:
+            with self.lock:
+                if self._pendingRel is None:
+                    return
+                rel = self._pendingRel
+                self._pendingRel = None
+                pos = self.pos[:]
+
             self._stageTransform = pg.SRTTransform3D()
-            self._stageTransform.translate(*self.pos)
+            self._stageTransform.translate(*pos)
             self._invStageTransform = pg.SRTTransform3D()
-            self._invStageTransform.translate(*[-x for x in self.pos])
+            self._invStageTransform.translate(*[-x for x in pos])
             self._updateTransform()
-        self.sigPositionChanged.emit({'rel': rel, 'abs': self.pos[:]})
+        self.sigPositionChanged.emit({'rel': rel, 'abs': pos})
+
+        self.checkSwitchChange(pos)
 
-        self.checkSwitchChange(self.pos)
+    def _flushPendingTransform(self):
+        ## called whenever the transform is read, possibly while device locks are held.
+        ## If another thread is already applying the update, don't wait for it (that
+        ## could deadlock); the caller sees the transform from just before the change.
+        if self._pendingRel is None or not self._flushLock.tryLock():
+            return
+        try:
+            self.flushPositionUpdate()
+        finally:
+            self._flushLock.unlock()
 
     def checkSwitchChange(self, pos):
         # position has changed. If user requested switch notifications, then we
@@ -180,8 +232,9 @@ class Stage(Device, OptomechDevice):
         This sets the starting position and orientation of the stage before the 
         hardware-reported stage position is taken into account.
         """
-        self._baseTransform = Qt.QMatrix4x4(tr)
-        self._updateTransform()
+        with self._flushLock:
+            self._baseTransform = Qt.QMatrix4x4(tr)
+            self._updateTransform()
 
     def _updateTransform(self):
         ## this informs rigidly-connected devices that they have moved
@@ -201,7 +254,9 @@ class Stage(Device, OptomechDevice):
             with self.lock:
                 return self.pos[:]
         else:
-            return self._getPosition()
+            pos = self._getPosition()
+            self.flushPositionUpdate()
+            return pos
 
     def globalPosition(self):
         """Return the position of the local coordinate system origin relative to 
@@ -385,13 +440,24 @@ class Stage(Device, OptomechDevice):
 
 class MoveFuture(object):
     """Used to track the progress of a requested move operation.
+
+    Drivers should call _moveFinished() as soon as they know that the move has
+    completed or was interrupted; this wakes any threads blocked in wait() and
+    invokes callbacks registered with onFinish(). For drivers that do not,
+    wait() falls back to polling isDone().
     """
+    ## seconds between isDone() checks while waiting for drivers that do not call _moveFinished()
+    pollInterval = 0.1
+
     def __init__(self, dev, pos, speed):
         self.startTime = pg.ptime.time()
         self.dev = dev
         self.speed = speed
         self.targetPos = pos
         self.startPos = dev.getPosition()
+        self._finishCond = threading.Condition()
+        self._finishNotified = False
+        self._finishCallbacks = []
 
     def percentDone(self):
         """Return the percent of the move that has completed.
@@ -426,6 +492,40 @@ class MoveFuture(object):
         or None if there was no failure (or if the reason is unknown).
         """
         return None
+
+    def onFinish(self, callback):
+        """Arrange for *callback(future)* to be called once the move has
+        completed or was interrupted. If that has already happened, the
+        callback is invoked immediately.
+
+        Callbacks run in whichever thread noticed the end of the move.
+        """
+        with self._finishCond:
+            if not self._finishNotified:
+                self._finishCallbacks.append(callback)
+                return
+        callback(self)
+
+    def _moveFinished(self):
+        """Called by drivers (from any thread) when the move has completed or
+        was interrupted. Calling this more than once has no further effect.
+        """
+        if self._finishNotified:
+            return
+        ## make sure the final position is reflected in the device transform before anyone wakes up
+        self.dev.flushPositionUpdate()
+        with self._finishCond:
+            if self._finishNotified:
+                return
+            self._finishNotified = True
+            callbacks = self._finishCallbacks
+            self._finishCallbacks = []
+            self._finishCond.notify_all()
+        for cb in callbacks:
+            try:
+                cb(self)
+            except Exception:
+                printExc("Error in move callback:")
         
     def wait(self, timeout=None, updates=False):
         """Block until the move has completed, has been interrupted, or the
@@ -436,13 +536,22 @@ class MoveFuture(object):
         If the move did not complete, raise an exception.
         """
         start = ptime.time()
-        while (timeout is None) or (ptime.time() < start + timeout):
-            if self.isDone():
+        while not self.isDone():
+            now = ptime.time()
+            if timeout is not None and now >= start + timeout:
                 break
+            dt = self.pollInterval if timeout is None else min(self.pollInterval, start + timeout - now)
             if updates is True:
-                Qt.QTest.qWait(100)
+                ## process events in short slices so that a signalled completion is noticed promptly
+                stop = now + dt
+                while not self._finishNotified and ptime.time() < stop:
+                    Qt.QTest.qWait(10)
             else:
-                time.sleep(0.1)
+                with self._finishCond:
+                    if not self._finishNotified:
+                        self._finishCond.wait(dt)
+        if self.isDone():
+            self._moveFinished()
         if not self.isDone() or self.wasInterrupted():
             err = self.errorMessage()
             if err is None:
@@ -451,6 +560,65 @@ class MoveFuture(object):
                 raise RuntimeError("Move did not complete: %s" % err)
 
 
+class PositionUpdateCoalescer(Qt.QObject):
+    """Delivers stage position changes at most once per display frame.
+
+    Stage drivers may report positions at a high rate (and from any thread).
+    Rather than rebuilding the transform of every stage (and every device
+    attached to it) and emitting sigPositionChanged for each report, stages
+    register pending changes here; all pending changes are applied together
+    *interval* seconds after the first one arrives.
+    """
+    sigSchedule = Qt.Signal()
+
+    def __init__(self, interval=1/60.):
+        Qt.QObject.__init__(self)
+        self.interval = interval
+        self.lock = threading.Lock()
+        self._pending = []
+
+        self._timer = Qt.QTimer()
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self.flush)
+        self.sigSchedule.connect(self._schedule)
+
+    def positionChanged(self, stage):
+        """Register a pending position change for *stage*. May be called from any thread."""
+        with self.lock:
+            if stage in self._pending:
+                return
+            self._pending.append(stage)
+            first = len(self._pending) == 1
+        if first:
+            self.sigSchedule.emit()
+
+    def _schedule(self):
+        if not self._timer.isActive():
+            self._timer.start(int(self.interval * 1000))
+
+    def flush(self):
+        """Apply all pending position changes now."""
+        with self.lock:
+            stages = self._pending
+            self._pending = []
+        for stage in stages:
+            try:
+                stage.flushPositionUpdate()
+            except Exception:
+                printExc("Error updating position of %s:" % stage.name())
+
+
+_positionCoalescer = None
+
+def positionCoalescer():
+    """Return the PositionUpdateCoalescer shared by all stages. The first call
+    must be made from the GUI thread."""
+    global _positionCoalescer
+    if _positionCoalescer is None:
+        _positionCoalescer = PositionUpdateCoalescer()
+    return _positionCoalescer
+
+
 class StageInterface(Qt.QWidget):
     def __init__(self, dev, win):
         Qt.QWidget.__init__(self)
@@ -0,0 +1,122 @@
+from __future__ import print_function
+import time
+import numpy as np
+import acq4.pyqtgraph as pg
+from acq4.util import Qt
+from acq4.devices.MockStage import MockStage
+
+
+class DummyManager(Qt.QObject):
+    # just enough of the Manager interface to create a MockStage
+    sigAbortAll = Qt.Signal()
+
+    def declareInterface(self, *args):
+        pass
+
+
+def makeStage():
+    pg.mkQApp()
+    return MockStage(DummyManager(), {}, 'TestStage')
+
+
+def test_move_wait():
+    stage = makeStage()
+    try:
+        stage.stageThread.interval = 5e-3
+        moves = []
+        signals = []
+        stage.sigPositionChanged.connect(signals.append)
+
+        fut = stage.moveTo([10e-6, 0, 0], speed=1e-3)
+        fut.onFinish(moves.append)
+        start = time.time()
+        fut.wait(timeout=2)
+        dt = time.time() - start
+
+        # move takes ~10 ms; wait() must return as soon as the stage thread reports completion
+        assert dt < 0.05
+        assert fut.isDone() and not fut.wasInterrupted()
+        assert moves == [fut]
+        assert np.allclose(stage.getPosition(), [10e-6, 0, 0])
+
+        # transform is up to date when the move completes
+        assert np.allclose(stage.mapToGlobal([0, 0, 0]), [10e-6, 0, 0])
+        Qt.QTest.qWait(50)
+        assert np.allclose(signals[-1]['abs'], [10e-6, 0, 0])
+
+        # callbacks added later are invoked immediately
+        fut.onFinish(moves.append)
+        assert moves == [fut, fut]
+
+        # interrupted moves wake waiters and raise
+        fut = stage.moveTo([0, 0, 0], speed=1e-6)
+        fut2 = stage.moveTo([0, 1e-6, 0], speed=1e-3)
+        assert fut.isDone() and fut.wasInterrupted()
+        try:
+            fut.wait(timeout=1)
+            raise AssertionError("interrupted move should raise")
+        except RuntimeError:
+            pass
+        fut2.wait(timeout=1)
+    finally:
+        stage.quit()
+
+
+def test_position_coalescing():
+    stage = makeStage()
+    try:
+        stage.quit()  # stop the simulated hardware; positions are reported by hand below
+        signals = []
+        transforms = []
+        stage.sigPositionChanged.connect(signals.append)
+        stage.sigTransformChanged.connect(transforms.append)
+
+        for i in range(1, 11):
+            stage.posChanged([i * 1e-6, 0, 0])
+        
+        # position is available at once; signal and transform are deferred
+        assert np.allclose(stage.getPosition(), [10e-6, 0, 0])
+        assert len(signals) == 0
+
+        Qt.QTest.qWait(100)
+        assert len(signals) == 1
+        assert len(transforms) == 1
+        assert np.allclose(signals[0]['abs'], [10e-6, 0, 0])
+        assert np.allclose(signals[0]['rel'], [10e-6, 0, 0])
+        assert np.allclose(stage.mapToGlobal([0, 0, 0]), [10e-6, 0, 0])
+    finally:
+        stage.quit()
+
+
+def test_pending_position_mapping():
+    # deferred position changes are applied as soon as the transform is read,
+    # without waiting for the event loop
+    stage = makeStage()
+    child = MockStage(stage.dm, {}, 'TestChild')
+    try:
+        stage.quit()
+        child.quit()
+        child.setParentDevice(stage)
+        signals = []
+        stage.sigPositionChanged.connect(signals.append)
+        assert np.allclose(child.globalPosition(), [0, 0, 0])
+
+        stage.posChanged([5e-6, 0, 0])
+        assert np.allclose(stage.globalPosition(), [5e-6, 0, 0])
+        assert len(signals) == 1
+
+        # cached transforms of child devices are updated too
+        stage.posChanged([7e-6, 1e-6, 0])
+        assert np.allclose(child.mapToGlobal([0, 0, 0]), [7e-6, 1e-6, 0])
+        assert np.allclose(child.mapFromGlobal([7e-6, 1e-6, 0]), [0, 0, 0])
+        stage.posChanged([8e-6, 1e-6, 0])
+        assert np.allclose(stage.mapToStage([0, 0, 0]), [8e-6, 1e-6, 0])
+        assert len(signals) == 3
+        assert np.allclose(signals[-1]['rel'], [1e-6, 0, 0])
+
+        # nothing is left for the coalescer to deliver
+        Qt.QTest.qWait(50)
+        assert len(signals) == 3
+    finally:
+        stage.quit()
+        child.quit()
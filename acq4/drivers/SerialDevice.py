@@ -1,5 +1,5 @@
 from __future__ import print_function
-import serial, time, sys
+import serial, time, sys, os, select
 import logging
 
 import six
@@ -34,16 +34,31 @@ class SerialDevice(object):
 
     Provides some commonly used functions for reading and writing 
     serial packets.
+
+    Incoming data is read in chunks into an internal buffer, so that bytes
+    received past the end of one packet are kept for the next read. Reads wait
+    for data in one of two ways (see *ioMode*):
+
+    * 'select': block in select() on the port's file descriptor until data
+      arrives or the timeout expires (POSIX only). This gives the lowest
+      latency and uses no CPU while waiting.
+    * 'poll': check inWaiting() repeatedly, sleeping between checks for
+      100 us up to 50 ms.
     """
-    def __init__(self, **kwds):
+    def __init__(self, ioMode=None, **kwds):
         """
         All keyword arguments define the default arguments to use when 
         opening the serial port (see pyserial Serial.__init__).
 
+        *ioMode* may be 'select' or 'poll'; by default, 'select' is used
+        wherever the port supports it.
+
         If both 'port' and 'baudrate' are provided here, then 
         self.open() is called automatically.
         """
         self.serial = None
+        self.ioMode = ioMode
+        self._rxBuffer = bytearray()
         self.__serialOpts = {
             'bytesize': serial.EIGHTBITS, 
             'timeout': 0, # no timeout. See SerialDevice._readWithTimeout()
@@ -85,19 +100,35 @@ class SerialDevice(object):
             })
         self.__serialOpts.update(kwds)
         self.serial = serial.Serial(**self.__serialOpts)
+        self._rxBuffer = bytearray()
+        if self.ioMode is None:
+            self.ioMode = 'select' if self._canSelect() else 'poll'
         logging.info('Opened serial port: %s', self.__serialOpts)
 
+    def _canSelect(self):
+        if os.name != 'posix':
+            return False
+        try:
+            self.serial.fileno()
+        except Exception:
+            return False
+        return True
+
     def close(self):
         """Close the serial port."""
         self.serial.close()
         self.serial = None
+        self._rxBuffer = bytearray()
         logging.info('Closed serial port: %s', self.__serialOpts['port'])
 
     def readAll(self):
         """Read all bytes waiting in buffer; non-blocking."""
+        d = bytes(self._rxBuffer)
+        del self._rxBuffer[:]
         n = self.serial.inWaiting()
         if n > 0:
-            d = self.serial.read(n)
+            d += self.serial.read(n)
+        if len(d) > 0:
             logging.info('Serial port %s readAll: %r', self.__serialOpts['port'], d)
             return d
         return ''
@@ -122,6 +153,8 @@ class SerialDevice(object):
         if len(packet) < length:
             raise TimeoutError("Timed out waiting for serial data (received so far: %s)" % repr(packet), packet)
         if term is not None:
+            if isinstance(term, str):
+                term = term.encode()
             if packet[-len(term):] != term:
                 time.sleep(0.01)
                 extra = self.readAll()
@@ -136,22 +169,43 @@ class SerialDevice(object):
         # Note: pyserial's timeout mechanism is broken (specifically, calling setTimeout can cause 
         # serial data to be lost) so we implement our own in readWithTimeout().
         start = time.time()
-        packet = b''
+        while len(self._rxBuffer) < nBytes:
+            remaining = timeout - (time.time() - start)
+            if remaining <= 0:
+                break
+            self._fillBuffer(remaining)
+        packet = bytes(self._rxBuffer[:nBytes])
+        del self._rxBuffer[:nBytes]
+        return packet
+
+    def _fillBuffer(self, timeout):
+        """Wait up to *timeout* seconds for data to arrive, then append
+        everything that is waiting to the receive buffer. Return the
+        number of bytes added."""
+        if self.ioMode == 'select':
+            ready = select.select([self.serial.fileno()], [], [], timeout)[0]
+            if len(ready) == 0:
+                return 0
+            data = self.serial.read(max(1, self.serial.inWaiting()))
+            self._rxBuffer.extend(data)
+            return len(data)
+
+        start = time.time()
         # Interval between serial port checks is adaptive:
         #   * start with very short interval for low-latency reads
         #   * iteratively increase interval duration to reduce CPU usage on long reads
         sleep = 100e-6  # initial sleep is 100 us
-        while time.time()-start < timeout:
+        while True:
             waiting = self.serial.inWaiting()
             if waiting > 0:
-                readBytes = min(waiting, nBytes-len(packet))
-                packet += self.serial.read(readBytes)
-                sleep = 100e-6  # every time we read data, reset sleep time
-            if len(packet) >= nBytes:
-                break
-            time.sleep(sleep)
+                data = self.serial.read(waiting)
+                self._rxBuffer.extend(data)
+                return len(data)
+            remaining = timeout - (time.time() - start)
+            if remaining <= 0:
+                return 0
+            time.sleep(min(sleep, remaining))
             sleep = min(0.05, 2*sleep) # wait a bit longer next time
-        return packet
 
     def readUntil(self, term, minBytes=0, timeout=5):
         """Read from the serial port until *term* is received, or *timeout* has elapsed.
@@ -163,24 +217,39 @@ class SerialDevice(object):
             term = term.encode()
 
         start = time.time()
-
-        if minBytes > 0:
-            packet = self.read(minBytes, timeout=timeout)
-        else:
-            packet = b''
-
+        # term must end beyond the first minBytes
+        searchStart = max(0, minBytes - len(term) + 1)
         while True:
-            elapsed = time.time()-start
-            if elapsed >= timeout:
-                err = TimeoutError("Timed out while reading serial packet. Data so far: '%r'" % packet, packet)
-                raise err
-            try:
-                packet += self.read(1, timeout=timeout-elapsed)
-            except TimeoutError:
+            i = self._rxBuffer.find(term, searchStart)
+            if i >= 0:
+                end = i + len(term)
+                packet = bytes(self._rxBuffer[:end])
+                del self._rxBuffer[:end]
+                logging.info('Serial port %s read: %r', self.__serialOpts['port'], packet)
+                return packet
+            # next search only needs to cover the newly received bytes
+            searchStart = max(searchStart, len(self._rxBuffer) - len(term) + 1)
+
+            remaining = timeout - (time.time() - start)
+            if remaining <= 0:
+                packet = bytes(self._rxBuffer)
+                del self._rxBuffer[:]
                 raise TimeoutError("Timed out while reading serial packet. Data so far: '%r'" % packet, packet)
+            self._fillBuffer(remaining)
 
-            if len(packet) > minBytes and packet[-len(term):] == term:
-                return packet
+    def pipeline(self, commands, term, timeout=5):
+        """Write several commands at once, then read one *term*-terminated
+        response for each. Return the list of responses (excluding *term*).
+
+        This avoids waiting one round trip per command, but may only be used
+        with devices that answer every command in *commands* with exactly one
+        response, in order.
+        """
+        if isinstance(term, str):
+            term = term.encode()
+        commands = [c.encode() if isinstance(c, str) else c for c in commands]
+        self.write(b''.join(commands))
+        return [self.readUntil(term, timeout=timeout)[:-len(term)] for c in commands]
 
     def clearBuffer(self):
         ## not recommended..
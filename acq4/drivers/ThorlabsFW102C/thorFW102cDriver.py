@@ -138,8 +138,7 @@ class FilterWheelDriver(SerialDevice):
         errors = []
         packets = []
         while True:
-            n = self.serial.inWaiting()
-            s += self.read(n)
+            s += self.readAll()  ## includes bytes already buffered by SerialDevice
             #print "read:", repr(s)
             if not block and len(s) == 0:
                 return
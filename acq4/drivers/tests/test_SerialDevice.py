@@ -0,0 +1,84 @@
+from __future__ import print_function
+import os, pty, time, threading
+import pytest
+from acq4.drivers.SerialDevice import SerialDevice, TimeoutError
+
+
+class LoopbackDevice(object):
+    """Stand-in for a serial instrument on the master side of a pty.
+
+    Each command terminated by '\\r' is answered with 'ok:<command>\\r',
+    optionally split into several writes.
+    """
+    def __init__(self, split=1, delay=0):
+        self.master, slave = pty.openpty()
+        self.port = os.ttyname(slave)
+        self.split = split
+        self.delay = delay
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        buf = b''
+        while True:
+            try:
+                data = os.read(self.master, 1024)
+            except OSError:
+                return
+            if len(data) == 0:
+                return
+            buf += data
+            while b'\r' in buf:
+                cmd, _, buf = buf.partition(b'\r')
+                resp = b'ok:' + cmd + b'\r'
+                n = max(1, len(resp) // self.split)
+                for i in range(0, len(resp), n):
+                    time.sleep(self.delay)
+                    os.write(self.master, resp[i:i+n])
+
+    def close(self):
+        os.close(self.master)
+
+
+@pytest.mark.parametrize('ioMode', ['select', 'poll'])
+def test_readUntil(ioMode):
+    dev = LoopbackDevice(split=3, delay=1e-3)
+    sd = SerialDevice(port=dev.port, baudrate=9600, ioMode=ioMode)
+    try:
+        sd.write('abc\r')
+        assert sd.readUntil('\r') == b'ok:abc\r'
+
+        # bytes past the end of a packet are kept for the next read
+        sd.write('one\rtwo\r')
+        assert sd.readUntil('\r') == b'ok:one\r'
+        assert sd.read(7, term='\r') == b'ok:two'
+
+        # minBytes skips terminators inside the packet
+        sd.write('x\ry\r')
+        assert sd.readUntil('\r', minBytes=6) == b'ok:x\rok:y\r'
+
+        assert sd.pipeline(['P\r', 'Q\r', 'R\r'], term='\r') == [b'ok:P', b'ok:Q', b'ok:R']
+
+        start = time.time()
+        with pytest.raises(TimeoutError):
+            sd.readUntil('\r', timeout=0.1)
+        assert time.time() - start < 0.5
+    finally:
+        sd.close()
+        dev.close()
+
+
+def test_select_latency():
+    dev = LoopbackDevice()
+    sd = SerialDevice(port=dev.port, baudrate=9600)
+    try:
+        assert sd.ioMode == 'select'
+        start = time.time()
+        for i in range(100):
+            assert sd.pipeline(['%d\r' % i], term='\r') == [b'ok:%d' % i]
+        # each exchange should take well under the 50 ms worst case of the polling loop
+        assert (time.time() - start) / 100. < 10e-3
+    finally:
+        sd.close()
+        dev.close()
@@ -78,6 +78,10 @@ class FileDataView(Qt.QSplitter):
                 w = pg.MultiPlotWidget(self)
                 self.addWidget(w)
                 w.plot(data)
+                ## long recordings: draw min/max envelopes of only the visible samples
+                for plot in w.mPlotItem.plots:
+                    plot[0].setDownsampling(auto=True, mode='peak')
+                    plot[0].setClipToView(True)
                 self.currentType = 'plot'
                 self.widgets.append(w)
                 #print "add mplot:", w.mPlotItem.plots
@@ -14,6 +14,7 @@ class FileLogView(LogWidget):
         LogWidget.__init__(self, parent, acq4.Manager.getManager())
         
         self.currentLogDir = None ## will be set to a dh when a file is selected in Data Manager
+        self.loadedStartTime = None ## earliest time loaded from the current log (None means all entries are loaded)
         self.mod = mod
     
     def selectedFileChanged(self, dh):
@@ -38,18 +39,36 @@ class FileLogView(LogWidget):
             else:
                 p = p.parent()
         
-        ## if we're already displaying that log file, stop here, otherwise set/display the log file
-        if logDir == self.currentLogDir:
+        ## when filtering by directory, entries logged before the directory was created can not match,
+        ## so only that part of the log needs to be loaded.
+        startTime = None
+        if self.ui.filterTree.topLevelItem(0).checkState(0):
+            startTime = dh.info().get('__timestamp__', None)
+        
+        ## if we're already displaying that log file (and have loaded enough of it), stop here, otherwise set/display the log file
+        loaded = self.loadedStartTime is None or (startTime is not None and startTime >= self.loadedStartTime)
+        if logDir == self.currentLogDir and loaded:
             self.updateDirFilter(dh)
             self.filterEntries()
         else:
             self.currentLogDir = logDir
-            self.setCurrentLog(logDir)
+            self.setCurrentLog(logDir, startTime=startTime)
+
+    def filtersChanged(self):
+        ## Only entries after the directory's timestamp were loaded for the directory filter;
+        ## the rest of the log is needed once that filter is turned off.
+        ## (LogWidget.__init__ calls this before our attributes exist)
+        if (getattr(self, 'loadedStartTime', None) is not None and self.currentLogDir is not None
+                and not self.ui.filterTree.topLevelItem(0).checkState(0)):
+            self.setCurrentLog(self.currentLogDir)
+        LogWidget.filtersChanged(self)
 
-    def setCurrentLog(self, dh):
+    def setCurrentLog(self, dh, startTime=None):
+        self.loadedStartTime = None
         if dh is not None:
             try:
-                self.loadFile(dh['log.txt'].name())
+                self.loadFile(dh['log.txt'].name(), startTime=startTime)
+                self.loadedStartTime = startTime
                 self.ui.dirLabel.setText("Currently displaying " + self.currentLogDir.name(relativeTo=self.manager.baseDir)+'/log.txt')    
             except:
                 debug.printExc("Error loading log file:")
@@ -319,60 +319,41 @@ class MosaicEditor(AnalysisModule):
 
     def rescaleImages(self):
         """
-        Apply corrections to the images and rescale the data.
+        Rescale the display levels of the selected images.
         This does the following:
-        1. compute mean image over entire selected group
-        2. smooth the mean image heavily.
-        3. rescale the images and correct for field flatness from the average image
-        4. apply the scale.
+        1. compute a histogram of the levels over the entire selected group
+        2. find the most common level of the group and of each image
+        3. scale each image's display levels so that its most common level
+           matches that of the group.
         Use the min/max mosaic button to readjust the display scale after this
         automatic operation if the scaling is not to your liking.
         """
-        nsel =  len(self.canvas.selectedItems())
-        if nsel == 0:
+        ## Statistics are accumulated one image at a time from low-resolution copies
+        ## of the data (see ImageCanvasItem.lowResData), so that large groups of images
+        ## never need to be in memory at full resolution.
+        imgs = [item for item in self.canvas.selectedItems() if isinstance(item, items.ImageCanvasItem.ImageCanvasItem) and item.data is not None]
+        if len(imgs) == 0:
             return
-       # print dir(self.selectedItems()[0].data)
-        nxm = self.canvas.selectedItems()[0].data.shape
-        meanImage = np.zeros((nxm[0], nxm[1]))
+        lowRes = [item.lowResData() for item in imgs]
         nhistbins = 100
+        
         # generate a histogram of the global levels in the image (all images selected)
-        hm = np.histogram(np.dstack([x.data for x in self.canvas.selectedItems()]), nhistbins)
-        #$meanImage = np.mean(self.selectedItems().asarray(), axis=0)
-        n = 0
-        self.imageMax = 0.0
-        for i in range(nsel):
-            try:
-                meanImage = meanImage + np.array(self.canvas.selectedItems()[i].data)
-                imagemax = np.amax(np.amax(meanImage, axis=1), axis=0)
-                if imagemax > self.imageMax:
-                    self.imageMax = imagemax
-                n = n + 1
-            except:
-                print('image i = %d failed' % i)
-                print('file name: ', self.canvas.selectedItems()[i].name)
-                print('expected shape of nxm: ', nxm)
-                print(' but got data shape: ', self.canvas.selectedItems()[i].data.shape)
-
-        meanImage = meanImage/n # np.mean(meanImage[0:n], axis=0)
-        filtwidth = np.floor(nxm[0]/10+1)
-        blimg = scipy.ndimage.filters.gaussian_filter(meanImage, filtwidth, order = 0, mode='reflect')
-        #pg.image(blimg)
+        self.imageMax = max([np.nanmax(d) for d in lowRes])
+        imageMin = min([np.nanmin(d) for d in lowRes])
+        bins = np.linspace(imageMin, self.imageMax, nhistbins + 1)
+        hist = np.zeros(nhistbins)
+        for d in lowRes:
+            hist += np.histogram(d, bins)[0]
         
-        m = np.argmax(hm[0]) # returns the index of the max count
+        m = np.argmax(hist) # index of the most common level
         # now rescale each individually
         # rescaling is done against the global histogram, to keep the gain constant.
-        for i in range(nsel):
-            d = np.array(self.canvas.selectedItems()[i].data)
-#            hmd = np.histogram(d, 512) # return (count, bins)
-            xh = d.shape # capture shape just in case it is not right (have data that is NOT !!)
-            # flatten the illumination using the blimg average illumination pattern
-            newImage = d # / blimg[0:xh[0], 0:xh[1]] # (d - imin)/(blimg - imin) # rescale image.
-            hn = np.histogram(newImage, bins = hm[1]) # use bins from global image
-            n = np.argmax(hn[0])
-            newImage = (hm[1][m]/hn[1][n])*newImage # rescale to the global max.
-            self.canvas.selectedItems()[i].updateImage(newImage)
-         #   self.canvas.selectedItems()[i].levelRgn.setRegion([0, 2.0])
-            self.canvas.selectedItems()[i].levelRgn.setRegion([0., self.imageMax])
+        # The scale is applied to each image's display levels rather than its data.
+        for item, d in zip(imgs, lowRes):
+            hn = np.histogram(d, bins=bins)[0] # use bins from global image
+            k = np.argmax(hn)
+            scale = bins[m] / bins[k] if bins[k] != 0 else 1.0
+            item.setLevels(0., self.imageMax / scale)
 
     def normalizeImages(self):
         self.canvas.view.autoRange()
@@ -381,12 +362,9 @@ class MosaicEditor(AnalysisModule):
         """
         Set all the selected images to have the scaling in the editor bar (absolute values)
         """
-        nsel =  len(self.canvas.selectedItems())
-        if nsel == 0:
-            return
-        for i in range(nsel):
-            self.canvas.selectedItems()[i].levelRgn.setRegion([self.ui.mosaicDisplayMin.value(),
-                                                               self.ui.mosaicDisplayMax.value()])
+        for item in self.canvas.selectedItems():
+            if isinstance(item, items.ImageCanvasItem.ImageCanvasItem):
+                item.setLevels(self.ui.mosaicDisplayMin.value(), self.ui.mosaicDisplayMax.value())
 
     def flipUD(self):
         """
@@ -1,80 +1,222 @@
 from __future__ import print_function
-import re, json
-
-
+import os, re, json
+import numpy as np
 import six
+from acq4.util import logstore
 
 
 class MultiPatchLog(object):
-    def __init__(self, filename=None):
+    """Positions and other events recorded by the MultiPatch module.
+
+    Logs are read incrementally: the byte offset of the last complete line is
+    remembered, and update() parses only lines that were appended since the
+    previous read. This allows a viewer to follow the log of a running
+    experiment.
+
+    If *startTime* is given, the sparse offset index that accompanies the log
+    (see acq4.util.logstore) is used to skip directly to the relevant part of
+    the file. Each index entry records the last position of every device before
+    its offset, and events between the indexed offset and *startTime* are parsed
+    only to update those positions, so that devices that are stationary at
+    *startTime* still have a position. Likewise, parsing stops at the first
+    event after *stopTime*.
+    """
+    ## bytes between index points written when a log without an index is read
+    indexSpacing = 65536
+
+    def __init__(self, filename=None, startTime=None, stopTime=None):
         self._devices = {}
         self._minTime = None
         self._maxTime = None
+        self._file = None
+        self._offset = 0
+        self._startTime = None
+        self._lastStops = {}  ## {device: (time, position)} of the last move_stop parsed
         
         if filename is not None:
-            self.read(filename)
-
-    def read(self, file):
-        for line in open(file, 'rb').readlines():
-            # parse line
-            if line.startswith('{'):
-                # json format
-                event = json.loads(line.rstrip(',\r\n'))
-
-                # just to cover a bug; remove after updating legacy log files
-                if isinstance(event['event_time'], six.string_types):
-                    event['event_time'] = float(event['event_time'].rstrip(','))
-            else:
-                # this covers the original multipatch log format; remove after updating all legacy log files
-                fields = re.split(r',\s*', line.strip())
-                time, eventType, device = [eval(v) for v in fields[:3]]
-                data = fields[3:]
-                time = float(time)
-
-                event = {
-                    'event_time': time,
-                    'device': device,
-                    'event': eventType,
-                }
-                if eventType == 'move_stop':
-                    event['position'] = list(map(float, data))
-
-            # keep track of min/max time values
-            time = event['event_time']
-            if self._minTime is None:
-                self._minTime = time
-                self._maxTime = time
-            else:
-                self._minTime = min(self._minTime, time)
-                self._maxTime = max(self._maxTime, time)
+            self.read(filename, startTime=startTime, stopTime=stopTime)
+
+    def read(self, file, startTime=None, stopTime=None):
+        """Read events from *file*, optionally limited to the time range
+        *startTime* to *stopTime*. Return the list of events that were read.
+        """
+        self._file = file
+        self._startTime = startTime
+        self._offset = 0
+        self._lastStops = {}
+        idx = logstore.LogIndex(logstore.indexFileName(file))
+        if startTime is not None:
+            self._offset, lastStops = idx.seekEntry(startTime)
+            if lastStops is not None:
+                self._lastStops = dict([(dev, tuple(stop)) for dev, stop in lastStops.items()])
+            elif self._offset > 0:
+                ## index does not record device positions; they can only be found
+                ## by reading from the start
+                self._offset = 0
+        
+        buildIndex = len(idx) == 0 and self._offset == 0 and stopTime is None
+        events = self._parse(stopTime=stopTime, indexPoints=[] if buildIndex else None, skipped=dict(self._lastStops))
+        return events
+
+    def update(self):
+        """Parse any events that were appended to the file since the last
+        read() or update(), and return the list of new events.
+        """
+        if self._file is None:
+            return []
+        if os.path.getsize(self._file) < self._offset:
+            ## file was replaced; start over
+            self._devices = {}
+            self._minTime = None
+            self._maxTime = None
+            self._offset = 0
+        return self._parse()
 
-            # initialize irregular time series if needed
-            device = event['device']
+    def _parse(self, stopTime=None, indexPoints=None, skipped=None):
+        ## parse complete lines starting at self._offset.
+        ## If *indexPoints* is a list, a new sparse index is written for the file.
+        ## *skipped* is {device: (time, position)} of the last move_stop before startTime.
+        events = []
+        skipped = {} if skipped is None else skipped
+        with open(self._file, 'rb') as fd:
+            fd.seek(self._offset)
+            for line in fd:
+                if not line.endswith(b'\n'):
+                    break  ## incomplete line; the writer is still busy with it
+                event = self._parseLine(line)
+                if event is not None:
+                    t = event['event_time']
+                    if stopTime is not None and t > stopTime:
+                        break
+                    if indexPoints is not None and (len(indexPoints) == 0 or self._offset - indexPoints[-1][1] >= self.indexSpacing):
+                        indexPoints.append((t, self._offset, dict(self._lastStops)))
+                    if event['event'] == 'move_stop':
+                        self._lastStops[event['device']] = (t, event['position'])
+                    if self._startTime is None or t >= self._startTime:
+                        if len(skipped) > 0:
+                            self._seedPositions(skipped)
+                            skipped = {}
+                        self._addEvent(event)
+                        events.append(event)
+                    elif event['event'] == 'move_stop':
+                        skipped[event['device']] = (t, event['position'])
+                self._offset += len(line)
+        self._seedPositions(skipped)
+
+        if indexPoints is not None and len(indexPoints) > 0:
+            try:
+                with open(logstore.indexFileName(self._file), 'wb') as fd:
+                    fd.write(b''.join([(json.dumps(list(p)) + '\n').encode('utf-8') for p in indexPoints]))
+            except (IOError, OSError):
+                pass  ## index is only an optimization; the log directory may be read-only
+        return events
+
+    def _parseLine(self, line):
+        line = line.decode('utf-8').strip()
+        if len(line) == 0:
+            return None
+        if line.startswith('{'):
+            # json format
+            event = json.loads(line.rstrip(','))
+
+            # just to cover a bug; remove after updating legacy log files
+            if isinstance(event['event_time'], six.string_types):
+                event['event_time'] = float(event['event_time'].rstrip(','))
+        else:
+            # this covers the original multipatch log format; remove after updating all legacy log files
+            fields = re.split(r',\s*', line)
+            time, eventType, device = [eval(v) for v in fields[:3]]
+            data = fields[3:]
+            time = float(time)
+
+            event = {
+                'event_time': time,
+                'device': device,
+                'event': eventType,
+            }
+            if eventType == 'move_stop':
+                event['position'] = list(map(float, data))
+        return event
+
+    def _seedPositions(self, positions):
+        ## record the last known {device: (time, position)} before startTime,
+        ## without counting them as events that were read
+        for device, (time, position) in positions.items():
             if device not in self._devices:
                 self._devices[device] = {
                     'position': IrregularTimeSeries(interpolate=True)
                 }
-            
-            # Record event into irregular time series
-            dev = self._devices[device]
-            time = event['event_time']
-            if event['event'] == 'move_start':
-                posSeries = dev['position']
-                lastPos = posSeries.lastValue()
-                if lastPos is not None:
-                    posSeries[time] = lastPos
-            elif event['event'] == 'move_stop':
-                dev['position'][time] = event['position']
+            posSeries = self._devices[device]['position']
+            if len(posSeries) == 0:
+                posSeries[time] = position
+
+    def _addEvent(self, event):
+        # keep track of min/max time values
+        time = event['event_time']
+        if self._minTime is None:
+            self._minTime = time
+            self._maxTime = time
+        else:
+            self._minTime = min(self._minTime, time)
+            self._maxTime = max(self._maxTime, time)
+
+        # initialize irregular time series if needed
+        device = event['device']
+        if device not in self._devices:
+            self._devices[device] = {
+                'position': IrregularTimeSeries(interpolate=True)
+            }
+        
+        # Record event into irregular time series
+        dev = self._devices[device]
+        if event['event'] == 'move_start':
+            posSeries = dev['position']
+            lastPos = posSeries.lastValue()
+            if lastPos is not None:
+                posSeries[time] = lastPos
+        elif event['event'] == 'move_stop':
+            dev['position'][time] = event['position']
 
     def devices(self):
         return list(self._devices.keys())
 
+    def lastPositions(self):
+        """Return {device: (time, position)} for the last move_stop event of each
+        device that has been parsed, including those before startTime."""
+        return dict(self._lastStops)
+
     def state(self, time):
         state = {}
         for dev in self.devices():
             state[dev] = {'position': self._devices[dev]['position'][time]}
         return state
 
+    def positionTracks(self):
+        """Return the recorded positions of all devices for the whole session.
+
+        The result is a dict {device: (times, positions)}, where *times* is a 1D
+        array of the times at which each device started or stopped moving and
+        *positions* is an array of shape (len(times), 3).
+        """
+        tracks = {}
+        for dev, series in self._devices.items():
+            pos = series['position']
+            values = pos.valueArray()
+            if values is None:
+                values = np.array(pos.values(), dtype=float).reshape(len(pos), -1)
+            tracks[dev] = (pos.timeArray(), values)
+        return tracks
+
+    def positions(self, times):
+        """Return the interpolated positions of all devices at each time in the
+        array *times*, as a dict {device: positions}.
+
+        Each *positions* array has shape (len(times), 3) and contains NaN at
+        times before the device's first recorded position.
+        """
+        times = np.asarray(times, dtype=float)
+        return dict([(dev, series['position'].lookup(times)) for dev, series in self._devices.items()])
+
     def firstTime(self):
         return self._minTime
 
@@ -83,13 +225,54 @@ class MultiPatchLog(object):
         
 
 
+class MultiPatchLogWriter(object):
+    """Appends events to a MultiPatch log file, one JSON object per line, and
+    maintains the sparse offset index used by MultiPatchLog to seek by time.
+    Each index entry records the last position of every device before it.
+    """
+    def __init__(self, filename, indexSpacing=65536):
+        self.filename = filename
+        self.indexSpacing = indexSpacing
+        self._lastStops = {}
+        if os.path.isfile(filename) and os.path.getsize(filename) > 0:
+            ## appending to an existing log; find where its devices were left
+            self._lastStops = MultiPatchLog(filename, startTime=float('inf')).lastPositions()
+        self._file = open(filename, 'ab')
+        self._file.seek(0, 2)
+        idx = logstore.LogIndex(logstore.indexFileName(filename))
+        self._lastIndexed = idx.offsets[-1] if len(idx) > 0 else None
+
+    def write(self, events):
+        """Append a list of event dicts to the log."""
+        offset = self._file.tell()
+        lines = []
+        indexPoints = []
+        for ev in events:
+            line = (json.dumps(ev) + ",\n").encode('utf-8')
+            if self._lastIndexed is None or offset - self._lastIndexed >= self.indexSpacing:
+                indexPoints.append((ev['event_time'], offset, dict(self._lastStops)))
+                self._lastIndexed = offset
+            if ev['event'] == 'move_stop':
+                self._lastStops[ev['device']] = (ev['event_time'], ev['position'])
+            lines.append(line)
+            offset += len(line)
+        self._file.write(b''.join(lines))
+        self._file.flush()
+        if len(indexPoints) > 0:
+            with open(logstore.indexFileName(self.filename), 'ab') as fd:
+                fd.write(b''.join([(json.dumps(list(p)) + '\n').encode('utf-8') for p in indexPoints]))
+
+    def close(self):
+        self._file.close()
+
+
 class IrregularTimeSeries(object):
     """An irregularly-sampled time series.
     
-    Allows efficient retrieval of the series value at any time using a lookup table.
-    Intended for cases where the lookup table would be reasonably-sized (for example,
-    an hour of events indexed at 1-second resolution). For larger data sets, a 
-    b-tree would be a more reasonable approach.
+    Times are stored in a growable numpy array, so that the value at any time
+    (or at an entire array of times) can be found by binary search. Values that
+    are numeric scalars or fixed-length sequences of scalars are additionally
+    kept in a float array, which allows vectorized lookup and interpolation.
     
     If enabled, values are interpolated linearly. Values may be of any type,
     but only scalar, array, and tuple-of-scalar types may be interpolated.
@@ -108,14 +291,19 @@ class IrregularTimeSeries(object):
         series[5.0]   # returns None because the series begins at 10.0
         series[14.0]  # returns 0.6; interpolated between 2nd and 3rd timepoints
         series[50]    # returns 1.2; the last value in the time series
+        
+        # Look up many times at once; returns an array with NaN before 10.0
+        series[np.arange(0, 60, 0.1)]
     """
-    def __init__(self, data=None, interpolate=False, resolution=1.0):
+    def __init__(self, data=None, interpolate=False, resolution=None):
+        ## *resolution* is accepted for backward compatibility; it is no longer needed
         self.interpolate = interpolate
-        self._resolution = resolution
         
-        self.events = []
-        self.index = []  # each value maps a time in seconds to the index of the value recorded immediately after the time
-        self._startTime = None
+        self._len = 0
+        self._times = np.empty(16)
+        self._values = np.empty(16, dtype=object)  # original value objects
+        self._numeric = None  # float array of values, or None if they are not all numeric with the same shape
+        self._numericOk = True
         
         if data is not None:
             self.extend(data)
@@ -126,20 +314,45 @@ class IrregularTimeSeries(object):
         Points in the series must be added in increasing chronological order.
         It is allowed to add multiple values for the same time point.
         """
-        if len(self.events) > 0 and time < self.events[-1][0]:
+        n = self._len
+        if n > 0 and time < self._times[n-1]:
             raise ValueError("Time points must be added in increasing order.")
 
-        if self._startTime is None:
-            self._startTime = time
-        i = self._getIndex(time)
+        if n == len(self._times):
+            self._grow()
+        self._times[n] = time
+        self._values[n] = value
+        if self._numericOk:
+            self._setNumeric(n, value)
+        self._len = n + 1
 
-        # Extend index
-        dif = i + 1 - len(self.index)
-        if dif > 0:
-            self.index.extend([len(self.events)] * dif)
-        self.index[i] = len(self.events)
-        
-        self.events.append((float(time), value))
+    def _grow(self):
+        size = len(self._times) * 2
+        self._times = np.resize(self._times, size)
+        values = np.empty(size, dtype=object)
+        values[:self._len] = self._values[:self._len]
+        self._values = values
+        if self._numeric is not None:
+            numeric = np.empty((size,) + self._numeric.shape[1:])
+            numeric[:self._len] = self._numeric[:self._len]
+            self._numeric = numeric
+
+    def _setNumeric(self, i, value):
+        ## keep a float copy of *value*, or give up on vectorized values if this is not possible
+        if isinstance(value, six.string_types):
+            v = None
+        else:
+            try:
+                v = np.asarray(value, dtype=float)
+            except (TypeError, ValueError):
+                v = None
+        if v is not None and self._numeric is None:
+            self._numeric = np.empty((len(self._times),) + v.shape)
+        if v is None or v.shape != self._numeric.shape[1:]:
+            self._numeric = None
+            self._numericOk = False
+            return
+        self._numeric[i] = v
        
     def extend(self, data):
         for t,v in data:
@@ -147,39 +360,71 @@ class IrregularTimeSeries(object):
        
     def __getitem__(self, time):
         """Return the value of this series at the given time.
+        
+        If *time* is an array or list, then the values at all times are
+        returned as an array (see lookup()).
         """
-        events = self.events
-        if len(events) == 0:
+        if isinstance(time, (np.ndarray, list)):
+            return self.lookup(time)
+        
+        n = self._len
+        if n == 0:
             return None
-        if time <= self._startTime:
+        i = np.searchsorted(self._times[:n], time, side='right') - 1
+        if i < 0:
             return None
-        if time >= events[-1][0]:
-            return events[-1][1]
-        
-        # Use index to find a nearby event
-        i = self.index[min(self._getIndex(time), len(self.index)-1)]
+        if i == n - 1 or self._times[i] == time or not self.interpolate:
+            return self._values[i]
+        return self._interpolate(time, self._values[i], self._values[i+1], self._times[i], self._times[i+1])
+
+    def lookup(self, times, interpolate=None):
+        """Return the values of this series at each time in the array *times*.
         
-        if events[i][0] > time:
-            # walk backward to the requested event
-            while self.events[i][0] > time:
-                i -= 1
-        elif events[i][0] < time:
-            # walk forward to the requested event
-            while i+1 < len(self.events) and self.events[i+1][0] <= time:
-                i += 1
-        else:
-            return events[i][1]
+        Values are interpolated if *interpolate* is True (defaults to the
+        interpolate argument given to the constructor); otherwise the most
+        recent value at each time is returned.
         
-        # interpolate if requested
-        if self.interpolate:
-            t1, v1 = events[i]
-            t2, v2 = events[i+1]
-            return self._interpolate(time, v1, v2, t1, t2)
-        else:
-            return events[i][1]
+        For numeric series, the result is a float array with shape
+        ``times.shape + valueShape``, containing NaN at times before the start
+        of the series. For other series, an object array is returned with None
+        before the start.
+        """
+        if interpolate is None:
+            interpolate = self.interpolate
+        times = np.asarray(times, dtype=float)
+        n = self._len
+        t = self._times[:n]
+        idx = np.searchsorted(t, times, side='right') - 1
+        valid = idx >= 0
+
+        if self._numeric is None:
+            out = np.empty(times.shape, dtype=object)
+            out[...] = None
+            if n == 0:
+                return out
+            if not interpolate:
+                out[valid] = self._values[idx[valid]]
+            else:
+                for j in zip(*np.nonzero(valid)):
+                    out[j] = self[times[j]]
+            return out
 
-    def _getIndex(self, t):
-        return int((t - self._startTime) / self._resolution)
+        vshape = self._numeric.shape[1:]
+        if n == 0:
+            return np.full(times.shape + vshape, np.nan)
+        vals = self._numeric[:n]
+        i1 = np.clip(idx, 0, n-1)
+        if interpolate:
+            i2 = np.minimum(i1 + 1, n - 1)
+            dt = t[i2] - t[i1]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                s = np.where(dt > 0, (times - t[i1]) / dt, 0.0)
+            s = np.clip(s, 0.0, 1.0).reshape(s.shape + (1,) * len(vshape))
+            out = vals[i1] * (1.0 - s) + vals[i2] * s
+        else:
+            out = vals[i1]
+        out[~valid] = np.nan
+        return out
 
     def _interpolate(self, t, v1, v2, t1, t2):
         s = (t - t1) / (t2 - t1)
@@ -189,39 +434,58 @@ class IrregularTimeSeries(object):
         else:
             return v1 * (1.0 - s) + v2 * s
     
+    @property
+    def events(self):
+        """List of (time, value) pairs in the series.
+        """
+        return list(zip(self.times(), self.values()))
+
     def times(self):
         """Return a list of the time points in the series.
         """
-        return [ev[0] for ev in self.events]
+        return self._times[:self._len].tolist()
 
     def values(self):
         """Return a list of the values at each point in the series.
         """
-        return [ev[1] for ev in self.events]
+        return self._values[:self._len].tolist()
+
+    def timeArray(self):
+        """Return an array of the time points in the series.
+        """
+        return self._times[:self._len].copy()
+
+    def valueArray(self):
+        """Return a float array of the values in the series, or None if the
+        values are not numeric.
+        """
+        if self._numeric is None:
+            return None
+        return self._numeric[:self._len].copy()
 
     def firstValue(self):
-        if len(self.events) == 0:
+        if self._len == 0:
             return None
         else:
-            return self.events[0][1]
+            return self._values[0]
 
     def lastValue(self):
-        if len(self.events) == 0:
+        if self._len == 0:
             return None
         else:
-            return self.events[-1][1]
+            return self._values[self._len-1]
 
     def firstTime(self):
-        if len(self.events) == 0:
+        if self._len == 0:
             return None
         else:
-            return self.events[0][0]
+            return float(self._times[0])
 
     def lastTime(self):
-        if len(self.events) == 0:
+        if self._len == 0:
             return None
         else:
-            return self.events[-1][0]
+            return float(self._times[self._len-1])
 
     def __len__(self):
-        return len(self.events)
+        return self._len
@@ -1,7 +1,6 @@
 from __future__ import print_function
 import os, re
 import numpy as np
-import json
 from acq4.util import Qt
 
 from acq4.modules.Module import Module
@@ -11,6 +10,7 @@ import acq4.pyqtgraph as pg
 
 from .multipatchTemplate import Ui_MultiPatch
 from .pipetteTemplate import Ui_PipetteControl
+from .logfile import MultiPatchLogWriter
 
 
 class MultiPatch(Module):
@@ -538,7 +538,7 @@ class MultiPatchWindow(Qt.QWidget):
         if rec is True:
             man = getManager()
             sdir = man.getCurrentDir()
-            self.storageFile = open(sdir.createFile('MultiPatch.log', autoIncrement=True).name(), 'ab')
+            self.storageFile = MultiPatchLogWriter(sdir.createFile('MultiPatch.log', autoIncrement=True).name())
             self.writeRecords(self.eventHistory)
 
     def recordEvent(self, **kwds):
@@ -554,7 +554,5 @@ class MultiPatchWindow(Qt.QWidget):
     def writeRecords(self, recs):
         if self.storageFile is None:
             return
-        for rec in recs:
-            self.storageFile.write(json.dumps(rec) + ",\n")
-        self.storageFile.flush()
+        self.storageFile.write(recs)
 
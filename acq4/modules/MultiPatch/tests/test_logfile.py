@@ -1,6 +1,8 @@
 from __future__ import print_function
+import os
 import numpy as np
-from acq4.modules.MultiPatch.logfile import MultiPatchLog, IrregularTimeSeries
+from acq4.modules.MultiPatch.logfile import MultiPatchLog, MultiPatchLogWriter, IrregularTimeSeries
+from acq4.util import logstore
 
 
 def test_timeseries_index():
@@ -67,4 +69,137 @@ def test_timeseries_index():
                     ts[t] = v
                 for t in np.arange(-1, 40, 0.05):
                     assert ts[t] == lookup(t, ts)
-    
\ No newline at end of file
+                
+                # vectorized lookup must agree with scalar lookup
+                times = np.arange(-1, 40, 0.05)
+                vals = ts[times]
+                for t,v in zip(times, vals):
+                    expect = lookup(t, ts)
+                    if expect is None:
+                        assert v is None or np.all(np.isnan(v))
+                    elif isinstance(expect, str):
+                        assert v == expect
+                    else:
+                        assert np.allclose(v, expect)
+
+
+def test_log_positions(tmpdir):
+    logfile = tmpdir.join('MultiPatch_000.log')
+    events = [
+        {'event_time': 100.0, 'device': 'Pipette1', 'event': 'move_stop', 'position': [0., 0., 0.]},
+        {'event_time': 101.0, 'device': 'Pipette2', 'event': 'move_stop', 'position': [1., 1., 1.]},
+        {'event_time': 102.0, 'device': 'Pipette1', 'event': 'move_start'},
+        {'event_time': 104.0, 'device': 'Pipette1', 'event': 'move_stop', 'position': [10., 20., 0.]},
+    ]
+    import json
+    logfile.write(''.join([json.dumps(ev) + ',\n' for ev in events]))
+    log = MultiPatchLog(str(logfile))
+
+    tracks = log.positionTracks()
+    assert set(tracks.keys()) == {'Pipette1', 'Pipette2'}
+    t, pos = tracks['Pipette1']
+    assert np.all(t == [100., 102., 104.])
+    assert np.all(pos == [[0, 0, 0], [0, 0, 0], [10, 20, 0]])
+
+    times = np.array([99., 100., 103., 110.])
+    pos = log.positions(times)
+    assert np.all(np.isnan(pos['Pipette1'][0]))
+    assert np.allclose(pos['Pipette1'][1:], [[0, 0, 0], [5, 10, 0], [10, 20, 0]])
+    assert np.all(np.isnan(pos['Pipette2'][:2]))
+    assert np.allclose(pos['Pipette2'][2:], 1)
+    for t, p in zip(times[1:], pos['Pipette1'][1:]):
+        assert np.allclose(log.state(t)['Pipette1']['position'], p)
+
+
+def test_log_incremental(tmpdir):
+    fname = str(tmpdir.join('MultiPatch_000.log'))
+    writer = MultiPatchLogWriter(fname, indexSpacing=1000)
+    writer.write([{'event_time': float(t), 'device': 'Pipette1', 'event': 'move_stop', 'position': [t, 0., 0.]} for t in range(100)])
+
+    log = MultiPatchLog(fname)
+    assert log.lastTime() == 99
+    assert log.update() == []
+
+    # partially written lines are left for the next update
+    writer.write([{'event_time': 100., 'device': 'Pipette2', 'event': 'move_stop', 'position': [0., 0., 0.]}])
+    with open(fname, 'ab') as fd:
+        fd.write(b'{"event_time": 101.0, "dev')
+    new = log.update()
+    assert len(new) == 1 and new[0]['device'] == 'Pipette2'
+    assert log.lastTime() == 100
+    with open(fname, 'ab') as fd:
+        fd.write(b'ice": "Pipette1", "event": "move_start"},\n')
+    assert len(log.update()) == 1
+    assert log.lastTime() == 101
+    assert len(log.positionTracks()['Pipette1'][0]) == 101
+
+    # seek to a time range using the index
+    idx = logstore.LogIndex(logstore.indexFileName(fname))
+    assert len(idx) > 1
+    log2 = MultiPatchLog(fname, startTime=50, stopTime=60)
+    assert log2.firstTime() == 50
+    assert log2.lastTime() == 60
+    assert log2._offset < os.path.getsize(fname)
+
+    # devices that stopped before startTime still have a position at startTime
+    assert np.allclose(log2.state(50)['Pipette1']['position'], [50, 0, 0])
+    fname2 = str(tmpdir.join('MultiPatch_001.log'))
+    writer = MultiPatchLogWriter(fname2, indexSpacing=1000)
+    events = [{'event_time': float(t), 'device': 'Pipette1', 'event': 'move_stop', 'position': [t, 0., 0.]} for t in range(100)]
+    events.insert(61, {'event_time': 60.5, 'device': 'Pipette2', 'event': 'move_stop', 'position': [1., 2., 3.]})
+    writer.write(events)
+    idx = logstore.LogIndex(logstore.indexFileName(fname2))
+    assert idx.seekOffset(60.75) > 0
+    log3 = MultiPatchLog(fname2, startTime=60.75)
+    assert log3.firstTime() == 61
+    assert np.allclose(log3.state(60.75)['Pipette1']['position'], [60.75, 0, 0])
+    assert np.allclose(log3.state(60.75)['Pipette2']['position'], [1, 2, 3])
+
+    # an index is created for logs that were written without one
+    os.remove(logstore.indexFileName(fname))
+    MultiPatchLog(fname)
+    assert len(logstore.LogIndex(logstore.indexFileName(fname))) > 0
+
+
+def test_log_seek_parked(tmpdir):
+    # a device that stopped long before the index point used for seeking
+    fname = str(tmpdir.join('MultiPatch_000.log'))
+    writer = MultiPatchLogWriter(fname, indexSpacing=1000)
+    events = [{'event_time': 5., 'device': 'Pipette2', 'event': 'move_stop', 'position': [1., 2., 3.]}]
+    events += [{'event_time': float(t), 'device': 'Pipette1', 'event': 'move_stop', 'position': [t, 0., 0.]} for t in range(10, 60)]
+    writer.write(events)
+    writer.close()
+
+    # appending to the log continues to record Pipette2's position in the index
+    writer = MultiPatchLogWriter(fname, indexSpacing=1000)
+    writer.write([{'event_time': float(t), 'device': 'Pipette1', 'event': 'move_stop', 'position': [t, 0., 0.]} for t in range(60, 100)])
+    writer.close()
+
+    idx = logstore.LogIndex(logstore.indexFileName(fname))
+    offset, lastStops = idx.seekEntry(90.5)
+    assert offset > 0 and idx.times[-1] > 80
+    assert lastStops['Pipette2'] == [5, [1, 2, 3]]
+    for startTime in (45.5, 90.5):
+        log = MultiPatchLog(fname, startTime=startTime)
+        assert log.firstTime() == int(startTime) + 1
+        assert np.allclose(log.state(startTime)['Pipette2']['position'], [1, 2, 3])
+        assert np.allclose(log.state(startTime)['Pipette1']['position'], [startTime, 0, 0])
+    assert log.lastPositions()['Pipette2'][0] == 5
+
+    # an index built while reading also records positions
+    os.remove(logstore.indexFileName(fname))
+    log = MultiPatchLog()
+    log.indexSpacing = 1000
+    log.read(fname)
+    offset, lastStops = logstore.LogIndex(logstore.indexFileName(fname)).seekEntry(90.5)
+    assert offset > 0
+    assert lastStops['Pipette2'] == [5, [1, 2, 3]]
+    log = MultiPatchLog(fname, startTime=90.5)
+    assert np.allclose(log.state(90.5)['Pipette2']['position'], [1, 2, 3])
+
+    # an index written without positions is not used to seek
+    with open(logstore.indexFileName(fname), 'w') as fd:
+        fd.write(''.join(['[%r, %d]\n' % (t, o) for t, o in zip(idx.times, idx.offsets)]))
+    log = MultiPatchLog(fname, startTime=90.5)
+    assert np.allclose(log.state(90.5)['Pipette2']['position'], [1, 2, 3])
+    assert log.firstTime() == 91
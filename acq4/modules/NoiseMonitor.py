@@ -1,29 +1,45 @@
 from __future__ import print_function
 import time, weakref, collections
 import numpy as np
+from six.moves import queue
 from acq4.util import Qt
 
 from acq4.modules.Module import Module
 import acq4.util.InterfaceCombo  # just to register 'interface' parameter type
 from acq4.util.DataManager import getDirHandle
+from acq4.util.Thread import Thread
+from acq4.util.Mutex import Mutex
+from acq4.util.debug import printExc
+import acq4.util.ptime as ptime
 import acq4.pyqtgraph as pg
+from acq4.pyqtgraph.metaarray import HDF5Appender
 
 
 class NoiseMonitor(Module):
     """ Used to monitor electrical noise over long time periods.
+
+    In the default mode, one trace is recorded from each channel every *interval*.
+    In continuous mode, a single task covering all channels is executed back-to-back
+    by a background thread, and traces are analyzed and written to disk by a second
+    thread, so that the recording covers (nearly) all of the elapsed time.
     """
     moduleDisplayName = "Noise Monitor"
     moduleCategory = "Utilities"
 
+    sigCoverageChanged = Qt.Signal()
+
     def __init__(self, manager, name, config):
-        Module.__init__(self, manager, name, config) 
-        
+        Module.__init__(self, manager, name, config)
+
         self.recordDir = None
         self.recordWritable = False
         self.running = False
-        
+        self.startTime = None
+        self.acqThread = None
+        self.analysisThread = None
+
         self.win = Qt.QSplitter()
-        
+
         self.ctrlWidget = pg.LayoutWidget()
         self.win.addWidget(self.ctrlWidget)
         self.newBtn = Qt.QPushButton('New Record')
@@ -31,30 +47,40 @@ class NoiseMonitor(Module):
         self.startBtn = Qt.QPushButton('Start')
         self.startBtn.setCheckable(True)
         self.fileLabel = Qt.QLabel()
+        self.coverageLabel = Qt.QLabel()
         self.ctrlWidget.addWidget(self.newBtn, 0, 0)
         self.ctrlWidget.addWidget(self.loadBtn, 1, 0)
         self.ctrlWidget.addWidget(self.startBtn, 2, 0)
         self.ctrlWidget.addWidget(self.fileLabel, 3, 0)
+        self.ctrlWidget.addWidget(self.coverageLabel, 4, 0)
         self.newBtn.clicked.connect(self.newRecord)
         self.loadBtn.clicked.connect(self.loadClicked)
         self.startBtn.toggled.connect(self.startToggled)
 
         self.params = pg.parametertree.Parameter.create(name='params', type='group', children=[
+            dict(name='continuous', type='bool', value=False),
             dict(name='interval', type='float', value=10, suffix='s', siPrefix=True, limits=[0.001, None], step=1.0),
             dict(name='trace duration', type='float', value=1.0, suffix='s', siPrefix=True, limits=[0.001, None], step=0.1),
             dict(name='sample rate', type='int', value=1e6, suffix='Hz', siPrefix=True, limits=[100, None], step=1e5),
+            dict(name='save raw data', type='bool', value=True),
         ])
         self.ptree = pg.parametertree.ParameterTree()
         self.ptree.setParameters(self.params)
-        self.ctrlWidget.addWidget(self.ptree, 4, 0)
+        self.ctrlWidget.addWidget(self.ptree, 5, 0)
 
         self.channelLayout =Qt.QSplitter()
         self.win.addWidget(self.channelLayout)
-        
+
         self.channels = collections.OrderedDict()
 
+        ## time recorded / time elapsed since start was clicked
+        self.coverageLock = Mutex()
+        self.recordedTime = 0.0
+        self.runStartTime = None
+        self.sigCoverageChanged.connect(self.updateCoverageLabel)
+
         self.win.show()
-        
+
         self.timer = Qt.QTimer()
         self.timer.timeout.connect(self.runOnce)
 
@@ -75,17 +101,77 @@ class NoiseMonitor(Module):
                     self.newRecord()
                 if self.startTime is None:
                     self.startTime = time.time()
-                self.timer.start(self.params['interval'] * 1000)
-                self.runOnce()
+                with self.coverageLock:
+                    self.recordedTime = 0.0
+                    self.runStartTime = ptime.time()
+                self.params.param('continuous').setReadonly(True)
+                if self.params['continuous']:
+                    self.startContinuous()
+                else:
+                    self.timer.start(self.params['interval'] * 1000)
+                    self.runOnce()
             except:
                 self.startBtn.setChecked(False)
                 raise
-            
+
             self.startBtn.setText('Stop')
         else:
             self.timer.stop()
+            self.stopContinuous()
+            for w in self.channels.values():
+                w.closeFiles()
+            self.params.param('continuous').setReadonly(False)
             self.startBtn.setText('Start')
 
+    def startContinuous(self):
+        dur = self.params['trace duration']
+        rate = self.params['sample rate']
+        npts = int(dur * rate)
+        cmd = {
+            'protocol': {'duration': dur},
+            'DAQ': {'rate': rate, 'numPts': npts},
+        }
+        for dev, w in self.channels.items():
+            cmd[dev] = w.command(npts)
+        task = self.manager.createTask(cmd)
+
+        self.analysisThread = AnalysisThread(self)
+        self.acqThread = AcquisitionThread(self, task, self.analysisThread.queue)
+        self.acqThread.sigStopped.connect(self.acquisitionStopped)
+        self.analysisThread.start()
+        self.acqThread.start()
+
+    def stopContinuous(self):
+        if self.acqThread is not None:
+            self.acqThread.stop()
+            self.acqThread.wait()
+            self.acqThread = None
+        if self.analysisThread is not None:
+            ## let the analysis thread finish writing traces that were already recorded
+            self.analysisThread.stop()
+            self.analysisThread.wait()
+            self.analysisThread = None
+
+    def acquisitionStopped(self):
+        ## acquisition thread exited on its own (because of an error)
+        self.startBtn.setChecked(False)
+
+    def traceRecorded(self, duration):
+        """Called by the acquisition thread(s) after each trace is recorded."""
+        with self.coverageLock:
+            self.recordedTime += duration
+        self.sigCoverageChanged.emit()
+
+    def updateCoverageLabel(self):
+        with self.coverageLock:
+            if self.runStartTime is None:
+                return
+            elapsed = ptime.time() - self.runStartTime
+            recorded = self.recordedTime
+        if elapsed <= 0:
+            return
+        self.coverageLabel.setText('Coverage: %0.1f%%' % (100. * min(1.0, recorded / elapsed)))
+
     def newRecord(self):
         self.recordDir = self.manager.getCurrentDir().mkdir('NoiseMonitor', autoIncrement=True)
         self.recordWritable = True
@@ -95,7 +181,7 @@ class NoiseMonitor(Module):
 
         for dev in self.config['devices']:
             w = self.addChannel(dev, mode=self.config['devices'][dev]['mode'], recordDir=self.recordDir)
-        
+
     def loadClicked(self):
         try:
             startDir = self.manager.getCurrentDir()
@@ -122,12 +208,124 @@ class NoiseMonitor(Module):
 
     def clearChannels(self):
         for w in self.channels.values():
+            w.closeFiles()
             w.hide()
             w.setParent(None)
         self.channels = collections.OrderedDict()
 
+    def quit(self):
+        self.startBtn.setChecked(False)
+        for w in self.channels.values():
+            w.closeFiles()
+        Module.quit(self)
+
+
+class AcquisitionThread(Thread):
+    """Executes one task repeatedly, with no delay between runs, and puts
+    (trialTime, result) for each run into *outQueue*.
+
+    Executing the same Task object again avoids rebuilding the device tasks
+    (and their command arrays) for every trace, which keeps the dead time
+    between traces as short as the device configure/start overhead allows.
+    """
+    sigStopped = Qt.Signal()
+
+    def __init__(self, mod, task, outQueue):
+        Thread.__init__(self)
+        self.mod = weakref.ref(mod)
+        self.task = task
+        self.queue = outQueue
+        self.lock = Mutex()
+        self.stopThread = False
+
+    def stop(self):
+        with self.lock:
+            self.stopThread = True
+
+    def run(self):
+        mod = self.mod()
+        duration = self.task.duration()
+        try:
+            while True:
+                with self.lock:
+                    if self.stopThread:
+                        break
+                self.task.execute(processEvents=False)
+                trialTime = time.time() - mod.startTime
+                result = self.task.getResult()
+                mod.traceRecorded(duration)
+                ## blocks if analysis falls behind; the lost time shows up as reduced coverage
+                self.queue.put((trialTime, result))
+        except Exception:
+            printExc("Error in continuous noise acquisition; stopping.")
+            self.sigStopped.emit()
+
+
+class AnalysisThread(Thread):
+    """Analyzes and stores traces from the acquisition thread, one channel at a time.
+    """
+    def __init__(self, mod, maxQueue=10):
+        Thread.__init__(self)
+        self.mod = weakref.ref(mod)
+        self.queue = queue.Queue(maxsize=maxQueue)
+
+    def stop(self):
+        ## processed after any traces that are already queued
+        self.queue.put(None)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            trialTime, result = item
+            mod = self.mod()
+            for dev, w in list(mod.channels.items()):
+                try:
+                    w.processTrace(trialTime, result[dev]['Channel': 'primary'])
+                except Exception:
+                    printExc("Error analyzing noise data for %s:" % dev)
+
+
+def envelope(data):
+    """Return [min, mean, max, std] of *data*."""
+    return np.array([data.min(), data.mean(), data.max(), data.std()])
+
+
+def welchSpectrum(data, rate, nperseg):
+    """Return (freqs, asd), the amplitude spectral density of *data* (units/sqrt(Hz))
+    estimated by Welch's method: the power spectra of 50%-overlapping,
+    Hann-windowed segments of *nperseg* samples are averaged. This is much
+    cheaper than a full-length FFT and gives a fixed, smooth set of frequency bins.
+    """
+    data = np.ascontiguousarray(data, dtype=float)
+    nperseg = min(nperseg, len(data))
+    step = max(1, nperseg // 2)
+    nseg = 1 + (len(data) - nperseg) // step
+    segs = np.lib.stride_tricks.as_strided(data, shape=(nseg, nperseg),
+                                           strides=(data.strides[0] * step, data.strides[0]))
+    win = np.hanning(nperseg)
+    segs = (segs - segs.mean(axis=1)[:, np.newaxis]) * win
+    psd = (np.abs(np.fft.rfft(segs, axis=1)) ** 2).mean(axis=0)
+    psd /= rate * (win ** 2).sum()
+    ## one-sided spectrum; DC and Nyquist bins are not doubled
+    if nperseg % 2 == 0:
+        psd[1:-1] *= 2
+    else:
+        psd[1:] *= 2
+    freqs = np.fft.rfftfreq(nperseg, 1.0 / rate)
+    return freqs, np.sqrt(psd)
+
 
 class ChannelRecorder(Qt.QSplitter):
+
+    ## spectrogram resolution (the Welch segment length is twice this)
+    spectrumBins = 1000
+    ## the displayed spectrogram is downsampled (by max) to no more than 2x this many traces
+    maxDisplayRows = 2000
+
+    sigTraceProcessed = Qt.Signal(object, object, object, object)  # trialTime, data, envelope, spectrum
+
     def __init__(self, mod, dev, mode, recordDir):
         self.mod = weakref.ref(mod)
         self.dev = dev
@@ -147,144 +345,206 @@ class ChannelRecorder(Qt.QSplitter):
         self.rawDataFile = None
         self.envelopeFile = None
         self.spectrogramFile = None
+        self.appenders = {}  ## name: HDF5Appender used while recording
+        self.fileLock = Mutex(recursive=True)
         self.resetDisplay = True
         self.showNewRecords = True
 
+        ## analysis results kept for display
+        self.trials = []
+        self.envRows = []
+        self.specRows = []
+        self.freqs = None
+        self._specPending = []
+        self._specDecimation = 1
+
         Qt.QSplitter.__init__(self, Qt.Qt.Vertical)
 
         self.plot = pg.PlotWidget(labels={'left': ('Primary', self.units), 'bottom': ('Time', 's')}, title="%s (%s)" % (dev, mode))
         self.plot.setDownsampling(auto=True)
         self.plot.setClipToView(True)
         self.addWidget(self.plot)
-        
+
         self.envelopePlot = pg.PlotWidget(labels={'left': ('Mean, Stdev, Peaks', self.units), 'bottom': ('Time', 's')})
+        self.envelopePlot.setDownsampling(auto=True)
+        self.envelopePlot.setClipToView(True)
         self.addWidget(self.envelopePlot)
-        
+
         self.specView = pg.PlotItem(labels={'left': ('Frequency', 'Hz'), 'bottom': ('Time', 's')})
         self.spectrogram = pg.ImageView(view=self.specView)
         self.specView.setAspectLocked(False)
         self.spectrogram.imageItem.setAutoDownsample(True)
         self.addWidget(self.spectrogram)
-        
+
         self.setStretchFactor(0, 10)
         self.setStretchFactor(1, 15)
         self.setStretchFactor(2, 30)
-        
+
         self.specLine = pg.InfiniteLine()
         self.spectrogram.addItem(self.specLine)
-        
+
         self.envLine = pg.InfiniteLine(movable=True)
         self.envelopePlot.addItem(self.envLine)
         self.envLine.sigDragged.connect(self.lineDragged)
 
+        self.sigTraceProcessed.connect(self.traceProcessed)
+
         if not self.writable:
             # Load previously collected data
             self.loadRecord()
 
     def loadRecord(self):
-        self.rawDataFile = self.recordDir['rawData.ma']
+        self.rawDataFile = self.recordDir['rawData.ma'] if self.recordDir.exists('rawData.ma') else None
         self.envelopeFile = self.recordDir['envelope.ma']
         self.spectrogramFile = self.recordDir['spectrogram.ma']
+
+        envelope = self.envelopeFile.read()
+        specData = self.spectrogramFile.read()
+        self.trials = list(envelope.xvals('Trial'))
+        self.envRows = list(envelope.asarray())
+        self.freqs = specData.xvals('Frequency')
+        self.specRows = []
+        self._specPending = []
+        self._specDecimation = 1
+        for row in specData.asarray():
+            self._addSpectrumRow(row)
+
         self.resetDisplay = True
         self.plotAnalysis()
         self.envLine.setValue(0)
 
     def lineDragged(self):
         self.showNewRecords = self.envLine.value() >= self.envLine.bounds()[1]
-        data = self.rawDataFile.read(readAllData=False)
-        tvals = data.xvals('Trial')
+        tvals = np.array(self.trials)
+        if len(tvals) == 0:
+            return
         ind = np.argwhere(tvals >= self.envLine.value())[0,0]
         self.specLine.setValue(tvals[-1] * ind / len(tvals))
-        self.plotRawData(data['Trial': ind])
-        
-        # workaround for h5py bug that leaves file handles open
-        data._data.file.close()
+
+        with self.fileLock:
+            app = self.appenders.get('rawData')
+            if app is not None:
+                self.plotRawData(app.read(ind))
+            elif self.rawDataFile is not None:
+                data = self.rawDataFile.read(readAllData=False)
+                self.plotRawData(data['Trial': ind])
+                data.close()
+
+    def command(self, npts):
+        """Return the command for this channel's device in a noise recording task."""
+        return {'mode': self.mode, 'holding': 0, 'command': np.zeros(npts), 'recordSecondary': False}
 
     def runOnce(self):
         dev = self.dev
-        mode = self.mode
         dur = self.mod().params['trace duration']
         rate = self.mod().params['sample rate']
         npts = int(dur * rate)
         cmd = {
             'protocol': {'duration': dur},
             'DAQ': {'rate': rate, 'numPts': npts},
-            dev: {'mode': mode, 'holding': 0, 'command': np.zeros(npts), 'recordSecondary': False},
+            dev: self.command(npts),
         }
         task = self.mod().manager.createTask(cmd)
         task.execute()
         result = task.getResult()
-        
-        trialArr = np.array([time.time() - self.mod().startTime])
-        
-        # Raw data plot/storage
-        data = result[dev]['Channel': 'primary']
+        self.mod().traceRecorded(dur)
+
+        trialTime = time.time() - self.mod().startTime
+        self.processTrace(trialTime, result[dev]['Channel': 'primary'])
+
+    def processTrace(self, trialTime, data):
+        """Analyze and store one trace; the display is updated by sigTraceProcessed.
+        This may be called from the analysis thread."""
+        trialArr = np.array([trialTime])
         dataArr = data.asarray()
-        
+        rate = 1.0 / (data.xvals('Time')[1] - data.xvals('Time')[0])
+
         # inject random noise for testing
         # dataArr += np.random.normal(size=len(dataArr), scale=1e-9)
         # if np.random.random() > 0.9:
         #     dataArr += np.sin(np.linspace(0, 1000 * np.random.random(), len(dataArr))) * 1e-9
 
+        # Envelope analysis
+        envData = envelope(dataArr)
+
+        # Spectrum analysis; log scale for pretty
+        freqArr, spec = welchSpectrum(dataArr, rate, self.spectrumBins * 2)
+        spec = np.log10(spec)
+
+        with self.fileLock:
+            if self.mod().params['save raw data']:
+                ma = pg.metaarray.MetaArray(dataArr[np.newaxis, :], info=[
+                    {'name': 'Trial', 'units': 's', 'values': trialArr}] + data._info)
+                self.rawDataFile = self.appendRecord('rawData', ma, self.rawDataFile)
+
+            env = pg.metaarray.MetaArray(envData[np.newaxis, :], info=[
+                {'name': 'Trial', 'units': 's', 'values': trialArr},
+                {'name': 'Metric', 'units': self.units}])
+            self.envelopeFile = self.appendRecord('envelope', env, self.envelopeFile)
+
+            specMa = pg.metaarray.MetaArray(spec[np.newaxis, :], info=[
+                {'name': 'Trial', 'units': 's', 'values': trialArr},
+                {'name': 'Frequency', 'units': 'Hz', 'values': freqArr}])
+            self.spectrogramFile = self.appendRecord('spectrogram', specMa, self.spectrogramFile)
+
+        self.sigTraceProcessed.emit(trialTime, data, envData, (freqArr, spec))
+
+    def appendRecord(self, name, ma, fh):
+        """Append *ma* to the record file *name*, creating it (and returning its
+        FileHandle) on the first call. Later records are written in batches by
+        an HDF5Appender, which opens the file only while writing; closeFiles()
+        writes any records still held in memory."""
+        if fh is None:
+            return self.recordDir.writeFile(ma, name, appendAxis='Trial', newFile=True,
+                                            chunks=HDF5Appender.chunkShape(ma, 'Trial'))
+        app = self.appenders.get(name)
+        if app is None:
+            app = HDF5Appender(fh.name(), 'Trial')
+            self.appenders[name] = app
+        app.append(ma)
+        return fh
+
+    def closeFiles(self):
+        with self.fileLock:
+            for app in self.appenders.values():
+                app.close()
+            self.appenders = {}
+
+    def traceProcessed(self, trialTime, data, envData, spectrum):
+        self.trials.append(trialTime)
+        self.envRows.append(envData)
+        self.freqs = spectrum[0]
+        self._addSpectrumRow(spectrum[1])
+
         # plot raw data only if envelope line is at max position
         if self.showNewRecords:
             self.plotRawData(data)
-            self.envLine.setValue(trialArr[0])
-            self.specLine.setValue(trialArr[0])
-        
-        ma = pg.metaarray.MetaArray(dataArr[np.newaxis, :], info=[
-            {'name': 'Trial', 'units': 's', 'values': trialArr}] + data._info)
-
-        if self.rawDataFile is None:
-            self.rawDataFile = self.recordDir.writeFile(ma, 'rawData', appendAxis='Trial', newFile=True)
-        else:
-            ma.write(self.rawDataFile.name(), appendAxis='Trial')
-
+            self.envLine.setValue(trialTime)
+            self.specLine.setValue(trialTime)
 
-        # Envelope analysis
-        envData = np.array([[dataArr.min(), dataArr.mean(), dataArr.max(), dataArr.std()]])
-        env = pg.metaarray.MetaArray(envData, info=[
-            {'name': 'Trial', 'units': 's', 'values': trialArr},
-            {'name': 'Metric', 'units': self.units}])
-        if self.envelopeFile is None:
-            self.envelopeFile = self.recordDir.writeFile(env, 'envelope', appendAxis='Trial', newFile=True)
-        else:
-            env.write(self.envelopeFile.name(), appendAxis='Trial')
-
-
-        # Spectrum analysis
-        fft = np.abs(np.fft.fft(dataArr))
-        fft = fft[:len(fft)/2]
-        freqArr = np.linspace(0, rate/2., len(fft))
-
-        # downsample spectrogram
-        ds = len(fft) // 1000
-        fft = fft[:ds*1000].reshape(1000, ds).max(axis=1)
-        freqArr = freqArr[:ds*1000:ds]
-
-        # log scale for pretty
-        fft = np.log10(fft)
-
-        spec = pg.metaarray.MetaArray(fft[np.newaxis, :], info=[
-            {'name': 'Trial', 'units': 's', 'values': trialArr},
-            {'name': 'Frequency', 'units': 'Hz', 'values': freqArr}])
-        if self.spectrogramFile is None:
-            self.spectrogramFile = self.recordDir.writeFile(spec, 'spectrogram', appendAxis='Trial', newFile=True)
-        else:
-            spec.write(self.spectrogramFile.name(), appendAxis='Trial')
-                        
         self.plotAnalysis()
-            
-    def plotRawData(self, data=None):
-        if data is None:
-            data = self.rawDataFile.read()['Trial': -1]
+
+    def _addSpectrumRow(self, row):
+        self._specPending.append(row.astype(np.float32))
+        if len(self._specPending) < self._specDecimation:
+            return
+        self.specRows.append(np.max(self._specPending, axis=0))
+        self._specPending = []
+        if len(self.specRows) >= 2 * self.maxDisplayRows:
+            rows = np.array(self.specRows[:len(self.specRows) // 2 * 2])
+            self.specRows = list(np.maximum(rows[0::2], rows[1::2]))
+            self._specDecimation *= 2
+
+    def plotRawData(self, data):
         self.plot.plot(data.xvals('Time'), data.asarray(), clear=True)
-        
+
     def plotAnalysis(self):
+        if len(self.trials) == 0:
+            return
+
         # update envelope
-        envelope = self.envelopeFile.read()
-        trials = envelope.xvals('Trial')
-        envArr = envelope.asarray()
+        trials = np.array(self.trials)
+        envArr = np.array(self.envRows)
         self.envelopePlot.clear()
         self.envelopePlot.addItem(self.envLine)
         grey = (255, 255, 255, 100)
@@ -300,19 +560,11 @@ class ChannelRecorder(Qt.QSplitter):
         self.envelopePlot.plot(trials, envArr[:,1])  # mean
 
         # update spectrogram
-        specData = self.spectrogramFile.read()
-        specArr = specData.asarray()
-        self.spectrogram.setImage(specArr, autoLevels=self.resetDisplay, autoRange=True, 
-                                  scale=(trials[-1] / specArr.shape[0], specData.xvals('Frequency')[-1] / specArr.shape[1]))
-        
-        self.envLine.setBounds([0, trials[-1]])
-        
-        self.resetDisplay = False
-        
-    def quit(self):
-        self.startBtn.setChecked(False)
-        Module.quit(self)
-
-    
+        if len(self.specRows) > 0:
+            specArr = np.array(self.specRows)
+            self.spectrogram.setImage(specArr, autoLevels=self.resetDisplay, autoRange=True,
+                                      scale=(trials[-1] / specArr.shape[0], self.freqs[-1] / specArr.shape[1]))
 
+        self.envLine.setBounds([0, trials[-1]])
 
+        self.resetDisplay = False
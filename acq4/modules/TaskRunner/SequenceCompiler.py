@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+"""
+SequenceCompiler.py - On-demand generation of task sequence commands
+Distributed under MIT/X11 license. See license.txt for more infomation.
+
+Building the command structures for every point of a large parameter space
+before starting a sequence can freeze the UI for a long time. Instead, the
+TaskRunner hands the TaskThread a SequenceCompiler, which assembles commands
+in short slices of GUI idle time, a bounded number of trials ahead of the
+trial currently being executed.
+
+Device task GUIs read their widget state while generating commands. So that
+changes made in the GUI while a sequence runs do not affect it, every distinct
+device command is generated when the sequence starts (there are usually far
+fewer of these than trials), with a progress dialog that keeps the UI
+responsive and allows the sequence to be canceled. Only the per-trial work of
+combining them and creating storage directories is deferred. All generation
+happens in the GUI thread; the TaskThread only waits for (and consumes)
+commands that are ready.
+"""
+
+import sys, itertools, threading
+import six
+import numpy as np
+from collections import OrderedDict
+from acq4.util import Qt
+from acq4.util.SequenceRunner import SequenceRunner
+import acq4.util.ptime as ptime
+
+
+class SequenceCompiler(Qt.QObject):
+    """Generates the command for each trial of a task sequence.
+
+    *protocolFn(params)* must return a new command dict for one trial (without
+    device commands), and *deviceFn(dev, devParams)* returns the command for a
+    single device. Each device command is generated only once for each distinct
+    set of that device's parameters and then copied into every trial that uses
+    it; for example, in a 2-D sequence over
+    two devices, each device command is generated once per row or column rather
+    than once per trial. All device commands are generated by start().
+
+    Trials are compiled in the order they will be executed by the TaskThread
+    (the same order as runSequence(fn, paramInds, order)). At most *lookahead*
+    compiled trials are held in memory; each slice of compilation in the GUI
+    thread runs for no longer than *sliceTime* seconds.
+    """
+
+    sigWanted = Qt.Signal()  ## emitted from the task thread when it consumes a command
+
+    def __init__(self, protocolFn, deviceFn, devices, paramInds, order, linkedParams=None, lookahead=20, sliceTime=0.02):
+        Qt.QObject.__init__(self)
+        self.protocolFn = protocolFn
+        self.deviceFn = deviceFn
+        self.devices = devices
+        self.order = order
+        self.lookahead = lookahead
+        self.sliceTime = sliceTime
+
+        self._runner = SequenceRunner(paramInds, order, linkedParams=linkedParams)
+        self._runner.makeParamSpace()
+        self._inds = list(itertools.product(*[range(len(paramInds[k])) for k in order]))
+        self._next = 0
+
+        self._deviceCache = {}  ## (dev, devParams): command
+        self.generated = 0      ## number of device commands actually generated
+        self.reused = 0         ## number of device commands copied into trials
+
+        self._cond = threading.Condition()
+        self._ready = {}        ## ind: command
+        self._excInfo = None
+        self._stopped = False
+
+        self._timer = Qt.QTimer()
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._compileSome)
+        self.sigWanted.connect(self._schedule)
+
+    def __len__(self):
+        return len(self._inds)
+
+    def start(self, progressDlg=None):
+        """Generate all device commands and compile the first trial immediately
+        (so that the sequence uses the device state at this moment, and
+        configuration errors are raised to the caller), then continue in the
+        background. Must be called from the GUI thread.
+
+        If *progressDlg* is given, its value is set to the number of trials whose
+        device commands have been generated (so its maximum should be len(self)).
+        If it is canceled, an exception is raised and the sequence is not started."""
+        self._generateDeviceCommands(progressDlg)
+        self._compileNext()
+        self._schedule()
+
+    def stop(self):
+        """Stop compiling and release all commands. May be called from any thread."""
+        with self._cond:
+            self._stopped = True
+            self._ready.clear()
+            self._cond.notify_all()
+        self.sigWanted.emit()  ## device cache is released by the GUI thread
+
+    def command(self, params, stopCheck=None):
+        """Return the command for the trial with sequence indexes *params*, waiting
+        for it to be compiled if necessary. Called from the task thread.
+
+        Returns None if *stopCheck()* becomes True before the command is ready.
+        Exceptions raised while compiling are re-raised here."""
+        key = tuple([params[k] for k in self.order])
+        with self._cond:
+            while key not in self._ready:
+                if self._excInfo is not None:
+                    six.reraise(*self._excInfo)
+                if self._stopped or (stopCheck is not None and stopCheck()):
+                    return None
+                self._cond.wait(0.01)
+            cmd = self._ready.pop(key)
+        self.sigWanted.emit()
+        return cmd
+
+    def _schedule(self):
+        if not self._timer.isActive():
+            self._timer.start(0)
+
+    def _compileSome(self):
+        start = ptime.time()
+        while ptime.time() - start < self.sliceTime:
+            with self._cond:
+                if self._stopped or self._next >= len(self._inds):
+                    self._deviceCache = {}
+                    return
+                if self._excInfo is not None or len(self._ready) >= self.lookahead:
+                    return
+            try:
+                self._compileNext()
+            except Exception:
+                ## reported by the task thread when it asks for this trial
+                with self._cond:
+                    self._excInfo = sys.exc_info()
+                    self._cond.notify_all()
+                return
+        self._schedule()
+
+    def _deviceParams(self, dev, params):
+        ## select out just the parameters needed for this device
+        p = dict([(i[1], params[i]) for i in params.keys() if i[0] == dev])
+        return p, (dev, tuple(sorted(p.items())))
+
+    def _generateDeviceCommands(self, progressDlg=None):
+        for i, ind in enumerate(self._inds):
+            params = self._runner.getParams(list(ind))
+            for d in self.devices:
+                p, key = self._deviceParams(d, params)
+                if key not in self._deviceCache:
+                    self._deviceCache[key] = self.deviceFn(d, p)
+                    self.generated += 1
+            if progressDlg is not None:
+                progressDlg.setValue(i+1)  ## also processes events
+                if progressDlg.wasCanceled():
+                    self._deviceCache = {}
+                    raise Exception("Target sequence computation canceled by user.")
+
+    def _compileNext(self):
+        ind = self._inds[self._next]
+        params = self._runner.getParams(list(ind))
+        cmd = self.protocolFn(params)
+        for d in self.devices:
+            p, key = self._deviceParams(d, params)
+            cmd[d] = copyCommand(self._deviceCache[key])
+            self.reused += 1
+        with self._cond:
+            if self._stopped:
+                return
+            self._ready[ind] = cmd
+            self._next += 1
+            self._cond.notify_all()
+
+
+def copyCommand(cmd):
+    """Copy the dict/list structure and the arrays of a command, so that device
+    tasks may modify them in place. Other values are shared."""
+    if type(cmd) in (dict, OrderedDict):
+        return type(cmd)([(k, copyCommand(v)) for k, v in cmd.items()])
+    if type(cmd) is list:
+        return [copyCommand(v) for v in cmd]
+    if isinstance(cmd, np.ndarray):
+        return cmd.copy()
+    return cmd
@@ -13,6 +13,7 @@ from acq4.util.SequenceRunner import *
 from acq4.util.Mutex import Mutex
 from acq4.util.Thread import Thread
 from acq4.Manager import getManager, logMsg, logExc
+from acq4.Manager import Task as ManagerTask  ## TaskRunner.Task is defined below
 from acq4.util.debug import *
 import acq4.util.ptime as ptime
 from . import analysisModules
@@ -21,6 +22,8 @@ import sys, os
 from acq4.util.HelpfulException import HelpfulException
 import acq4.pyqtgraph as pg
 from acq4.util.StatusBar import StatusBar
+from acq4.util import gcpolicy
+from .SequenceCompiler import SequenceCompiler
 from functools import reduce
 
 
@@ -67,7 +70,8 @@ class TaskRunner(Module):
     
     sigTaskPaused = Qt.Signal()
     sigTaskFinished = Qt.Signal()       ## emitted when the task thread exits (end of task, end of sequence, or exit due to error)
-    sigNewFrame = Qt.Signal(object)         ## emitted at the end of each individual task
+    sigNewFrame = Qt.Signal(object)         ## emitted at the end of each individual task. frame['storage'] is the task's StorageJob
+                                            ## (or None); call frame['storage'].wait() before reading the task's files from disk.
     sigTaskSequenceStarted = Qt.Signal(object)  ## called whenever single task OR task sequence has started
     sigTaskStarted = Qt.Signal(object)      ## called at start of EVERY task, including within sequences
     sigTaskChanged = Qt.Signal(object, object)
@@ -529,9 +533,9 @@ class TaskRunner(Module):
         
         if self.protoStateGroup.state()['loop']:
             self.loopEnabled = True
-            
-        # good time to collect garbage
-        gc.collect()
+        else:
+            # good time to collect garbage (in loop mode, this is left to the idle collector)
+            gcpolicy.collector().collect()
 
         self.lastProtoTime = ptime.time()
         ## Disable all start buttons
@@ -582,7 +586,7 @@ class TaskRunner(Module):
         self.enableStartBtns(False)
         
         # good time to collect garbage
-        gc.collect()
+        gcpolicy.collector().collect()
         
         ## Find all top-level items in the sequence parameter list
         try:
@@ -596,7 +600,7 @@ class TaskRunner(Module):
             for i in items:
                 key = i[:2]
                 params[key] = i[2]
-                paramInds[key] = range(len(i[2]))
+                paramInds[key] = list(range(len(i[2])))
                 pLen *= len(i[2])
                 linkedParams[key] = i[3]
                 
@@ -618,10 +622,17 @@ class TaskRunner(Module):
                     self.docks[d].widget().prepareTaskStart()
                     
             #print params, linkedParams
-            ## Generate the complete array of command structures. This can take a long time, so we start a progress dialog.
-            with pg.ProgressDialog("Generating task commands..", 0, pLen) as progressDlg:
-                self.lastQtProcessTime = ptime.time()
-                prot = runSequence(lambda p: self.generateTask(dh, p, progressDlg), paramInds, list(paramInds.keys()), linkedParams=linkedParams)
+            ## Commands are assembled on demand (in GUI idle time, a few trials ahead of
+            ## the task thread) rather than for the entire parameter space up front.
+            ## Device commands and protocol settings are captured now, so that later
+            ## changes in the GUI do not affect the running sequence. Generating the
+            ## device commands can take a long time, so we start a progress dialog.
+            devices = [d for d in self.currentTask.devices if self.currentTask.deviceEnabled(d)]
+            protoState = self.protoStateGroup.state()
+            prot = SequenceCompiler(lambda p: self.generateProtocol(dh, p, protoState), self.generateDeviceTask, devices, 
+                                    paramInds, list(paramInds.keys()), linkedParams=linkedParams)
+            with pg.ProgressDialog("Generating task commands..", 0, len(prot)) as progressDlg:
+                prot.start(progressDlg)
             if dh is not None:
                 dh.flushSignals()  ## do this now rather than later when task is running
             
@@ -640,7 +651,37 @@ class TaskRunner(Module):
         ## Never put {} in the function signature
         if params is None:
             params = {}
-        prot = {'protocol': self.protoStateGroup.state()}
+        prot = self.generateProtocol(dh, params)
+        
+        for d in self.currentTask.devices:
+            if self.currentTask.deviceEnabled(d):
+                ## select out just the parameters needed for this device
+                p = dict([(i[1], params[i]) for i in params.keys() if i[0] == d])
+                ## Ask the device to generate its task command
+                prot[d] = self.generateDeviceTask(d, p)
+                #prof.mark("get task from %s" % d)
+        #print prot['protocol']['storageDir'].name()
+        
+        if progressDlg is not None:
+            progressDlg.setValue(progressDlg.value()+1)
+            ## only do UI updates every 1 sec.
+            now = ptime.time()
+            if now - self.lastQtProcessTime > 1.0:
+                self.lastQtProcessTime = now
+                Qt.QApplication.processEvents()
+            if progressDlg.wasCanceled():
+                raise Exception("Target sequence computation canceled by user.")
+        #prof.mark('done')
+        return prot
+    
+    def generateProtocol(self, dh, params, protoState=None):
+        """Return the task command for a single trial, without any device commands.
+        Creates the storage directory for the trial if *dh* is not None. If 
+        *protoState* is given, it is used (as a copy) instead of the current state
+        of the protocol controls."""
+        if protoState is None:
+            protoState = self.protoStateGroup.state()
+        prot = {'protocol': protoState.copy()}
 
         # Disable timeouts for these tasks because we don't know how long to wait
         # for external triggers. TODO: use the default timeout, but also allow devices
@@ -663,39 +704,24 @@ class TaskRunner(Module):
             prot['protocol']['storageDir'] = dh1
         #prof.mark('selected storage dir.')
         prot['protocol']['name'] = self.currentTask.fileName
-        
-        for d in self.currentTask.devices:
-            if self.currentTask.deviceEnabled(d):
-                ## select out just the parameters needed for this device
-                p = dict([(i[1], params[i]) for i in params.keys() if i[0] == d])
-                ## Ask the device to generate its task command
-                if d not in self.docks:
-                    raise HelpfulException("The device '%s' currently has no dock loaded." % d,
-                                           reasons=[
-                                               "This device name does not exist in the system's configuration",
-                                               "There was an error when creating the device at program startup",
-                                               ],
-                                           tags={},
-                                           importance=8,
-
-                                           docSections=['userGuide/modules/TaskRunner/loadingNonexistentDevices']
-                                           )
-                prot[d] = self.docks[d].widget().generateTask(p)
-                #prof.mark("get task from %s" % d)
-        #print prot['protocol']['storageDir'].name()
-        
-        if progressDlg is not None:
-            progressDlg.setValue(progressDlg.value()+1)
-            ## only do UI updates every 1 sec.
-            now = ptime.time()
-            if now - self.lastQtProcessTime > 1.0:
-                self.lastQtProcessTime = now
-                Qt.QApplication.processEvents()
-            if progressDlg.wasCanceled():
-                raise Exception("Target sequence computation canceled by user.")
-        #prof.mark('done')
         return prot
     
+    def generateDeviceTask(self, dev, params):
+        """Ask the task GUI of device *dev* to generate its command for the given
+        sequence parameters."""
+        if dev not in self.docks:
+            raise HelpfulException("The device '%s' currently has no dock loaded." % dev,
+                                   reasons=[
+                                       "This device name does not exist in the system's configuration",
+                                       "There was an error when creating the device at program startup",
+                                       ],
+                                   tags={},
+                                   importance=8,
+
+                                   docSections=['userGuide/modules/TaskRunner/loadingNonexistentDevices']
+                                   )
+        return self.docks[dev].widget().generateTask(params)
+    
     def taskInfo(self, params=None):
         """
         Generate a complete description of the task.
@@ -793,8 +819,8 @@ class TaskRunner(Module):
             Qt.QTimer.singleShot(int(t*1000.), self.loop)
         prof.finish()
         
-        # good time to collect garbage
-        gc.collect()
+        # collect garbage once things are quiet, rather than between every frame
+        gcpolicy.collector().requestIdleCollect()
             
     def loop(self):
         """Run one iteration when in loop mode"""
@@ -956,6 +982,9 @@ class TaskThread(Thread):
         sys.settrace(self._systrace)
 
         self.objs = None
+        task = self.task
+        gcc = gcpolicy.collector()
+        gcc.beginSequence()
         try:
             with self.lock:
                 self.stopThread = False
@@ -970,34 +999,57 @@ class TaskThread(Thread):
             else:
                 runSequence(self.runOnce, self.paramSpace, list(self.paramSpace.keys()))
             
+            ## Results are written by the manager's storage threads; don't report 
+            ## that the task has finished until they are all on disk.
+            self.dm.storageQueue.flush()
+            self.dm.storageQueue.checkErrors()
+            
         except:
             self.task = None  ## free up this memory
             self.paramSpace = None
             printExc("Error in task thread, exiting.")
             self.sigExitFromError.emit()
+        finally:
+            if isinstance(task, SequenceCompiler):
+                task.stop()
+            stats = gcc.endSequence()
+            if stats is not None:
+                logMsg(gcc.formatStats(stats), importance=4)
                     
     def runOnce(self, params=None):
-        # good time to collect garbage
-        gc.collect()
-        
-        prof = Profiler("TaskRunner.TaskThread.runOnce", disabled=True, delayed=False)
+        if ManagerTask.phaseTimeCallback is None:
+            prof = Profiler("TaskRunner.TaskThread.runOnce", disabled=True, delayed=False)
+        else:
+            prof = MarkRecorder("TaskRunner.TaskThread.runOnce", ManagerTask.phaseTimeCallback)
+        gcc = gcpolicy.collector()
         startTime = ptime.time()
         if params is None:
             params = {}
         
         ## Select correct command to execute
-        cmd = self.task
-        if params is not None:
-            for p in params:
-                cmd = cmd[p: params[p]]
+        if isinstance(self.task, SequenceCompiler):
+            ## wait for the command to be generated, if necessary
+            cmd = self.task.command(params, self.stopRequested)
+            if cmd is None:
+                ## stop requested; end the sequence here rather than skipping each remaining trial
+                raise Exception('stop')
+        else:
+            cmd = self.task
+            if params is not None:
+                for p in params:
+                    cmd = cmd[p: params[p]]
         prof.mark('select command')        
+        
+        ## Collect garbage in the gap between trials, but only if there is time to spare
+        if self.lastRunTime is not None:
+            gcc.collectInGap(self.lastRunTime + cmd['protocol']['cycleTime'] - ptime.time(), prof)
                 
         ## Wait before starting if we've already run too recently
         while (self.lastRunTime is not None) and (ptime.time() < self.lastRunTime + cmd['protocol']['cycleTime']):
             with self.lock:
                 if self.abortThread or self.stopThread:
                     #print "Task run aborted by user"
-                    return
+                    raise Exception('stop')
             time.sleep(1e-3)
         prof.mark('sleep')
         
@@ -1005,7 +1057,7 @@ class TaskThread(Thread):
         while True:
             with self.lock:
                 if self.abortThread or self.stopThread:
-                    return
+                    raise Exception('stop')
                 pause = self.paused
             if not pause:
                 break
@@ -1016,6 +1068,9 @@ class TaskThread(Thread):
         
         prof.mark('pause')
         
+        ## stop here if the results of a previous run could not be stored
+        self.dm.storageQueue.checkErrors()
+        
         if type(cmd) is not dict:
             print("========= TaskRunner.runOnce cmd: ==================")
             print(cmd)
@@ -1062,7 +1117,7 @@ class TaskThread(Thread):
                         # should be taken care of in TaskThread.abort()
                         # NO -- task.stop() is not thread-safe.
                         task.stop(abort=True)
-                        return
+                        return  ## the next trial of a sequence will see abortThread and stop
                 # adjust sleep time based on estimated time remaining in the task.
                 sleep = np.clip((endTime - time.time()) * 0.5, 1e-3, 20e-3)
                 time.sleep(sleep)
@@ -1080,7 +1135,12 @@ class TaskThread(Thread):
                 self._currentTask = None
         prof.mark('getResult')
             
-        frame = {'params': params, 'cmd': cmd, 'result': result}
+        ## Automatic collections that interrupted this trial
+        pauses = gcc.reportPauses()
+        if len(pauses) > 0 and ManagerTask.phaseTimeCallback is not None:
+            ManagerTask.phaseTimeCallback('gcpolicy.gc pauses', [('gen %d' % gen, dt) for gen, dt in pauses])
+        
+        frame = {'params': params, 'cmd': cmd, 'result': result, 'storage': task.storageJob}
         self.sigNewFrame.emit(frame)
         prof.mark('emit newFrame')
         if self.stopThread:
@@ -1091,6 +1151,10 @@ class TaskThread(Thread):
         prof.mark('yield')
         prof.finish()
         
+    def stopRequested(self):
+        with self.lock:
+            return self.stopThread or self.abortThread
+        
     def checkStop(self):
         with self.lock:
             if self.stopThread:
@@ -0,0 +1,164 @@
+from __future__ import print_function
+import threading, time
+from collections import OrderedDict
+import numpy as np
+import pytest
+import acq4.pyqtgraph as pg
+from acq4.modules.TaskRunner.SequenceCompiler import SequenceCompiler
+
+
+paramInds = OrderedDict([(('DevA', 'x'), [0, 1, 2]), (('DevB', 'y'), [0, 1])])
+order = list(paramInds.keys())
+trials = [{('DevA', 'x'): x, ('DevB', 'y'): y} for x in range(3) for y in range(2)]
+
+
+class Recorder(object):
+    def __init__(self, failAt=None):
+        self.protocols = []
+        self.devices = []
+        self.failAt = failAt
+
+    def protocolFn(self, params):
+        if len(self.protocols) == self.failAt:
+            raise ValueError("protocol failed")
+        self.protocols.append(dict(params))
+        return {'protocol': {'params': dict(params)}}
+
+    def deviceFn(self, dev, params):
+        self.devices.append((dev, dict(params)))
+        return {'command': np.zeros(10) + list(params.values())[0], 'opts': [dev]}
+
+
+def makeCompiler(rec, **kwds):
+    pg.mkQApp()
+    return SequenceCompiler(rec.protocolFn, rec.deviceFn, ['DevA', 'DevB'], paramInds, order, **kwds)
+
+
+def processUntil(cond, timeout=5.0):
+    app = pg.mkQApp()
+    start = time.time()
+    while not cond():
+        assert time.time() - start < timeout
+        app.processEvents()
+        time.sleep(0.001)
+
+
+def consume(comp, paramList):
+    ## request commands from another thread, as the TaskThread does
+    results = []
+    def run():
+        try:
+            for p in paramList:
+                results.append(comp.command(p))
+        except Exception as exc:
+            results.append(exc)
+    thread = threading.Thread(target=run)
+    thread.start()
+    processUntil(lambda: not thread.is_alive())
+    return results
+
+
+def test_order_and_counts():
+    rec = Recorder()
+    comp = makeCompiler(rec)
+    assert len(comp) == 6
+    comp.start()
+
+    ## every distinct device command is generated once, at start
+    assert comp.generated == 5
+    assert len(rec.devices) == 5
+
+    cmds = consume(comp, trials)
+    assert [c['protocol']['params'] for c in cmds] == trials
+    assert rec.protocols == trials
+    assert comp.reused == 12
+    for p, c in zip(trials, cmds):
+        assert np.all(c['DevA']['command'] == p[('DevA', 'x')])
+        assert np.all(c['DevB']['command'] == p[('DevB', 'y')])
+
+    ## trials do not share command structures or arrays
+    cmds[0]['DevB']['command'][:] = 10
+    cmds[0]['DevB']['opts'].append(1)
+    assert np.all(cmds[2]['DevB']['command'] == 0)
+    assert cmds[2]['DevB']['opts'] == ['DevB']
+
+    ## the device cache is released once everything is compiled
+    processUntil(lambda: len(comp._deviceCache) == 0)
+
+
+def test_lookahead():
+    rec = Recorder()
+    comp = makeCompiler(rec, lookahead=2)
+    comp.start()
+    app = pg.mkQApp()
+    for i in range(20):
+        app.processEvents()
+        time.sleep(0.001)
+    assert len(rec.protocols) == 2
+    assert len(comp._ready) == 2
+
+    ## consuming one trial allows one more to be compiled
+    consume(comp, trials[:1])
+    processUntil(lambda: len(rec.protocols) == 3)
+    for i in range(20):
+        app.processEvents()
+        time.sleep(0.001)
+    assert len(rec.protocols) == 3
+    comp.stop()
+
+
+def test_exception():
+    rec = Recorder(failAt=3)
+    comp = makeCompiler(rec)
+    comp.start()
+    results = consume(comp, trials)
+    assert len(results) == 4
+    assert [r['protocol']['params'] for r in results[:3]] == trials[:3]
+    assert isinstance(results[3], ValueError)
+
+    ## errors in the first trial are raised by start()
+    comp = makeCompiler(Recorder(failAt=0))
+    with pytest.raises(ValueError):
+        comp.start()
+
+
+def test_stop():
+    rec = Recorder()
+    comp = makeCompiler(rec, lookahead=2)
+    comp.start()
+    comp.stop()
+    assert len(comp._ready) == 0
+    assert consume(comp, trials[:1]) == [None]
+    processUntil(lambda: len(comp._deviceCache) == 0)
+    assert len(rec.protocols) == 1
+
+    ## command() also returns None when the task thread asks to stop
+    comp = makeCompiler(Recorder(), lookahead=1)
+    comp.start()
+    assert comp.command(trials[1], stopCheck=lambda: True) is None
+    comp.stop()
+
+
+def test_progress():
+    class Dialog(object):
+        def __init__(self, cancelAt):
+            self.values = []
+            self.cancelAt = cancelAt
+        def setValue(self, v):
+            self.values.append(v)
+        def wasCanceled(self):
+            return len(self.values) == self.cancelAt
+
+    rec = Recorder()
+    comp = makeCompiler(rec)
+    dlg = Dialog(None)
+    comp.start(dlg)
+    assert dlg.values == list(range(1, 7))
+    comp.stop()
+
+    rec = Recorder()
+    comp = makeCompiler(rec)
+    with pytest.raises(Exception):
+        comp.start(Dialog(3))
+    assert len(rec.protocols) == 0
+    assert len(comp._deviceCache) == 0
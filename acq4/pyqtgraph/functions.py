@@ -1425,6 +1425,10 @@ def downsample(data, n, axis=0, xvals='subsample'):
                 info[axis]['values'] = info[axis]['values'][::n][:nPts]
             elif xvals == 'downsample':
                 info[axis]['values'] = downsample(info[axis]['values'], n)
+        elif 'values_start' in info[axis]:
+            if xvals == 'downsample':
+                info[axis]['values_start'] += info[axis]['values_step'] * (n-1) * 0.5
+            info[axis]['values_step'] *= n
         return MetaArray(d2, info=info)
 
 
@@ -110,7 +110,9 @@ class PlotDataItem(GraphicsObject):
             autoDownsample   (bool) If True, resample the data before plotting to avoid plotting
                              multiple line segments per pixel. This can improve performance when
                              viewing very high-density data, but increases the initial overhead 
-                             and memory usage.
+                             and memory usage. With the 'peak' method, the min/max of each
+                             block of samples is precomputed at several block sizes (see
+                             PeakPyramid), so zooming and panning cost O(pixels).
             clipToView       (bool) If True, only plot data that is visible within the X range of
                              the containing ViewBox. This can improve performance when plotting
                              very large data sets where only a fraction of the data is visible
@@ -130,6 +132,7 @@ class PlotDataItem(GraphicsObject):
         self.yData = None
         self.xDisp = None
         self.yDisp = None
+        self._peaks = None  ## PeakPyramid for yData, built when first needed
         #self.dataMask = None
         #self.curves = []
         #self.scatters = []
@@ -453,6 +456,8 @@ class PlotDataItem(GraphicsObject):
         
         self.xData = x.view(np.ndarray)  ## one last check to make sure there are no MetaArrays getting by
         self.yData = y.view(np.ndarray)
+        self._xBuf = self._yBuf = None
+        self._peaks = None
         self.xClean = self.yClean = None
         self.xDisp = None
         self.yDisp = None
@@ -525,7 +530,7 @@ class PlotDataItem(GraphicsObject):
             if self.opts['autoDownsample']:
                 # this option presumes that x-values have uniform spacing
                 range = self.viewRect()
-                if range is not None:
+                if range is not None and len(x) > 1:
                     dx = float(x[-1]-x[0]) / (len(x)-1)
                     x0 = (range.left()-x[0]) / dx
                     x1 = (range.right()-x[0]) / dx
@@ -534,6 +539,7 @@ class PlotDataItem(GraphicsObject):
                         ds = int(max(1, int((x1-x0) / (width*self.opts['autoDownsampleFactor']))))
                     ## downsampling is expensive; delay until after clipping.
             
+            i0, i1 = 0, len(x)
             if self.opts['clipToView']:
                 view = self.getViewBox()
                 if view is None or not view.autoRangeEnabled()[0]:
@@ -542,12 +548,22 @@ class PlotDataItem(GraphicsObject):
                     if range is not None and len(x) > 1:
                         dx = float(x[-1]-x[0]) / (len(x)-1)
                         # clip to visible region extended by downsampling value
-                        x0 = np.clip(int((range.left()-x[0])/dx)-1*ds , 0, len(x)-1)
-                        x1 = np.clip(int((range.right()-x[0])/dx)+2*ds , 0, len(x)-1)
-                        x = x[x0:x1]
-                        y = y[x0:x1]
+                        i0 = np.clip(int((range.left()-x[0])/dx)-1*ds , 0, len(x)-1)
+                        i1 = np.clip(int((range.right()-x[0])/dx)+2*ds , 0, len(x)-1)
+            
+            usePeaks = (ds >= PeakPyramid.minBlock and self.opts['autoDownsample'] and 
+                        self.opts['downsampleMethod'] == 'peak' and x is self.xData)
+            if usePeaks:
+                ## min/max of blocks are precomputed for the raw data
+                if self._peaks is None:
+                    self._peaks = PeakPyramid()
+                self._peaks.update(y)
+                x, y = self._peaks.peaks(x, y, i0, i1, ds)
+            else:
+                x = x[i0:i1]
+                y = y[i0:i1]
                     
-            if ds > 1:
+            if ds > 1 and not usePeaks:
                 if self.opts['downsampleMethod'] == 'subsample':
                     x = x[::ds]
                     y = y[::ds]
@@ -627,11 +643,66 @@ class PlotDataItem(GraphicsObject):
         #self.yClean = None
         self.xDisp = None
         self.yDisp = None
+        self._xBuf = self._yBuf = None
+        self._peaks = None
         self.curve.setData([])
         self.scatter.setData([])
             
     def appendData(self, *args, **kargs):
-        pass
+        """
+        Add samples to the end of the data displayed by this item. Accepts *y*
+        or *x, y* as positional arguments or the keyword arguments x and y. If
+        no x values are given, they continue from the last two x values (or
+        0, 1, 2, ...). Existing data is not copied for each call; precomputed
+        downsampling is only extended by the new samples.
+        """
+        x = kargs.get('x', None)
+        y = kargs.get('y', None)
+        if len(args) == 1:
+            y = args[0]
+        elif len(args) == 2:
+            x, y = args
+        if y is None:
+            return
+        y = np.asarray(y).ravel()
+        if self.yData is None or len(self.yData) == 0:
+            if x is None:
+                x = np.arange(len(y))
+            self.setData(x=np.array(x), y=np.array(y))
+            return
+        
+        xData, yData = self.xData, self.yData
+        n = len(yData)
+        if x is None:
+            dx = float(xData[-1] - xData[-2]) if n > 1 else 1.0
+            x = xData[-1] + dx * np.arange(1, len(y)+1)
+        x = np.asarray(x).ravel()
+        if len(x) != len(y):
+            raise Exception("x and y arrays must have the same length (got %d and %d)" % (len(x), len(y)))
+        
+        ## grow storage geometrically so that repeated appends take amortized O(new samples);
+        ## storage is also replaced if the new samples need a wider dtype
+        xType = np.result_type(xData, x)
+        yType = np.result_type(yData, y)
+        if (self._yBuf is None or len(self._yBuf) < n + len(y) or
+                self._xBuf.dtype != xType or self._yBuf.dtype != yType):
+            size = max(2 * (n + len(y)), 1024)
+            self._xBuf = np.empty(size, dtype=xType)
+            self._yBuf = np.empty(size, dtype=yType)
+            self._xBuf[:n] = xData
+            self._yBuf[:n] = yData
+        if yType != yData.dtype:
+            ## precomputed peaks have the old dtype and would truncate new values
+            self._peaks = None
+        self._xBuf[n:n+len(y)] = x
+        self._yBuf[n:n+len(y)] = y
+        self.xData = self._xBuf[:n+len(y)]
+        self.yData = self._yBuf[:n+len(y)]
+        self.xDisp = self.yDisp = None
+        
+        self.updateItems()
+        self.informViewBoundsChanged()
+        self.sigPlotChanged.emit(self)
     
     def curveClicked(self):
         self.sigClicked.emit(self)
@@ -662,6 +733,97 @@ class PlotDataItem(GraphicsObject):
         y = np.abs(f)
         return x, y
     
+class PeakPyramid(object):
+    """
+    Precomputed min/max of blocks of samples, used by PlotDataItem to draw
+    'peak' downsampled curves.
+
+    Level k holds the minimum and maximum of consecutive blocks of
+    minBlock * 2**k samples. A curve downsampled by a factor *ds* is drawn from
+    the level with the block size nearest to ds, so the cost of each redraw is
+    proportional to the number of blocks visible rather than the number of
+    samples. When samples are appended to the data, only the new complete
+    blocks are computed (see update()).
+    """
+    minBlock = 4
+    
+    def __init__(self):
+        self.length = 0    ## number of samples that have been incorporated
+        self.levels = []   ## [mins, maxs, count] for each level; arrays have spare capacity
+    
+    def blockSize(self, level):
+        return self.minBlock << level
+    
+    def update(self, y):
+        """Incorporate any samples of *y* beyond those seen by the last call.
+        The samples already seen must not have changed."""
+        if len(y) < self.length:
+            self.__init__()
+        if len(y) == self.length:
+            return
+        self.length = len(y)
+        
+        ## level 0 is computed from the raw samples
+        src = None
+        level = 0
+        while True:
+            if level == len(self.levels):
+                self.levels.append([np.empty(0, dtype=y.dtype), np.empty(0, dtype=y.dtype), 0])
+            mins, maxs, count = self.levels[level]
+            if src is None:
+                nBlocks = len(y) // self.minBlock
+                if nBlocks > count:
+                    blocks = y[count*self.minBlock:nBlocks*self.minBlock].reshape(nBlocks-count, self.minBlock)
+                    newMin = blocks.min(axis=1)
+                    newMax = blocks.max(axis=1)
+            else:
+                srcMins, srcMaxs, srcCount = src
+                nBlocks = srcCount // 2
+                if nBlocks > count:
+                    newMin = srcMins[count*2:nBlocks*2].reshape(nBlocks-count, 2).min(axis=1)
+                    newMax = srcMaxs[count*2:nBlocks*2].reshape(nBlocks-count, 2).max(axis=1)
+            if nBlocks > count:
+                if len(mins) < nBlocks:
+                    size = max(2 * nBlocks, 64)
+                    mins = np.resize(mins, size)
+                    maxs = np.resize(maxs, size)
+                mins[count:nBlocks] = newMin
+                maxs[count:nBlocks] = newMax
+                self.levels[level] = [mins, maxs, nBlocks]
+            if nBlocks < 2:
+                break
+            src = self.levels[level]
+            level += 1
+    
+    def peaks(self, x, y, start, stop, ds):
+        """Return (x, y) for drawing samples *start* to *stop* of (x, y)
+        downsampled by approximately *ds*, as a saw wave following the max and
+        min of each block (the same format as the 'peak' downsampling method)."""
+        level = min(int(round(np.log2(ds / float(self.minBlock)))), len(self.levels) - 1)
+        while level > 0 and self.levels[level][2] == 0:
+            level -= 1
+        size = self.blockSize(level)
+        mins, maxs, count = self.levels[level]
+        b0 = start // size
+        b1 = min(-(-stop // size), count)
+        n = max(b1 - b0, 0)
+        
+        ## the last complete block is followed by fewer than *size* samples; add them as one more block
+        tail = y[max(b1*size, start):stop]
+        nTail = 1 if len(tail) > 0 else 0
+        
+        x1 = np.empty((n+nTail, 2))
+        x1[:n] = x[b0*size:b1*size:size, np.newaxis]
+        y1 = np.empty((n+nTail, 2))
+        y1[:n, 0] = maxs[b0:b1]
+        y1[:n, 1] = mins[b0:b1]
+        if nTail:
+            x1[n] = x[max(b1*size, start)]
+            y1[n, 0] = tail.max()
+            y1[n, 1] = tail.min()
+        return x1.reshape((n+nTail)*2), y1.reshape((n+nTail)*2)
+    
+
 def dataType(obj):
     if hasattr(obj, '__len__') and len(obj) == 0:
         return 'empty'
@@ -58,3 +58,52 @@ def test_clear():
 
     assert pdi.xData == None
     assert pdi.yData == None
+
+
+def test_peakPyramid():
+    from pyqtgraph.graphicsItems.PlotDataItem import PeakPyramid
+    y = np.random.normal(size=10007)
+    x = np.arange(len(y))
+    
+    # incremental updates must give the same result as a single update
+    p1 = PeakPyramid()
+    p1.update(y)
+    p2 = PeakPyramid()
+    for n in [3, 100, 1025, 4000, len(y)]:
+        p2.update(y[:n])
+    assert len(p1.levels) == len(p2.levels)
+    for l1, l2 in zip(p1.levels, p2.levels):
+        assert l1[2] == l2[2]
+        assert np.all(l1[0][:l1[2]] == l2[0][:l2[2]])
+        assert np.all(l1[1][:l1[2]] == l2[1][:l2[2]])
+    
+    # each block holds the max/min of its samples; the last partial block is included
+    xd, yd = p1.peaks(x, y, 0, len(y), 16)
+    assert np.all(xd[::2] == np.arange(0, len(y), 16))
+    assert np.all(yd[0::2] == [y[i:i+16].max() for i in range(0, len(y), 16)])
+    assert np.all(yd[1::2] == [y[i:i+16].min() for i in range(0, len(y), 16)])
+
+
+def test_appendData():
+    pdi = pg.PlotDataItem(np.arange(10))
+    pdi.appendData(np.arange(10, 15))
+    pdi.appendData(x=[15, 16], y=[15, 16])
+    x, y = pdi.getData()
+    assert np.all(x == np.arange(17))
+    assert np.all(y == np.arange(17))
+    
+    # appending values that need a wider dtype promotes the data and its peaks
+    pw = pg.PlotWidget()
+    pw.resize(200, 200)
+    pdi = pw.plot(np.zeros(4096, dtype=np.int16))
+    pw.show()
+    pg.QtGui.QApplication.processEvents()
+    pdi.setDownsampling(auto=True, method='peak')
+    pdi.getData()
+    assert pdi._peaks is not None
+    pdi.appendData(np.full(4096, 0.5))
+    assert pdi.yData.dtype.kind == 'f'
+    assert np.all(pdi.yData[4096:] == 0.5)
+    x, y = pdi.getData()
+    assert len(y) < len(pdi.yData)
+    assert y.max() == 0.5
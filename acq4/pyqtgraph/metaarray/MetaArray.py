@@ -10,9 +10,11 @@ new methods for slicing and indexing the array based on this meta data.
 More info at http://www.scipy.org/Cookbook/MetaArray
 """
 
-import types, copy, threading, os, re
+import types, copy, threading, os, re, time
 import pickle
 from functools import reduce
+from collections import OrderedDict
+from contextlib import contextmanager
 import numpy as np
 from ..python2_3 import basestring
 #import traceback
@@ -28,14 +30,23 @@ except:
     HAVE_HDF5 = False
 
 
-def axis(name=None, cols=None, values=None, units=None):
-    """Convenience function for generating axis descriptions when defining MetaArrays"""
+def axis(name=None, cols=None, values=None, units=None, start=None, step=None):
+    """Convenience function for generating axis descriptions when defining MetaArrays
+    
+    Evenly-spaced axis values may be given as *start* and *step* instead of *values*;
+    the values are then computed as needed rather than stored (see MetaArray.regularAxisInfo).
+    """
     ax = {}
     cNameOrder = ['name', 'units', 'title']
     if name is not None:
         ax['name'] = name
     if values is not None:
         ax['values'] = values
+    if start is not None or step is not None:
+        if start is None or step is None:
+            raise Exception("Regular axes require both start and step.")
+        ax['values_start'] = start
+        ax['values_step'] = step
     if units is not None:
         ax['units'] = units
     if cols is not None:
@@ -56,6 +67,266 @@ class sliceGenerator(object):
     def __getslice__(self, arg):
         return arg
 SLICER = sliceGenerator()
+
+
+class HDF5Cache(object):
+    """Per-process cache of open HDF5 file handles and decoded MetaArray meta info.
+    
+    Meta info is keyed by (file name, mtime, size) so that stale entries are never
+    returned after a file is rewritten; up to *maxMeta* decoded info structures are
+    kept (least recently used are discarded first).
+    
+    Keeping file handles open is optional and disabled by default (maxFiles=0),
+    because open handles prevent files from being moved or deleted on some
+    platforms. When enabled, up to *maxFiles* read-only handles are kept open.
+    """
+    def __init__(self, maxFiles=0, maxMeta=100):
+        self.maxFiles = maxFiles
+        self.maxMeta = maxMeta
+        self.lock = threading.RLock()
+        self._files = OrderedDict()   # fileName: [h5py.File, users]
+        self._meta = OrderedDict()    # (fileName, mtime, size): info
+        
+    def setMaxFiles(self, n):
+        with self.lock:
+            self.maxFiles = n
+            self._trimFiles()
+    
+    def setMaxMeta(self, n):
+        with self.lock:
+            self.maxMeta = n
+            while len(self._meta) > self.maxMeta:
+                self._meta.popitem(last=False)
+    
+    @contextmanager
+    def file(self, fileName):
+        """Context manager yielding a read-only h5py.File for *fileName*.
+        The handle is closed on exit unless the cache decides to keep it open."""
+        fileName = os.path.abspath(fileName)
+        with self.lock:
+            entry = self._files.pop(fileName, None)
+            if entry is None:
+                entry = [h5py.File(fileName, 'r'), 0]
+            self._files[fileName] = entry  ## (re)insert as most recently used
+            entry[1] += 1
+        try:
+            yield entry[0]
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                if self.maxFiles == 0 and entry[1] == 0:
+                    if self._files.get(fileName, None) is entry:
+                        del self._files[fileName]
+                    entry[0].close()
+                else:
+                    self._trimFiles()
+    
+    def _trimFiles(self):
+        ## close least-recently-used handles that are not currently in use
+        for fileName in list(self._files.keys()):
+            if len(self._files) <= self.maxFiles:
+                break
+            entry = self._files[fileName]
+            if entry[1] == 0:
+                del self._files[fileName]
+                entry[0].close()
+
+    def release(self, fileName):
+        """Close any cached handle for *fileName* (for example, before the file is
+        opened for writing)."""
+        fileName = os.path.abspath(fileName)
+        with self.lock:
+            entry = self._files.get(fileName, None)
+            if entry is not None and entry[1] == 0:
+                del self._files[fileName]
+                entry[0].close()
+
+    def readMeta(self, fileName, root):
+        """Return a copy of the decoded meta info in *root* (the 'info' group of
+        the open file *fileName*), using the cached version if it is current."""
+        st = os.stat(fileName)
+        key = (os.path.abspath(fileName), st.st_mtime, st.st_size)
+        with self.lock:
+            meta = self._meta.pop(key, None)
+        if meta is None:
+            meta = MetaArray.readHDF5Meta(root)
+        if self.maxMeta > 0:
+            with self.lock:
+                self._meta[key] = meta
+                while len(self._meta) > self.maxMeta:
+                    self._meta.popitem(last=False)
+        return copy.deepcopy(meta)
+
+hdf5Cache = HDF5Cache()
+
+
+class LazyHDF5Data(object):
+    """Read-only, array-like view of an HDF5 dataset that reads data only when indexed.
+    
+    Indexes are translated into the smallest hyperslab selections that HDF5 supports
+    (contiguous ranges, strided slices, and at most one increasing index list); anything
+    HDF5 can not select directly (masks, unsorted lists, reversed slices) is read as the
+    covering range and finished in memory. The file is opened through *hdf5Cache* for
+    each read, so this object holds no file handle of its own and can be pickled.
+    
+    The modification time and size of the file are recorded when this object is
+    created; reads raise IOError if the file has since been changed or removed,
+    rather than returning data from a different file.
+    """
+    def __init__(self, fileName, dsName, shape, dtype):
+        self.fileName = os.path.abspath(fileName)
+        self.dsName = dsName
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.fileStat = self._stat()
+        
+    def _stat(self):
+        st = os.stat(self.fileName)
+        return (st.st_mtime, st.st_size)
+        
+    @property
+    def ndim(self):
+        return len(self.shape)
+    
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+        
+    def __len__(self):
+        return self.shape[0]
+    
+    def __array__(self, dtype=None):
+        data = self[()]
+        if dtype is not None:
+            data = data.astype(dtype)
+        return data
+    
+    def __getitem__(self, ind):
+        if not isinstance(ind, tuple):
+            ind = (ind,)
+        if len(ind) == 0:
+            ind = (slice(None),) * self.ndim
+        if any(i is Ellipsis or i is None for i in ind) or len(ind) > self.ndim:
+            return self[()][ind]
+        ind = ind + (slice(None),) * (self.ndim - len(ind))
+        
+        ## normalize indexes; collect the positions of integer and array (advanced) indexes
+        norm = []
+        ints = []
+        arrays = []
+        for ax, i in enumerate(ind):
+            n = self.shape[ax]
+            if isinstance(i, (int, np.integer)):
+                i = int(i)
+                if i < 0:
+                    i += n
+                if i < 0 or i >= n:
+                    raise IndexError("index %d is out of bounds for axis %d with size %d" % (ind[ax], ax, n))
+                ints.append(ax)
+            elif isinstance(i, slice):
+                i = slice(*i.indices(n))
+            else:
+                i = np.asarray(i)
+                if i.dtype == bool:
+                    if i.shape != (n,):
+                        raise IndexError("boolean index for axis %d has shape %s; expected (%d,)" % (ax, i.shape, n))
+                    i = np.nonzero(i)[0]
+                elif i.ndim != 1:
+                    return self[()][ind]
+                else:
+                    i = i.astype(int)
+                    i[i < 0] += n
+                    if len(i) > 0 and (i.min() < 0 or i.max() >= n):
+                        raise IndexError("index out of bounds for axis %d with size %d" % (ax, n))
+                arrays.append(ax)
+            norm.append(i)
+        
+        ## With at most one index array, and no integer index separated from it by a slice,
+        ## numpy's indexing rules give the same result as HDF5's per-axis (outer) selection.
+        adv = sorted(ints + arrays)
+        if len(arrays) > 1 or (len(arrays) == 1 and adv[-1] - adv[0] != len(adv) - 1):
+            return self._readHull(norm)
+        
+        h5sel = []      ## selection passed to h5py
+        post = []       ## per remaining axis: index to apply in memory afterward (or None)
+        shape = []      ## shape of the final result
+        for i in norm:
+            if isinstance(i, int):
+                h5sel.append(i)
+                continue
+            if isinstance(i, slice):
+                if i.step > 0:
+                    sel = slice(i.start, max(i.start, i.stop), i.step)
+                    h5sel.append(sel)
+                    post.append(None)
+                    shape.append(len(range(sel.start, sel.stop, sel.step)))
+                    continue
+                i = np.arange(i.start, i.stop, i.step)
+            shape.append(len(i))
+            if len(i) == 0:
+                h5sel.append(slice(0, 0))
+                post.append(None)
+            elif np.all(np.diff(i) == 1):
+                h5sel.append(slice(int(i[0]), int(i[-1]) + 1))
+                post.append(None)
+            elif np.all(np.diff(i) > 0):
+                h5sel.append(i)
+                post.append(None)
+            else:
+                lo = int(i.min())
+                h5sel.append(slice(lo, int(i.max()) + 1))
+                post.append(i - lo)
+        
+        if 0 in shape:
+            return np.empty(shape, dtype=self.dtype)
+        
+        data = self._read(tuple(h5sel))
+        for ax, p in enumerate(post):
+            if p is not None:
+                data = np.take(data, p, axis=ax)
+        return data
+    
+    def _readHull(self, norm):
+        ## Read the box covering all requested elements, then apply numpy indexing in memory.
+        h5sel = []
+        memsel = []
+        for i in norm:
+            if isinstance(i, int):
+                h5sel.append(slice(i, i+1))
+                memsel.append(0)
+            elif isinstance(i, slice) and i.step > 0:
+                h5sel.append(i)
+                memsel.append(slice(None))
+            elif isinstance(i, slice):
+                idx = np.arange(i.start, i.stop, i.step)
+                if len(idx) == 0:
+                    h5sel.append(slice(0, 0))
+                    memsel.append(slice(None))
+                else:
+                    h5sel.append(slice(idx[-1], idx[0] + 1))
+                    memsel.append(slice(idx[0] - idx[-1], None, i.step))
+            elif len(i) == 0:
+                h5sel.append(slice(0, 0))
+                memsel.append(i)
+            else:
+                lo = int(i.min())
+                h5sel.append(slice(lo, int(i.max()) + 1))
+                memsel.append(i - lo)
+        if any(s.stop <= s.start for s in h5sel):
+            data = np.empty([len(range(s.start, s.stop, s.step or 1)) for s in h5sel], dtype=self.dtype)
+        else:
+            data = self._read(tuple(h5sel))
+        return data[tuple(memsel)]
+    
+    def _read(self, sel):
+        try:
+            stat = self._stat()
+        except OSError:
+            stat = None
+        if stat != self.fileStat:
+            raise IOError("File %s has been modified or removed since it was opened; read it again to access its data." % self.fileName)
+        with hdf5Cache.file(self.fileName) as f:
+            return f[self.dsName][sel]
     
 
 class MetaArray(object):
@@ -113,6 +384,16 @@ class MetaArray(object):
     # May also be a tuple (filter, opts), such as ('gzip', 3)
     defaultCompression = None
     
+    # HDF5 files at least this large (in bytes) are read lazily by default: only
+    # meta info is read when the file is opened, and data is read from disk as it
+    # is indexed. Smaller files are read entirely into memory. Each lazy read
+    # reopens the file (unless hdf5Cache keeps handles open), so element-by-element
+    # access to lazy data is slow.
+    lazyHDF5Threshold = 500e6
+    
+    # If True, HDF5 files of all sizes are read lazily by default.
+    lazyHDF5 = False
+    
     ## Types allowed as axis or column names
     nameTypes = [basestring, tuple]
     @staticmethod
@@ -169,6 +450,11 @@ class MetaArray(object):
                         info[i] = {}
                     else:
                         raise Exception("Axis specification must be Dict or None")
+                if i < self.ndim and ('values_start' in info[i] or 'values_step' in info[i]):
+                    if 'values_start' not in info[i] or 'values_step' not in info[i]:
+                        raise Exception("Regular axis %d must specify both values_start and values_step" % i)
+                    if 'values' in info[i]:
+                        raise Exception("Axis %d may specify either values or values_start/values_step, but not both" % i)
                 if i < self.ndim and 'values' in info[i]:
                     if type(info[i]['values']) is list:
                         info[i]['values'] = np.array(info[i]['values'])
@@ -223,7 +509,7 @@ class MetaArray(object):
         nInd = self._interpretIndexes(ind)
         
         #a = np.ndarray.__getitem__(self, nInd)
-        a = self._data[nInd]
+        a = self._data[nInd]  ## for lazy HDF5 data, this reads only the selected region
         if len(nInd) == self.ndim:
             if np.all([not isinstance(ind, slice) for ind in nInd]):  ## no slices; we have requested a single value from the array
                 return a
@@ -303,6 +589,9 @@ class MetaArray(object):
   
     def __setitem__(self, ind, val):
         nInd = self._interpretIndexes(ind)
+        if isinstance(self._data, LazyHDF5Data):
+            ## lazy data is read-only; load it into memory first (the file is not modified)
+            self.asarray()
         try:
             self._data[nInd] = val
         except:
@@ -311,7 +600,7 @@ class MetaArray(object):
         
     def __getattr__(self, attr):
         if attr in self.wrapMethods:
-            return getattr(self._data, attr)
+            return getattr(self.asarray(), attr)
         else:
             raise AttributeError(attr)
             #return lambda *args, **kwargs: MetaArray(getattr(a.view(ndarray), attr)(*args, **kwargs)
@@ -355,6 +644,10 @@ class MetaArray(object):
     def asarray(self):
         if isinstance(self._data, np.ndarray):
             return self._data
+        elif isinstance(self._data, LazyHDF5Data):
+            ## the whole array was requested; keep it so we don't go back to disk next time
+            self._data = self._data[()]
+            return self._data
         else:
             return np.array(self._data)
             
@@ -372,8 +665,11 @@ class MetaArray(object):
     def axisValues(self, axis):
         """Return the list of values for an axis"""
         ax = self._interpretAxis(axis)
-        if 'values' in self._info[ax]:
-            return self._info[ax]['values']
+        info = self._info[ax]
+        if 'values' in info:
+            return info['values']
+        elif 'values_start' in info:
+            return info['values_start'] + info['values_step'] * np.arange(self.shape[ax])
         else:
             raise Exception('Array axis %s (%d) has no associated values.' % (str(axis), ax))
   
@@ -383,7 +679,15 @@ class MetaArray(object):
         
     def axisHasValues(self, axis):
         ax = self._interpretAxis(axis)
-        return 'values' in self._info[ax]
+        return 'values' in self._info[ax] or 'values_start' in self._info[ax]
+    
+    def regularAxisInfo(self, axis):
+        """Return (start, step) if the values of *axis* are stored implicitly as
+        start + step * index, otherwise None."""
+        ax = self._info[self._interpretAxis(axis)]
+        if 'values_start' in ax:
+            return ax['values_start'], ax['values_step']
+        return None
         
     def axisHasColumns(self, axis):
         ax = self._interpretAxis(axis)
@@ -479,7 +783,22 @@ class MetaArray(object):
             return copy.deepcopy(self._info[self._interpretAxis(axis)])
   
     def copy(self):
-        return MetaArray(self._data.copy(), info=self.infoCopy())
+        return MetaArray(self.asarray().copy(), info=self.infoCopy())
+
+    def isLazy(self):
+        """Return True if the array data has not yet been read from disk
+        (see readFile)."""
+        return isinstance(self._data, LazyHDF5Data)
+
+    def close(self):
+        """Close any HDF5 file held open by this array.
+        Lazily-read arrays remain usable; they reopen the file as needed."""
+        f = getattr(self, '_openFile', None)
+        if f is not None:
+            f.close()
+            self._openFile = None
+        if isinstance(self._data, LazyHDF5Data):
+            hdf5Cache.release(self._data.fileName)
   
   
     def _interpretIndexes(self, ind):
@@ -541,16 +860,20 @@ class MetaArray(object):
                     index = self._getIndex(axis, ind.stop)
                     
                 ## x[Axis:min:max]
-                elif (isinstance(ind.stop, float) or isinstance(ind.step, float)) and ('values' in self._info[axis]):
+                elif (isinstance(ind.stop, float) or isinstance(ind.step, float)) and self.axisHasValues(axis):
                     #print "    axis value range"
-                    if ind.stop is None:
-                        mask = self.xvals(axis) < ind.step
-                    elif ind.step is None:
-                        mask = self.xvals(axis) >= ind.stop
+                    if 'values_start' in self._info[axis] and self._info[axis]['values_step'] > 0:
+                        ## compute the range directly rather than comparing against every value
+                        index = self._regularRange(axis, ind.stop, ind.step)
                     else:
-                        mask = (self.xvals(axis) >= ind.stop) * (self.xvals(axis) < ind.step)
-                    ##print "mask:", mask
-                    index = mask
+                        if ind.stop is None:
+                            mask = self.xvals(axis) < ind.step
+                        elif ind.step is None:
+                            mask = self.xvals(axis) >= ind.stop
+                        else:
+                            mask = (self.xvals(axis) >= ind.stop) * (self.xvals(axis) < ind.step)
+                        ##print "mask:", mask
+                        index = mask
                     
                 ## x[Axis:columnIndex]
                 elif isinstance(ind.stop, int) or isinstance(ind.step, int):
@@ -594,6 +917,27 @@ class MetaArray(object):
             #print "  normal numerical index"
             return (pos, ind, False)
   
+    def _regularRange(self, axis, minVal, maxVal):
+        ## return the slice of a regular axis whose values satisfy minVal <= x < maxVal
+        ## (the same elements that a comparison against xvals() would select)
+        start = self._info[axis]['values_start']
+        step = self._info[axis]['values_step']
+        n = self.shape[axis]
+        def first(v):
+            ## index of the first value >= v
+            if v is None:
+                return 0
+            i = int(np.clip(np.ceil((v - start) / step), 0, n))
+            ## correct for rounding error
+            while i > 0 and start + step * (i-1) >= v:
+                i -= 1
+            while i < n and start + step * i < v:
+                i += 1
+            return i
+        i0 = first(minVal)
+        i1 = n if maxVal is None else max(i0, first(maxVal))
+        return slice(i0, i1)
+  
     def _getAxis(self, name):
         for i in range(0, len(self._info)):
             axis = self._info[i]
@@ -614,7 +958,7 @@ class MetaArray(object):
   
     def _axisSlice(self, i, cols):
         #print "axisSlice", i, cols
-        if 'cols' in self._info[i] or 'values' in self._info[i]:
+        if 'cols' in self._info[i] or 'values' in self._info[i] or 'values_start' in self._info[i]:
             ax = self._axisCopy(i)
             if 'cols' in ax:
                 #print "  slicing columns..", array(ax['cols']), cols
@@ -625,6 +969,16 @@ class MetaArray(object):
                 #print "  result:", ax['cols']
             if 'values' in ax:
                 ax['values'] = np.array(ax['values'])[cols]
+            if 'values_start' in ax:
+                start = ax.pop('values_start')
+                step = ax.pop('values_step')
+                if isinstance(cols, slice):
+                    ## a slice of a regular axis is still regular
+                    first, stop, stride = cols.indices(self.shape[i])
+                    ax['values_start'] = start + step * first
+                    ax['values_step'] = step * stride
+                else:
+                    ax['values'] = (start + step * np.arange(self.shape[i]))[cols]
         else:
             ax = self._info[i]
         #print "     ", ax
@@ -651,12 +1005,16 @@ class MetaArray(object):
             ax = self._info[i]
             axs = titles[i]
             axs += '%s[%d] :' % (' ' * (maxl - len(axs) + 5 - len(str(self.shape[i]))), self.shape[i])
-            if 'values' in ax:
+            if 'values' in ax or 'values_start' in ax:
                 if self.shape[i] > 0:
-                    v0 = ax['values'][0]
+                    if 'values' in ax:
+                        v0 = ax['values'][0]
+                        v1 = ax['values'][-1]
+                    else:
+                        v0 = ax['values_start']
+                        v1 = v0 + ax['values_step'] * (self.shape[i] - 1)
                     axs += "  values: [%g" % (v0)
                     if self.shape[i] > 1:
-                        v1 = ax['values'][-1]
                         axs += " ... %g] (step %g)" % (v1, (v1 - v0) / (self.shape[i] - 1))
                     else:
                         axs += "]"
@@ -685,7 +1043,7 @@ class MetaArray(object):
 
     def axisCollapsingFn(self, fn, axis=None, *args, **kargs):
         #arr = self.view(np.ndarray)
-        fn = getattr(self._data, fn)
+        fn = getattr(self.asarray(), fn)
         if axis is None:
             return fn(axis, *args, **kargs)
         else:
@@ -716,10 +1074,7 @@ class MetaArray(object):
         order = order + list(range(len(order), self.ndim))
         
         try:
-            if self._isHDF:
-                return MetaArray(np.array(self._data).transpose(order), info=info)
-            else:
-                return MetaArray(self._data.transpose(order), info=info)
+            return MetaArray(self.asarray().transpose(order), info=info)
         except:
             print(order)
             raise
@@ -732,16 +1087,17 @@ class MetaArray(object):
         
             *writable* (bool) if True, then any modifications to data in the array will be stored to disk.
             *readAllData* (bool) if True, then all data in the array is immediately read from disk
-                          and the file is closed (this is the default for files < 500MB). Otherwise, the file will
-                          be left open and data will be read only as requested (this is 
-                          the default for files >= 500MB).
+                          and the file is closed. Otherwise, only the meta info is read and data
+                          is read from disk as it is indexed; for example ``data['Channel': 'primary']``
+                          reads just one column. By default, only files larger than
+                          MetaArray.lazyHDF5Threshold are read lazily (see MetaArray.lazyHDF5).
         
         
         """
         ## decide which read function to use
         with open(filename, 'rb') as fd:
             magic = fd.read(8)
-            if magic == '\x89HDF\r\n\x1a\n':
+            if magic == b'\x89HDF\r\n\x1a\n':
                 fd.close()
                 self._readHDF5(filename, **kwargs)
                 self._isHDF = True
@@ -923,29 +1279,36 @@ class MetaArray(object):
             except:
                 raise Exception("The file '%s' is HDF5-formatted, but the HDF5 library (h5py) was not found." % fileName)
         
-        ## by default, readAllData=True for files < 500MB
         if readAllData is None:
-            size = os.stat(fileName).st_size
-            readAllData = (size < 500e6)
+            if MetaArray.lazyHDF5:
+                readAllData = False
+            else:
+                size = os.stat(fileName).st_size
+                readAllData = (size < MetaArray.lazyHDF5Threshold)
         
         if writable is True:
-            mode = 'r+'
-        else:
-            mode = 'r'
-        f = h5py.File(fileName, mode)
+            hdf5Cache.release(fileName)
+            f = h5py.File(fileName, 'r+')
+            self._checkHDF5Version(f, fileName)
+            self._info = MetaArray.readHDF5Meta(f['info'])
+            self._data = f['data']
+            self._openFile = f
+            return
         
+        with hdf5Cache.file(fileName) as f:
+            self._checkHDF5Version(f, fileName)
+            self._info = hdf5Cache.readMeta(fileName, f['info'])
+            data = f['data']
+            if readAllData:  ## read all data, convert to ndarray
+                self._data = data[()]
+            else:
+                self._data = LazyHDF5Data(fileName, 'data', data.shape, data.dtype)
+            
+    @staticmethod
+    def _checkHDF5Version(f, fileName):
         ver = f.attrs['MetaArray']
         if ver > MetaArray.version:
-            print("Warning: This file was written with MetaArray version %s, but you are using version %s. (Will attempt to read anyway)" % (str(ver), str(MetaArray.version)))
-        meta = MetaArray.readHDF5Meta(f['info'])
-        self._info = meta
-        
-        if writable or not readAllData:  ## read all data, convert to ndarray, close file
-            self._data = f['data']
-            self._openFile = f
-        else:
-            self._data = f['data'][:]
-            f.close()
+            print("Warning: This file (%s) was written with MetaArray version %s, but you are using version %s. (Will attempt to read anyway)" % (fileName, str(ver), str(MetaArray.version)))
             
     def _readHDF5Remote(self, fileName):
         ## Used to read HDF5 files via remote process.
@@ -989,13 +1352,9 @@ class MetaArray(object):
         data = {}
         
         ## Pull list of values from attributes and child objects
-        for k in root.attrs:
-            val = root.attrs[k]
+        for k, val in root.attrs.items():
             if isinstance(val, basestring):  ## strings need to be re-evaluated to their original types
-                try:
-                    val = eval(val)
-                except:
-                    raise Exception('Can not evaluate string: "%s"' % val)
+                val = MetaArray._evalHDF5Attr(val)
             data[k] = val
         for k in root:
             obj = root[k]
@@ -1026,6 +1385,21 @@ class MetaArray(object):
             raise Exception("Don't understand metaType '%s'" % typ)
         
 
+    ## repr() strings that are common in meta info and can be decoded without eval()
+    _simpleAttrs = {'None': None, 'True': True, 'False': False}
+    _simpleStringRe = re.compile(r"^'[^'\\]*'$")
+    
+    @staticmethod
+    def _evalHDF5Attr(val):
+        if val in MetaArray._simpleAttrs:
+            return MetaArray._simpleAttrs[val]
+        if MetaArray._simpleStringRe.match(val) is not None:
+            return val[1:-1]
+        try:
+            return eval(val)
+        except:
+            raise Exception('Can not evaluate string: "%s"' % val)
+
     def write(self, fileName, **opts):
         """Write this object to a file. The object can be restored by calling MetaArray(file=fileName)
         opts:
@@ -1043,6 +1417,7 @@ class MetaArray(object):
     def writeMeta(self, fileName):
         """Used to re-write meta info to the given file.
         This feature is only available for HDF5 files."""
+        hdf5Cache.release(fileName)
         f = h5py.File(fileName, 'r+')
         if f.attrs['MetaArray'] != MetaArray.version:
             raise Exception("The file %s was created with a different version of MetaArray. Will not modify." % fileName)
@@ -1109,6 +1484,7 @@ class MetaArray(object):
         else:
             dsOpts['maxshape'] = None
             
+        hdf5Cache.release(fileName)
         if append:
             f = h5py.File(fileName, 'r+')
             if f.attrs['MetaArray'] != MetaArray.version:
@@ -1123,8 +1499,8 @@ class MetaArray(object):
             sl[ax] = slice(-self.shape[ax], None)
             data[tuple(sl)] = self.view(np.ndarray)
             
-            ## add axis values if they are present.
-            axKeys = ["values"]
+            ## add axis values if they are present. (regular axes have no values to append)
+            axKeys = ["values"] if 'values_start' not in self._info[ax] else []
             axKeys.extend(opts.get("appendKeys", []))
             axInfo = f['info'][str(ax)]
             for key in axKeys:
@@ -1345,6 +1721,130 @@ class MetaArray(object):
 
   
   
+class HDF5Appender(object):
+    """Appends blocks of data along one axis of an HDF5 MetaArray file, in batches.
+
+    MetaArray.write(appendAxis=...) opens and closes the file for every block,
+    which dominates the cost of recording many small blocks. An HDF5Appender
+    collects blocks in memory and writes them together: the file is opened, its
+    datasets are resized once for the whole batch, and it is closed again. A
+    batch is written when a block is appended at least *flushInterval* seconds
+    after the previous batch, and by flush(), read() and close(). If the file
+    does not exist yet, it is created from the first block (see chunkShape());
+    otherwise it must have been written by MetaArray with the same *appendAxis*.
+
+    The file is only open while a batch is written. A crash can then lose the
+    blocks that are still in memory (at most *flushInterval* seconds of data,
+    or until the next append), but not the data already in the file, and other
+    readers (such as the DataManager) are not locked out of the file during a
+    long recording. Keeping the file open in 'r+' mode would save reopening it
+    for each batch, but a crash could leave the whole file unreadable, and
+    HDF5 file locking would block readers until the recording stops.
+    """
+    def __init__(self, fileName, appendAxis, flushInterval=1.0):
+        if not HAVE_HDF5:
+            raise Exception("HDF5Appender requires the HDF5 library (h5py).")
+        self.fileName = fileName
+        self.appendAxis = appendAxis
+        self.flushInterval = flushInterval
+        self.lock = threading.Lock()
+        self._pending = []    ## blocks not yet written to the file
+        self._axis = None
+        self._length = None   ## length of the file along the append axis
+        self._lastFlush = 0.0   ## the first block for an existing file is written immediately
+
+    @staticmethod
+    def chunkShape(ma, appendAxis, chunkBytes=65536):
+        """Return a chunk shape for appending blocks like *ma* along *appendAxis*.
+        Chunks span enough blocks to hold at least *chunkBytes*, so that
+        appending short rows (for example, a few statistics per trial) does not
+        produce one tiny chunk per row."""
+        ax = ma._interpretAxis(appendAxis)
+        cs = [min(100000, x) for x in ma.shape]
+        cs[ax] = 1
+        rowBytes = ma.dtype.itemsize * int(np.prod(cs))
+        cs[ax] = max(1, chunkBytes // max(1, rowBytes))
+        return tuple(cs)
+
+    def append(self, ma):
+        """Append the MetaArray *ma* to the file (see flushInterval)."""
+        with self.lock:
+            if self._axis is None:
+                self._axis = ma._interpretAxis(self.appendAxis)
+                if not os.path.exists(self.fileName):
+                    ma.writeHDF5(self.fileName, appendAxis=self.appendAxis,
+                                 chunks=self.chunkShape(ma, self.appendAxis))
+                    self._length = ma.shape[self._axis]
+                    self._lastFlush = time.time()
+                    return
+            self._pending.append(ma)
+            if time.time() - self._lastFlush > self.flushInterval:
+                self._writePending()
+
+    def _writePending(self):
+        ## write all pending blocks with one resize per dataset; lock must be held
+        self._lastFlush = time.time()
+        if len(self._pending) == 0:
+            return
+        ax = self._axis
+        hdf5Cache.release(self.fileName)
+        f = h5py.File(self.fileName, 'r+')
+        try:
+            MetaArray._checkHDF5Version(f, self.fileName)
+            data = f['data']
+            shape = list(data.shape)
+            start = shape[ax]
+            shape[ax] += sum([ma.shape[ax] for ma in self._pending])
+            data.resize(tuple(shape))
+            sl = [slice(None)] * len(shape)
+            for ma in self._pending:
+                n = ma.shape[ax]
+                sl[ax] = slice(start, start + n)
+                data[tuple(sl)] = ma.view(np.ndarray)
+                start += n
+
+            ## regular axes have no values to append
+            if 'values' in self._pending[0]._info[ax]:
+                vals = f['info'][str(ax)]['values']
+                v2 = np.concatenate([np.asarray(ma._info[ax]['values']) for ma in self._pending])
+                vals.resize((vals.shape[0] + v2.shape[0],) + vals.shape[1:])
+                vals[-v2.shape[0]:] = v2
+            self._length = shape[ax]
+        finally:
+            f.close()
+        self._pending = []
+
+    def length(self):
+        """Return the length of the file along the append axis, including blocks
+        that have not been written yet, or None if nothing has been appended."""
+        with self.lock:
+            if self._axis is None:
+                return None
+            return self._length + sum([ma.shape[self._axis] for ma in self._pending])
+
+    def read(self, ind):
+        """Flush and read back element *ind* along the append axis."""
+        self.flush()
+        with self.lock:
+            ax = self._axis
+        if ax is None:
+            raise IndexError("No data has been written to %s" % self.fileName)
+        return MetaArray(file=self.fileName, readAllData=False)[(slice(None),) * ax + (ind,)]
+
+    def flush(self):
+        """Write any blocks that are still in memory to the file."""
+        with self.lock:
+            if self._axis is not None:
+                self._writePending()
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self._axis = None
+            self._length = None
+            self._lastFlush = 0.0
+
+
 if __name__ == '__main__':
     ## Create an array with every option possible
     
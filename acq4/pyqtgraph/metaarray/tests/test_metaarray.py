@@ -0,0 +1,148 @@
+import os, tempfile, itertools
+import pytest
+import numpy as np
+from acq4.pyqtgraph.metaarray import MetaArray, axis, HAVE_HDF5, hdf5Cache, HDF5Appender
+
+
+def makeArray():
+    data = np.random.normal(size=(3, 200, 4))
+    info = [
+        axis('Channel', cols=[('primary', 'A'), ('secondary', 'V'), ('command', 'V')]),
+        axis('Time', values=np.linspace(0, 1, 200), units='s'),
+        axis('Z'),
+        {'note': 'test', 'quote': "it's", 'none': None},
+    ]
+    return MetaArray(data, info=info)
+
+
+@pytest.mark.skipif(not HAVE_HDF5, reason="h5py is not available")
+def test_lazy_hdf5():
+    ma = makeArray()
+    fn = tempfile.mktemp(suffix='.ma')
+    ma.write(fn)
+    try:
+        # small files are read into memory unless lazy reading is requested
+        assert not MetaArray(file=fn).isLazy()
+        lazy = MetaArray(file=fn, readAllData=False)
+        assert lazy.isLazy()
+        assert lazy._info[-1] == ma._info[-1]
+
+        # named / column / value-range indexing reads only the requested region
+        sub = lazy['Channel': 'primary', 'Time': 0.2:0.4]
+        assert np.all(sub == ma['Channel': 'primary', 'Time': 0.2:0.4])
+        col = lazy['Channel': 'secondary']
+        assert not col.isLazy()
+        assert np.all(col.xvals('Time') == ma.xvals('Time'))
+        assert lazy.isLazy()
+
+        # every combination of index types must match numpy's result
+        opts = [slice(None), 1, -1, [2, 0], [0, 2], slice(None, None, -1), slice(150, 10, -7),
+                slice(3, 3), [], slice(1, None, 2)]
+        for ind in itertools.product(opts, repeat=3):
+            try:
+                expect = ma.asarray()[ind]
+            except IndexError:
+                continue
+            got = lazy._data[ind]
+            assert got.shape == expect.shape
+            assert np.all(got == expect)
+
+        # full-array operations load the data
+        assert np.all(lazy == ma)
+        assert not lazy.isLazy()
+
+        # cached file handles are released before the file is rewritten,
+        # and lazy arrays refuse to read from a file that has changed
+        hdf5Cache.setMaxFiles(4)
+        lazy = MetaArray(file=fn, readAllData=False)
+        lazy['Channel': 0]
+        ma2 = makeArray()
+        ma2.write(fn)
+        with pytest.raises(IOError):
+            lazy['Channel': 0]
+        lazy.close()
+        lazy = MetaArray(file=fn, readAllData=False)
+        assert np.all(lazy['Channel': 0] == ma2['Channel': 0])
+        lazy.close()
+    finally:
+        hdf5Cache.setMaxFiles(0)
+        os.remove(fn)
+
+
+def test_regular_axis():
+    data = np.random.normal(size=(2, 1000))
+    explicit = MetaArray(data, info=[axis('Channel', cols=['a', 'b']), axis('Time', values=np.arange(1000) * 1e-4)])
+    regular = MetaArray(data, info=[axis('Channel', cols=['a', 'b']), axis('Time', start=0.0, step=1e-4)])
+    assert regular.axisHasValues('Time')
+    assert regular.regularAxisInfo('Time') == (0.0, 1e-4)
+    assert np.all(regular.xvals('Time') == explicit.xvals('Time'))
+
+    # value-range indexing selects the same samples as a comparison against xvals
+    for t0, t1 in [(0.01, 0.02), (0.0123, 0.05), (None, 0.03), (0.03, None), (-1.0, 5.0), (0.2, 0.1)]:
+        sub = regular['Time': t0:t1]
+        expect = explicit['Time': t0:t1]
+        assert sub.shape == expect.shape
+        assert np.allclose(sub.xvals('Time'), expect.xvals('Time'), rtol=0, atol=1e-12)
+
+    # slices stay regular; other indexes produce explicit values
+    sub = regular[:, 100:900:4]
+    assert sub.regularAxisInfo('Time') is not None
+    assert np.allclose(sub.xvals('Time'), explicit[:, 100:900:4].xvals('Time'))
+    sub = regular[:, [3, 1, 2]]
+    assert sub.regularAxisInfo('Time') is None
+    assert np.all(sub.xvals('Time') == explicit.xvals('Time')[[3, 1, 2]])
+
+    if HAVE_HDF5:
+        fn = tempfile.mktemp(suffix='.ma')
+        try:
+            regular.write(fn)
+            loaded = MetaArray(file=fn)
+            assert loaded.regularAxisInfo('Time') == (0.0, 1e-4)
+            assert np.all(loaded.xvals('Time') == explicit.xvals('Time'))
+        finally:
+            os.remove(fn)
+
+
+@pytest.mark.skipif(not HAVE_HDF5, reason="h5py is not available")
+def test_hdf5_appender():
+    fn = tempfile.mktemp(suffix='.ma')
+    rows = [MetaArray(np.random.normal(size=(1, 4)), info=[axis('Trial', values=[float(i)], units='s'), axis('Metric')])
+            for i in range(20)]
+    try:
+        app = HDF5Appender(fn, 'Trial')
+        for row in rows[:10]:
+            app.append(row)
+        assert app.length() == 10
+        assert np.all(app.read(3) == rows[3][0])
+        app.close()
+
+        # reopening an existing file appends to it; blocks are written in batches,
+        # and the file is not held open between batches
+        app = HDF5Appender(fn, 'Trial', flushInterval=1e6)
+        for row in rows[10:]:
+            app.append(row)
+        assert app.length() == 20
+        assert MetaArray(file=fn, readAllData=True).shape == (11, 4)
+        app.close()
+
+        loaded = MetaArray(file=fn, readAllData=True)
+        assert loaded.shape == (20, 4)
+        assert np.all(loaded.asarray() == np.concatenate([r.asarray() for r in rows]))
+        assert np.all(loaded.xvals('Trial') == np.arange(20))
+    finally:
+        os.remove(fn)
+
+
+def test_downsample_regular_axis():
+    import acq4.pyqtgraph.functions as fn
+    from acq4.pyqtgraph.flowchart.library import functions as fcfn
+    data = MetaArray(np.arange(1000.), info=[axis('Time', start=0., step=1e-3)])
+    explicit = MetaArray(np.arange(1000.), info=[axis('Time', values=np.arange(1000) * 1e-3)])
+    for downsample in (fn.downsample, fcfn.downsample):
+        for xvals in ('subsample', 'downsample'):
+            ds = downsample(data, 10, xvals=xvals)
+            expect = downsample(explicit, 10, xvals=xvals)
+            assert ds.regularAxisInfo('Time') is not None
+            assert ds.shape == (100,)
+            assert np.allclose(ds.xvals('Time'), expect.xvals('Time'))
+        assert np.isclose(downsample(data, 10).xvals('Time')[-1], 0.99)
@@ -166,6 +166,7 @@ class Process(RemoteEventHandler):
                     raise Exception('Timed out waiting for remote process to end.')
                 time.sleep(0.05)
         self.conn.close()
+        self.shm.cleanup()
         self.debugMsg('Child process exited. (%d)' % self.proc.returncode)
 
     def debugMsg(self, msg, *args):
@@ -343,6 +344,7 @@ class ForkedProcess(RemoteEventHandler):
             pass
         
         self.conn.close()  # don't leak file handles!
+        self.shm.cleanup()
         self.hasJoined = True
 
     def kill(self):
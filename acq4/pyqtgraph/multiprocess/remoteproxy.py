@@ -10,6 +10,7 @@ except ImportError:
 
 # color printing for debugging
 from ..util import cprint
+from .sharedmem import SharedMemoryTransport, available as shmAvailable
 
 class ClosedError(Exception):
     """Raised when an event handler receives a request to close the connection
@@ -79,6 +80,12 @@ class RemoteEventHandler(object):
         self.nextRequestId = 0
         self.exited = False
         
+        ## Large arrays are passed through shared memory while the remote process
+        ## reports (with '_shm' in the options of its last message) that it accepts them.
+        ## Set shm.threshold to None to pickle arrays in both directions.
+        self.shm = SharedMemoryTransport()
+        self.peerShm = False
+        
         # Mutexes to help prevent issues when multiple threads access the same RemoteEventHandler
         self.processLock = threading.RLock()
         self.sendLock = threading.RLock()
@@ -203,7 +210,8 @@ class RemoteEventHandler(object):
                 reqId = None  ## prevents attempt to return information from this request
                               ## (this is already a return from a previous request)
             
-            opts = pickle.loads(optStr)
+            opts = self.shm.loads(optStr)
+            self.peerShm = shmAvailable and opts.get('_shm', False)
             self.debugMsg("    handleRequest: id=%s opts=%s", reqId, opts)
             #print os.getpid(), "received request:", cmd, reqId, opts
             returnType = opts.get('returnType', 'auto')
@@ -407,6 +415,9 @@ class RemoteEventHandler(object):
                        excString      string-formatted version of the exception and 
                                       traceback
         =============  =====================================================================
+        
+        Every request also carries the option '_shm', which tells the remote process
+        whether this process accepts large arrays through shared memory (see sharedmem.py).
         """
         if self.exited:
             self.debugMsg('  send: exited already; raise ClosedError.')
@@ -433,9 +444,12 @@ class RemoteEventHandler(object):
                 
             #print os.getpid(), "send request:", request, reqId, opts
             
+            ## advertise shared-memory support to the remote process
+            opts['_shm'] = shmAvailable and self.shm.threshold is not None
+            
             ## double-pickle args to ensure that at least status and request ID get through
             try:
-                optStr = pickle.dumps(opts)
+                optStr = self.shm.dumps(opts, useShm=self.peerShm)
             except:
                 print("====  Error pickling this object:  ====")
                 print(opts)
@@ -552,12 +566,13 @@ class RemoteEventHandler(object):
         
         ## If there are arrays in the arguments, send those as byte messages.
         ## We do this because pickling arrays is too expensive.
+        ## (arrays that will go through shared memory are left in place)
         for i,arg in enumerate(args):
-            if arg.__class__ == np.ndarray:
+            if arg.__class__ == np.ndarray and not self._useShm(arg):
                 args[i] = ("__byte_message__", len(byteMsgs), (arg.dtype, arg.shape))
                 byteMsgs.append(arg)
         for k,v in kwds.items():
-            if v.__class__ == np.ndarray:
+            if v.__class__ == np.ndarray and not self._useShm(v):
                 kwds[k] = ("__byte_message__", len(byteMsgs), (v.dtype, v.shape))
                 byteMsgs.append(v)
         
@@ -586,12 +601,17 @@ class RemoteEventHandler(object):
         Transfer an object by value to the remote host (the object must be picklable) 
         and return a proxy for the new remote object.
         """
-        if obj.__class__ is np.ndarray:
+        if obj.__class__ is np.ndarray and not self._useShm(obj):
             opts = {'dtype': obj.dtype, 'shape': obj.shape}
             return self.send(request='transferArray', opts=opts, byteData=[obj], **kwds)            
         else:
             return self.send(request='transfer', opts=dict(obj=obj), **kwds)
         
+    def _useShm(self, arr):
+        ## True if *arr* will be sent through shared memory when pickled
+        threshold = self.shm.threshold
+        return self.peerShm and threshold is not None and arr.nbytes >= threshold and not arr.dtype.hasobject
+        
     def autoProxy(self, obj, noProxyTypes):
         ## Return object wrapped in LocalObjectProxy _unless_ its type is in noProxyTypes.
         for typ in noProxyTypes:
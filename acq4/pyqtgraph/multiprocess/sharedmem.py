@@ -0,0 +1,121 @@
+"""
+Shared-memory transport for large arrays sent between processes.
+
+Normally, arrays sent through a RemoteEventHandler are pickled, written to the
+pipe, read back, and unpickled, which copies the data several times. When both
+processes support it, arrays larger than a threshold are instead written once
+into a file in shared memory (/dev/shm where available) and only the file name,
+dtype, and shape are pickled. The receiving process maps the file and unlinks it
+immediately, so the memory is released by the operating system as soon as the
+last array referencing the mapping is garbage collected.
+
+This is only used on POSIX systems; on other platforms (where an open file can
+not be unlinked) arrays are always pickled.
+"""
+import os, io, mmap, tempfile, threading, itertools
+import numpy as np
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+available = os.name == 'posix'
+
+
+def shmDir():
+    """Return the directory used for shared-memory files."""
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+
+class SharedMemoryTransport(object):
+    """Pickles and unpickles request options for one RemoteEventHandler,
+    moving ndarrays of at least *threshold* bytes through shared memory.
+
+    Files that have been written but not yet claimed by the remote process are
+    tracked so that they can be removed if the connection closes first.
+    """
+    _counter = itertools.count()
+
+    def __init__(self, threshold=1000000):
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self._files = []  ## files created by this process that the receiver may not have unlinked yet
+
+    def dumps(self, obj, useShm=True):
+        """Pickle *obj*. If *useShm* is True, large arrays are written to
+        shared memory rather than into the pickle."""
+        if not (useShm and available and self.threshold is not None):
+            return pickle.dumps(obj)
+        buf = io.BytesIO()
+        ## protocol 2 allows arbitrary persistent ids and is readable by python 2 and 3
+        p = pickle.Pickler(buf, 2)
+        created = []
+        p.persistent_id = lambda o: self._persistentId(o, created)
+        try:
+            p.dump(obj)
+        except:
+            self._remove(created)
+            raise
+        if len(created) > 0:
+            with self.lock:
+                self._files.extend(created)
+                if len(self._files) > 100:
+                    self._files = [f for f in self._files if os.path.exists(f)]
+        return buf.getvalue()
+
+    def loads(self, data):
+        """Unpickle *data*, mapping any arrays that were sent through shared memory."""
+        p = pickle.Unpickler(io.BytesIO(data))
+        p.persistent_load = self._persistentLoad
+        return p.load()
+
+    def _persistentId(self, obj, created):
+        if type(obj) not in (np.ndarray, np.memmap):
+            return None
+        if obj.nbytes < self.threshold or obj.dtype.hasobject:
+            return None
+        fileName = os.path.join(shmDir(), 'pyqtgraph-mp-%d-%d' % (os.getpid(), next(self._counter)))
+        fd = os.open(fileName, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600)
+        created.append(fileName)
+        try:
+            ## write() avoids the page faults of filling a fresh mapping
+            data = memoryview(np.ascontiguousarray(obj).reshape(-1).view(np.uint8))
+            written = 0
+            while written < len(data):
+                written += os.write(fd, data[written:])
+        finally:
+            os.close(fd)
+        return ('shm', fileName, obj.dtype, obj.shape)
+
+    def _persistentLoad(self, pid):
+        kind, fileName, dtype, shape = pid
+        if kind != 'shm':
+            raise pickle.UnpicklingError("Unknown persistent id %r" % kind)
+        fd = os.open(fileName, os.O_RDWR)
+        try:
+            ## once mapped, the file is no longer needed; the memory lives until the array is released
+            os.unlink(fileName)
+            size = os.fstat(fd).st_size
+            if size == 0:
+                return np.empty(shape, dtype=dtype)
+            mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        return np.frombuffer(mm, dtype=dtype).reshape(shape)
+
+    def cleanup(self):
+        """Remove files that were sent but never claimed by the remote process."""
+        with self.lock:
+            files, self._files = self._files, []
+        self._remove(files)
+
+    @staticmethod
+    def _remove(files):
+        for f in files:
+            try:
+                os.unlink(f)
+            except OSError:
+                pass
@@ -0,0 +1,33 @@
+import os
+import numpy as np
+import pytest
+from pyqtgraph.multiprocess import sharedmem
+from pyqtgraph.multiprocess.sharedmem import SharedMemoryTransport
+
+
+@pytest.mark.skipif(not sharedmem.available, reason="shared memory transport requires POSIX")
+def test_transport():
+    t = SharedMemoryTransport(threshold=1000)
+    big = np.arange(1000, dtype=float).reshape(10, 100)[:, ::2]  # non-contiguous
+    small = np.arange(10)
+    rec = np.zeros(200, dtype=[('x', float), ('y', 'int16')])
+    msg = t.dumps({'big': big, 'small': small, 'rec': rec})
+    assert len(msg) < big.nbytes
+    assert len(t._files) == 2
+    
+    out = t.loads(msg)
+    assert np.all(out['big'] == big)
+    assert np.all(out['small'] == small)
+    assert out['rec'].dtype == rec.dtype
+    # files are removed as soon as they are mapped by the receiver
+    assert not any(os.path.exists(f) for f in t._files)
+    
+    # arrays that were never received are removed by cleanup()
+    t.dumps(big)
+    files = t._files[:]
+    t.cleanup()
+    assert not any(os.path.exists(f) for f in files)
+    
+    # without shared memory, arrays are pickled
+    msg = t.dumps(big, useShm=False)
+    assert len(msg) > big.nbytes
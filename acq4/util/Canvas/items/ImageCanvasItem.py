@@ -9,6 +9,7 @@ import acq4.pyqtgraph as pg
 import acq4.pyqtgraph.flowchart
 import acq4.util.DataManager as DataManager
 import acq4.util.debug as debug
+import acq4.util.imagepyramid as imagepyramid
 from .itemtypes import registerItemType
 
 
@@ -20,8 +21,14 @@ class ImageCanvasItem(CanvasItem):
         image: May be a fileHandle, ndarray, or GraphicsItem.
         handle: May optionally be specified in place of image
 
+    Image files with at least *pyramidMinSize* values are displayed from an 
+    ImagePyramid cached next to the file (see acq4.util.imagepyramid); only the
+    parts of the pyramid level matching the current zoom that are in view are
+    read from disk.
     """
     _typeName = "Image"
+    usePyramid = True
+    pyramidMinSize = 2**20
     
     def __init__(self, image=None, **opts):
 
@@ -31,6 +38,8 @@ class ImageCanvasItem(CanvasItem):
 
         item = None
         self.data = None
+        self.pyramid = None
+        self._filterInputSet = False
         
         if isinstance(image, Qt.QGraphicsItem):
             item = image
@@ -39,7 +48,7 @@ class ImageCanvasItem(CanvasItem):
         elif isinstance(image, DataManager.FileHandle):
             opts['handle'] = image
             self.handle = image
-            self.data = self.handle.read()
+            meta = self.loadData()
 
             if 'name' not in opts:
                 opts['name'] = self.handle.shortName()
@@ -63,10 +72,10 @@ class ImageCanvasItem(CanvasItem):
                             m = self.handle.info()['microscope']
                             opts['pos'] = m['position'][0:2]
                         else:
-                            info = self.data._info[-1]
+                            info = meta._info[-1]
                             opts['pos'] = info.get('imagePosition', None)
-                    elif hasattr(self.data, '_info'):
-                        info = self.data._info[-1]
+                    elif hasattr(meta, '_info'):
+                        info = meta._info[-1]
                         opts['scale'] = info.get('pixelSize', None)
                         opts['pos'] = info.get('imagePosition', None)
                     else:
@@ -76,7 +85,7 @@ class ImageCanvasItem(CanvasItem):
                 debug.printExc('Error reading transformation for image file %s:' % image.name())
 
         if item is None:
-            item = pg.ImageItem()
+            item = PyramidImageItem()
         CanvasItem.__init__(self, item, **opts)
 
         self.splitter = Qt.QSplitter()
@@ -117,10 +126,8 @@ class ImageCanvasItem(CanvasItem):
         self.timeControls = [self.timeSlider]
 
         if self.data is not None:
-            if isinstance(self.data, pg.metaarray.MetaArray):
-                self.filter.setInput(self.data.asarray())
-            else:
-                self.filter.setInput(self.data)
+            if self.pyramid is None:
+                self.setFilterInput()
             self.updateImage()
             
             # Needed to ensure selection box wraps the image properly
@@ -130,6 +137,64 @@ class ImageCanvasItem(CanvasItem):
             # Why doesn't this work?
             #self.selectBoxFromUser() ## move select box to match new bounds
             
+    def loadData(self):
+        """Set self.data (and self.pyramid, for large images) from the file handle.
+        Returns an object that may carry the file's meta info (in its _info attribute)."""
+        fh = self.handle
+        pyr = None
+        data = None
+        if self.usePyramid:
+            pyr = imagepyramid.load(fh.name(), imagepyramid.sourceKey(fh.name()))
+        if pyr is None:
+            data = fh.read()
+            if self.usePyramid and data.size >= self.pyramidMinSize:
+                try:
+                    pyr = imagepyramid.forFile(fh, data=data)
+                except Exception:
+                    debug.printExc('Could not build image pyramid for %s; displaying from memory:' % fh.name())
+        
+        if pyr is None:
+            self.data = data
+            return data
+        
+        self.pyramid = pyr
+        self.data = pyr.data()
+        if data is not None:
+            return data
+        if fh.ext().lower() == '.ma':
+            ## read only the meta info
+            return fh.read(readAllData=False)
+        return None
+        
+    def setFilterInput(self):
+        if isinstance(self.data, pg.metaarray.MetaArray):
+            self.filter.setInput(self.data.asarray())
+        else:
+            self.filter.setInput(np.asarray(self.data))
+        self._filterInputSet = True
+        
+    def filterActive(self):
+        return any([name not in ('Input', 'Output') for name in self.filter.fc.nodes()])
+
+    def setLevels(self, mn, mx):
+        """Set the black and white levels used to display this image."""
+        self.autoBtn.setChecked(False)
+        self.histogram.setLevels(mn, mx)
+
+    def lowResData(self, maxSize=256):
+        """Return a downsampled copy of the displayed image (or of the first 
+        frame of a stack) with sides of roughly *maxSize* pixels, for computing 
+        statistics without reading the full-resolution data."""
+        if self.pyramid is not None:
+            frame = 0 if self.pyramid.isStack() else None
+            return self.pyramid.lowRes(frame=frame, maxSize=maxSize)
+        data = np.asarray(self.data)
+        if imagepyramid.isStack(data):
+            data = data[0]
+        while min(data.shape[:2]) >= 2 * maxSize:
+            data = imagepyramid.downsample2(data)
+        return data
+
     @classmethod
     def checkFile(cls, fh):
         if not fh.isFile():
@@ -149,15 +214,22 @@ class ImageCanvasItem(CanvasItem):
         self.graphicsItem().setCompositionMode(getattr(Qt.QPainter, 'CompositionMode_' + mode))
 
     def filterStateChanged(self):
+        ## Pyramid data is only read in full when a filter needs it
+        if self.pyramid is not None and not self._filterInputSet and self.filterActive():
+            self.setFilterInput()
         self.updateImage()
 
     def updateImage(self):
         img = self.graphicsItem()
 
         # Try running data through flowchart filter
-        data = self.filter.output()
+        data = None
+        if self._filterInputSet:
+            data = self.filter.output()
+        pyramid = None
         if data is None:
             data = self.data
+            pyramid = self.pyramid
 
         if data.ndim == 4:
             showTime = True
@@ -172,9 +244,16 @@ class ImageCanvasItem(CanvasItem):
         if showTime:
             self.timeSlider.setMinimum(0)
             self.timeSlider.setMaximum(data.shape[0]-1)
-            self.graphicsItem().setImage(data[self.timeSlider.value()], autoLevels=self.autoBtn.isChecked())
+            frame = self.timeSlider.value()
+        else:
+            frame = 0
+        
+        if pyramid is not None:
+            img.setPyramid(pyramid, frame=frame, autoLevels=self.autoBtn.isChecked())
+        elif showTime:
+            img.setImage(data[frame], autoLevels=self.autoBtn.isChecked())
         else:
-            self.graphicsItem().setImage(data, autoLevels=self.autoBtn.isChecked())
+            img.setImage(data, autoLevels=self.autoBtn.isChecked())
 
         for widget in self.timeControls:
             widget.setVisible(showTime)
@@ -195,6 +274,147 @@ class ImageCanvasItem(CanvasItem):
 registerItemType(ImageCanvasItem)
 
 
+class PyramidImageItem(pg.ImageItem):
+    """ImageItem that can display a frame of an ImagePyramid.
+    
+    Only the visible part of the pyramid level that best matches the screen
+    resolution is read and rendered (in blocks of *tileSize* pixels, so that 
+    small pans do not cause a re-render). Setting a regular array with setImage()
+    returns to normal ImageItem behavior.
+    """
+    tileSize = 256
+    
+    def __init__(self, *args, **kargs):
+        self.pyramid = None
+        self.frameIndex = 0
+        self._region = None    ## (level, a0, a1, b0, b1) indexes of the rendered block
+        pg.ImageItem.__init__(self, *args, **kargs)
+    
+    def setPyramid(self, pyramid, frame=0, autoLevels=None, **kargs):
+        self.pyramid = pyramid
+        self.frameIndex = frame
+        self._region = None
+        if autoLevels is None:
+            autoLevels = 'levels' not in kargs
+        if autoLevels:
+            ## levels come from a low-resolution copy rather than the full frame
+            low = pyramid.lowRes(frame if pyramid.isStack() else None)
+            mn, mx = np.nanmin(low), np.nanmax(low)
+            if mn == mx or np.isnan(mn) or np.isnan(mx):
+                mn, mx = 0, 255
+            kargs['levels'] = [mn, mx]
+        kargs['autoDownsample'] = False
+        ## The full-resolution frame is never drawn directly (see render()), so a
+        ## zero-stride stand-in with its shape and dtype avoids reading it from disk.
+        placeholder = np.broadcast_to(np.zeros((), dtype=pyramid.meta['dtype']), pyramid.frameShape(0))
+        pg.ImageItem.setImage(self, placeholder, autoLevels=False, **kargs)
+    
+    def setImage(self, image=None, autoLevels=None, **kargs):
+        if image is not None:
+            self.pyramid = None
+        pg.ImageItem.setImage(self, image, autoLevels, **kargs)
+    
+    def getHistogram(self, *args, **kwds):
+        if self.pyramid is None:
+            return pg.ImageItem.getHistogram(self, *args, **kwds)
+        image = self.image
+        self.image = self.pyramid.lowRes(self.frameIndex if self.pyramid.isStack() else None)
+        try:
+            return pg.ImageItem.getHistogram(self, *args, **kwds)
+        finally:
+            self.image = image
+    
+    def quickMinMax(self, targetSize=1e6):
+        if self.pyramid is None:
+            return pg.ImageItem.quickMinMax(self, targetSize)
+        low = self.pyramid.lowRes(self.frameIndex if self.pyramid.isStack() else None)
+        return np.nanmin(low), np.nanmax(low)
+    
+    def _visibleRegion(self):
+        ## Return (level, a0, a1, b0, b1): the block of the pyramid level to display,
+        ## as index ranges along the first two axes of the level data.
+        pyr = self.pyramid
+        o = self.mapToDevice(Qt.QPointF(0, 0))
+        x = self.mapToDevice(Qt.QPointF(1, 0))
+        y = self.mapToDevice(Qt.QPointF(0, 1))
+        rect = self.viewRect()
+        if o is None or x is None or y is None or rect is None:
+            level = pyr.nLevels() - 1
+            shape = pyr.frameShape(level)
+            return (level, 0, shape[0], 0, shape[1])
+        scale = max(pg.Point(x - o).length(), pg.Point(y - o).length())
+        level = pyr.levelForScale(scale)
+        shape = pyr.frameShape(level)
+        f = 2 ** level
+        
+        ## visible range along each data axis, in level pixels, snapped to tiles
+        rect = self.mapRectToData(rect)
+        ts = self.tileSize
+        a0 = int(np.clip(np.floor(rect.left() / f / ts) * ts, 0, shape[0]))
+        a1 = int(np.clip(np.ceil(rect.right() / f / ts) * ts, 0, shape[0]))
+        b0 = int(np.clip(np.floor(rect.top() / f / ts) * ts, 0, shape[1]))
+        b1 = int(np.clip(np.ceil(rect.bottom() / f / ts) * ts, 0, shape[1]))
+        return (level, a0, a1, b0, b1)
+    
+    def mapRectToData(self, rect):
+        ## x/y in the returned rect correspond to the first/second data axes
+        return self.inverseDataTransform().mapRect(rect)
+    
+    def _drawRect(self):
+        level, a0, a1, b0, b1 = self._region
+        f = 2 ** level
+        rect = Qt.QRectF(a0 * f, b0 * f, (a1 - a0) * f, (b1 - b0) * f)
+        return self.dataTransform().mapRect(rect)
+    
+    def _checkRegion(self):
+        if self.pyramid is None or self._region is None:
+            return
+        if self._visibleRegion() != self._region:
+            self.qimage = None
+            self.update()
+    
+    def viewTransformChanged(self):
+        if self.pyramid is None:
+            pg.ImageItem.viewTransformChanged(self)
+        else:
+            self._checkRegion()
+    
+    def viewRangeChanged(self):
+        pg.ImageItem.viewRangeChanged(self)
+        self._checkRegion()
+    
+    def render(self):
+        if self.pyramid is None:
+            return pg.ImageItem.render(self)
+        region = self._visibleRegion()
+        level, a0, a1, b0, b1 = region
+        self._region = region
+        if a1 <= a0 or b1 <= b0:
+            self.qimage = None
+            return
+        ## render just the selected block using the normal ImageItem machinery
+        image = self.image
+        self.image = self.pyramid.block(level, self.frameIndex, slice(a0, a1), slice(b0, b1))
+        try:
+            pg.ImageItem.render(self)
+        finally:
+            self.image = image
+    
+    def paint(self, p, *args):
+        if self.pyramid is None:
+            return pg.ImageItem.paint(self, p, *args)
+        if self.qimage is None:
+            self.render()
+            if self.qimage is None:
+                return
+        if self.paintMode is not None:
+            p.setCompositionMode(self.paintMode)
+        p.drawImage(self._drawRect(), self.qimage)
+        if self.border is not None:
+            p.setPen(self.border)
+            p.drawRect(self.boundingRect())
+
+
 class ImageFilterWidget(Qt.QWidget):
     
     sigStateChanged = Qt.Signal()
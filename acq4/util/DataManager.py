@@ -15,7 +15,8 @@ if __name__ == '__main__':
     path = os.path.dirname(os.path.abspath(__file__))
     sys.path.append(os.path.join(path, '..', '..'))
 
-import threading, os, re, sys, shutil
+import threading, os, re, sys, shutil, json
+import numpy as np
 from acq4.util.functions import strncmp
 from acq4.util.configfile import *
 import time
@@ -29,6 +30,16 @@ import acq4.filetypes as filetypes
 from acq4.util.debug import *
 import copy
 import acq4.util.advancedTypes as advancedTypes
+import acq4.util.logstore as logstore
+import acq4.util.imagepyramid as imagepyramid
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir  ## backport for python 2
+    except ImportError:
+        scandir = None
 
 
 def abspath(fileName):
@@ -64,6 +75,131 @@ def cleanup():
     getDataManager().cleanup()
 
 
+class ReadCache(object):
+    """Process-wide LRU cache of FileHandle.read() results.
+    
+    Results are keyed by file path, modification time, size, and the arguments
+    passed to read(), and are discarded when the file's handle reports a change
+    (see FileHandle.emitChanged). The total (approximate) memory used by cached
+    results is limited to *maxSize* bytes; results larger than *maxItemSize* bytes
+    are never cached.
+    
+    Only arrays and MetaArrays are cached. Each caller receives its own copy of
+    the cached result, so results may be modified freely; copying from memory is
+    still much faster than reading from (network) storage. MetaArrays whose data
+    is still on disk (lazily-read or writable HDF5 files) are never cached,
+    because loading their data would bypass the size limits.
+    """
+    def __init__(self, maxSize=256e6, maxItemSize=64e6):
+        self.maxSize = maxSize
+        self.maxItemSize = maxItemSize
+        self.enabled = True
+        self.lock = Mutex(Qt.QMutex.Recursive)
+        self.cache = OrderedDict()  # key: (data, size)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        
+    def read(self, fh, readFn, args, kargs):
+        """Return the cached result of readFn(*args, **kargs) for FileHandle *fh*,
+        calling readFn if needed."""
+        key = self._key(fh, args, kargs)
+        if key is None:
+            return readFn(*args, **kargs)
+        
+        with self.lock:
+            if key in self.cache:
+                item = self.cache.pop(key)
+                self.cache[key] = item  ## move to end (most recently used)
+                self.hits += 1
+                return item[0].copy()
+            self.misses += 1
+        
+        data = readFn(*args, **kargs)
+        if not self._cacheable(data):
+            return data
+        size = self._sizeOf(data)
+        if size > self.maxItemSize:
+            return data
+        with self.lock:
+            if key not in self.cache:
+                ## the caller may modify the result it receives
+                self.cache[key] = (data.copy(), size)
+                self.size += size
+                self._trim()
+        return data
+        
+    def _key(self, fh, args, kargs):
+        if not self.enabled:
+            return None
+        try:
+            st = os.stat(fh.name())
+            key = (abspath(fh.name()), st.st_mtime, st.st_size, args, tuple(sorted(kargs.items())))
+            hash(key)
+        except (OSError, TypeError):
+            ## missing file or unhashable read arguments; don't cache
+            return None
+        return key
+        
+    @staticmethod
+    def _sizeOf(data):
+        if hasattr(data, 'implements') and data.implements('MetaArray'):
+            return data._data.nbytes + sys.getsizeof(data._info)
+        return data.nbytes
+    
+    @staticmethod
+    def _cacheable(data):
+        ## Only array results have a known size and can be copied for each caller.
+        ## MetaArrays are cached only if all of their data is in memory.
+        if hasattr(data, 'implements') and data.implements('MetaArray'):
+            return isinstance(data._data, np.ndarray) and data._data.dtype != object
+        return isinstance(data, np.ndarray) and not isinstance(data, np.memmap) and data.dtype != object
+        
+    def _trim(self):
+        while self.size > self.maxSize and len(self.cache) > 0:
+            key, (data, size) = self.cache.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+            
+    def invalidate(self, fileName, recursive=False):
+        """Discard cached results for *fileName* (and for everything beneath it
+        if *recursive* is True)."""
+        if fileName is None:
+            return
+        fileName = abspath(fileName)
+        prefix = os.path.join(fileName, '')
+        with self.lock:
+            for key in list(self.cache.keys()):
+                if key[0] == fileName or (recursive and key[0].startswith(prefix)):
+                    data, size = self.cache.pop(key)
+                    self.size -= size
+        
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+            self.size = 0
+        
+    def setMaxSize(self, maxSize, maxItemSize=None):
+        with self.lock:
+            self.maxSize = maxSize
+            if maxItemSize is not None:
+                self.maxItemSize = maxItemSize
+            self._trim()
+            
+    def setEnabled(self, enabled):
+        with self.lock:
+            self.enabled = enabled
+            if not enabled:
+                self.clear()
+            
+    def stats(self):
+        """Return a dict of cache statistics."""
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'count': len(self.cache), 'size': self.size, 'maxSize': self.maxSize}
+
+
 class DataManager(Qt.QObject):
     """Class for creating and caching DirHandle objects to make sure there is only one manager object per file/directory. 
     This class is (supposedly) thread-safe.
@@ -275,8 +411,9 @@ class FileHandle(Qt.QObject):
             if oldDir.isManaged() and not newDir.isManaged():
                 raise Exception("Not moving managed file to unmanaged location--this would cause loss of meta info.")
             
-
+            logstore.flushAll()  ## buffered log messages must reach the old location before it moves
             os.rename(fn1, fn2)
+            imagepyramid.discard(fn1)
             self.path = fn2
             self.parentDir = None
             self.manager._handleChanged(self, 'moved', fn1, fn2)
@@ -312,7 +449,9 @@ class FileHandle(Qt.QObject):
             if managed:
                 info = parent._fileInfo(oldName)
                 parent.forget(oldName)
+            logstore.flushAll()
             os.rename(fn1, fn2)
+            imagepyramid.discard(fn1)
             self.path = fn2
             self.manager._handleChanged(self, 'renamed', fn1, fn2)
             if managed:
@@ -329,8 +468,10 @@ class FileHandle(Qt.QObject):
             oldName = self.shortName()
             if parent.isManaged():
                 parent.forget(oldName)
+            logstore.flushAll()
             if self.isFile():
                 os.remove(fn1)
+                imagepyramid.discard(fn1)
             else:
                 shutil.rmtree(fn1)
             self.manager._handleChanged(self, 'deleted', fn1)
@@ -339,19 +480,32 @@ class FileHandle(Qt.QObject):
             parent._childChanged()
         
     def read(self, *args, **kargs):
+        """Read and return the contents of this file, using the reader for its file type.
+        
+        Array results are cached process-wide (see ReadCache); each call returns its own
+        copy, which may be modified. Pass useCache=False to bypass the cache
+        (for example, for very large files that will only be read once).
+        """
         self.checkExists()
+        useCache = kargs.pop('useCache', True)
         with self.lock:
-            typ = self.fileType()
-            
-            if typ is None:
-                fd = open(self.name(), 'r')
-                data = fd.read()
-                fd.close()
+            if useCache:
+                return readCache.read(self, self._read, args, kargs)
             else:
-                cls = filetypes.getFileType(typ)
-                data = cls.read(self, *args, **kargs)
-            
-            return data
+                return self._read(*args, **kargs)
+        
+    def _read(self, *args, **kargs):
+        typ = self.fileType()
+        
+        if typ is None:
+            fd = open(self.name(), 'r')
+            data = fd.read()
+            fd.close()
+        else:
+            cls = filetypes.getFileType(typ)
+            data = cls.read(self, *args, **kargs)
+        
+        return data
         
     def fileType(self):
         with self.lock:
@@ -366,9 +520,16 @@ class FileHandle(Qt.QObject):
             return typ
 
     def emitChanged(self, change, *args):
+        self._invalidateReadCache(change, args)
         self.delayedChanges.append(change)
         self.sigChanged.emit(self, change, args)
 
+    def _invalidateReadCache(self, change, args):
+        if change in ('moved', 'renamed', 'deleted'):
+            readCache.invalidate(args[0], recursive=True)
+        elif change != 'log':
+            readCache.invalidate(self.path)
+        
     def delayedChange(self, args):
         changes = list(set(self.delayedChanges))
         self.delayedChanges = []
@@ -433,7 +594,9 @@ class DirHandle(FileHandle):
         FileHandle.__init__(self, path, manager)
         self._index = None
         self.lsCache = {}  # sortMode: [files...]
-        self.cTimeCache = {}
+        self.cTimeCache = {}  # fileName: (mtime, timestamp)
+        self._entryInfo = {}  # fileName: (isDir, mtime, ctime); filled in by _scanDir
+        self._tsCacheLoaded = False
         self._indexFileExists = False
         
         if not os.path.isdir(self.path):
@@ -451,6 +614,9 @@ class DirHandle(FileHandle):
     def _logFile(self):
         return os.path.join(self.path, '.log')
     
+    def _timestampCacheFile(self):
+        return os.path.join(self.path, '.tscache')
+    
     def __getitem__(self, item):
         item = item.lstrip(os.path.sep)
         fileName = os.path.join(self.name(), item)
@@ -471,37 +637,34 @@ class DirHandle(FileHandle):
             tags['__timestamp__'] = time.time()
             tags['__message__'] = str(msg)
             
-            fd = open(self._logFile(), 'a')
-            fd.write("%s\n" % repr(tags))
-            fd.close()
+            logstore.getWriter(self._logFile()).write(tags)
             self.emitChanged('log', tags)
         
-    def readLog(self, recursive=0):
-        """Return a list containing one dict for each log line"""
+    def readLog(self, recursive=0, startTime=None, stopTime=None):
+        """Return a list containing one dict for each log line.
+        
+        If *startTime* and/or *stopTime* are given, only messages whose timestamps
+        fall within that range are returned. With *recursive* > 0, messages from
+        subdirectories (up to that depth) are merged in time order; each has a
+        'subdir' key giving its location relative to this directory.
+        """
         with self.lock:
-            logf = self._logFile()
-            if not os.path.exists(logf):
-                log = []
+            reader = logstore.getReader(self._logFile())
+            if startTime is None and stopTime is None:
+                log = reader.read()
             else:
-                try:
-                    fd = open(logf, 'r')
-                    lines = fd.readlines()
-                    fd.close()
-                    log = [eval(l.strip()) for l in lines]
-                except:
-                    print("****************** Error reading log file %s! *********************" % logf)
-                    raise
+                log = reader.query(startTime, stopTime)
             
             if recursive > 0:
+                logs = [log]
                 for d in self.subDirs():
                     dh = self[d]
-                    subLog = dh.readLog(recursive=recursive-1)
-                    for msg in subLog:
-                        if 'subdir' not in msg:
-                            msg['subdir'] = ''
-                        msg['subdir'] = os.path.join(dh.shortName(), msg['subdir'])
-                    log  = log + subLog
-                log.sort(lambda a,b: cmp(a['__timestamp__'], b['__timestamp__']))
+                    subLog = []
+                    for msg in dh.readLog(recursive=recursive-1, startTime=startTime, stopTime=stopTime):
+                        msg['subdir'] = os.path.join(dh.shortName(), msg.get('subdir', ''))
+                        subLog.append(msg)
+                    logs.append(subLog)
+                log = logstore.mergeLogs(logs)
             
             return log
         
@@ -509,8 +672,7 @@ class DirHandle(FileHandle):
         """Return a list of string names for all sub-directories."""
         with self.lock:
             ls = self.ls()
-            subdirs = [d for d in ls if os.path.isdir(os.path.join(self.name(), d))]
-            return subdirs
+            return [d for d in ls if self._entryInfo.get(d, (False,))[0]]
     
     def incrementFileName(self, fileName, useExt=True):
         """Given fileName.ext, finds the next available fileName_NNN.ext"""
@@ -598,25 +760,18 @@ class DirHandle(FileHandle):
                 return ret
     
     def _updateLsCache(self, sortMode):
-        try:
-            files = os.listdir(self.name())
-        except:
-            printExc("Error while listing files in %s:" % self.name())
-            files = []
-        for i in ['.index', '.log']:
-            if i in files:
-                files.remove(i)
+        self._entryInfo = self._scanDir()
+        files = list(self._entryInfo.keys())
         
         if sortMode == 'date':
             ## Sort files by creation time
             with BusyCursor():
-                for f in files:
-                    if f not in self.cTimeCache:
-                        self.cTimeCache[f] = self._getFileCTime(f)
-            files.sort(key=lambda f: (self.cTimeCache[f], f))  ## sort by time first, then name.
+                self._updateCTimeCache(files)
+            files.sort(key=lambda f: (self.cTimeCache[f][1], f))  ## sort by time first, then name.
         elif sortMode == 'alpha':
             ## show directories first when sorting alphabetically.
-            files.sort(lambda a,b: 2*cmp(os.path.isdir(os.path.join(self.name(),b)), os.path.isdir(os.path.join(self.name(),a))) + cmp(a,b))
+            info = self._entryInfo
+            files.sort(key=lambda f: (not info[f][0], f))
         elif sortMode == None:
             pass
         else:
@@ -624,18 +779,101 @@ class DirHandle(FileHandle):
             
         self.lsCache[sortMode] = files
     
-    def _getFileCTime(self, fileName):
-        if self.isManaged():
-            index = self._readIndex()
+    def _scanDir(self):
+        """Return {fileName: (isDir, mtime, ctime)} for all user-visible entries in 
+        this directory, gathered in a single pass over the directory."""
+        hidden = ('.index', '.log', '.tscache', imagepyramid.dirName)
+        entries = {}
+        try:
+            if scandir is not None:
+                for e in scandir(self.name()):
+                    if e.name in hidden:
+                        continue
+                    try:
+                        st = e.stat()
+                        entries[e.name] = (e.is_dir(), st.st_mtime, st.st_ctime)
+                    except OSError:
+                        pass  ## removed while we were listing
+            else:
+                import stat
+                for f in os.listdir(self.name()):
+                    if f in hidden:
+                        continue
+                    try:
+                        st = os.stat(os.path.join(self.name(), f))
+                        entries[f] = (stat.S_ISDIR(st.st_mode), st.st_mtime, st.st_ctime)
+                    except OSError:
+                        pass
+        except:
+            printExc("Error while listing files in %s:" % self.name())
+        
+        ## the offset indexes that logstore writes next to log files (.log.idx, log.txt.idx, ..)
+        suffix = logstore.indexFileName('')
+        for f in list(entries.keys()):
+            base = f[:-len(suffix)]
+            if f.endswith(suffix) and (base in entries or base in hidden):
+                del entries[f]
+        return entries
+    
+    def _updateCTimeCache(self, files):
+        """Make sure cTimeCache has a current timestamp for each file in *files*.
+        
+        Timestamps that are not recorded in this directory's index (and so require
+        reading each child's index) are also kept in a .tscache file, so that they 
+        only need to be determined once per file, even across restarts.
+        """
+        index = self._readIndex(unmanagedOk=True)
+        if not self._tsCacheLoaded:
+            self._loadTimestampCache()
+        changed = False
+        for f in files:
+            mtime = self._entryInfo[f][1]
+            if index is not None and f in index and '__timestamp__' in index[f]:
+                self.cTimeCache[f] = (mtime, index[f]['__timestamp__'])
+                continue
+            cached = self.cTimeCache.get(f, None)
+            if cached is not None and cached[0] == mtime:
+                continue
+            self.cTimeCache[f] = (mtime, self._getFileCTime(f, index))
+            changed = True
+        if changed and index is not None:
+            self._saveTimestampCache(files)
+    
+    def _loadTimestampCache(self):
+        self._tsCacheLoaded = True
+        cacheFile = self._timestampCacheFile()
+        if not os.path.isfile(cacheFile):
+            return
+        try:
+            with open(cacheFile, 'r') as fd:
+                cache = json.load(fd)
+            for f, v in cache.items():
+                self.cTimeCache.setdefault(f, tuple(v))
+        except Exception:
+            ## a damaged cache is simply rebuilt
+            pass
+    
+    def _saveTimestampCache(self, files):
+        index = self._readIndex(unmanagedOk=True) or {}
+        cache = dict([(f, self.cTimeCache[f]) for f in files if f in self.cTimeCache and f not in index])
+        try:
+            with open(self._timestampCacheFile(), 'w') as fd:
+                json.dump(cache, fd)
+        except (IOError, OSError):
+            pass  ## read-only data; the cache just won't persist
+    
+    def _getFileCTime(self, fileName, index=None):
+        if index is None:
+            index = self._readIndex(unmanagedOk=True)
+        if index is not None:
             try:
-                t = index[fileName]['__timestamp__']
-                return t
+                return index[fileName]['__timestamp__']
             except KeyError:
                 pass
             
             ## try getting time directly from file
             try:
-                t = self[fileName].info()['__timestamp__']
+                return self[fileName].info()['__timestamp__']
             except:
                 pass
                     
@@ -645,6 +883,9 @@ class DirHandle(FileHandle):
             return time.mktime(time.strptime(m.groups()[0], "%Y.%m.%d"))
         
         ## if all else fails, just ask the file system
+        info = self._entryInfo.get(fileName, None)
+        if info is not None:
+            return info[2]
         try:
             return os.path.getctime(os.path.join(self.name(), fileName))
         except:
@@ -883,5 +1124,13 @@ class DirHandle(FileHandle):
         self.lsCache = {}
         self.emitChanged('children')
 
+    def _invalidateReadCache(self, change, args):
+        if change in ('moved', 'renamed', 'deleted'):
+            readCache.invalidate(args[0], recursive=True)
+        elif change in ('children', 'meta') and len(args) > 0 and args[0] != '.':
+            ## a file in this directory was written or had its meta info changed
+            readCache.invalidate(os.path.join(self.path, args[0]))
+
 
+readCache = ReadCache()
 dm = DataManager()
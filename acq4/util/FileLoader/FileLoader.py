@@ -4,13 +4,19 @@ from . import template
 from acq4.util import Qt
 from acq4.util.HelpfulException import HelpfulException
 from acq4.Manager import logMsg, logExc, getManager
+from .Prefetcher import SequencePrefetcher
 
 
 class FileLoader(Qt.QWidget):
     """Interface for 1) displaying directory tree and 2) loading a file from the tree.
     You must call setHost, and the widget will call host.loadFileRequested whenever 
     the user requests to load a file and host.clearFilesRequested whenever the user 
-    clicks the clear button."""
+    clicks the clear button.
+    
+    If setPrefetchFunction() is called, the data files of a sequence directory are read
+    in the background as soon as the directory is selected in the tree (see 
+    SequencePrefetcher); results are streamed through prefetcher.sigFileLoaded.
+    """
     
     
     sigFileLoaded = Qt.Signal(object)
@@ -23,6 +29,7 @@ class FileLoader(Qt.QWidget):
         self.dataManager = dataManager
         self.loaded = []
         Qt.QWidget.__init__(self)
+        self.prefetcher = SequencePrefetcher()
         self.ui = template.Ui_Form()
         self.ui.setupUi(self)
         self.setHost(host)
@@ -31,6 +38,7 @@ class FileLoader(Qt.QWidget):
         self.ui.loadBtn.clicked.connect(self.loadClicked)
         self.ui.clearBtn.clicked.connect(self.clearClicked)
         self.ui.dirTree.currentItemChanged.connect(self.updateNotes) ## self.ui.dirTree is a DirTreeWidget
+        self.ui.dirTree.currentItemChanged.connect(self.prefetchSelection)
         self.ui.dirTree.itemDoubleClicked.connect(self.doubleClickEvent)
         self.ui.fileTree.currentItemChanged.connect(self.selectedFileChanged)
         
@@ -133,6 +141,22 @@ class FileLoader(Qt.QWidget):
         notes = fh.handle.info().get('notes', ' ')
         self.ui.notesTextEdit.setPlainText(notes)
         
+    def setPrefetchFunction(self, fn):
+        """Enable background reading of sequence data. When a directory is selected, 
+        fn(subDirHandle) is called (from a worker thread) for each of its subdirectories 
+        and should return the handle of the file to read, or None. Pass None to disable."""
+        self.prefetcher.setFileFunction(fn)
+        if fn is None:
+            self.prefetcher.cancel()
+        
+    def prefetchSelection(self, current, previous):
+        if self.prefetcher.fileFunction() is None:
+            return
+        if current is None or not current.handle.isDir():
+            self.prefetcher.cancel()
+            return
+        self.prefetcher.prefetch(current.handle)
+        
     def loadedFiles(self):
         """Return a list of loaded file handles"""
         return self.loaded[:]
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import threading
+import concurrent.futures
+from acq4.util import Qt
+from acq4.util.debug import printExc
+
+
+class SequencePrefetcher(Qt.QObject):
+    """Reads the data files of a sequence directory in a background thread pool.
+
+    For each subdirectory of the directory passed to prefetch(), *fileFn(subDirHandle)* is
+    called to select the file to read (it may return None to skip that subdirectory). Files
+    are read with FileHandle.read(), so prefetched results also populate the DataManager's
+    read cache; later reads of the same files from the GUI thread return immediately.
+
+    Results are streamed as they arrive through sigFileLoaded (not necessarily in sequence
+    order; use the index argument). Starting a new prefetch cancels the previous one, and
+    no further signals are emitted for a cancelled job. See PrefetchStore for a simple way
+    to keep the streamed results until an analysis module asks for them.
+    """
+
+    sigFileLoaded = Qt.Signal(object, object, object, object)  # (dirHandle, index, fileHandle, data)
+    sigFileError = Qt.Signal(object, object, object, object)   # (dirHandle, index, fileHandle, exception)
+    sigFinished = Qt.Signal(object)  # dirHandle
+
+    def __init__(self, fileFn=None, maxWorkers=4):
+        Qt.QObject.__init__(self)
+        self._fileFn = fileFn
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=maxWorkers)
+        self._lock = threading.Lock()
+        self._job = 0
+        self._futures = []
+        self._remaining = 0
+
+    def setFileFunction(self, fn):
+        self._fileFn = fn
+
+    def fileFunction(self):
+        return self._fileFn
+
+    def prefetch(self, dh, fileFn=None):
+        """Begin reading the sequence data in directory *dh*, cancelling any
+        prefetch already in progress."""
+        if fileFn is None:
+            fileFn = self._fileFn
+        if fileFn is None:
+            raise Exception("No file function set; can not determine which files to prefetch.")
+        job = self.cancel()
+        with self._lock:
+            self._futures = [self._pool.submit(self._listDir, job, dh, fileFn)]
+
+    def cancel(self):
+        """Stop the current prefetch. Files already being read are allowed to finish,
+        but their results are discarded. Return the new job ID."""
+        with self._lock:
+            self._job += 1
+            for fut in self._futures:
+                fut.cancel()
+            self._futures = []
+            self._remaining = 0
+            return self._job
+
+    def isRunning(self):
+        with self._lock:
+            return self._remaining > 0 or any(not f.done() for f in self._futures)
+
+    def close(self):
+        self.cancel()
+        self._pool.shutdown(wait=False)
+
+    def _cancelled(self, job):
+        return job != self._job
+
+    def _listDir(self, job, dh, fileFn):
+        try:
+            dirs = dh.subDirs()
+        except Exception:
+            printExc("Error listing sequence directory %s:" % dh.name())
+            return
+        with self._lock:
+            if self._cancelled(job):
+                return
+            self._remaining = len(dirs)
+            self._futures.extend([self._pool.submit(self._load, job, dh, i, name, fileFn) for i, name in enumerate(dirs)])
+        if len(dirs) == 0:
+            self.sigFinished.emit(dh)
+
+    def _load(self, job, dh, index, name, fileFn):
+        if self._cancelled(job):
+            return
+        fh = None
+        try:
+            fh = fileFn(dh[name])
+            if fh is not None:
+                data = fh.read()
+                ## lazily-read arrays are loaded now, while we are off the GUI thread; indexing
+                ## returns a new in-memory array and leaves the object returned by read() untouched
+                if hasattr(data, 'implements') and data.implements('MetaArray') and data.isLazy():
+                    data = data[:]
+                if not self._cancelled(job):
+                    self.sigFileLoaded.emit(dh, index, fh, data)
+        except Exception as exc:
+            if not self._cancelled(job):
+                self.sigFileError.emit(dh, index, fh, exc)
+        finally:
+            with self._lock:
+                done = False
+                if not self._cancelled(job):
+                    self._remaining -= 1
+                    done = self._remaining == 0
+            if done:
+                self.sigFinished.emit(dh)
+
+
+class PrefetchStore(object):
+    """Keeps the files streamed by a SequencePrefetcher for the most recently
+    prefetched directory, so that an analysis module can use them instead of
+    reading the files again::
+
+        self.prefetched = PrefetchStore(fileLoader.prefetcher)
+        ...
+        data = self.prefetched.read(fileHandle)  # prefetched result, or fileHandle.read()
+
+    Each result is handed out only once; results for a directory are discarded
+    when files from another directory start to arrive.
+    """
+    def __init__(self, prefetcher):
+        self._dir = None
+        self._data = {}
+        prefetcher.sigFileLoaded.connect(self.fileLoaded)
+
+    def fileLoaded(self, dh, index, fh, data):
+        if dh is not self._dir:
+            self._dir = dh
+            self._data = {}
+        self._data[fh.name()] = data
+
+    def read(self, fh):
+        """Return the prefetched data for FileHandle *fh*, or read it now if it
+        has not arrived yet."""
+        data = self._data.pop(fh.name(), None)
+        if data is None:
+            data = fh.read()
+        return data
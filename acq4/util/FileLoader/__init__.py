@@ -1,2 +1,3 @@
 from __future__ import print_function
 from .FileLoader import FileLoader
+from .Prefetcher import SequencePrefetcher, PrefetchStore
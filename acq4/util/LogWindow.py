@@ -12,6 +12,7 @@ from acq4.util import Qt
 from . import LogWidgetTemplate
 from acq4.pyqtgraph import FeedbackButton
 import acq4.util.configfile as configfile
+import acq4.util.logstore as logstore
 from acq4.util.DataManager import DirHandle
 from acq4.util.HelpfulException import HelpfulException
 from acq4.util.Mutex import Mutex
@@ -21,6 +22,7 @@ from acq4.util.debug import printExc
 import six
 import weakref
 import re
+from collections import OrderedDict
 
 #from acq4.Manager import getManager
 
@@ -103,7 +105,8 @@ class LogWindow(Qt.QMainWindow):
         self.msgCount = 0
         self.logCount=0
         self.logFile = None
-        configfile.writeConfigFile('', self.fileName())  ## start a new temp log file, destroying anything left over from the last session.
+        self.logFileLegacy = False  ## True if the current log file uses the old configfile format
+        logstore.resetLog(self.fileName())  ## start a new temp log file, destroying anything left over from the last session.
         self.buttons = [] ## weak references to all Log Buttons get added to this list, so it's easy to make them all do things, like flash red.
         self.lock = Mutex()
         self.errorDialog = ErrorDialog()
@@ -155,6 +158,7 @@ class LogWindow(Qt.QMainWindow):
             'msgType': msgType,
             #'exception': exception,
             'id': self.msgCount,
+            '__timestamp__': time.time(),
         }
         for k in kwargs:
             entry[k] = kwargs[k]
@@ -293,22 +297,29 @@ class LogWindow(Qt.QMainWindow):
         
         if oldfName == 'tempLog.txt':
             with self.lock:
-                temp = configfile.readConfigFile(oldfName)
+                temp = logstore.getReader(oldfName).read()
         else:
-            temp = {}
+            temp = []
                 
         if dh.exists('log.txt'):
             self.logFile = dh['log.txt']
             with self.lock:
-                self.msgCount = len(configfile.readConfigFile(self.logFile.name()))
-            newTemp = {}
-            for v in temp.values():
+                self.logFileLegacy = not logstore.isStructuredLog(self.logFile.name())
+                if self.logFileLegacy:
+                    self.msgCount = len(configfile.readConfigFile(self.logFile.name()))
+                else:
+                    last = logstore.getReader(self.logFile.name()).lastEntry()
+                    self.msgCount = 0 if last is None else int(last.get('id', 0))
+            newTemp = OrderedDict()
+            for v in temp:
                 self.msgCount += 1
+                v['id'] = self.msgCount
                 newTemp['LogEntry_'+str(self.msgCount)] = v
             self.saveEntry(newTemp)
         else:
             self.logFile = dh.createFile('log.txt')
-            self.saveEntry(temp)
+            self.logFileLegacy = False
+            self.saveEntry(OrderedDict([('LogEntry_'+str(v['id']), v) for v in temp]))
         
         self.logMsg('Moved log storage from %s to %s.' % (oldfName, self.fileName()))
         self.wid.ui.dirLabel.setText("Current Storage Directory: " + self.fileName())
@@ -320,9 +331,15 @@ class LogWindow(Qt.QMainWindow):
         else:
             return self.logFile.parent()
     
-    def saveEntry(self, entry):  
+    def saveEntry(self, entry):
+        """Append entries, given as {'LogEntry_N': entry, ...}, to the current log file."""
         with self.lock:
-            configfile.appendConfigFile(entry, self.fileName())
+            if self.logFileLegacy:
+                configfile.appendConfigFile(entry, self.fileName())
+            else:
+                writer = logstore.getWriter(self.fileName())
+                for v in entry.values():
+                    writer.write(v)
     
     def disablePopups(self, disable):
         self.errorDialog.disable(disable)
@@ -372,9 +389,19 @@ class LogWidget(Qt.QWidget):
         #page = self.ui.logView.page()
         #page.setLinkDelegationPolicy(page.DelegateAllLinks)
         
-    def loadFile(self, f):
-        """Load the file, f. f must be able to be read by configfile.py"""
-        log = configfile.readConfigFile(f)
+    def loadFile(self, f, startTime=None, stopTime=None):
+        """Load the log file, f. 
+        
+        f may be a structured log (see acq4.util.logstore) or an older log that can be read by configfile.py.
+        For structured logs, only entries with startTime <= timestamp <= stopTime are loaded.
+        """
+        if logstore.isStructuredLog(f):
+            log = logstore.getReader(f).query(startTime, stopTime)
+        else:
+            log = []
+            for k,v in configfile.readConfigFile(f).items():
+                v['id'] = k[9:]  ## record unique ID to facilitate HTML generation (javascript needs this ID)
+                log.append(v)
         self.entries = []
         self.entryArrayBuffer = np.zeros(len(log),dtype=[
             ('index', 'int32'),
@@ -386,8 +413,7 @@ class LogWidget(Qt.QWidget):
         self.entryArray = self.entryArrayBuffer[:]
                                    
         i = 0
-        for k,v in log.items():
-            v['id'] = k[9:]  ## record unique ID to facilitate HTML generation (javascript needs this ID)
+        for v in log:
             self.entries.append(v)
             self.entryArray[i] = np.array([(i, v.get('importance', 5), v.get('msgType', 'status'), v.get('currentDir', ''), v.get('entryId', v['id']))], dtype=[('index', 'int32'), ('importance', 'int32'), ('msgType', '|S10'), ('directory', '|S100'), ('entryId', 'int32')])
             i += 1
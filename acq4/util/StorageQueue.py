@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+"""
+StorageQueue.py - Background writer for acquired data
+Distributed under MIT/X11 license. See license.txt for more infomation.
+
+Writing task results to disk (especially with HDF5 compression) can take
+much longer than acquiring them. The Manager hands each task's storage work
+to a StorageQueue so that devices can be released as soon as their data is in
+memory; the files are written by worker threads while the next task runs.
+
+    job = queue.submit(writeResults, dirHandle, result)
+    ...
+    job.wait()           # block until this job is written; re-raises its storage error
+    queue.flush()        # block until everything queued so far is written
+    queue.checkErrors()  # raise the first error from any job not yet waited on
+"""
+
+import sys, threading
+import six
+from six.moves import queue as Queue
+from acq4.util.debug import printExc
+
+
+class StorageJob(object):
+    """Handle to a single piece of queued storage work."""
+    def __init__(self, queue, fn, args, kwds):
+        self.queue = queue
+        self.fn = fn
+        self.args = args
+        self.kwds = kwds
+        self.excInfo = None
+        self._done = threading.Event()
+
+    def _run(self):
+        try:
+            self.fn(*self.args, **self.kwds)
+        except Exception:
+            self.excInfo = sys.exc_info()
+            printExc("Error while storing data:")
+        finally:
+            ## drop references to the (possibly large) result data
+            self.args = self.kwds = None
+
+    def isDone(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Wait for this job to be written. Re-raises the exception if storage
+        failed. Returns False if the timeout expired."""
+        if not self._done.wait(timeout):
+            return False
+        if self.excInfo is not None:
+            self.queue.clearError(self)
+            six.reraise(*self.excInfo)
+        return True
+
+
+class StorageQueue(object):
+    """Bounded queue of storage jobs processed by *workers* background threads.
+
+    At most *maxSize* jobs may be waiting; submit() blocks when the queue is full
+    so that acquisition can not outrun the disk indefinitely. With workers=0,
+    jobs run synchronously inside submit().
+
+    Errors are kept until they are collected by checkErrors() (or by waiting on
+    the job that failed), so that a failed write can stop a running sequence.
+    """
+    def __init__(self, workers=2, maxSize=8):
+        self.lock = threading.Lock()
+        self._queue = Queue.Queue(maxsize=maxSize)
+        self._pending = []
+        self._errors = []
+        self._nWorkers = 0
+        self._threadCount = 0  ## for naming threads
+        self.setWorkers(workers)
+
+    def setWorkers(self, n):
+        """Set the number of worker threads. When the number is reduced, extra
+        threads exit once the jobs queued before this call have been taken."""
+        with self.lock:
+            change = n - self._nWorkers
+            self._nWorkers = n
+            for i in range(change):
+                self._threadCount += 1
+                t = threading.Thread(target=self._run, name='StorageQueue-%d' % self._threadCount)
+                t.daemon = True
+                t.start()
+        for i in range(-change):
+            self._queue.put(None)  ## tells one worker to exit
+
+    def submit(self, fn, *args, **kwds):
+        """Queue fn(*args, **kwds) to be run in a worker thread and return a StorageJob."""
+        job = StorageJob(self, fn, args, kwds)
+        with self.lock:
+            self._pending.append(job)
+        if self._nWorkers == 0:
+            self._runJob(job)
+        else:
+            self._queue.put(job)
+        return job
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                self._runJob(job)
+            finally:
+                self._queue.task_done()
+
+    def _runJob(self, job):
+        job._run()
+        with self.lock:
+            self._pending.remove(job)
+            if job.excInfo is not None:
+                self._errors.append(job)
+        job._done.set()
+
+    def pending(self):
+        """Return the number of jobs that have not finished yet."""
+        with self.lock:
+            return len(self._pending)
+
+    def flush(self, timeout=None):
+        """Block until all jobs submitted so far have finished. Return False if
+        *timeout* expired first. Errors are not raised here; see checkErrors()."""
+        with self.lock:
+            jobs = self._pending[:]
+        for job in jobs:
+            if not job._done.wait(timeout):
+                return False
+        return True
+
+    def checkErrors(self):
+        """Raise the first storage error that has not been reported yet."""
+        with self.lock:
+            if len(self._errors) == 0:
+                return
+            job = self._errors.pop(0)
+        six.reraise(*job.excInfo)
+
+    def clearError(self, job):
+        """Forget an error that has already been handled by the caller."""
+        with self.lock:
+            if job in self._errors:
+                self._errors.remove(job)
@@ -8,6 +8,7 @@ Distributed under MIT/X11 license. See license.txt for more infomation.
 
 from acq4.pyqtgraph.debug import *
 import acq4.pyqtgraph.debug as pgdebug
+import acq4.pyqtgraph.ptime as ptime
 
 
 LOG_UI = None
@@ -106,3 +107,33 @@ def exceptionCallback(*args):
             blockLogging = False
 
 
+class MarkRecorder(object):
+    """Has the same mark()/finish() interface as Profiler, but instead of
+    printing, passes [(mark, seconds since previous mark), ...] to
+    *callback(name, marks)* when finished. Used to collect timing statistics
+    (for example, by acq4.benchmarks) from code that is instrumented with
+    Profiler marks."""
+    def __init__(self, name, callback):
+        self.name = name
+        self.callback = callback
+        self.marks = []
+        self._finished = False
+        self._lastTime = ptime.time()
+
+    def __call__(self, msg=None):
+        if msg is None:
+            msg = str(len(self.marks))
+        now = ptime.time()
+        self.marks.append((msg, now - self._lastTime))
+        self._lastTime = now
+
+    def mark(self, msg=None):
+        self(msg)
+
+    def finish(self, msg=None):
+        if self._finished:
+            return
+        self._finished = True
+        if msg is not None:
+            self(msg)
+        self.callback(self.name, self.marks)
@@ -8,6 +8,7 @@ import scipy
 #from acq4.pyqtgraph import graphicsItems
 import acq4.pyqtgraph as pg
 import acq4.util.metaarray as metaarray
+import acq4.pyqtgraph.multiprocess as mp
 #import acq4.pyqtgraph.CheckTable as CheckTable
 from collections import OrderedDict
 from acq4.analysis.tools.Fitting import Fitting
@@ -19,8 +20,9 @@ class EventFitter(CtrlNode):
     nodeName = "EventFitter"
     uiTemplate = [
         ('multiFit', 'check', {'value': False}),
-        #('parallel', 'check', {'value': False}),
-        #('nProcesses', 'spin', {'value': 1, 'min': 1, 'int': True}),
+        ('warmStart', 'check', {'value': False}),
+        ('parallel', 'check', {'value': False}),  ## forks the process; avoid while other threads are running
+        ('nProcesses', 'spin', {'value': 0, 'min': 0, 'int': True}),  ## 0 = one per CPU
         ('plotFits', 'check', {'value': True}),
         ('plotGuess', 'check', {'value': False}),
         ('plotEvents', 'check', {'value': False}),
@@ -37,26 +39,7 @@ class EventFitter(CtrlNode):
         self.plotItems = []
         self.selectedFit = None
         self.deletedFits = []
-        self.pool = None  ## multiprocessing pool
-        self.poolSize = 0
-        #self.ctrls['parallel'].toggled.connect(self.setupPool)
-        #self.ctrls['nProcesses'].valueChanged.connect(self.setupPool)
-    
-    #def setupPool(self):
-        #import multiprocessing as mp
-        #if self.ctrls['parallel'].isChecked():
-            #nProc = self.ctrls['nProcesses'].value()
-            #if self.pool is not None and self.poolSize != nProc:
-                #self.pool.terminate()
-                #self.pool = None
-            #if self.pool is None:
-                #self.pool = mp.Pool(processes=nProc)
-                #self.poolSize = nProc
-        #else:
-            #if self.pool is not None:
-                #self.pool.terminate()
-                #self.pool = None
-    
+
     def process(self, waveform, events, display=True):
         self.deletedFits = []
         for item in self.plotItems:
@@ -72,10 +55,11 @@ class EventFitter(CtrlNode):
             'dt': dt, 'tau': tau, 'multiFit': self.ctrls['multiFit'].isChecked(),
             'waveform': waveform.view(np.ndarray),
             'tvals': waveform.xvals('Time'),
+            'warmStart': self.ctrls['warmStart'].isChecked(),
+            'workers': (self.ctrls['nProcesses'].value() or None) if self.ctrls['parallel'].isChecked() else 1,
         }
         
         
-        #if not self.ctrls['parallel'].isChecked():
         output = processEventFits(events, startEvent=0, stopEvent=len(events), opts=opts)
         guesses = output['guesses']
         eventData = output['eventData']
@@ -83,36 +67,6 @@ class EventFitter(CtrlNode):
         xVals = output['xVals']
         yVals = output['yVals']
         output = output['output']
-        #else:
-            #print "parallel:", self.pool, self.poolSize
-            #results = []
-            #nProcesses = self.ctrls['nProcesses'].value()
-            #evPerProcess = int(len(events) / nProcesses)
-            #start = 0
-            #for i in range(nProcesses):
-                #stop = start + evPerProcess
-                #if stop > len(events):
-                    #stop = len(events)
-                #args = (events, start, stop, opts)
-                #results.append(self.pool.apply_async(processEventFits, args))
-                #print "started process", start, stop
-                #start = stop
-            #data = []
-            #guesses = []
-            #eventData = []
-            #indexes = []
-            #xVals = []
-            #yVals = []
-            #for res in results:  ## reconstruct results here
-                #print "getting result", res
-                #output = res.get(10)
-                #data.append(output['output'])
-                #guesses.extend(output['guesses'])
-                #eventData.extend(output['eventData'])
-                #indexes.extend(output['indexes'])
-                #xVals.extend(output['xVals'])
-                #yVals.extend(output['yVals'])
-            #output = np.concatenate(data)
             
         for i in range(len(indexes)):            
             if display and self['plot'].isConnected():
@@ -201,14 +155,16 @@ class EventFitter(CtrlNode):
         
 def processEventFits(events, startEvent, stopEvent, opts):
     ## This function does all the processing work for EventFitter.
-    dt = opts['dt']
-    origTau = opts['tau']
-    multiFit = opts['multiFit']
-    waveform = opts['waveform']
+    ##
+    ## Events are fitted in chains of opts['chainLength'] consecutive events (aligned
+    ## to multiples of the chain length). If opts['warmStart'] is True, the initial rise
+    ## and decay guesses for each event come from the previous fit in the same chain.
+    ## Chains are independent of each other, so they may be fitted by several worker
+    ## processes (opts['workers'] > 1) with exactly the same results as a serial run.
+    workers = opts.get('workers', 1)
+    chainLength = opts.get('chainLength', 32)
     tvals = opts['tvals']
     
-    nFields = len(events.dtype.fields)
-    
     dtype = [(n, events[n].dtype) for n in events.dtype.names]
     output = np.empty(len(events), dtype=dtype + [
         ('fitAmplitude', float), 
@@ -221,8 +177,27 @@ def processEventFits(events, startEvent, stopEvent, opts):
         ('fitLengthOverDecay', float),
     ])
     
-    offset = 0 ## not all input events will produce output events; offset keeps track of the difference.
-
+    ## find the start of every event window at once
+    startIndexes = np.searchsorted(tvals, events['time'][startEvent:stopEvent])
+    
+    chains = []
+    i = startEvent
+    while i < stopEvent:
+        stop = min(stopEvent, (i // chainLength + 1) * chainLength)
+        chains.append((i, stop))
+        i = stop
+    
+    results = []
+    if workers == 1 or len(chains) < 2:
+        for chain in chains:
+            results.append((chain[0], fitEventChain(events, chain, startIndexes[chain[0]-startEvent:chain[1]-startEvent], opts)))
+    else:
+        with mp.Parallelize(tasks=chains, results=results, workers=workers) as tasker:
+            for chain in tasker:
+                fits = fitEventChain(events, chain, startIndexes[chain[0]-startEvent:chain[1]-startEvent], opts)
+                tasker.results.append((chain[0], fits))
+        results.sort(key=lambda r: r[0])
+    
     outputState = {
         'guesses': [],
         'eventData': [], 
@@ -231,120 +206,145 @@ def processEventFits(events, startEvent, stopEvent, opts):
         'yVals': []
     }
     
-    for i in range(startEvent, stopEvent):
-        start = events[i]['time']
-        #sliceLen = 50e-3
-        sliceLen = dt*300. ## Ca2+ events are much longer than 50ms
-        if i+1 < len(events):
-            nextStart = events[i+1]['time']
-            sliceLen = min(sliceLen, nextStart-start)
-                
-        guessLen = events[i]['len']*dt
-        tau = origTau
-        if tau is not None:
-            guessLen += tau*2.
-        #print i, guessLen, tau, events[i]['len']*dt
+    n = 0  ## not all input events will produce output events
+    for chainStart, fits in results:
+        for fit in fits:
+            output[n] = fit['output']
+            n += 1
+            outputState['guesses'].append(fit['guess'])
+            outputState['eventData'].append(fit['eventData'])
+            outputState['indexes'].append(fit['index'])
+            outputState['xVals'].append(fit['times'])
+            outputState['yVals'].append(fit['computed'])
+    
+    outputState['output'] = output[:n]
+        
+    return outputState
+
+
+def fitEventChain(events, chain, startIndexes, opts):
+    ## Fit events chain[0] through chain[1]-1; *startIndexes* are the indexes into
+    ## opts['waveform'] where each event begins.
+    ## Returns a list with one dict per event that could be fitted.
+    fits = []
+    prevFit = None
+    for i, startIndex in zip(range(*chain), startIndexes):
+        fit = fitEvent(events, i, startIndex, opts, prevFit if opts.get('warmStart', False) else None)
+        if fit is not None:
+            fits.append(fit)
+            prevFit = fit['fit']
+    return fits
 
-        #sliceLen = 50e-3
-        sliceLen = guessLen
-        if i+1 < len(events):  ## cut slice back if there is another event coming up
-            nextStart = events[i+1]['time']
-            sliceLen = min(sliceLen, nextStart-start)
-        
-        
-        ## Figure out from where to pull waveform data that will be fitted
-        startIndex = np.argwhere(tvals>=start)[0][0]
-        stopIndex = startIndex + int(sliceLen/dt)
-        eventData = waveform[startIndex:stopIndex]
-        times = tvals[startIndex:stopIndex]
-        #print i, startIndex, stopIndex, dt
-        if len(times) < 4:  ## PSP fit requires at least 4 points; skip this one
-            offset += 1
-            continue
-        
-        ## reconvolve this chunk of the signal if it was previously deconvolved
-        if tau is not None:
-            eventData = functions.expReconvolve(eventData, tau=tau, dt=dt)
-        #print i, len(eventData)
-        ## Make guesses as to the shape of the event
-        mx = eventData.max()
-        mn = eventData.min()
-        if mx > -mn:
-            peakVal = mx
+
+def fitEvent(events, i, startIndex, opts, prevFit=None):
+    ## Fit a single event. If *prevFit* is given, its rise and decay taus are used
+    ## as the initial guess. Returns None if there is not enough data to fit.
+    dt = opts['dt']
+    origTau = opts['tau']
+    multiFit = opts['multiFit']
+    waveform = opts['waveform']
+    tvals = opts['tvals']
+    
+    start = events[i]['time']
+    guessLen = events[i]['len']*dt
+    tau = origTau
+    if tau is not None:
+        guessLen += tau*2.
+    #print i, guessLen, tau, events[i]['len']*dt
+
+    sliceLen = guessLen
+    if i+1 < len(events):  ## cut slice back if there is another event coming up
+        nextStart = events[i+1]['time']
+        sliceLen = min(sliceLen, nextStart-start)
+    
+    
+    ## Figure out from where to pull waveform data that will be fitted
+    stopIndex = startIndex + int(sliceLen/dt)
+    eventData = waveform[startIndex:stopIndex]
+    times = tvals[startIndex:stopIndex]
+    #print i, startIndex, stopIndex, dt
+    if len(times) < 4:  ## PSP fit requires at least 4 points; skip this one
+        return None
+    
+    ## reconvolve this chunk of the signal if it was previously deconvolved
+    if tau is not None:
+        eventData = functions.expReconvolve(eventData, tau=tau, dt=dt)
+    #print i, len(eventData)
+    ## Make guesses as to the shape of the event
+    mx = eventData.max()
+    mn = eventData.min()
+    if mx > -mn:
+        peakVal = mx
+    else:
+        peakVal = mn
+    guessAmp = peakVal * 2  ## fit converges more reliably if we start too large
+    guessRise = guessLen/4.
+    guessDecay = guessLen/2.
+    guessStart = times[0]
+    
+    zc = functions.zeroCrossingEvents(eventData - (peakVal/3.))
+    ## eliminate events going the wrong direction
+    if len(zc) > 0:
+        if guessAmp > 0:
+            zc = zc[zc['peak']>0]
         else:
-            peakVal = mn
-        guessAmp = peakVal * 2  ## fit converges more reliably if we start too large
-        guessRise = guessLen/4.
-        guessDecay = guessLen/2.
-        guessStart = times[0]
-        
-        zc = functions.zeroCrossingEvents(eventData - (peakVal/3.))
-        ## eliminate events going the wrong direction
-        if len(zc) > 0:
-            if guessAmp > 0:
-                zc = zc[zc['peak']>0]
-            else:
-                zc = zc[zc['peak']<0]
-        #print zc    
-        ## measure properties for the largest event within 10ms of start
-        zc = zc[zc['index'] < 10e-3/dt]
-        if len(zc) > 0:
-            if guessAmp > 0:
-                zcInd = np.argmax(zc['sum']) ## the largest event in this clip
-            else:
-                zcInd = np.argmin(zc['sum']) ## the largest event in this clip
-            zcEv = zc[zcInd]
-            #guessLen = dt*zc[zcInd]['len']
-            guessRise = .1e-3 #dt*zcEv['len'] * 0.2
-            guessDecay = dt*zcEv['len'] * 0.8 
-            guessStart = times[0] + dt*zcEv['index'] - guessRise*3.
-            
-            ## cull down the data set if possible
-            cullLen = zcEv['index'] + zcEv['len']*3
-            if len(eventData) > cullLen:
-                eventData = eventData[:cullLen]
-                times = times[:cullLen]
-                
-            
-        ## fitting to exponential rise * decay
-        ## parameters are [amplitude, x-offset, rise tau, fall tau]
-        guess = [guessAmp, guessStart, guessRise, guessDecay]
-        #guess = [amp, times[0], guessLen/4., guessLen/2.]  ## careful! 
-        bounds = [
-            sorted((guessAmp * 0.1, guessAmp)),
-            sorted((guessStart-min(guessRise, 0.01), guessStart+guessRise*2)), 
-            sorted((dt*0.5, guessDecay)),
-            sorted((dt*0.5, guessDecay * 50.))
-        ]
-        yVals = eventData.view(np.ndarray)
-        
-        fit = functions.fitPsp(times, yVals, guess=guess, bounds=bounds, multiFit=multiFit)
-        
-        computed = functions.pspFunc(fit, times)
-        peakTime = functions.pspMaxTime(fit[2], fit[3])
-        diff = (yVals - computed)
-        err = (diff**2).sum()
-        fracError = diff.std() / computed.std()
-        lengthOverDecay = (times[-1] - fit[1]) / fit[3]  # ratio of (length of data that was fit : decay constant)
-        output[i-offset] = tuple(events[i]) + tuple(fit) + (peakTime, err, fracError, lengthOverDecay)
-        #output['fitTime'] += output['time']
+            zc = zc[zc['peak']<0]
+    #print zc    
+    ## measure properties for the largest event within 10ms of start
+    zc = zc[zc['index'] < 10e-3/dt]
+    if len(zc) > 0:
+        if guessAmp > 0:
+            zcInd = np.argmax(zc['sum']) ## the largest event in this clip
+        else:
+            zcInd = np.argmin(zc['sum']) ## the largest event in this clip
+        zcEv = zc[zcInd]
+        #guessLen = dt*zc[zcInd]['len']
+        guessRise = .1e-3 #dt*zcEv['len'] * 0.2
+        guessDecay = dt*zcEv['len'] * 0.8 
+        guessStart = times[0] + dt*zcEv['index'] - guessRise*3.
+        
+        ## cull down the data set if possible
+        cullLen = zcEv['index'] + zcEv['len']*3
+        if len(eventData) > cullLen:
+            eventData = eventData[:cullLen]
+            times = times[:cullLen]
             
-        #print fit
-        #self.events.append(eventData)
-        
-        outputState['guesses'].append(guess)
-        outputState['eventData'].append(eventData)
-        outputState['indexes'].append(i)
-        outputState['xVals'].append(times)
-        outputState['yVals'].append(computed)
         
+    ## fitting to exponential rise * decay
+    ## parameters are [amplitude, x-offset, rise tau, fall tau]
+    guess = [guessAmp, guessStart, guessRise, guessDecay]
+    #guess = [amp, times[0], guessLen/4., guessLen/2.]  ## careful! 
+    bounds = [
+        sorted((guessAmp * 0.1, guessAmp)),
+        sorted((guessStart-min(guessRise, 0.01), guessStart+guessRise*2)), 
+        sorted((dt*0.5, guessDecay)),
+        sorted((dt*0.5, guessDecay * 50.))
+    ]
+    if prevFit is not None:
+        ## warm start: neighboring events usually have similar kinetics
+        guess[2] = np.clip(prevFit[2], *bounds[2])
+        guess[3] = np.clip(prevFit[3], *bounds[3])
+    yVals = eventData.view(np.ndarray)
+    
+    fit = functions.fitPsp(times, yVals, guess=guess, bounds=bounds, multiFit=multiFit)
+    
+    computed = functions.pspFunc(fit, times)
+    peakTime = functions.pspMaxTime(fit[2], fit[3])
+    diff = (yVals - computed)
+    err = (diff**2).sum()
+    fracError = diff.std() / computed.std()
+    lengthOverDecay = (times[-1] - fit[1]) / fit[3]  # ratio of (length of data that was fit : decay constant)
+    
+    return {
+        'index': i,
+        'fit': tuple(fit),
+        'output': tuple(events[i]) + tuple(fit) + (peakTime, err, fracError, lengthOverDecay),
+        'guess': guess,
+        'eventData': eventData,
+        'times': times,
+        'computed': computed,
+    }
 
-    if offset > 0:
-        output = output[:-offset]
-        
-    outputState['output'] = output
-        
-    return outputState
 
 class CaEventFitter(EventFitter):
     nodeName="CaEventFitter"
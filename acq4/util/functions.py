@@ -10,6 +10,7 @@ siFormat / siEval  - functions for dealing with numbers in SI notation
 downsample - multidimensional downsampling by mean
 rmsMatch / fastRmsMatch - recursive template matching
 makeDispMap / matchDistortImg - for measuring and correcting motion/distortion between two images
+makeDispMapFFT - fast tiled phase-correlation version of makeDispMap
 
 
 """
@@ -28,6 +29,10 @@ import scipy.signal, scipy.ndimage, scipy.optimize
 import numpy.ma
 from acq4.util.debug import *
 import numpy as np
+try:
+    import scipy.fft as fftpack  ## faster than numpy.fft, and keeps float32 precision
+except ImportError:
+    fftpack = np.fft
 
 try:
     import scipy.weave as weave
@@ -458,6 +463,10 @@ def downsample(data, n, axis=0, xvals='subsample'):
                 info[axis]['values'] = info[axis]['values'][::n][:nPts]
             elif xvals == 'downsample':
                 info[axis]['values'] = downsample(info[axis]['values'], n)
+        elif 'values_start' in info[axis]:
+            if xvals == 'downsample':
+                info[axis]['values_start'] += info[axis]['values_step'] * (n-1) * 0.5
+            info[axis]['values_step'] *= n
         return MetaArray(d2, info=info)
     
         
@@ -1290,6 +1299,163 @@ def makeDispMap(im1, im2, maxDist=10, searchRange=None, normBlur=5.0, matchSize=
     return (matchOffset, bestMatch)
 
 
+def makeDispMapFFT(im1, im2, tileSize=64, stride=None, maxDist=None, subpixel=True, fullRes=True):
+    """Fast, vectorized alternative to makeDispMap using phase correlation on tiles.
+    Return a tuple (displacement, goodness).
+
+    Both images are divided into square tiles of *tileSize* pixels spaced *stride*
+    pixels apart (default tileSize/2). For each pair of tiles, the displacement is
+    taken from the peak of the phase correlation (the inverse FFT of the
+    normalized cross-power spectrum). Displacements follow the makeDispMap
+    convention: im2[p] ~= im1[p - displacement[p]], with the row displacement in
+    [..., 0] and the column displacement in [..., 1]. Unlike makeDispMap, goodness
+    is the relative height of the correlation peak (about 0 to 1; *higher* is better).
+
+    maxDist limits the search to displacements of at most this many pixels along
+    each axis (displacements must always be less than tileSize/2).
+    If subpixel is True, tiles that are displaced by a pixel or more are re-cut
+    at the whole-pixel displacement found in a first pass, and the remaining
+    fraction of a pixel is estimated by fitting a parabola through the
+    correlation peak and its neighbors.
+    If fullRes is True, the per-tile results are linearly interpolated between
+    tile centers to give maps with the same shape as the images (as returned by
+    makeDispMap); otherwise arrays with one value per tile are returned.
+    """
+    im1 = np.asarray(im1, dtype=np.float32)
+    im2 = np.asarray(im2, dtype=np.float32)
+    if im1.shape != im2.shape or im1.ndim != 2:
+        raise ValueError("Images must be 2D and have the same shape (got %s and %s)" % (im1.shape, im2.shape))
+    tileSize = int(min(tileSize, im1.shape[0], im1.shape[1]))
+    if stride is None:
+        stride = max(1, tileSize // 2)
+    ny = (im1.shape[0] - tileSize) // stride + 1
+    nx = (im1.shape[1] - tileSize) // stride + 1
+
+    ## 2D Hann window reduces the edge effects of the (circular) FFT
+    win = np.hanning(tileSize).astype(np.float32)
+    win = win[:, None] * win[None, :]
+
+    ## displacement of each correlation bin (bins past tileSize/2 wrap around to negative)
+    shifts = np.arange(tileSize)
+    shifts[shifts > tileSize // 2] -= tileSize
+    mask = None
+    if maxDist is not None:
+        outOfRange = abs(shifts) > maxDist
+        mask = outOfRange[:, None] | outOfRange[None, :]
+
+    disp = np.empty((ny, nx, 2), dtype=np.float32)
+    goodness = np.empty((ny, nx), dtype=np.float32)
+    cols = np.arange(nx) * stride
+
+    def spectrum(tiles):
+        tiles = tiles - tiles.mean(axis=(1, 2), keepdims=True)
+        return fftpack.rfft2(tiles * win)
+
+    ## process one row of tiles at a time to bound memory use
+    for i in range(ny):
+        y = i * stride
+        rgn1 = im1[y:y+tileSize]
+        rgn2 = im2[y:y+tileSize]
+        F1 = spectrum(np.lib.stride_tricks.as_strided(rgn1, shape=(nx, tileSize, tileSize),
+                                                      strides=(rgn1.strides[1] * stride,) + rgn1.strides))
+        F2 = spectrum(np.lib.stride_tricks.as_strided(rgn2, shape=(nx, tileSize, tileSize),
+                                                      strides=(rgn2.strides[1] * stride,) + rgn2.strides))
+        dy, dx, fy, fx, good = _phaseCorrelationPeak(F1, F2, shifts, mask)
+
+        if subpixel:
+            ## Windowed tiles that overlap only partially bias the peak toward zero
+            ## displacement. For tiles that are displaced by a pixel or more, the
+            ## tiles are re-cut at the whole-pixel displacement, leaving only a small
+            ## residual, which the parabolic fit estimates well. Near the image
+            ## edges, the im1 tile is moved instead of (or as well as) the im2 tile.
+            redo = (dy != 0) | (dx != 0)
+            if redo.any():
+                ry, rx = dy[redo], dx[redo]
+                y2 = np.clip(y + ry, 0, im2.shape[0] - tileSize)
+                x2 = np.clip(cols[redo] + rx, 0, im2.shape[1] - tileSize)
+                y1 = np.clip(y2 - ry, 0, im1.shape[0] - tileSize)
+                x1 = np.clip(x2 - rx, 0, im1.shape[1] - tileSize)
+                G1 = F1[redo]
+                moved = (y1 != y) | (x1 != cols[redo])
+                if moved.any():
+                    G1[moved] = spectrum(_cutTiles(im1, y1[moved], x1[moved], tileSize))
+                G2 = spectrum(_cutTiles(im2, y2, x2, tileSize))
+                ry, rx, rfy, rfx, rgood = _phaseCorrelationPeak(G1, G2, shifts, None)
+                dy[redo] = (y2 - y1) + ry
+                dx[redo] = (x2 - x1) + rx
+                fy[redo] = rfy
+                fx[redo] = rfx
+                good[redo] = rgood
+            dy = dy + fy
+            dx = dx + fx
+
+        disp[i, :, 0] = dy
+        disp[i, :, 1] = dx
+        goodness[i] = good
+
+    if not fullRes:
+        return disp, goodness
+
+    center = (tileSize - 1) / 2.
+    disp = _interpTileGrid(disp, im1.shape, center, stride)
+    goodness = _interpTileGrid(goodness, im1.shape, center, stride)
+    return disp, goodness
+
+
+def _cutTiles(im, ys, xs, tileSize):
+    """Return the tiles of *im* with top-left corners at (ys[i], xs[i])."""
+    inds = np.arange(tileSize)
+    return im[(ys[:, None] + inds)[:, :, None], (xs[:, None] + inds)[:, None, :]]
+
+
+def _phaseCorrelationPeak(F1, F2, shifts, mask):
+    """Return (dy, dx, fy, fx, goodness) for each pair of tile spectra in F1, F2
+    (see makeDispMapFFT). dy, dx are the whole-pixel displacements and fy, fx the
+    sub-pixel corrections from a parabolic fit around the correlation peak."""
+    n = F1.shape[0]
+    tileSize = len(shifts)
+    cps = F2 * F1.conj()
+    ## Only partially whiten the spectrum: full normalization gives equal weight
+    ## to noisy high-frequency bins, which badly biases the sub-pixel estimate.
+    amp = np.sqrt(np.abs(cps))
+    cps /= amp + 1e-12
+    scale = amp.mean(axis=(1, 2)) + 1e-12  ## peak height for a perfect match
+    corr = fftpack.irfft2(cps, s=(tileSize, tileSize))
+    if mask is not None:
+        corr[:, mask] = -np.inf
+
+    inds = np.arange(n)
+    peak = corr.reshape(n, -1).argmax(axis=1)
+    py, px = peak // tileSize, peak % tileSize
+    c0 = corr[inds, py, px]
+
+    frac = []
+    for cm, cp in ((corr[inds, (py-1) % tileSize, px], corr[inds, (py+1) % tileSize, px]),
+                   (corr[inds, py, (px-1) % tileSize], corr[inds, py, (px+1) % tileSize])):
+        denom = cm - 2 * c0 + cp
+        with np.errstate(invalid='ignore', divide='ignore'):
+            off = np.where(np.isfinite(denom) & (denom < 0), 0.5 * (cm - cp) / denom, 0.0)
+        frac.append(np.clip(off, -0.5, 0.5))
+
+    return shifts[py], shifts[px], frac[0], frac[1], c0 / scale
+
+
+def _interpTileGrid(grid, shape, center, stride):
+    """Linearly interpolate *grid* (values at tile centers center + i*stride along
+    both axes) to an array of *shape* along the first two axes. Values beyond the
+    outermost tile centers are held constant."""
+    for ax in (0, 1):
+        n = grid.shape[ax]
+        pos = np.clip((np.arange(shape[ax]) - center) / float(stride), 0, n - 1)
+        i0 = np.floor(pos).astype(int)
+        i1 = np.minimum(i0 + 1, n - 1)
+        w = (pos - i0).astype(grid.dtype).reshape((-1,) + (1,) * (grid.ndim - ax - 1))
+        g0 = np.take(grid, i0, axis=ax)
+        g1 = np.take(grid, i1, axis=ax)
+        grid = g0 * (1 - w) + g1 * w
+    return grid
+
+
             
 def matchDistortImg(im1, im2, scale=4, maxDist=40, mapBlur=30, showProgress=False):
     """Distort im2 to fit optimally over im1. Searches scaled-down images first to determine range"""
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+"""
+gcpolicy.py - Scheduling of garbage collection around timing-sensitive work
+Distributed under MIT/X11 license. See license.txt for more infomation.
+
+A full collection of a large heap (many MetaArrays and Qt objects) can take
+tens of milliseconds. Rather than calling gc.collect() at arbitrary points,
+code that runs task sequences uses the shared collector:
+
+    gcc = gcpolicy.collector()
+    gcc.beginSequence()              # raise thresholds while trials are running
+    ...
+    gcc.collectInGap(slack, prof)    # full collection only if it fits in the gap
+    gcc.reportPauses(prof)           # automatic collections since the last report
+    ...
+    stats = gcc.endSequence()        # restore thresholds; collect once idle
+    print(gcc.formatStats(stats))    # collections and pauses during the sequence
+"""
+
+import gc, threading, collections
+from acq4.util import Qt
+import acq4.util.ptime as ptime
+
+
+class GarbageCollector(Qt.QObject):
+    """Decides when to run garbage collection.
+
+    * During sequences, the generational thresholds are raised so that the
+      interpreter rarely starts a full collection on its own in the middle of
+      a trial.
+    * Between trials, a full collection is run only if the recent cost of a
+      full collection (times *margin*) fits within the time remaining before
+      the next trial must start.
+    * Otherwise, collection is deferred until the application has been idle
+      (no sequence running) for *idleDelay* seconds. With the raised
+      thresholds the interpreter almost never collects the oldest generation
+      by itself, so after *maxDeferred* consecutive trials without a full
+      collection, one is run in the next gap regardless of its cost.
+
+    The durations of all collections (including automatic ones, on python
+    versions that support gc.callbacks) are recorded. Each one can be reported
+    through a Profiler, and totals for each sequence are returned by
+    endSequence() (see sequenceStats()).
+    """
+    sigRequestIdle = Qt.Signal()
+
+    def __init__(self, sequenceThresholds=(10000, 50, 1000), margin=2.0, idleDelay=0.5, maxDeferred=20):
+        Qt.QObject.__init__(self)
+        self.sequenceThresholds = sequenceThresholds
+        self.margin = margin
+        self.idleDelay = idleDelay
+        self.maxDeferred = maxDeferred
+        self.lock = threading.RLock()
+        self._sequences = 0
+        self._savedThresholds = None
+        self._fullTimes = collections.deque(maxlen=5)  # durations of recent full collections
+        self._deferred = 0  # gaps since the last full collection
+        ## (generation, duration) of automatic collections not yet reported. The
+        ## gc callback may run in any thread (including, re-entrantly, one that
+        ## holds this lock), so the lock must be reentrant.
+        self._pauses = []
+        self._pauseLock = threading.RLock()
+        self._autoStart = None
+        self._manual = False
+        self._stats = self._newStats()
+
+        self._idleTimer = Qt.QTimer()
+        self._idleTimer.setSingleShot(True)
+        self._idleTimer.timeout.connect(self._idleCollect)
+        self.sigRequestIdle.connect(self._startIdleTimer)
+
+        if hasattr(gc, 'callbacks'):
+            gc.callbacks.append(self._gcCallback)
+
+    def beginSequence(self):
+        """Tune thresholds for a run of timing-sensitive trials. Calls may be nested."""
+        with self.lock:
+            self._sequences += 1
+            if self._sequences == 1:
+                self._savedThresholds = gc.get_threshold()
+                gc.set_threshold(*self.sequenceThresholds)
+                with self._pauseLock:
+                    self._stats = self._newStats()
+
+    def endSequence(self):
+        """Restore the thresholds that were in effect before beginSequence() and
+        schedule a collection for when the application becomes idle.
+        Returns the sequenceStats() of the outermost sequence, or None if this
+        ends a nested one."""
+        stats = None
+        with self.lock:
+            self._sequences = max(0, self._sequences - 1)
+            if self._sequences == 0 and self._savedThresholds is not None:
+                gc.set_threshold(*self._savedThresholds)
+                self._savedThresholds = None
+                stats = self.sequenceStats()
+        self.requestIdleCollect()
+        return stats
+
+    @staticmethod
+    def _newStats():
+        ## [count, total seconds, max seconds] for each kind of collection
+        return {'full': [0, 0.0, 0.0], 'young': [0, 0.0, 0.0], 'automatic': [0, 0.0, 0.0],
+                'deferred': 0, 'forced': 0}
+
+    def _addStat(self, kind, dt):
+        with self._pauseLock:
+            st = self._stats[kind]
+            st[0] += 1
+            st[1] += dt
+            st[2] = max(st[2], dt)
+
+    def sequenceStats(self):
+        """Return the collections since the current (or last) sequence began:
+        {'full': (count, total, max), 'young': ..., 'automatic': ..., 'deferred': n, 'forced': n}.
+        'full' and 'young' are collections run by this object (in seconds), 'automatic'
+        are those started by the interpreter, 'deferred' counts gaps that were too short
+        for a full collection, and 'forced' counts full collections run because
+        *maxDeferred* was reached."""
+        with self._pauseLock:
+            stats = {}
+            for k, v in self._stats.items():
+                stats[k] = tuple(v) if isinstance(v, list) else v
+            return stats
+
+    @staticmethod
+    def formatStats(stats):
+        """Return a one-line description of *stats* (see sequenceStats())."""
+        parts = []
+        for kind in ('full', 'young', 'automatic'):
+            n, total, mx = stats[kind]
+            parts.append('%d %s (%0.1f ms total, max %0.1f ms)' % (n, kind, total*1000, mx*1000))
+        return 'Garbage collections: %s; %d full collections deferred, %d forced.' % (
+            ', '.join(parts), stats['deferred'], stats['forced'])
+
+    def inSequence(self):
+        return self._sequences > 0
+
+    def estimatedFullTime(self):
+        """Return the expected duration of a full collection, based on recent ones,
+        or None if none has been measured yet."""
+        with self.lock:
+            if len(self._fullTimes) == 0:
+                return None
+            return max(self._fullTimes)
+
+    def collect(self, generation=2, prof=None):
+        """Run a collection now, record its duration, and return the duration."""
+        with self.lock:
+            self._manual = True
+            try:
+                start = ptime.time()
+                gc.collect(generation)
+                dt = ptime.time() - start
+            finally:
+                self._manual = False
+            if generation == 2:
+                self._fullTimes.append(dt)
+                self._deferred = 0
+        self._addStat('full' if generation == 2 else 'young', dt)
+        if prof is not None:
+            ## the profiler measures the time since its previous mark
+            prof.mark('gc collect (gen %d)' % generation)
+        return dt
+
+    def collectInGap(self, slack, prof=None):
+        """Called between trials with *slack* seconds remaining until the next
+        trial should start. Runs a full collection if it is expected to fit, or
+        if the last *maxDeferred* gaps were too short for one; otherwise only the
+        youngest generation is collected and the full collection is deferred
+        until idle. Returns True if a full collection ran."""
+        est = self.estimatedFullTime()
+        with self.lock:
+            overdue = self._deferred >= self.maxDeferred
+        if est is None or est * self.margin < slack or overdue:
+            if overdue and not (est is None or est * self.margin < slack):
+                with self._pauseLock:
+                    self._stats['forced'] += 1
+            self.collect(2, prof)
+            return True
+        self.collect(0, prof)
+        with self.lock:
+            self._deferred += 1
+        with self._pauseLock:
+            self._stats['deferred'] += 1
+        self.requestIdleCollect()
+        return False
+
+    def requestIdleCollect(self):
+        """Run a full collection after the application has been idle for a while.
+        May be called from any thread."""
+        self.sigRequestIdle.emit()
+
+    def _startIdleTimer(self):
+        self._idleTimer.start(int(self.idleDelay * 1000))
+
+    def _idleCollect(self):
+        if self.inSequence():
+            ## still busy; endSequence() will ask again
+            return
+        self.collect(2)
+
+    def _gcCallback(self, phase, info):
+        ## called by the interpreter around every collection
+        if self._manual:
+            return
+        if phase == 'start':
+            self._autoStart = ptime.time()
+        elif self._autoStart is not None:
+            dt = ptime.time() - self._autoStart
+            self._autoStart = None
+            with self._pauseLock:
+                self._pauses.append((info.get('generation', -1), dt))
+                if len(self._pauses) > 1000:
+                    del self._pauses[:-1000]
+            self._addStat('automatic', dt)
+
+    def reportPauses(self, prof=None):
+        """Return the list of (generation, seconds) for automatic collections that
+        occurred since the last call, and report their total (via prof.mark) if
+        *prof* is given."""
+        with self._pauseLock:
+            pauses, self._pauses = self._pauses, []
+        if len(pauses) > 0 and prof is not None:
+            total = sum([dt for gen, dt in pauses])
+            prof.mark('gc pauses: %d collections, %0.2f ms (max %0.2f ms)' % (len(pauses), total*1000, max([dt for gen, dt in pauses])*1000))
+        return pauses
+
+
+_collector = None
+
+def collector():
+    """Return the shared GarbageCollector. The first call must be made from the
+    GUI thread."""
+    global _collector
+    if _collector is None:
+        _collector = GarbageCollector()
+    return _collector
@@ -11,7 +11,7 @@ entering python code used to generate waveforms. Functions available
 for evaluation are provided in waveforms.py.
 """
 
-import sys, types, re
+import sys, types, re, hashlib, threading
 import numpy as np
 from acq4.util import Qt
 from collections import OrderedDict
@@ -27,6 +27,55 @@ import six
 
 import acq4.util.units as units
 
+class WaveformCache(object):
+    """Process-wide LRU cache of generated waveforms.
+    
+    Waveforms are keyed by content (a hash of the function text, sample rate, 
+    number of samples, parameter values, offset, and extra eval names) so that
+    identical stimuli are shared between generators, task runs, and sequence 
+    previews. The total memory used by cached arrays is limited to *maxSize* bytes.
+    Cached arrays are made read-only, since they may be returned to many callers.
+    """
+    def __init__(self, maxSize=128e6):
+        self.maxSize = maxSize
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()  # key: (item, size)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        
+    def get(self, key):
+        with self.lock:
+            if key not in self.cache:
+                self.misses += 1
+                return None
+            item = self.cache.pop(key)
+            self.cache[key] = item  ## move to end (most recently used)
+            self.hits += 1
+            return item[0]
+        
+    def set(self, key, item):
+        ret = item[0]
+        size = ret.nbytes if isinstance(ret, np.ndarray) else 0
+        if size > self.maxSize:
+            return
+        with self.lock:
+            if key in self.cache:
+                return
+            self.cache[key] = (item, size)
+            self.size += size
+            while self.size > self.maxSize and len(self.cache) > 0:
+                k, (old, oldSize) = self.cache.popitem(last=False)
+                self.size -= oldSize
+        
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+            self.size = 0
+            
+waveformCache = WaveformCache()
+
+
 class StimGenerator(Qt.QWidget):
     
     sigDataChanged = Qt.Signal()        ## Emitted when the output of getSingle() is expected to have changed
@@ -50,9 +99,11 @@ class StimGenerator(Qt.QWidget):
         
         self.pSpace = None    ## cached sequence parameter space
         
-        self.cache = {}       ## cached waveforms
+        self.cache = {}       ## waveforms generated since the last change (see also waveformCache)
         self.cacheRate = None
         self.cacheNPts = None
+        self._compiled = None ## (function string, hash, code) of the compiled function
+        self._ns = {False: None, True: None}  ## evaluation namespaces (single, batch)
 
         
         
@@ -151,6 +202,7 @@ class StimGenerator(Qt.QWidget):
 
     def clearCache(self):
         self.cache = {}
+        self._ns = {False: None, True: None}
     
     def functionString(self):
         return str(self.ui.functionText.toPlainText())
@@ -374,92 +426,244 @@ class StimGenerator(Qt.QWidget):
         """
         Return a single generated waveform (possibly cached) with the given sample rate
         number of samples, and sequence parameters.        
+        
+        Waveforms are cached in the shared waveformCache; the returned array may be
+        shared with other callers and is read-only. Use a copy to modify it.
         """
         if params is None:
             params = {}
+        self._checkCacheShape(rate, nPts)
+        
+        values = self._paramValues(params)
+        key = self._cacheKey(rate, nPts, values)
+        hit = self._cacheGet(key)
+        if hit is not None:
+            ret, msg = hit
+            self.setError(msg)
+            return ret
+        
+        ## update the persistent namespace with rate, nPts, and the parameter values
+        ns, arg, fixed = self._namespace(batch=False)
+        arg.clear()
+        arg['rate'] = rate
+        arg['nPts'] = nPts
+        self._setNames(ns, fixed, [('rate', rate), ('nPts', nPts)] + list(values.items()))
+        
+        ret = self._evaluate(ns, nPts)
             
-        if self.cacheRate != rate or self.cacheNPts != nPts:
-            self.clearCache()
-            
-        paramKey = tuple(params.items())
-        if paramKey in self.cache:
-            return self.cache[paramKey]
-            
-        self.cacheRate = rate
-        self.cacheNPts = nPts
-            
-        ## create namespace with generator functions. 
-        ##   - iterates over all functions provided in waveforms module
-        ##   - wrap each function to automatically provide rate and nPts arguments
-        ns = {}
-        #arg = {'rate': rate * self.timeScale, 'nPts': nPts}
-        arg = {'rate': rate, 'nPts': nPts}
-        ns.update(arg)  ## copy rate and nPts to eval namespace
-        for i in dir(waveforms):
-            obj = getattr(waveforms, i)
-            if type(obj) is types.FunctionType:
-                ns[i] = self.makeWaveFunction(i, arg)
-        
-        ## add current sequence parameter values into namespace
+        if isinstance(ret, ndarray):
+            #ret *= self.scale
+            ret += self.offset
+            #print "===eval===", ret.min(), ret.max(), self.scale
+        elif ret is not None:
+            raise TypeError("Function must return ndarray or None.")
+        
+        msg = arg.get('message', None)
+        self.setError(msg)
+        
+        self._cacheSet(key, (ret, msg))
+        return ret
+    
+    def getBatch(self, rate, nPts, paramList):
+        """
+        Return a list of waveforms, one for each dict of sequence parameter indexes in 
+        *paramList*. The result is the same as calling getSingle() for each item, but 
+        when possible the function is evaluated once for the entire batch with the
+        sequence parameters given as column arrays. As with getSingle(), the returned
+        arrays are read-only.
+        """
+        paramList = [{} if p is None else p for p in paramList]
+        self._checkCacheShape(rate, nPts)
+        waves = [None] * len(paramList)
+        todo = []
+        for i, params in enumerate(paramList):
+            values = self._paramValues(params)
+            key = self._cacheKey(rate, nPts, values)
+            hit = self._cacheGet(key)
+            if hit is None:
+                todo.append((i, values, key))
+            else:
+                waves[i] = hit[0]
+        
+        if len(todo) > 1 and self._vectorizable():
+            try:
+                batch = self._evaluateBatch(rate, nPts, [t[1] for t in todo])
+            except Exception:
+                batch = None
+            if batch is not None:
+                rows, msg = batch
+                for (i, values, key), row in zip(todo, rows):
+                    ## copy so that each cached row does not keep the whole batch alive
+                    row = row.copy()
+                    waves[i] = row
+                    self._cacheSet(key, (row, msg))
+                self.setError(msg)
+                todo = []
+        
+        ## anything that could not be vectorized is generated one at a time
+        for i, values, key in todo:
+            waves[i] = self.getSingle(rate, nPts, paramList[i])
+        return waves
+    
+    def _paramValues(self, params):
+        ## Return an ordered dict of the current value of each sequence parameter
         seq = self.paramSpace() # -- this is where the Laser bug was happening -- seq becomes 'Pulse_sum', but params was {'power.Pulse_sum': x}, so the default value is always used instead (fixed by removing 'power.' before the params are sent to stimGenerator, but perhaps there is a better place to fix this)
+        values = OrderedDict()
         for k in seq:
             if k in params:  ## select correct value from sequence list
                 try:
-                    ns[k] = float(seq[k][1][params[k]])
+                    values[k] = float(seq[k][1][params[k]])
                 except IndexError:
                     print("Requested value %d for param %s, but only %d in the param list." % (params[k], str(k), len(seq[k][1])))
                     raise
             else:  ## just use single value
-                ns[k] = float(seq[k][0])
-
-        ## add units into namespace
-        ns.update(units.allUnits)
-        
-        ## add extra parameters to namespace
-        ns.update(self.extraParams)
-
-        ## evaluate and return
+                values[k] = float(seq[k][0])
+        return values
+    
+    def _cacheKey(self, rate, nPts, values):
+        ## Waveforms are keyed by content: the function text, all values that
+        ## can appear in its namespace, and the offset. Returns None if the
+        ## key can not be hashed (in which case the waveform is not cached).
+        funcHash = self._compile()[1]
+        try:
+            key = (funcHash, float(rate), int(nPts), tuple(values.items()), self.offset, tuple(sorted(self.extraParams.items())))
+            hash(key)
+        except TypeError:
+            return None
+        return key
+    
+    def _checkCacheShape(self, rate, nPts):
+        if self.cacheRate != rate or self.cacheNPts != nPts:
+            self.cache = {}
+        self.cacheRate = rate
+        self.cacheNPts = nPts
+    
+    def _cacheGet(self, key):
+        ## Waveforms generated since the last change are also kept by this generator,
+        ## so that they stay alive (and keep their identity) until clearCache().
+        if key is None:
+            return None
+        hit = self.cache.get(key, None)
+        if hit is None:
+            hit = waveformCache.get(key)
+            if hit is not None:
+                self.cache[key] = hit
+        return hit
+    
+    def _cacheSet(self, key, item):
+        if isinstance(item[0], ndarray):
+            item[0].flags.writeable = False
+        if key is None:
+            return
+        self.cache[key] = item
+        waveformCache.set(key, item)
+    
+    def _compile(self):
+        ## Compile the function string once, rather than on every evaluation.
+        ## Returns (function string, hash, (mode, code)).
         fn = self.functionString()
-        
-        ## build global namespace with numpy imported
-        #gns = {}
-        ns['np'] = np
-        
-        #print "function: '%s'" % fn
-        if fn.strip() == '':
-            ret = np.zeros(nPts)
-        else:
-            try:  # first try eval() without line breaks for backward compatibility
-                ret = eval(fn.replace('\n', ''), ns, {})
-            except SyntaxError:  # next try exec() as contents of a function
-                try:
+        if self._compiled is None or self._compiled[0] != fn:
+            if fn.strip() == '':
+                code = None
+            else:
+                try:  # first try eval() without line breaks for backward compatibility
+                    code = ('eval', compile(fn.replace('\n', ''), '<stimulus>', 'eval'))
+                except SyntaxError:  # next try exec() as contents of a function
                     run = "\noutput=fn()\n"
-                    code = "def fn():\n" + "\n".join(["    "+l for l in fn.split('\n')]) + run
-                    #print "--- Code: ---"
-                    #print code
-                    #print "-------------"
-                    lns = {}
-                    exec(code, ns, lns)
-                    ret = lns['output']
-                except SyntaxError as err:
-                    err.lineno -= 1
-                    raise err
-                
-            
-        if isinstance(ret, ndarray):
-            #ret *= self.scale
-            ret += self.offset
-            #print "===eval===", ret.min(), ret.max(), self.scale
-        elif ret is not None:
-            raise TypeError("Function must return ndarray or None.")
-        
-        if 'message' in arg:
-            self.setError(arg['message'])
-        else:
-            self.setError()
-            
-        self.cache[paramKey] = ret
-        return ret
+                    src = "def fn():\n" + "\n".join(["    "+l for l in fn.split('\n')]) + run
+                    try:
+                        code = ('exec', compile(src, '<stimulus>', 'exec'))
+                    except SyntaxError as err:
+                        err.lineno -= 1
+                        raise err
+            self._compiled = (fn, hashlib.sha1(fn.encode('utf-8')).hexdigest(), code)
+        return self._compiled
+    
+    def _evaluate(self, ns, nPts):
+        code = self._compile()[2]
+        if code is None:
+            return np.zeros(nPts)
+        mode, code = code
+        if mode == 'eval':
+            return eval(code, ns, {})
+        lns = {}
+        exec(code, ns, lns)
+        return lns['output']
+    
+    def _namespace(self, batch):
+        ## Return the (namespace, arg) used to evaluate the function. The namespace is 
+        ## built once and reused; only rate, nPts and parameter values change between calls.
+        ##   - wave functions are wrapped to automatically provide the arg dict
+        ##     (rate, nPts, and any message generated by the function)
+        ##   - units, extra parameters and numpy take precedence over parameter names
+        if self._ns[batch] is None:
+            arg = {}
+            ns = {}
+            for i in dir(waveforms):
+                obj = getattr(waveforms, i)
+                if type(obj) is types.FunctionType and not i.startswith('_'):
+                    if batch:
+                        ns[i] = self.makeBatchFunction(i, arg)
+                    else:
+                        ns[i] = self.makeWaveFunction(i, arg)
+            fixed = set(units.allUnits.keys()) | set(self.extraParams.keys()) | set(['np'])
+            ns.update(units.allUnits)
+            ns.update(self.extraParams)
+            ns['np'] = np
+            self._ns[batch] = (ns, arg, fixed)
+        return self._ns[batch]
+    
+    def _setNames(self, ns, fixed, items):
+        for k, v in items:
+            if k not in fixed:
+                ns[k] = v
+    
+    def _vectorizable(self):
+        ## The function may be evaluated for a whole batch only if every name it 
+        ## uses is a wave function, parameter, unit, rate or nPts. Arithmetic on the
+        ## parameter columns is then elementwise, so each row is identical to the 
+        ## single evaluation.
+        code = self._compile()[2]
+        if code is None:
+            return False
+        names = set()
+        codes = [code[1]]
+        while len(codes) > 0:
+            co = codes.pop()
+            names.update(co.co_names)
+            codes.extend([c for c in co.co_consts if isinstance(c, types.CodeType)])
+        allowed = set([i for i in dir(waveforms) if type(getattr(waveforms, i)) is types.FunctionType and not i.startswith('_')])
+        allowed |= set(self.paramSpace().keys()) | set(units.allUnits.keys()) | set(['rate', 'nPts', 'fn', 'output'])
+        return names.issubset(allowed)
+    
+    def _evaluateBatch(self, rate, nPts, valueList):
+        ## Evaluate the function once with parameters given as (n, 1) columns.
+        ## Returns (list of waveforms, message), or None if the result does not
+        ## have the expected shape or a warning was generated (the message can
+        ## not be attributed to individual rows).
+        n = len(valueList)
+        ns, arg, fixed = self._namespace(batch=True)
+        arg.clear()
+        arg['rate'] = rate
+        arg['nPts'] = nPts
+        arg['batch'] = n
+        items = [('rate', rate), ('nPts', nPts)]
+        for k in valueList[0]:
+            col = np.array([v[k] for v in valueList])
+            if np.all(col == col[0]):
+                items.append((k, col[0]))
+            else:
+                items.append((k, col[:, None]))
+        self._setNames(ns, fixed, items)
+        ret = self._evaluate(ns, nPts)
+        if not isinstance(ret, ndarray) or ret.shape not in [(nPts,), (n, nPts)]:
+            return None
+        if arg.get('message', None):
+            return None
+        if ret.ndim == 1:
+            ret = np.repeat(ret[None, :], n, axis=0)
+        ret += self.offset
+        return list(ret), arg.get('message', None)
         
     def makeWaveFunction(self, name, arg):
         ## Creates a copy of a wave function (such as steps or pulses) with the first parameter filled in
@@ -467,6 +671,14 @@ class StimGenerator(Qt.QWidget):
         obj = getattr(waveforms, name)
         return lambda *args, **kwargs: obj(arg, *args, **kwargs)
         
+    def makeBatchFunction(self, name, arg):
+        ## Like makeWaveFunction, but for evaluating a batch of waveforms at once
+        obj = getattr(waveforms, name)
+        batchFn = waveforms._batchFunctions.get(name, None)
+        if batchFn is None:
+            return lambda *args, **kwargs: waveforms._batchLoop(obj, arg, *args, **kwargs)
+        return lambda *args, **kwargs: batchFn(arg, *args, **kwargs)
+        
 
 
 
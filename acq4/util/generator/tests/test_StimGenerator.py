@@ -0,0 +1,99 @@
+from __future__ import print_function
+import numpy as np
+import pytest
+import acq4.pyqtgraph as pg
+from acq4.util.generator.StimGenerator import StimGenerator, waveformCache
+
+
+rate = 10000.
+nPts = 1000
+
+
+def makeGenerator(function, params):
+    pg.mkQApp()
+    sg = StimGenerator()
+    sg.loadState({'function': function, 'params': params, 'advancedMode': True})
+    return sg
+
+
+def allParams(sg):
+    seqs = sg.listSequences()
+    names = list(seqs.keys())
+    paramList = [{}]
+    for name in names:
+        paramList = [dict(p, **{name: i}) for p in paramList for i in range(len(seqs[name]))]
+    return paramList
+
+
+def cachedMessage(sg, params):
+    key = sg._cacheKey(rate, nPts, sg._paramValues(params))
+    return sg._cacheGet(key)[1]
+
+
+def clearCaches(sg):
+    waveformCache.clear()
+    sg.clearCache()
+
+
+def checkBatch(sg):
+    ## getBatch must return the same waveforms and messages as getSingle
+    paramList = allParams(sg)
+    assert len(paramList) > 1
+
+    clearCaches(sg)
+    singles = []
+    for p in paramList:
+        singles.append((sg.getSingle(rate, nPts, p), cachedMessage(sg, p)))
+        clearCaches(sg)
+
+    batch = sg.getBatch(rate, nPts, paramList)
+    assert len(batch) == len(paramList)
+    for p, (single, msg), wave in zip(paramList, singles, batch):
+        assert np.all(wave == single)
+        assert cachedMessage(sg, p) == msg
+        ## cached waveforms are shared, so they must not be writable
+        assert not wave.flags.writeable
+        with pytest.raises(ValueError):
+            wave[0] = 1
+    return singles
+
+
+def test_batch_vectorized():
+    sg = makeGenerator("pulse(10e-3, width, amp) + 0.5", {
+        'width': {'default': '1e-3', 'sequence': 'list', 'list': '[1e-3, 2e-3, 5e-3]'},
+        'amp': {'default': '1', 'sequence': 'list', 'list': '[1, 2]'},
+    })
+    assert sg._vectorizable()
+    singles = checkBatch(sg)
+    assert all(msg is None for wave, msg in singles)
+
+    ## rows are copies, not views of a single batch array
+    clearCaches(sg)
+    batch = sg.getBatch(rate, nPts, allParams(sg))
+    assert all(w.base is None for w in batch)
+
+
+def test_batch_warnings():
+    ## a zero-width pulse generates a warning for one row only
+    sg = makeGenerator("pulse(10e-3, width, 1)", {
+        'width': {'default': '1e-3', 'sequence': 'list', 'list': '[0, 1e-3, 2e-3]'},
+    })
+    singles = checkBatch(sg)
+    assert singles[0][1] is not None
+    assert singles[1][1] is None
+
+    ## a short period warns for one row, and the next row resets the message
+    sg = makeGenerator("sineWave(period, 1)", {
+        'period': {'default': '1e-2', 'sequence': 'list', 'list': '[1e-4, 1e-2, 2e-2]'},
+    })
+    singles = checkBatch(sg)
+    assert 'Period' in singles[0][1]
+    assert singles[1][1] == ''
+
+
+def test_batch_not_vectorizable():
+    sg = makeGenerator("np.ones(nPts) * abs(amp)", {
+        'amp': {'default': '1', 'sequence': 'list', 'list': '[-1, 2, 3]'},
+    })
+    assert not sg._vectorizable()
+    checkBatch(sg)
@@ -314,4 +314,107 @@ def noise(params, mean, sigma, start=0.0, stop=None):
         stop = nPts-1
 
     d[start:stop] = numpy.random.normal(size=stop-start, loc=mean, scale=sigma)
-    return d
\ No newline at end of file
+    return d
+
+## Batch versions used by StimGenerator.getBatch().
+## Here, any argument may also be a column array of shape (batch, 1) holding one
+## value per waveform; the result has shape (batch, nPts). The output of each row 
+## is identical to calling the single-waveform function with that row's values. 
+## Arguments that can not be batched raise an exception, and the caller falls back 
+## to generating each waveform individually.
+
+def _isColumn(x, n):
+    return isinstance(x, numpy.ndarray) and x.ndim == 2 and x.shape == (n, 1)
+
+def _batchValues(x, n):
+    ## length-n float array from a scalar or a batch column
+    if _isColumn(x, n):
+        return x[:, 0].astype(float)
+    if not isNum(x):
+        raise TypeError("Can not vectorize argument %r" % (x,))
+    return numpy.full(n, x, dtype=float)
+
+def _batchList(x, n, count=1):
+    if _isColumn(x, n) or not isList(x):
+        return [_batchValues(x, n)] * count
+    return [_batchValues(v, n) for v in x]
+
+def _batchRow(x, n, i):
+    ## select the value for one waveform from a (possibly nested) argument
+    if _isColumn(x, n):
+        return float(x[i, 0])
+    if type(x) in (list, tuple):
+        return type(x)([_batchRow(v, n, i) for v in x])
+    return x
+
+def _hasColumn(x, n):
+    if _isColumn(x, n):
+        return True
+    if type(x) in (list, tuple):
+        return any([_hasColumn(v, n) for v in x])
+    return False
+
+def _batchLoop(fn, params, *args, **kwargs):
+    ## generic batch version of fn: call once per waveform
+    n = params['batch']
+    if not _hasColumn(list(args) + list(kwargs.values()), n):
+        return fn(params, *args, **kwargs)
+    rows = []
+    for i in range(n):
+        rowArgs = [_batchRow(a, n, i) for a in args]
+        rowKwargs = dict([(k, _batchRow(v, n, i)) for k, v in kwargs.items()])
+        rows.append(fn(params, *rowArgs, **rowKwargs))
+        if params.get('message', None):
+            ## a warning for one row could be overwritten by the next
+            raise ValueError("Waveform %d generated a warning; can not vectorize." % i)
+    return numpy.vstack(rows)
+
+def _pulseBatch(params, times, widths, values, base=0.0):
+    n = params['batch']
+    nPts = params['nPts']
+    rate = params['rate']
+    times = _batchList(times, n)
+    widths = _batchList(widths, n, len(times))
+    values = _batchList(values, n, len(times))
+    
+    d = numpy.empty((n, nPts))
+    d[:] = _batchValues(base, n)[:, None]
+    for i in range(len(times)):
+        for j in range(n):
+            t1 = int(times[i][j] * rate)
+            wid = int(widths[i][j] * rate)
+            if wid == 0:
+                params['message'] = "WARNING: Pulse width %f is too short for rate %f" % (widths[i][j], rate)
+            if t1+wid >= nPts:
+                params['message'] = "WARNING: Function is longer than generated waveform."
+            d[j, t1:t1+wid] = values[i][j]
+    return d
+
+def _stepsBatch(params, times, values, base=0.0):
+    n = params['batch']
+    nPts = params['nPts']
+    rate = params['rate']
+    if _isColumn(times, n) or not isList(times) or _isColumn(values, n) or not isList(values):
+        raise TypeError("times and values must be lists")
+    times = _batchList(times, n)
+    values = _batchList(values, n)
+    
+    d = numpy.empty((n, nPts))
+    d[:] = _batchValues(base, n)[:, None]
+    for j in range(n):
+        for i in range(1, len(times)):
+            t1 = int(times[i-1][j] * rate)
+            t2 = int(times[i][j] * rate)
+            if t1 == t2:
+                params['message'] = "WARNING: Step width %f is too short for rate %f" % (times[i][j]-times[i-1][j], rate)
+            if t2 >= nPts:
+                params['message'] = "WARNING: Function is longer than generated waveform."
+            d[j, t1:t2] = values[i-1][j]
+        last = int(times[-1][j] * rate)
+        d[j, last:] = values[-1][j]
+    return d
+
+_batchFunctions = {
+    'pulse': _pulseBatch,
+    'steps': _stepsBatch,
+}
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division
+"""
+imagepyramid.py - Multi-resolution, memory-mapped copies of image files
+Distributed under MIT/X11 license. See license.txt for more infomation.
+
+Large images (and mosaics of many camera frames) are slow to load and use a
+lot of memory if every file is read completely. An ImagePyramid stores
+successively 2x-downsampled copies of a file's image data as .npy files in a
+hidden directory next to the data:
+
+    <dir>/.pyramid/<fileName>/pyramid.json
+    <dir>/.pyramid/<fileName>/level1.npy
+    <dir>/.pyramid/<fileName>/level2.npy
+    ...
+
+Level 0 (full resolution) of a MetaArray file is read from the file itself:
+lazily from HDF5 files, memory-mapped from others. The cache then adds only
+about 1/3 of the size of the original data. Level 0 of other image files
+(png, tif, ..) can not be read without decoding the whole image, so it is
+stored in level0.npy.
+
+Levels are memory-mapped when used, so only the rows that are actually
+displayed (or analyzed) are read from disk. The pyramid is rebuilt if the
+source file's size or modification time changes.
+
+    pyr = imagepyramid.forFile(fh)     # load or build the pyramid for a FileHandle
+    pyr.level(2)                       # 4x-downsampled data, memory-mapped
+    pyr.lowRes()                       # small copy for statistics and histograms
+"""
+
+import os, json, shutil, threading
+import numpy as np
+from acq4.pyqtgraph.metaarray import MetaArray
+
+
+dirName = '.pyramid'
+
+
+def cachePath(fileName):
+    """Return the directory used to cache the pyramid of *fileName*."""
+    path, name = os.path.split(os.path.abspath(fileName))
+    return os.path.join(path, dirName, name)
+
+
+def isStack(data):
+    """Return True if the first axis of *data* is a frame (time or z) axis.
+    This uses the same convention as ImageCanvasItem: 3D arrays with 4 or fewer
+    values along the last axis are color images."""
+    return data.ndim == 4 or (data.ndim == 3 and data.shape[2] > 4)
+
+
+def readMetaArray(fileName):
+    """Return the MetaArray stored in *fileName* without reading its data into memory.
+    HDF5 files are read lazily; other MetaArray files are memory-mapped."""
+    with open(fileName, 'rb') as fd:
+        isHDF = fd.read(8) == b'\x89HDF\r\n\x1a\n'
+    if isHDF:
+        return MetaArray(file=fileName, readAllData=False)
+    else:
+        return MetaArray(file=fileName, mmap=True)
+
+
+def downsample2(frame):
+    """Average 2x2 blocks of pixels along the first two axes of *frame*.
+    An odd last row or column is dropped."""
+    h, w = frame.shape[0] // 2, frame.shape[1] // 2
+    d = frame[:h*2, :w*2].reshape((h, 2, w, 2) + frame.shape[2:])
+    out = d.mean(axis=(1, 3))
+    if frame.dtype.kind in 'iu':
+        out = np.round(out)
+    return out.astype(frame.dtype)
+
+
+def levelShapes(shape, minSize):
+    """Return the (rows, cols) of each pyramid level for a frame of *shape*.
+    Levels are added until the smaller side would drop below *minSize*."""
+    shapes = [tuple(shape[:2])]
+    while min(shapes[-1]) >= 2 * minSize:
+        shapes.append((shapes[-1][0] // 2, shapes[-1][1] // 2))
+    return shapes
+
+
+class ImagePyramid(object):
+    """Multi-resolution copy of an image, image stack, or color image stored in
+    the directory *path* (see build()).
+
+    Level 0 holds the full-resolution data; level i is downsampled by 2**i along
+    the two spatial axes. Any frame axis (see isStack) and color axis are kept.
+    """
+    version = 2
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'pyramid.json'), 'r') as fd:
+            self.meta = json.load(fd)
+        self._levels = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def build(cls, data, path, source=None, minSize=128, sourceFile=None):
+        """Write a pyramid for the image *data* into directory *path* and return it.
+
+        *data* may be an array or a MetaArray; frames of an image stack are read
+        (from a lazy or memory-mapped MetaArray) and downsampled one at a time, so
+        at most one full-resolution frame is in memory at once. *source* is
+        stored with the pyramid and used by forFile() to check that it is current.
+
+        If *sourceFile* names the MetaArray file that *data* was read from, level 0
+        is read from that file (see readMetaArray) rather than copied into the pyramid.
+        """
+        isMetaArray = hasattr(data, 'implements') and data.implements('MetaArray')
+        if not isMetaArray:
+            data = np.asarray(data)
+        stack = isStack(data)
+        nFrames = data.shape[0] if stack else 1
+        shapes = levelShapes(data.shape[1:3] if stack else data.shape[:2], minSize)
+        colorShape = tuple(data.shape[3:] if stack else data.shape[2:])
+
+        def getFrame(i):
+            frame = data[i] if stack else data
+            return frame.asarray() if isMetaArray else np.asarray(frame)
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+        levels = []
+        for i, shape in enumerate(shapes):
+            if i == 0 and sourceFile is not None:
+                levels.append(None)
+                continue
+            fileName = os.path.join(path, 'level%d.npy' % i)
+            levels.append(np.lib.format.open_memmap(fileName, mode='w+', dtype=data.dtype,
+                                                    shape=(nFrames,) + shape + colorShape))
+
+        mn = mx = None
+        for i in range(nFrames):
+            frame = getFrame(i)
+            level = frame
+            for j, arr in enumerate(levels):
+                if j > 0:
+                    level = downsample2(level)
+                if arr is not None:
+                    arr[i] = level
+            if data.dtype.kind in 'iuf':
+                fmn, fmx = np.nanmin(frame), np.nanmax(frame)
+                mn = fmn if mn is None else min(mn, fmn)
+                mx = fmx if mx is None else max(mx, fmx)
+        for arr in levels:
+            if arr is not None:
+                arr.flush()
+        del levels
+
+        meta = {
+            'version': cls.version,
+            'source': source,
+            'sourceFile': None if sourceFile is None else os.path.abspath(sourceFile),
+            'stack': stack,
+            'shape': list(data.shape),
+            'dtype': str(data.dtype),
+            'levels': [list(s) for s in shapes],
+            'min': None if mn is None else float(mn),
+            'max': None if mx is None else float(mx),
+        }
+        ## the index is written last; an interrupted build is never mistaken for a complete one
+        with open(os.path.join(path, 'pyramid.json'), 'w') as fd:
+            json.dump(meta, fd)
+        return cls(path)
+
+    def nLevels(self):
+        return len(self.meta['levels'])
+
+    def isStack(self):
+        return self.meta['stack']
+
+    def nFrames(self):
+        return self.meta['shape'][0] if self.isStack() else 1
+
+    def shape(self):
+        """Shape of the original data."""
+        return tuple(self.meta['shape'])
+
+    def levels(self):
+        """Return the (min, max) of the full-resolution data."""
+        return self.meta['min'], self.meta['max']
+
+    def level(self, i):
+        """Return the (memory-mapped) data for level *i*, with the same axes as
+        the original data. Level 0 of a MetaArray file is the MetaArray read
+        lazily from the source file."""
+        with self.lock:
+            if i not in self._levels:
+                if i == 0 and self.meta['sourceFile'] is not None:
+                    arr = readMetaArray(self.meta['sourceFile'])
+                else:
+                    arr = np.load(os.path.join(self.path, 'level%d.npy' % i), mmap_mode='r')
+                    if not self.isStack():
+                        arr = arr[0]
+                self._levels[i] = arr
+            return self._levels[i]
+
+    def data(self):
+        """Return the full-resolution data (memory-mapped or lazily read)."""
+        return self.level(0)
+
+    def frame(self, i, frame=0):
+        """Return a single frame of level *i*."""
+        arr = self.level(i)
+        return arr[frame] if self.isStack() else arr
+
+    def frameShape(self, i):
+        """Return the shape of a single frame of level *i* (without reading it)."""
+        shape = self.meta['shape']
+        colorShape = shape[3:] if self.isStack() else shape[2:]
+        return tuple(self.meta['levels'][i]) + tuple(colorShape)
+
+    def block(self, i, frame, rows, cols):
+        """Return the region [rows, cols] (slices) of a single frame of level *i*.
+        Only the region is read from disk, and the result is read into memory."""
+        ind = (frame, rows, cols) if self.isStack() else (rows, cols)
+        return np.array(self.level(i)[ind])
+
+    def levelForScale(self, scale):
+        """Return the index of the lowest-resolution level that still has at least
+        one pixel per screen pixel, given *scale* screen pixels per full-resolution pixel."""
+        if scale <= 0:
+            return self.nLevels() - 1
+        i = int(np.floor(np.log2(1.0 / scale)))
+        return int(np.clip(i, 0, self.nLevels() - 1))
+
+    def lowRes(self, frame=None, maxSize=256):
+        """Return the lowest level that is at least *maxSize* pixels on its smaller
+        side (or the smallest level available). If *frame* is given, only that
+        frame of a stack is returned. The result is read into memory."""
+        i = self.nLevels() - 1
+        while i > 0 and min(self.meta['levels'][i]) < maxSize:
+            i -= 1
+        arr = self.level(i) if frame is None else self.frame(i, frame)
+        return np.array(arr)
+
+    def close(self):
+        with self.lock:
+            self._levels = {}
+
+
+def load(fileName, source=None):
+    """Return the cached pyramid for *fileName*, or None if there is no current one."""
+    path = cachePath(fileName)
+    try:
+        pyr = ImagePyramid(path)
+    except (IOError, OSError, ValueError):
+        return None
+    if pyr.meta.get('version') != ImagePyramid.version or pyr.meta.get('source') != source:
+        return None
+    return pyr
+
+
+def discard(fileName):
+    """Remove the cached pyramid of *fileName*, if there is one."""
+    path = cachePath(fileName)
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def sourceKey(fileName):
+    st = os.stat(fileName)
+    return [st.st_size, st.st_mtime]
+
+
+def forFile(fh, data=None, minSize=128):
+    """Return the pyramid for FileHandle *fh*, building (and caching) it if needed.
+    *data* may be given if the file contents have already been read; otherwise
+    MetaArray files are read one frame at a time."""
+    fileName = fh.name()
+    source = sourceKey(fileName)
+    pyr = load(fileName, source)
+    if pyr is None:
+        sourceFile = fileName if fh.ext().lower() == '.ma' else None
+        if data is None:
+            data = fh.read() if sourceFile is None else readMetaArray(fileName)
+        pyr = ImagePyramid.build(data, cachePath(fileName), source=source, minSize=minSize, sourceFile=sourceFile)
+    return pyr
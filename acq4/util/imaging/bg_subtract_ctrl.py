@@ -15,18 +15,39 @@ class BgSubtractCtrl(Qt.QWidget):
     * subtract / divide background
     * background blur for unsharp masking
     * continuous averaging
+
+    The background is an exponential running average that is updated in place
+    as frames arrive. Optionally (*medianFrames* > 0), the background is instead
+    the per-pixel median of the most recent frames, and (*trackVariance*) the
+    per-pixel variance of the running average is kept in backgroundVariance.
+
+    While the background is changing, the blurred background is recomputed at
+    most every *blurInterval* seconds. Blurs wider than *blurDownsampleSigma*
+    pixels are computed on a downsampled background and interpolated back to
+    full size.
     """
     needFrameUpdate = Qt.Signal()
 
+    medianFrames = 0
+    trackVariance = False
+    blurInterval = 0.2
+    blurDownsampleSigma = 4.0
+
     def __init__(self, parent=None):
         Qt.QWidget.__init__(self, parent)
         self.ui = Ui_Form()
         self.ui.setupUi(self)
 
         self.backgroundFrame = None
+        self.backgroundVariance = None
         self.blurredBackgroundFrame = None
         self.lastFrameTime = None
         self.requestBgReset = False
+        self._history = None       ## recent frames for median backgrounds
+        self._historyIndex = 0
+        self._historyCount = 0
+        self._bgChanged = False    ## background changed since the last blur / median
+        self._lastBlurTime = None
 
         ## Connect Background Subtraction Dock
         self.ui.bgBlurSpin.valueChanged.connect(self.updateBackgroundBlur)
@@ -44,16 +65,30 @@ class BgSubtractCtrl(Qt.QWidget):
         self.ui.divideBgBtn.setChecked(False)
 
     def getBackgroundFrame(self):
+        """Return the (blurred) background, or None if no background has been collected.
+
+        The background is updated in place as frames arrive, and without blur the
+        returned array is the background itself, so it is only valid until the next
+        frame. Callers that keep it must make a copy.
+        """
         if self.backgroundFrame is None:
             return None
         if self.blurredBackgroundFrame is None:
             self.updateBackgroundBlur()
+        elif self._bgChanged and pg.ptime.time() - self._lastBlurTime > self.blurInterval:
+            self.updateBackgroundBlur()
         return self.blurredBackgroundFrame
 
     def updateBackgroundBlur(self):
+        if self.backgroundFrame is None:
+            return
+        if self.medianFrames > 0 and self._bgChanged:
+            self._updateMedian()
+        self._bgChanged = False
+        self._lastBlurTime = pg.ptime.time()
         b = self.ui.bgBlurSpin.value()
         if b > 0.0:
-            self.blurredBackgroundFrame = scipy.ndimage.gaussian_filter(self.backgroundFrame, (b, b))
+            self.blurredBackgroundFrame = blur(self.backgroundFrame, b, self.blurDownsampleSigma)
         else:
             self.blurredBackgroundFrame = self.backgroundFrame
 
@@ -94,23 +129,112 @@ class BgSubtractCtrl(Qt.QWidget):
             x = float(self.bgFrameCount) / (self.bgFrameCount + 1)
             self.bgFrameCount += 1
     
-        img = frame.getImage().astype(np.float32)
+        img = frame.getImage()
         if self.requestBgReset or self.backgroundFrame is None or self.backgroundFrame.shape != img.shape:
             self.requestBgReset = False
-            self.backgroundFrame = img
+            self.resetBackground(img)
             self.needFrameUpdate.emit()
         else:
-            self.backgroundFrame = x * self.backgroundFrame + (1-x) * img
+            self.addFrame(img, x)
+
+    def resetBackground(self, img):
+        """Start a new background from the single frame *img*."""
+        self.backgroundFrame = img.astype(np.float32)
+        self.backgroundVariance = np.zeros(img.shape, dtype=np.float32) if self.trackVariance else None
+        self._history = None
+        if self.medianFrames > 0:
+            self._history = np.empty((self.medianFrames,) + img.shape, dtype=np.float32)
+            self._history[0] = img
+            self._historyIndex = 1 % self.medianFrames
+            self._historyCount = 1
         self.blurredBackgroundFrame = None
-        
-    def processImage(self, data):
+        self._bgChanged = True
+
+    def addFrame(self, img, x):
+        """Integrate *img* into the background, keeping a fraction *x* of the
+        previous background. All updates are done in place."""
+        bg = self.backgroundFrame
+        if self._history is not None:
+            ## the median itself is only recomputed along with the blur
+            self._history[self._historyIndex] = img
+            self._historyIndex = (self._historyIndex + 1) % len(self._history)
+            self._historyCount = min(self._historyCount + 1, len(self._history))
+        elif self.backgroundVariance is not None:
+            ## exponentially weighted variance:
+            ##   var = x * (var + (1-x) * (img-bg)**2);  bg = bg + (1-x) * (img-bg)
+            diff = np.subtract(img, bg, dtype=np.float32)
+            bg += diff * (1-x)
+            diff *= diff
+            diff *= (1-x)
+            var = self.backgroundVariance
+            var += diff
+            var *= x
+        else:
+            ## bg = x * bg + (1-x) * img, without temporaries
+            bg -= img
+            bg *= x
+            bg += img
+        self._bgChanged = True
+
+    def _updateMedian(self):
+        frames = self._history[:self._historyCount]
+        np.median(frames, axis=0, out=self.backgroundFrame)
+        if self.trackVariance:
+            np.var(frames, axis=0, out=self.backgroundVariance)
+
+    def processImage(self, data, out=None):
+        """Return *data* with the background divided out or subtracted, or *data*
+        itself if no correction is active.
+
+        If *out* is given (a float32 array with the same shape as *data*), the
+        result is written into it instead of allocating a new array. *out* may
+        be *data* itself.
+        """
         if self.ui.divideBgBtn.isChecked():
-            bg = self.getBackgroundFrame()
-            if bg is not None and bg.shape == data.shape:
-                data = data / bg
+            op = np.divide
         elif self.ui.subtractBgBtn.isChecked():
-            bg = self.getBackgroundFrame()
-            if bg is not None and bg.shape == data.shape:
-                data = data - bg
+            op = np.subtract
+        else:
+            return data
+        bg = self.getBackgroundFrame()
+        if bg is None or bg.shape != data.shape:
+            return data
+        if out is None or out.shape != data.shape:
+            return op(data, bg)
+        return op(data, bg, out=out)
+
+    def isActive(self):
+        """Return True if processImage() will currently modify frames."""
+        return (self.ui.divideBgBtn.isChecked() or self.ui.subtractBgBtn.isChecked()) and self.backgroundFrame is not None
+
+
+def blur(img, sigma, downsampleSigma=4.0):
+    """Gaussian blur of *img* with width *sigma* pixels.
+
+    For sigma > downsampleSigma, the image is first averaged over blocks of
+    n x n pixels (so that the remaining blur is about downsampleSigma pixels wide),
+    blurred, and linearly interpolated back to the original shape.
+    """
+    n = int(sigma // downsampleSigma) if downsampleSigma > 0 else 1
+    if n < 2 or min(img.shape[:2]) < n * 4:
+        return scipy.ndimage.gaussian_filter(img, (sigma, sigma))
+    h, w = img.shape[0] // n, img.shape[1] // n
+    small = img[:h*n, :w*n].reshape(h, n, w, n).mean(axis=(1, 3), dtype=np.float32)
+    small = scipy.ndimage.gaussian_filter(small, (sigma / n, sigma / n))
+    return upsample(small, n, img.shape[:2]).astype(img.dtype)
+
 
-        return data
+def upsample(img, n, shape):
+    """Linearly interpolate *img*, whose pixels are the means of n x n blocks,
+    to the full-resolution *shape*."""
+    for axis, size in enumerate(shape):
+        ## block centers are at (i + 0.5) * n - 0.5 in full-resolution coordinates
+        x = np.clip((np.arange(size, dtype=np.float32) + 0.5) / n - 0.5, 0, img.shape[axis] - 1)
+        i0 = np.floor(x).astype(int)
+        i1 = np.minimum(i0 + 1, img.shape[axis] - 1)
+        w = (x - i0).reshape((-1, 1) if axis == 0 else (1, -1))
+        a = np.take(img, i0, axis=axis)
+        a *= 1 - w
+        a += np.take(img, i1, axis=axis) * w
+        img = a
+    return img
@@ -27,6 +27,7 @@ class ContrastCtrl(Qt.QWidget):
         self.ignoreLevelChange = False
         self.alpha = 1.0
         self.lastAGCMax = None
+        self.statsSize = 256  ## auto gain statistics use about statsSize x statsSize pixels
 
         ## Connect DisplayGain dock
         self.ui.histogram.sigLookupTableChanged.connect(self.levelsChanged)
@@ -80,6 +81,13 @@ class ContrastCtrl(Qt.QWidget):
         """
         self.lastMinMax = None
 
+    def statsSample(self, data):
+        """Return a strided view of *data* with roughly statsSize pixels along
+        each axis (no data is copied).
+        """
+        step = max(1, int(max(data.shape[:2]) // self.statsSize))
+        return data[::step, ::step]
+
     def processImage(self, data):
         # Update auto gain for new image
         # Note that histogram is linked to image item; this is what determines
@@ -87,18 +95,24 @@ class ContrastCtrl(Qt.QWidget):
 
         if self.ui.btnAutoGain.isChecked():
             cw = self.ui.spinAutoGainCenterWeight.value()
-            (w, h) = data.shape
-            center = data[w//2-w//6:w//2+w//6, h//2-h//6:h//2+h//6]
-            minVal = data.min() * (1.0-cw) + center.min() * cw
-            maxVal = data.max() * (1.0-cw) + center.max() * cw
+            ## gain statistics are measured on a strided subsample; the full frame
+            ## is never scanned here
+            sub = self.statsSample(data)
+            (w, h) = sub.shape
+            center = sub[w//2-w//6:w//2+w//6, h//2-h//6:h//2+h//6]
+            minVal = sub.min() * (1.0-cw) + center.min() * cw
+            maxVal = sub.max() * (1.0-cw) + center.max() * cw
 
             ## If there is inf/nan in the image, strip it out before computing min/max
-            if any([np.isnan(minVal), np.isinf(minVal),  np.isnan(minVal), np.isinf(minVal)]):
-                nanMask = np.isnan(data)
-                infMask = np.isinf(data)
-                valid = data[~nanMask * ~infMask]
-                minVal = valid.min() * (1.0-cw) + center.min() * cw
-                maxVal = valid.max() * (1.0-cw) + center.max() * cw
+            if not np.isfinite(minVal) or not np.isfinite(maxVal):
+                valid = sub[np.isfinite(sub)]
+                validCenter = center[np.isfinite(center)]
+                if valid.size == 0:
+                    return
+                if validCenter.size == 0:
+                    validCenter = valid
+                minVal = valid.min() * (1.0-cw) + validCenter.min() * cw
+                maxVal = valid.max() * (1.0-cw) + validCenter.max() * cw
             
             ## Smooth min/max range to avoid noise
             if self.lastMinMax is None:
@@ -1,4 +1,5 @@
 from __future__ import print_function
+import numpy as np
 from acq4.util import Qt
 from acq4 import pyqtgraph as pg
 from .contrast_ctrl import ContrastCtrl
@@ -14,6 +15,12 @@ class FrameDisplay(Qt.QObject):
     * frame rate limiting
     * contrast control widget
     * background subtraction control widget
+
+    Frames are processed into a pair of preallocated buffers that are used
+    alternately, so the image item never shares memory with the acquisition
+    buffers and no new arrays are allocated while the frame shape is constant.
+    The time from acquisition to display of each frame is recorded in
+    displayLatency.
     """
     # Allow subclasses to override these:
     contrastClass = ContrastCtrl
@@ -31,11 +38,15 @@ class FrameDisplay(Qt.QObject):
         self.bgCtrl.needFrameUpdate.connect(self.updateFrame)
 
         self.nextFrame = None
+        self._nextFrameTime = None
         self._updateFrame = False
         self.currentFrame = None
         self.lastDrawTime = None
         self.displayFps = None
+        self.displayLatency = None  ## seconds from frame acquisition to display
         self.hasQuit = False
+        self._buffers = [None, None]
+        self._bufferIndex = 0
 
         ## Check for new frame updates every 16ms
         ## Some checks may be skipped even if there is a new frame waiting to avoid drawing more than
@@ -46,9 +57,6 @@ class FrameDisplay(Qt.QObject):
         #Qt.QTimer.singleShot(1, self.drawFrame)
         ## avoiding possible singleShot-induced crashes
 
-    def newFrame(self, frame):
-        self.currentFrame = frame
-
     def updateFrame(self):
         """Redisplay the current frame.
         """
@@ -65,10 +73,14 @@ class FrameDisplay(Qt.QObject):
         return self.bgCtrl
 
     def backgroundFrame(self):
-        """Return the currently active background image or None if background
+        """Return a copy of the currently active background image or None if background
         subtraction is disabled.
         """
-        return self.bgCtrl.backgroundFrame()
+        if not self.bgCtrl.isActive():
+            return None
+        ## the background is updated in place as new frames arrive
+        bg = self.bgCtrl.getBackgroundFrame()
+        return None if bg is None else bg.copy()
 
     def visibleImage(self):
         """Return a copy of the image as it is currently visible in the scene.
@@ -86,6 +98,7 @@ class FrameDisplay(Qt.QObject):
         
         ## self.nextFrame gets picked up by drawFrame() at some point
         self.nextFrame = frame
+        self._nextFrameTime = pg.ptime.time()
         
         self.bgCtrl.newFrame(frame)
 
@@ -119,8 +132,10 @@ class FrameDisplay(Qt.QObject):
             self.lastDrawTime = t
             prof()
             
+            newFrame = self.nextFrame is not None
+            
             ## Handle the next available frame, if there is one.
-            if self.nextFrame is not None:
+            if newFrame:
                 self.currentFrame = self.nextFrame
                 self.nextFrame = None
             
@@ -128,19 +143,23 @@ class FrameDisplay(Qt.QObject):
             info = self.currentFrame.info()
             prof()
             
-            
-            ## divide the background out of the current frame if needed
-            data = self.bgCtrl.processImage(data)
+            ## divide the background out of the current frame (if needed) or copy it
+            ## into the next display buffer
+            data = self.processImage(data)
             prof()
             
             ## Set new levels if auto gain is enabled
             self.contrastCtrl.processImage(data)
             prof()
             
-            ## update image in viewport
-            self._imageItem.updateImage(data.copy())  # using data.copy() here avoids crashes!
+            ## update image in viewport; levels and LUT are applied when the item is rendered
+            self._imageItem.updateImage(data)
             prof()
 
+            if newFrame:
+                self.displayLatency = pg.ptime.time() - info.get('time', self._nextFrameTime)
+                prof.mark('display latency: %0.1f ms' % (self.displayLatency * 1000))
+
             self.imageUpdated.emit(self.currentFrame)
             prof()
             
@@ -151,6 +170,22 @@ class FrameDisplay(Qt.QObject):
         finally:
             pass
 
+    def processImage(self, data):
+        """Return the display-ready image for *data*, written into the next of
+        the two display buffers.
+        """
+        dtype = np.float32 if self.bgCtrl.isActive() else data.dtype
+        buf = self._buffers[self._bufferIndex]
+        if buf is None or buf.shape != data.shape or buf.dtype != dtype:
+            buf = np.empty(data.shape, dtype=dtype)
+            self._buffers[self._bufferIndex] = buf
+        self._bufferIndex = 1 - self._bufferIndex
+
+        out = self.bgCtrl.processImage(data, out=buf if dtype == np.float32 else None)
+        if out is not buf:
+            np.copyto(buf, out, casting='unsafe')
+        return buf
+
     def quit(self):
         self.imageItem = None
         self.hasQuit = True
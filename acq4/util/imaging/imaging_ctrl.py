@@ -127,6 +127,9 @@ class ImagingCtrl(Qt.QWidget):
         fps = self.frameDisplay.displayFps
         if fps is not None:
             self.ui.displayFpsLabel.setValue(fps)
+        latency = self.frameDisplay.displayLatency
+        if latency is not None:
+            self.ui.displayFpsLabel.setToolTip('Display latency: %0.1f ms' % (latency * 1000))
 
         if self.recordingStack():
             frameShape = frame.getImage().shape
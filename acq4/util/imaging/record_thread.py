@@ -202,7 +202,7 @@ class RecordThread(Thread):
         times = [f[1]['time'] for f in frames]
         translations = np.array([f[1]['transform'].getTranslation() for f in frames])
         arrayInfo = [
-            {'name': 'Time', 'values': array(times) - self.startFrameTime, 'units': 's', 'translation': translations},
+            {'name': 'Time', 'values': np.array(times) - self.startFrameTime, 'units': 's', 'translation': translations},
             {'name': 'X'},
             {'name': 'Y'}
         ]
@@ -0,0 +1,84 @@
+from __future__ import print_function
+import numpy as np
+import scipy.ndimage
+import acq4.pyqtgraph as pg
+from acq4.util.imaging.bg_subtract_ctrl import BgSubtractCtrl, blur
+
+
+def makeCtrl(**attrs):
+    pg.mkQApp()
+    ctrl = BgSubtractCtrl()
+    for k, v in attrs.items():
+        setattr(ctrl, k, v)
+    return ctrl
+
+
+def test_running_average():
+    rng = np.random.RandomState(0)
+    ctrl = makeCtrl()
+    frames = rng.randint(0, 4096, size=(10, 32, 48)).astype(np.uint16)
+    ctrl.resetBackground(frames[0])
+    expect = frames[0].astype(np.float64)
+    for i, x in enumerate(np.linspace(0.5, 0.95, 9)):
+        bg = ctrl.backgroundFrame
+        ctrl.addFrame(frames[i+1], x)
+        ## updated in place
+        assert ctrl.backgroundFrame is bg
+        expect = x * expect + (1-x) * frames[i+1]
+        assert np.allclose(ctrl.backgroundFrame, expect, rtol=1e-5)
+
+
+def test_variance():
+    ## on a stationary sequence, the running variance approaches the variance
+    ## of the frames
+    rng = np.random.RandomState(0)
+    ctrl = makeCtrl(trackVariance=True)
+    frames = rng.normal(loc=1000, scale=20, size=(400, 64, 64)).astype(np.float32)
+    ctrl.resetBackground(frames[0])
+    x = 0.95
+    for frame in frames[1:]:
+        ctrl.addFrame(frame, x)
+    assert ctrl.backgroundVariance.dtype == np.float32
+    var = np.var(frames, axis=0)
+    assert abs(ctrl.backgroundVariance.mean() / var.mean() - 1) < 0.05
+    assert abs(ctrl.backgroundFrame.mean() - frames.mean()) < 1.0
+
+
+def test_median():
+    ctrl = makeCtrl(medianFrames=3)
+    ctrl.ui.bgBlurSpin.setValue(0)
+    shape = (8, 8)
+    ctrl.resetBackground(np.full(shape, 1.0))
+    ctrl.updateBackgroundBlur()
+    assert np.all(ctrl.getBackgroundFrame() == 1)
+
+    ## after six frames, the ring buffer holds only the last three (3, 4, 6)
+    for v in [5, 2, 3, 4, 6]:
+        ctrl.addFrame(np.full(shape, float(v)), 0.5)
+    assert ctrl._historyCount == 3
+    assert ctrl._historyIndex == 0
+    ctrl.updateBackgroundBlur()
+    assert np.all(ctrl.getBackgroundFrame() == 4)
+
+    ctrl.addFrame(np.full(shape, 10.0), 0.5)
+    ctrl.updateBackgroundBlur()
+    assert np.all(ctrl.getBackgroundFrame() == 6)
+
+
+def test_blur():
+    rng = np.random.RandomState(0)
+    y, x = np.mgrid[:256, :256]
+    img = 1000 + 200 * np.sin(x / 30.) * np.cos(y / 45.) + rng.normal(size=x.shape) * 50
+    img[100:150, 60:200] += 300
+    img = img.astype(np.float32)
+
+    ## small blurs are computed directly
+    assert np.all(blur(img, 4, 4.0) == scipy.ndimage.gaussian_filter(img, (4, 4)))
+
+    ## wider blurs are computed at lower resolution, within 0.5% of the image range
+    for sigma in (8, 16):
+        ref = scipy.ndimage.gaussian_filter(img, (sigma, sigma))
+        b = blur(img, sigma, 4.0)
+        assert b.shape == img.shape
+        assert b.dtype == img.dtype
+        assert np.abs(b - ref).max() < 0.005 * (ref.max() - ref.min())
@@ -0,0 +1,446 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+"""
+logstore.py - Append-only structured log files
+Distributed under MIT/X11 license. See license.txt for more infomation.
+
+Log entries are stored one JSON object per line. Every entry carries a
+numeric timestamp (the '__timestamp__' key by default), and entries are
+always appended in time order. Next to each log file, a small sparse index
+(<logfile>.idx) records [timestamp, byteOffset] pairs every few KB so that
+a time range can be read without parsing everything that comes before it.
+
+Values that JSON cannot represent directly (tuples, numpy arrays and
+scalars, dicts with non-string keys, and arbitrary objects) are tagged so that
+they are read back as they were written; arbitrary objects are stored as their
+repr() and eval'd on reading, as the older log format did.
+
+Older logs that were written one python repr() per line are still readable.
+The eval() fallback is only used for such files (those whose first line is not
+JSON); a malformed line in a JSON log raises an exception.
+
+Entries are buffered and written in batches, so the last second of messages
+may be lost if the process crashes. Entries whose 'msgType' is 'error' are
+written immediately, along with anything buffered before them.
+
+    writer = getWriter('/path/.log')
+    writer.write({'__timestamp__': time.time(), '__message__': 'hi'})
+
+    reader = getReader('/path/.log')
+    reader.read()                 # all entries; only new lines are parsed
+    reader.query(t0, t1)          # entries with t0 <= timestamp <= t1
+"""
+
+import os, json, time, bisect, heapq, threading, atexit
+import six
+import numpy as np
+
+
+TIME_KEY = '__timestamp__'
+
+_writers = {}
+_readers = {}
+_registryLock = threading.Lock()
+
+
+def indexFileName(fileName):
+    """Return the name of the sparse offset index that accompanies *fileName*."""
+    return fileName + '.idx'
+
+
+def getWriter(fileName, **kwds):
+    """Return the shared LogWriter for *fileName*, creating it if needed.
+    All writes to a single file from within this process should go through
+    the same writer."""
+    fileName = os.path.abspath(fileName)
+    with _registryLock:
+        w = _writers.get(fileName, None)
+        if w is None:
+            w = LogWriter(fileName, **kwds)
+            _writers[fileName] = w
+        return w
+
+
+def getReader(fileName):
+    """Return the shared (caching) LogReader for *fileName*."""
+    fileName = os.path.abspath(fileName)
+    with _registryLock:
+        r = _readers.get(fileName, None)
+        if r is None:
+            r = LogReader(fileName)
+            _readers[fileName] = r
+        return r
+
+
+def flushWriter(fileName):
+    """Write out any buffered entries destined for *fileName*."""
+    with _registryLock:
+        w = _writers.get(os.path.abspath(fileName), None)
+    if w is not None:
+        w.flush()
+
+
+def flushAll():
+    """Write out buffered entries for all open log writers."""
+    with _registryLock:
+        writers = list(_writers.values())
+    for w in writers:
+        w.flush()
+
+atexit.register(flushAll)
+
+
+def resetLog(fileName):
+    """Delete a log file and its index, discarding any buffered entries."""
+    fileName = os.path.abspath(fileName)
+    with _registryLock:
+        w = _writers.pop(fileName, None)
+        _readers.pop(fileName, None)
+    if w is not None:
+        w.discard()
+    for fn in (fileName, indexFileName(fileName)):
+        if os.path.exists(fn):
+            os.remove(fn)
+
+
+def isStructuredLog(fileName):
+    """Return True if *fileName* is empty, missing, or starts with a
+    line-per-entry log (JSON or repr dicts). Returns False for the older
+    configfile-formatted logs."""
+    if not os.path.isfile(fileName):
+        return True
+    with open(fileName, 'rb') as fd:
+        head = fd.read(256).lstrip()
+    return len(head) == 0 or head[:1] == b'{'
+
+
+def mergeLogs(logs, timeKey=TIME_KEY):
+    """Merge several lists of log entries that are each already sorted by time.
+    Returns a single sorted list; runs in O(n log k) for k input logs."""
+    logs = [l for l in logs if len(l) > 0]
+    if len(logs) == 0:
+        return []
+    if len(logs) == 1:
+        return list(logs[0])
+    ## decorate with (time, source, position) so that entries never need to be compared
+    decorated = [((e[timeKey], i, j, e) for j, e in enumerate(log)) for i, log in enumerate(logs)]
+    return [d[3] for d in heapq.merge(*decorated)]
+
+
+## keys of the dicts used to tag values that JSON can't represent
+_TAGS = ('__tuple__', '__ndarray__', '__items__', '__repr__')
+
+
+def _encode(obj):
+    """Return a JSON-compatible copy of *obj* that _decode() can turn back into
+    an equal object."""
+    if obj is None or isinstance(obj, (bool, float) + six.integer_types + six.string_types):
+        return obj
+    if isinstance(obj, list):
+        return [_encode(v) for v in obj]
+    if isinstance(obj, tuple):
+        return {'__tuple__': [_encode(v) for v in obj]}
+    if isinstance(obj, dict):
+        if all(isinstance(k, six.string_types) for k in obj) and not (len(obj) <= 2 and any(k in _TAGS for k in obj)):
+            return dict([(k, _encode(v)) for k, v in obj.items()])
+        return {'__items__': [[_encode(k), _encode(v)] for k, v in obj.items()]}
+    if isinstance(obj, np.ndarray) and obj.dtype.kind in 'biuf':
+        return {'__ndarray__': obj.tolist(), 'dtype': obj.dtype.str}
+    if isinstance(obj, np.generic) and obj.dtype.kind in 'biuf':
+        return obj.item()
+    return {'__repr__': repr(obj)}
+
+
+def _decode(obj):
+    ## object_hook for json.loads; reverses the tagging done by _encode()
+    if len(obj) == 1 and '__tuple__' in obj:
+        return tuple(obj['__tuple__'])
+    if len(obj) == 1 and '__items__' in obj:
+        return dict([(k, v) for k, v in obj['__items__']])
+    if len(obj) == 2 and '__ndarray__' in obj and 'dtype' in obj:
+        return np.array(obj['__ndarray__'], dtype=obj['dtype'])
+    if len(obj) == 1 and '__repr__' in obj:
+        try:
+            return eval(obj['__repr__'], dict(np.__dict__))
+        except Exception:
+            return obj['__repr__']
+    return obj
+
+
+def _parseLine(line, legacy=False):
+    """Parse one line of a log file. Lines that are not JSON are eval'd only
+    if *legacy* is True."""
+    line = line.strip()
+    if len(line) == 0:
+        return None
+    try:
+        return json.loads(line.decode('utf-8'), object_hook=_decode)
+    except ValueError:
+        if not legacy:
+            raise
+        ## legacy logs store one repr(dict) per line
+        return eval(line)
+
+
+def _isLegacyFile(fileName):
+    ## True if the first line of the file is not JSON (the file was written one
+    ## python repr() per line); None if there is no complete line yet
+    if not os.path.isfile(fileName):
+        return None
+    with open(fileName, 'rb') as fd:
+        for line in fd:
+            if not line.endswith(b'\n'):
+                return None
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            try:
+                json.loads(line.decode('utf-8'))
+                return False
+            except ValueError:
+                return True
+    return None
+
+
+class LogWriter(object):
+    """Buffered, append-only writer for a structured log file.
+
+    Entries are held in memory and written in batches, either when
+    *bufferSize* entries have accumulated or *flushInterval* seconds after the
+    first buffered entry (whichever comes first). An index point is appended to
+    the .idx file whenever at least *indexSpacing* bytes have been written since
+    the last one.
+
+    Entries whose 'msgType' is listed in *syncTypes* are written (along with
+    everything buffered before them) before write() returns.
+    """
+    def __init__(self, fileName, bufferSize=64, flushInterval=1.0, indexSpacing=65536, timeKey=TIME_KEY, syncTypes=('error',)):
+        self.fileName = os.path.abspath(fileName)
+        self.bufferSize = bufferSize
+        self.syncTypes = syncTypes
+        self.flushInterval = flushInterval
+        self.indexSpacing = indexSpacing
+        self.timeKey = timeKey
+        self.lock = threading.RLock()
+        self._buffer = []
+        self._timer = None
+        self._lastIndexed = self._readLastIndexOffset()
+
+    def _readLastIndexOffset(self):
+        idx = LogIndex(indexFileName(self.fileName))
+        if len(idx) == 0:
+            return None
+        return idx.offsets[-1]
+
+    def write(self, entry):
+        """Append one entry (a dict) to the log. If the entry has no timestamp,
+        the current time is added."""
+        if self.timeKey not in entry:
+            entry[self.timeKey] = time.time()
+        line = json.dumps(_encode(entry)) + '\n'
+        sync = entry.get('msgType', None) in self.syncTypes
+        with self.lock:
+            self._buffer.append((entry[self.timeKey], line.encode('utf-8')))
+            if sync or len(self._buffer) >= self.bufferSize or self.flushInterval <= 0:
+                self.flush()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.flushInterval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """Write all buffered entries to disk."""
+        with self.lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if len(self._buffer) == 0:
+                return
+            buf = self._buffer
+            self._buffer = []
+
+            indexPoints = []
+            with open(self.fileName, 'ab') as fd:
+                fd.seek(0, 2)
+                offset = fd.tell()
+                for t, line in buf:
+                    if self._lastIndexed is None or offset - self._lastIndexed >= self.indexSpacing:
+                        indexPoints.append((t, offset))
+                        self._lastIndexed = offset
+                    offset += len(line)
+                fd.write(b''.join([l for t, l in buf]))
+            if len(indexPoints) > 0:
+                with open(indexFileName(self.fileName), 'ab') as fd:
+                    fd.write(b''.join([(json.dumps([t, o]) + '\n').encode('utf-8') for t, o in indexPoints]))
+
+    def discard(self):
+        """Drop any buffered entries without writing them."""
+        with self.lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._buffer = []
+            self._lastIndexed = None
+
+
+class LogIndex(object):
+    """Sparse [timestamp, byteOffset] index for a log file.
+
+    Index entries may also have a third element, [timestamp, byteOffset, state],
+    where *state* is anything the writer recorded about the entries before that
+    offset (for example, the last known value of something that rarely changes).
+    """
+    def __init__(self, fileName):
+        self.times = []
+        self.offsets = []
+        self.states = []
+        if not os.path.isfile(fileName):
+            return
+        with open(fileName, 'rb') as fd:
+            for line in fd:
+                try:
+                    entry = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    break  ## partially written last line
+                self.times.append(entry[0])
+                self.offsets.append(entry[1])
+                self.states.append(entry[2] if len(entry) > 2 else None)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def seekOffset(self, t):
+        """Return the byte offset of an indexed entry at or before time *t*
+        (or 0 if there is none)."""
+        return self.seekEntry(t)[0]
+
+    def seekEntry(self, t):
+        """Return (byteOffset, state) for the indexed entry at or before time *t*,
+        or (0, None) if there is none. *state* is None if the entry has none."""
+        i = bisect.bisect_right(self.times, t) - 1
+        if i < 0:
+            return 0, None
+        return self.offsets[i], self.states[i]
+
+
+class LogReader(object):
+    """Incremental reader for a structured log file.
+
+    read() remembers the byte offset it has parsed up to, so repeated calls
+    only parse lines that were appended since the last call. query() returns a
+    time range, using the sparse index to skip directly to the relevant part of
+    the file when the log has not been fully parsed yet.
+
+    Entries are cached; read() and query() return copies of the cached dicts so
+    that callers may modify them.
+    """
+    def __init__(self, fileName, timeKey=TIME_KEY):
+        self.fileName = os.path.abspath(fileName)
+        self.timeKey = timeKey
+        self.lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._offset = 0
+        self._entries = []
+        self._times = []
+        self._legacy = None
+
+    def isLegacy(self):
+        """Return True if this log was written one python repr() per line."""
+        if self._legacy is None:
+            self._legacy = _isLegacyFile(self.fileName)
+        return self._legacy is True
+
+    def _parse(self, offset, stopTime=None):
+        """Parse complete lines starting at *offset*.
+        Return (entries, newOffset). If *stopTime* is given, stop parsing at
+        the first entry later than stopTime."""
+        if not os.path.isfile(self.fileName):
+            return [], 0
+        with open(self.fileName, 'rb') as fd:
+            fd.seek(0, 2)
+            size = fd.tell()
+            if size < offset:
+                raise ValueError("Log file %s has been truncated." % self.fileName)
+            fd.seek(offset)
+            entries = []
+            legacy = self.isLegacy()
+            for line in fd:
+                if not line.endswith(b'\n'):
+                    break  ## incomplete line; a writer is still busy with it
+                try:
+                    entry = _parseLine(line, legacy)
+                except Exception:
+                    print("****************** Error reading log file %s! *********************" % self.fileName)
+                    raise
+                if entry is not None:
+                    if stopTime is not None and entry.get(self.timeKey, 0) > stopTime:
+                        break
+                    entries.append(entry)
+                offset += len(line)
+        return entries, offset
+
+    def update(self):
+        """Parse any lines appended since the last update.
+        Return the list of new entries."""
+        flushWriter(self.fileName)
+        with self.lock:
+            try:
+                new, self._offset = self._parse(self._offset)
+            except ValueError:
+                ## file was replaced; start over
+                self._reset()
+                new, self._offset = self._parse(0)
+            self._entries.extend(new)
+            self._times.extend([e.get(self.timeKey, 0) for e in new])
+            return new
+
+    def read(self):
+        """Return a list of all entries in the log."""
+        with self.lock:
+            self.update()
+            return [dict(e) for e in self._entries]
+
+    def query(self, startTime=None, stopTime=None):
+        """Return entries with startTime <= timestamp <= stopTime.
+        Either bound may be None."""
+        with self.lock:
+            if self._offset > 0 or (startTime is None and stopTime is None):
+                ## already parsed at least part of the file; keep the cache current
+                self.update()
+                i1 = 0 if startTime is None else bisect.bisect_left(self._times, startTime)
+                i2 = len(self._times) if stopTime is None else bisect.bisect_right(self._times, stopTime)
+                return [dict(e) for e in self._entries[i1:i2]]
+
+        ## cold query: seek via the index and parse only what is needed
+        flushWriter(self.fileName)
+        offset = 0
+        if startTime is not None:
+            offset = LogIndex(indexFileName(self.fileName)).seekOffset(startTime)
+        entries, end = self._parse(offset, stopTime=stopTime)
+        if startTime is not None:
+            entries = [e for e in entries if e.get(self.timeKey, 0) >= startTime]
+        return entries
+
+    def lastEntry(self):
+        """Return the final entry in the log without parsing the whole file,
+        or None if the log is empty."""
+        flushWriter(self.fileName)
+        if not os.path.isfile(self.fileName):
+            return None
+        with open(self.fileName, 'rb') as fd:
+            fd.seek(0, 2)
+            end = fd.tell()
+            chunk = 4096
+            data = b''
+            while end > 0:
+                start = max(0, end - chunk)
+                fd.seek(start)
+                data = fd.read(end - start) + data
+                end = start
+                lines = data.rstrip(b'\n').split(b'\n')
+                if len(lines) > 1 or end == 0:
+                    return _parseLine(lines[-1], self.isLegacy())
+                chunk *= 2
+        return None
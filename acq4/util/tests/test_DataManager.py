@@ -1,5 +1,6 @@
 from __future__ import print_function
-import tempfile, shutil, atexit, os
+import tempfile, shutil, atexit, os, time
+import numpy as np
 import acq4.util.DataManager as dm
 from acq4.util.DirTreeWidget import DirTreeWidget
 import acq4.pyqtgraph as pg
@@ -75,3 +76,92 @@ def test_datamanager():
 
 
 
+
+
+def test_log():
+    rh = dm.getDirHandle(root)
+    d1 = rh.mkdir('logdir', autoIncrement=True)
+    d2 = d1.mkdir('sub')
+
+    for d, msg in [(d1, 'first'), (d2, 'second'), (d1, 'third')]:
+        d.logMsg(msg, tags={'x': 1} if d is d2 else None)
+        time.sleep(0.01)  # keep timestamps distinct
+
+    log = d1.readLog()
+    assert [m['__message__'] for m in log] == ['first', 'third']
+
+    # only newly appended messages are parsed on the next read
+    d1.logMsg('fourth')
+    assert len(d1.readLog()) == 3
+
+    # recursive reads are merged in time order
+    log = d1.readLog(recursive=1)
+    assert [m['__message__'] for m in log] == ['first', 'second', 'third', 'fourth']
+    assert log[1]['subdir'] == os.path.join('sub', '')
+    assert log[1]['x'] == 1
+    assert 'subdir' not in d2.readLog()[0]
+
+    # log indexes are hidden, along with the index of any other (log) file
+    for name in ('log.txt', 'log.txt.idx', 'other.idx'):
+        with open(os.path.join(d1.name(), name), 'w') as fd:
+            fd.write('')
+    files = d1.ls()
+    assert '.log.idx' not in files and 'log.txt.idx' not in files
+    assert 'log.txt' in files and 'other.idx' in files
+
+    # time-range query
+    t = log[1]['__timestamp__']
+    assert [m['__message__'] for m in d1.readLog(recursive=1, startTime=t)] == ['second', 'third', 'fourth']
+    assert [m['__message__'] for m in d1.readLog(recursive=1, stopTime=t)] == ['first', 'second']
+
+
+def test_read_cache():
+    rh = dm.getDirHandle(root)
+    cache = dm.readCache
+    cache.clear()
+    fh = rh.writeFile(np.arange(10), 'cached.ma')
+
+    stats = cache.stats()
+    a = fh.read()
+    b = fh.read()
+    assert cache.stats()['hits'] == stats['hits'] + 1
+    assert cache.stats()['misses'] == stats['misses'] + 1
+
+    # each caller gets its own copy, which may be modified
+    assert a is not b and np.all(a == b)
+    a[:] = 0
+    b += 1
+    assert np.all(fh.read() == np.arange(10))
+
+    # writing the file through the data manager discards the cached result
+    rh.writeFile(np.arange(5), 'cached.ma')
+    c = fh.read()
+    assert c.shape == (5,)
+
+    # opt out
+    assert fh.read(useCache=False) is not c
+
+    # arrays whose data is still on disk, and results that are not arrays, are not cached
+    lazy = fh.read(readAllData=False)
+    if lazy.isLazy():
+        assert fh.read(readAllData=False) is not lazy
+    assert not cache._cacheable({'a': np.arange(3)})
+
+
+def test_ls_sort():
+    rh = dm.getDirHandle(root).mkdir('sorting')
+    for name in ['b', 'a', 'c']:
+        rh.mkdir(name)
+    rh.writeFile(np.arange(3), 'aa.ma')
+
+    assert rh.ls(sortMode='alpha') == ['a', 'b', 'c', 'aa.ma']
+    assert rh.ls(sortMode='date') == ['b', 'a', 'c', 'aa.ma']
+    assert rh.subDirs() == ['b', 'a', 'c']
+
+    # timestamps that are not in the parent index are read from each child once,
+    # then remembered in a persistent cache
+    rh['a'].mkdir('x')
+    os.mkdir(os.path.join(rh.name(), 'a', 'z'))
+    assert rh['a'].ls(sortMode='date') == ['x', 'z']
+    assert os.path.isfile(os.path.join(rh.name(), 'a', '.tscache'))
+    assert '.tscache' not in rh['a'].ls()
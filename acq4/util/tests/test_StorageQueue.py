@@ -0,0 +1,119 @@
+from __future__ import print_function
+import threading, time
+import pytest
+from acq4.util.StorageQueue import StorageQueue
+
+
+def test_order():
+    ## with one worker, jobs are written in the order they were submitted
+    q = StorageQueue(workers=1, maxSize=4)
+    written = []
+    for i in range(20):
+        q.submit(written.append, i)
+    assert q.flush(timeout=5)
+    assert written == list(range(20))
+    assert q.pending() == 0
+    q.setWorkers(0)
+
+
+def test_flush_waits():
+    q = StorageQueue(workers=2)
+    gate = threading.Event()
+    written = []
+    def store(i):
+        gate.wait()
+        written.append(i)
+    jobs = [q.submit(store, i) for i in range(2)]
+    assert q.pending() == 2
+    assert not q.flush(timeout=0.05)
+    assert not jobs[0].wait(timeout=0.01)
+    gate.set()
+    assert q.flush(timeout=5)
+    assert sorted(written) == [0, 1]
+    assert all([j.isDone() for j in jobs])
+    q.setWorkers(0)
+
+
+def test_errors():
+    q = StorageQueue(workers=1)
+    def fail():
+        raise ValueError("disk full")
+    q.submit(fail)
+    ok = q.submit(lambda: None)
+    assert q.flush(timeout=5)
+    assert ok.wait(timeout=5)
+    with pytest.raises(ValueError):
+        q.checkErrors()
+    ## each error is reported once
+    q.checkErrors()
+
+    ## an error collected by waiting on its job is not reported again
+    job = q.submit(fail)
+    with pytest.raises(ValueError):
+        job.wait(timeout=5)
+    q.checkErrors()
+    q.setWorkers(0)
+
+
+def test_synchronous():
+    q = StorageQueue(workers=0)
+    caller = []
+    job = q.submit(lambda: caller.append(threading.current_thread()))
+    assert job.isDone()
+    assert caller == [threading.current_thread()]
+    assert q.pending() == 0
+
+    def fail():
+        raise ValueError("disk full")
+    job = q.submit(fail)
+    assert job.isDone()
+    with pytest.raises(ValueError):
+        q.checkErrors()
+
+
+def nWorkers(n, timeout=5):
+    ## wait for the number of StorageQueue threads to reach *n*; return the number
+    start = time.time()
+    while True:
+        count = len([t for t in threading.enumerate() if t.name.startswith('StorageQueue')])
+        if count == n or time.time() > start + timeout:
+            return count
+        time.sleep(0.01)
+
+
+def test_set_workers():
+    ## queues from earlier tests retire their workers asynchronously
+    assert nWorkers(0) == 0
+    q = StorageQueue(workers=3)
+    assert nWorkers(3) == 3
+    q.setWorkers(1)
+    assert nWorkers(1) == 1
+    written = []
+    q.submit(written.append, 1)
+    assert q.flush(timeout=5) and written == [1]
+    q.setWorkers(0)
+    assert nWorkers(0) == 0
+
+
+def test_task_wait_for_storage():
+    from acq4.Manager import Task
+    task = Task.__new__(Task)  ## only the storage job is needed here
+    task.storageJob = None
+    assert task.isStored()
+    assert task.waitForStorage() is True
+
+    q = StorageQueue(workers=1)
+    gate = threading.Event()
+    def store():
+        gate.wait()
+        raise IOError("write failed")
+    task.storageJob = q.submit(store)
+    assert not task.isStored()
+    assert task.waitForStorage(timeout=0.01) is False
+    gate.set()
+    with pytest.raises(IOError):
+        task.waitForStorage(timeout=5)
+    assert task.isStored()
+    ## the error was reported to the task's caller, not again by the queue
+    q.checkErrors()
+    q.setWorkers(0)
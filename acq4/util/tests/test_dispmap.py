@@ -0,0 +1,40 @@
+from __future__ import print_function
+import numpy as np
+import scipy.ndimage
+import acq4.util.functions as functions
+
+
+def makeImage(shape=(128, 128), seed=0):
+    rng = np.random.RandomState(seed)
+    return scipy.ndimage.gaussian_filter(rng.normal(size=shape), 2).astype(np.float32)
+
+
+def test_dispmap_matches_reference():
+    im1 = makeImage()
+    shift = (3, -2)
+    im2 = np.roll(np.roll(im1, shift[0], axis=0), shift[1], axis=1)
+
+    ref, err = functions.makeDispMap(im1, im2, maxDist=5)
+    disp, goodness = functions.makeDispMapFFT(im1, im2, tileSize=32, maxDist=5)
+    assert disp.shape == ref.shape
+    assert goodness.shape == err.shape
+
+    # compare away from the borders, where the reference is not affected by wrapping
+    inner = (slice(16, -16), slice(16, -16))
+    assert np.all(ref[inner] == shift)
+    assert np.abs(disp[inner] - ref[inner]).max() < 0.25
+    assert goodness[inner].min() > 0.5
+
+
+def test_dispmap_subpixel():
+    im1 = makeImage((256, 256), seed=1)
+    for shift in [(0.4, -1.7), (2.25, 0.5)]:
+        im2 = scipy.ndimage.shift(im1, shift, order=3, mode='wrap')
+        disp, goodness = functions.makeDispMapFFT(im1, im2, tileSize=64, stride=32, fullRes=False)
+        assert disp.shape == (7, 7, 2)
+        assert np.abs(disp.reshape(-1, 2).mean(axis=0) - shift).max() < 0.1
+
+        # without refinement, displacements are whole pixels
+        disp, goodness = functions.makeDispMapFFT(im1, im2, subpixel=False, fullRes=False)
+        assert np.all(disp == np.round(disp))
+        assert np.abs(disp - shift).max() <= 0.75
@@ -0,0 +1,66 @@
+from __future__ import print_function
+import os
+import numpy as np
+import pytest
+import acq4.util.functions as functions
+from acq4.util.flowchart.Analysis import processEventFits
+
+
+def makeEvents(n=100, dt=1e-4, seed=1):
+    rng = np.random.RandomState(seed)
+    t = np.arange(int(n * 0.05 / dt)) * dt
+    y = rng.normal(scale=2e-12, size=len(t))
+    times = np.sort(rng.uniform(0, t[-1] - 0.02, size=n))
+    events = np.zeros(n, dtype=[('index', int), ('time', float), ('len', int), ('sum', float), ('peak', float)])
+    for i, start in enumerate(times):
+        y += functions.pspFunc([-30e-12 * rng.uniform(0.5, 1.5), start, 0.5e-3, 5e-3], t)
+        events[i] = (int(start / dt), start, 100, 0, 0)
+    opts = {'dt': dt, 'tau': None, 'multiFit': False, 'waveform': y, 'tvals': t, 'chainLength': 16}
+    return events, opts
+
+
+def loadReference():
+    ## fits computed by the original (serial, cold-start) implementation
+    fn = os.path.join(os.path.dirname(__file__), 'eventfits_reference.txt')
+    with open(fn) as fh:
+        names = [l for l in fh if l.startswith('#')][-1][1:].split()
+    data = np.loadtxt(fn)
+    return dict([(n, data[:, i]) for i, n in enumerate(names)])
+
+
+fitFields = ['fitAmplitude', 'fitTime', 'fitRiseTau', 'fitDecayTau', 'fitTimeToPeak', 'fitError']
+
+
+def test_eventFitsReference():
+    events, opts = makeEvents()
+    ref = loadReference()
+    fits = processEventFits(events, 0, len(events), dict(opts, workers=1))['output']
+    assert np.array_equal(fits['index'], ref['index'])
+    for n in fitFields:
+        assert np.allclose(fits[n], ref[n], rtol=1e-6, atol=0), n
+    
+    ## warm-started fits may converge differently, but should be about as good
+    fits = processEventFits(events, 0, len(events), dict(opts, workers=1, warmStart=True))['output']
+    assert np.array_equal(fits['index'], ref['index'])
+    for n in fitFields:
+        assert np.median(np.abs(fits[n] - ref[n]) / np.abs(ref[n])) < 0.01, n
+    assert fits['fitError'].sum() < 1.1 * ref['fitError'].sum()
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="parallel fitting requires fork()")
+def test_parallelEventFits():
+    events, opts = makeEvents()
+    for warm in (False, True):
+        opts['warmStart'] = warm
+        serial = processEventFits(events, 0, len(events), dict(opts, workers=1))
+        parallel = processEventFits(events, 0, len(events), dict(opts, workers=2))
+        assert len(serial['output']) > 0.9 * len(events)
+        assert np.array_equal(serial['output'], parallel['output'])
+        assert serial['indexes'] == parallel['indexes']
+        for a, b in zip(serial['yVals'], parallel['yVals']):
+            assert np.array_equal(a, b)
+    
+    ## fits of a sub-range match the same events in a full run
+    part = processEventFits(events, 16, 48, dict(opts, workers=1))
+    inds = [serial['indexes'].index(i) for i in part['indexes']]
+    assert np.array_equal(part['output'], serial['output'][inds])
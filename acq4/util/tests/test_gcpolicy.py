@@ -0,0 +1,92 @@
+from __future__ import print_function
+import gc
+import pytest
+import acq4.pyqtgraph as pg
+from acq4.util.gcpolicy import GarbageCollector
+
+
+@pytest.fixture
+def gcc():
+    pg.mkQApp()
+    thresholds = gc.get_threshold()
+    gcc = GarbageCollector(maxDeferred=3)
+    ## automatic collections would be recorded as pauses
+    gc.disable()
+    yield gcc
+    gc.enable()
+    if gcc._gcCallback in gc.callbacks:
+        gc.callbacks.remove(gcc._gcCallback)
+    gc.set_threshold(*thresholds)
+
+
+def test_collect_in_gap(gcc):
+    gcc.beginSequence()
+    assert gcc.inSequence()
+    assert gc.get_threshold() == gcc.sequenceThresholds
+
+    ## no estimate yet; always collect
+    assert gcc.collectInGap(0) is True
+    gcc._fullTimes.clear()
+    gcc._fullTimes.append(0.01)
+
+    ## enough time for a full collection
+    assert gcc.collectInGap(1.0) is True
+    gcc._fullTimes.clear()
+    gcc._fullTimes.append(0.01)
+
+    ## too little time: deferred until maxDeferred gaps have passed
+    assert [gcc.collectInGap(0.001) for i in range(3)] == [False] * 3
+    assert gcc._deferred == 3
+    assert gcc.collectInGap(0.001) is True
+    assert gcc._deferred == 0
+
+    stats = gcc.endSequence()
+    assert not gcc.inSequence()
+    assert stats['deferred'] == 3
+    assert stats['forced'] == 1
+    assert stats['full'][0] == 3
+    assert stats['young'][0] == 3
+    assert 'deferred' in gcc.formatStats(stats)
+
+
+def test_nested_sequences(gcc):
+    gcc.beginSequence()
+    gcc.beginSequence()
+    assert gcc.endSequence() is None
+    assert gcc.inSequence()
+    assert gcc.endSequence() is not None
+
+    ## stats are reset when the outermost sequence begins
+    gcc.collect(2)
+    gcc.beginSequence()
+    assert gcc.sequenceStats()['full'][0] == 0
+    gcc.endSequence()
+
+
+def test_pauses(gcc):
+    gcc.beginSequence()
+    gcc._gcCallback('start', {})
+    gcc._gcCallback('stop', {'generation': 2})
+    gcc._gcCallback('start', {})
+    gcc._gcCallback('stop', {'generation': 0})
+
+    ## collections started by collect() are not reported as pauses
+    gcc.collect(0)
+
+    pauses = gcc.reportPauses()
+    assert [gen for gen, dt in pauses] == [2, 0]
+    assert all(dt >= 0 for gen, dt in pauses)
+    assert gcc.reportPauses() == []
+
+    marks = []
+    class Prof(object):
+        def mark(self, msg):
+            marks.append(msg)
+    gcc._gcCallback('start', {})
+    gcc._gcCallback('stop', {'generation': 1})
+    assert len(gcc.reportPauses(Prof())) == 1
+    assert len(marks) == 1
+
+    stats = gcc.endSequence()
+    assert stats['automatic'][0] == 3
+    assert stats['young'][0] == 1
@@ -0,0 +1,59 @@
+from __future__ import print_function
+import tempfile, shutil, os
+import numpy as np
+import acq4.util.imagepyramid as imagepyramid
+from acq4.pyqtgraph.metaarray import MetaArray
+
+
+def test_pyramid():
+    root = tempfile.mkdtemp()
+    try:
+        # image stack: 3 frames of 512x300
+        data = np.random.randint(0, 1000, size=(3, 512, 300)).astype(np.uint16)
+        path = imagepyramid.cachePath(os.path.join(root, 'image.ma'))
+        pyr = imagepyramid.ImagePyramid.build(data, path, source=[1, 2.0], minSize=64)
+        
+        assert pyr.isStack()
+        assert pyr.nLevels() == 3
+        assert pyr.level(0).shape == data.shape
+        assert pyr.level(1).shape == (3, 256, 150)
+        assert pyr.level(2).shape == (3, 128, 75)
+        assert np.all(pyr.data() == data)
+        assert pyr.levels() == (data.min(), data.max())
+        
+        # each level is a 2x2 block average of the previous one
+        expect = data[1, :2, :2].mean()
+        assert pyr.frame(1, frame=1)[0, 0] == np.round(expect)
+        
+        # screen pixels per data pixel -> level
+        assert pyr.levelForScale(2.0) == 0
+        assert pyr.levelForScale(0.5) == 1
+        assert pyr.levelForScale(0.01) == 2
+        
+        assert pyr.lowRes(frame=0, maxSize=50).shape == (128, 75)
+        assert pyr.lowRes(frame=0, maxSize=100).shape == (256, 150)
+        
+        # cached pyramid is only used if the source has not changed
+        assert imagepyramid.load(os.path.join(root, 'image.ma'), [1, 2.0]) is not None
+        assert imagepyramid.load(os.path.join(root, 'image.ma'), [1, 3.0]) is None
+        
+        # 2D and color images have no frame axis
+        img = np.random.normal(size=(256, 256, 3))
+        pyr = imagepyramid.ImagePyramid.build(img, path, minSize=64)
+        assert not pyr.isStack()
+        assert pyr.level(1).shape == (128, 128, 3)
+        assert np.allclose(pyr.level(1)[3, 4], img[6:8, 8:10].mean(axis=(0, 1)))
+        
+        # level 0 of a MetaArray file is read from the file rather than copied
+        fileName = os.path.join(root, 'stack.ma')
+        MetaArray(data, info=[{'name': 'Time'}, {'name': 'X'}, {'name': 'Y'}, {}]).write(fileName)
+        path = imagepyramid.cachePath(fileName)
+        pyr = imagepyramid.ImagePyramid.build(imagepyramid.readMetaArray(fileName), path, minSize=64, sourceFile=fileName)
+        assert not os.path.exists(os.path.join(path, 'level0.npy'))
+        assert np.all(np.asarray(pyr.data()) == data)
+        assert np.all(pyr.level(1) == imagepyramid.ImagePyramid.build(data, path + '2', minSize=64).level(1))
+        assert pyr.frameShape(0) == (512, 300)
+        assert np.all(pyr.block(0, 2, slice(10, 20), slice(5, 8)) == data[2, 10:20, 5:8])
+        assert np.all(pyr.block(1, 2, slice(10, 20), slice(5, 8)) == pyr.level(1)[2, 10:20, 5:8])
+    finally:
+        shutil.rmtree(root)
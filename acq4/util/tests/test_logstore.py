@@ -0,0 +1,71 @@
+from __future__ import print_function
+import os, json, tempfile, shutil
+import numpy as np
+import pytest
+from acq4.util import logstore
+
+
+@pytest.fixture
+def logFile():
+    path = tempfile.mkdtemp()
+    yield os.path.join(path, '.log')
+    logstore.flushAll()
+    shutil.rmtree(path)
+
+
+def test_roundtrip(logFile):
+    entry = {
+        '__timestamp__': 1.0,
+        'tuple': (1, 2, (3, 'a')),
+        'list': [1, 2.5, None],
+        'array': np.arange(4, dtype='int16'),
+        'scalar': np.float32(0.5),
+        'intKeys': {1: 'one', (2, 3): 'two-three'},
+        'tagLike': {'__tuple__': 'not a tuple'},
+        'bytes': b'\x00raw',
+    }
+    logstore.getWriter(logFile).write(dict(entry))
+    read = logstore.getReader(logFile).read()
+    assert len(read) == 1
+    read = read[0]
+    assert read['tuple'] == (1, 2, (3, 'a'))
+    assert read['list'] == [1, 2.5, None]
+    assert read['array'].dtype == np.dtype('int16')
+    assert np.all(read['array'] == entry['array'])
+    assert read['scalar'] == 0.5
+    assert read['intKeys'] == entry['intKeys']
+    assert read['tagLike'] == entry['tagLike']
+    assert read['bytes'] == entry['bytes']
+
+
+def test_copies(logFile):
+    logstore.getWriter(logFile).write({'__timestamp__': 1.0, 'id': 1})
+    reader = logstore.getReader(logFile)
+    reader.read()[0]['id'] = 'changed'
+    reader.query(0, 2)[0]['id'] = 'changed'
+    assert reader.read()[0]['id'] == 1
+    assert reader.query(0, 2)[0]['id'] == 1
+
+
+def test_error_flush(logFile):
+    writer = logstore.getWriter(logFile)
+    writer.write({'__timestamp__': 1.0, 'msgType': 'status'})
+    assert not os.path.exists(logFile)
+    writer.write({'__timestamp__': 2.0, 'msgType': 'error'})
+    with open(logFile, 'rb') as fd:
+        assert len(fd.readlines()) == 2
+
+
+def test_legacy(logFile):
+    with open(logFile, 'w') as fd:
+        fd.write("%s\n" % repr({'__timestamp__': 1.0, 'x': (1, 2)}))
+    logstore.getWriter(logFile).write({'__timestamp__': 2.0, 'x': (3, 4)})
+    assert [e['x'] for e in logstore.getReader(logFile).read()] == [(1, 2), (3, 4)]
+
+    ## repr lines are not eval'd in JSON logs
+    os.remove(logFile)
+    with open(logFile, 'w') as fd:
+        fd.write(json.dumps({'__timestamp__': 1.0}) + '\n')
+        fd.write("%s\n" % repr({'__timestamp__': 2.0}))
+    with pytest.raises(ValueError):
+        logstore.LogReader(logFile).read()
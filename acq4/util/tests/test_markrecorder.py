@@ -0,0 +1,21 @@
+from __future__ import print_function
+import time
+from acq4.util.debug import MarkRecorder
+
+
+def test_markrecorder():
+    calls = []
+    prof = MarkRecorder('test', lambda name, marks: calls.append((name, marks)))
+    time.sleep(0.01)
+    prof.mark('first')
+    prof('second')
+    prof()
+    prof.finish()
+    prof.finish()  ## only reported once
+
+    assert len(calls) == 1
+    name, marks = calls[0]
+    assert name == 'test'
+    assert [m[0] for m in marks] == ['first', 'second', '2']
+    assert marks[0][1] >= 0.009
+    assert all(dt >= 0 for m, dt in marks)